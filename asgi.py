@@ -0,0 +1,4 @@
+from observatorio.asgi import create_asgi_app
+
+# Servidor ASGI opcional: uvicorn asgi:app --host 0.0.0.0 --port 5011
+app = create_asgi_app()
@@ -0,0 +1,118 @@
+"""
+Benchmark de capacidade de conexões concorrentes: waitress (WSGI) x uvicorn (ASGI).
+
+Suba o mesmo app nos dois modos, com o rate limit desligado, e aponte o
+script para cada um:
+
+    RATELIMIT_ENABLED=false waitress-serve --port=5011 app:app
+    RATELIMIT_ENABLED=false uvicorn asgi:app --port=5012
+
+    python benchmarks/bench_asgi.py --base http://127.0.0.1:5011 --relato 1
+    python benchmarks/bench_asgi.py --base http://127.0.0.1:5012 --relato 1
+
+O script abre uma sessão (GET /relato/<id>) para obter o cookie e o token
+CSRF e depois dispara POSTs em /vote/<id>/acredito a partir de N conexões
+keep-alive simultâneas. Depois do primeiro voto as respostas são 403 ("já
+votou"), mas cada uma ainda faz a consulta no banco, que é exatamente a
+espera de rede que queremos medir.
+
+Sem dependências externas: usa um cliente HTTP/1.1 mínimo sobre asyncio.
+"""
+
+import argparse
+import asyncio
+import re
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def _ler_resposta(reader):
+    cabecalho = await reader.readuntil(b'\r\n\r\n')
+    linhas = cabecalho.decode('latin-1').split('\r\n')
+    status = int(linhas[0].split()[1])
+    headers = {}
+    for linha in linhas[1:]:
+        if ':' in linha:
+            k, v = linha.split(':', 1)
+            headers.setdefault(k.strip().lower(), []).append(v.strip())
+    tamanho = int(headers.get('content-length', ['0'])[0])
+    corpo = await reader.readexactly(tamanho) if tamanho else b''
+    return status, headers, corpo
+
+
+async def _requisicao(reader, writer, metodo, host, caminho, extras=''):
+    writer.write(
+        f'{metodo} {caminho} HTTP/1.1\r\nHost: {host}\r\nContent-Length: 0\r\n{extras}\r\n'.encode('latin-1')
+    )
+    await writer.drain()
+    return await _ler_resposta(reader)
+
+
+async def abrir_sessao(host, porta, relato_id):
+    """Faz um GET no relato e devolve (cookie, token_csrf)."""
+    reader, writer = await asyncio.open_connection(host, porta)
+    status, headers, corpo = await _requisicao(reader, writer, 'GET', host, f'/relato/{relato_id}')
+    writer.close()
+    cookie = '; '.join(c.split(';')[0] for c in headers.get('set-cookie', []))
+    token = re.search(rb'name="csrf-token" content="([^"]+)"', corpo)
+    if status != 200 or not token:
+        raise SystemExit(f'Não foi possível abrir a sessão (status {status}). O relato {relato_id} existe e está aprovado?')
+    return cookie, token.group(1).decode()
+
+
+async def cliente(host, porta, caminho, extras, fim, latencias, erros):
+    try:
+        reader, writer = await asyncio.open_connection(host, porta)
+    except OSError:
+        erros['conexao'] = erros.get('conexao', 0) + 1
+        return
+    try:
+        while time.perf_counter() < fim:
+            inicio = time.perf_counter()
+            status, _, _ = await _requisicao(reader, writer, 'POST', host, caminho, extras)
+            if status in (200, 403):
+                latencias.append(time.perf_counter() - inicio)
+            else:
+                erros[status] = erros.get(status, 0) + 1
+    except (OSError, asyncio.IncompleteReadError):
+        erros['reset'] = erros.get('reset', 0) + 1
+    finally:
+        writer.close()
+
+
+async def rodada(host, porta, caminho, extras, conexoes, duracao):
+    latencias, erros = [], {}
+    fim = time.perf_counter() + duracao
+    await asyncio.gather(*(cliente(host, porta, caminho, extras, fim, latencias, erros) for _ in range(conexoes)))
+    return latencias, erros
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base', default='http://127.0.0.1:5011')
+    parser.add_argument('--relato', type=int, required=True, help='ID de um relato aprovado.')
+    parser.add_argument('--conexoes', default='10,50,100,200,500', help='Níveis de concorrência, separados por vírgula.')
+    parser.add_argument('--duracao', type=float, default=10.0, help='Segundos por nível.')
+    args = parser.parse_args()
+
+    url = urlsplit(args.base)
+    host, porta = url.hostname, url.port or 80
+    cookie, token = await abrir_sessao(host, porta, args.relato)
+    extras = f'Cookie: {cookie}\r\nX-CSRFToken: {token}\r\n'
+    caminho = f'/vote/{args.relato}/acredito'
+
+    print(f'{"conexões":>9} {"req/s":>9} {"p50 (ms)":>9} {"p99 (ms)":>9}  erros')
+    for conexoes in (int(c) for c in args.conexoes.split(',')):
+        latencias, erros = await rodada(host, porta, caminho, extras, conexoes, args.duracao)
+        if latencias:
+            latencias.sort()
+            p50 = statistics.median(latencias) * 1000
+            p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))] * 1000
+        else:
+            p50 = p99 = float('nan')
+        print(f'{conexoes:>9} {len(latencias) / args.duracao:>9.1f} {p50:>9.1f} {p99:>9.1f}  {erros or "-"}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
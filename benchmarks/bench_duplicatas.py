@@ -0,0 +1,111 @@
+"""
+Benchmark da detecção de quase-duplicatas (observatorio/similaridade.py),
+sem banco: um dicionário chave LSH -> ids faz o papel do índice GIN sobre
+minhash_bandas.
+
+    python benchmarks/bench_duplicatas.py
+    python benchmarks/bench_duplicatas.py --textos 50000 --ondas 20 --copias 50
+
+Gera --textos textos sintéticos (15 a 80 palavras de um vocabulário com
+palavras frequentes, como as de ligação do português) e --ondas ondas de
+spam de --copias cópias cada, com 1 a 3 palavras trocadas e um sufixo
+variável por cópia. Cada texto é classificado na ordem de chegada, como no
+submit, pelas faixas LSH; os últimos --varredura também são comparados
+com todas as assinaturas anteriores (a alternativa sem índice).
+
+Relata o tempo médio por texto de cada busca, os candidatos lidos por
+busca, a revocação da busca por faixas (cópias ligadas a outra cópia
+anterior da mesma onda; as que ficam de fora caíram abaixo de
+--jaccard-min, em geral textos curtos com várias trocas) e os textos
+ligados por engano a outro grupo.
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from observatorio.similaridade import minhash, bandas, jaccard  # noqa: E402
+
+FREQUENTES = ('de a o que e do da em um para com nao uma os no se na por mais as dos como mas ao ele '
+              'das seu sua ou quando muito nos ja eu tambem so pelo pela ate isso').split()
+
+
+def gerar(args, rng):
+    raras = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(args.vocabulario)]
+
+    def texto():
+        return ' '.join(rng.choice(FREQUENTES) if rng.random() < 0.4 else rng.choice(raras)
+                        for _ in range(rng.randint(15, 80)))
+
+    textos = [(texto(), None) for _ in range(args.textos)]
+    for onda in range(args.ondas):
+        original = texto()
+        for copia in range(args.copias):
+            palavras = original.split()
+            for _ in range(rng.randint(1, 3)):
+                palavras[rng.randrange(len(palavras))] = rng.choice(raras)
+            palavras.append(f'promo{copia}')
+            textos.append((' '.join(palavras), onda))
+    rng.shuffle(textos)
+    return textos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--textos', type=int, default=20000)
+    parser.add_argument('--ondas', type=int, default=10)
+    parser.add_argument('--copias', type=int, default=30)
+    parser.add_argument('--vocabulario', type=int, default=5000)
+    parser.add_argument('--jaccard-min', type=float, default=0.7)
+    parser.add_argument('--varredura', type=int, default=500,
+                        help='Textos (os últimos) em que a varredura completa também é medida.')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    textos = gerar(args, rng)
+    inicio = time.perf_counter()
+    assinaturas = [minhash(texto) for texto, _ in textos]
+    assinar = (time.perf_counter() - inicio) / len(textos) * 1000
+
+    indice = defaultdict(list)
+    tempo_lsh = tempo_varredura = 0.0
+    candidatos = agrupadas = copias = falsos = 0
+    vistos_por_onda = defaultdict(int)
+    for posicao, ((_, onda), assinatura) in enumerate(zip(textos, assinaturas)):
+        inicio = time.perf_counter()
+        chaves = bandas(assinatura)
+        achados = {i for chave in chaves for i in indice[chave]}
+        parecidos = [i for i in achados if jaccard(assinatura, assinaturas[i]) >= args.jaccard_min]
+        tempo_lsh += time.perf_counter() - inicio
+        candidatos += len(achados)
+
+        if posicao >= len(textos) - args.varredura:
+            inicio = time.perf_counter()
+            [i for i in range(posicao) if jaccard(assinatura, assinaturas[i]) >= args.jaccard_min]
+            tempo_varredura += time.perf_counter() - inicio
+
+        if onda is not None and vistos_por_onda[onda]:
+            copias += 1
+            agrupadas += any(textos[i][1] == onda for i in parecidos)
+        falsos += any(textos[i][1] is None or textos[i][1] != onda for i in parecidos)
+        if onda is not None:
+            vistos_por_onda[onda] += 1
+        for chave in chaves:
+            indice[chave].append(posicao)
+
+    total = len(textos)
+    print(f"{total} textos ({args.ondas} ondas de {args.copias} cópias); assinatura: {assinar:.3f} ms por texto")
+    print(f"faixas LSH  {tempo_lsh / total * 1000:8.3f} ms por texto   {candidatos / total:6.1f} candidatos por busca")
+    print(f"varredura   {tempo_varredura / max(1, args.varredura) * 1000:8.3f} ms por texto   "
+          f"(últimos {args.varredura}, com ~{total} anteriores)")
+    print(f"cópias agrupadas: {agrupadas}/{copias} ({agrupadas / max(1, copias):.1%}); "
+          f"textos com falso positivo: {falsos}")
+
+
+if __name__ == '__main__':
+    main()
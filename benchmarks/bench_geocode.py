@@ -0,0 +1,145 @@
+"""
+Benchmark do 'flask geocode-locais' contra um Nominatim de mentira local,
+sem rede: o servidor responde /search com coordenadas determinísticas perto
+do campus (cerca de 10% dos nomes "não encontrados"), com --latencia
+segundos de atraso, e devolve 429 a quem passar de --taxa requisições em
+qualquer janela de 1 segundo.
+
+    python benchmarks/bench_geocode.py
+    python benchmarks/bench_geocode.py --taxa 5 --trabalhadores 4 --latencia 0.5
+
+Três rodadas sobre uma cópia do locais_uem.json, com cache e checkpoint
+num diretório temporário:
+
+1. o servidor falha (HTTP 500) a partir da metade das requisições;
+2. retomada: só os que falharam são consultados de novo;
+3. do zero (--recomecar), com tudo vindo do cache: nenhuma requisição.
+
+Relata o tempo de cada rodada, as requisições atendidas e os 429 (deveria
+ser 0: o balde de tokens respeita o limite), e o tempo que a versão serial
+antiga levaria (1 s de sleep + latência por local).
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/nao_usado')
+os.environ.setdefault('SECRET_KEY', 'bench')
+
+from observatorio import create_app  # noqa: E402
+
+CENTRO = (-23.4065, -51.9395)
+
+
+class Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, endereco, taxa, latencia):
+        super().__init__(endereco, Manipulador)
+        self.por_segundo = max(1, math.floor(taxa))
+        self.latencia = latencia
+        self.lock = threading.Lock()
+        self.recentes = collections.deque()
+        self.atendidas = 0
+        self.recusadas = 0
+        self.falhar_apos = None
+
+
+class Manipulador(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        servidor = self.server
+        with servidor.lock:
+            # Janela deslizante de 1 s (com 5% de tolerância para o relógio das duas pontas)
+            agora = time.monotonic()
+            while servidor.recentes and agora - servidor.recentes[0] >= 0.95:
+                servidor.recentes.popleft()
+            if len(servidor.recentes) >= servidor.por_segundo:
+                servidor.recusadas += 1
+                return self._responder(429, {'error': 'rate limited'})
+            servidor.recentes.append(agora)
+            servidor.atendidas += 1
+            falhar = servidor.falhar_apos is not None and servidor.atendidas > servidor.falhar_apos
+        time.sleep(servidor.latencia)
+        if falhar:
+            return self._responder(500, {'error': 'falha simulada'})
+        consulta = parse_qs(urlsplit(self.path).query).get('q', [''])[0]
+        resumo = hashlib.sha256(consulta.encode()).digest()
+        if resumo[0] < 26:
+            return self._responder(200, [])
+        lat = CENTRO[0] + (resumo[1] - 128) / 128 * 0.005
+        lon = CENTRO[1] + (resumo[2] - 128) / 128 * 0.005
+        self._responder(200, [{'lat': str(lat), 'lon': str(lon)}])
+
+
+def rodada(runner, rotulo, servidor, argumentos):
+    antes_atendidas, antes_recusadas = servidor.atendidas, servidor.recusadas
+    inicio = time.perf_counter()
+    resultado = runner.invoke(args=['geocode-locais', *argumentos])
+    duracao = time.perf_counter() - inicio
+    if resultado.exception and not isinstance(resultado.exception, SystemExit):
+        raise resultado.exception
+    resumo = [linha for linha in resultado.output.splitlines() if 'movido(s)' in linha]
+    print(f"{rotulo:<28}{duracao:8.1f} s  {servidor.atendidas - antes_atendidas:4d} requisições  "
+          f"{servidor.recusadas - antes_recusadas:3d} x 429   {resumo[0] if resumo else resultado.output[-200:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--taxa', type=float, default=4.0, help='Limite do servidor (e do provedor), em req/s.')
+    parser.add_argument('--trabalhadores', type=int, default=4)
+    parser.add_argument('--latencia', type=float, default=0.3)
+    args = parser.parse_args()
+
+    servidor = Servidor(('127.0.0.1', 0), args.taxa, args.latencia)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{servidor.server_address[1]}/search'
+
+    pasta = tempfile.mkdtemp(prefix='bench_geocode_')
+    try:
+        arquivo = os.path.join(pasta, 'locais_uem.json')
+        shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'locais_uem.json'), arquivo)
+        with open(arquivo, encoding='utf-8') as f:
+            total = sum(1 for nome in json.load(f) if not nome.startswith('_'))
+
+        app = create_app({'GEOCODE_CACHE_DIR': os.path.join(pasta, 'cache')})
+        runner = app.test_cli_runner()
+        comum = ['--arquivo', arquivo, '--url', f'nominatim={url}', '--taxa', f'nominatim={args.taxa}',
+                 '--trabalhadores', str(args.trabalhadores)]
+
+        print(f"{total} locais; servidor a {args.taxa:g} req/s com {args.latencia:g} s de latência. "
+              f"Serial antigo: ~{total * (1 + args.latencia):.0f} s.")
+        servidor.falhar_apos = total // 2
+        rodada(runner, '1. falha na metade', servidor, comum)
+        servidor.falhar_apos = None
+        rodada(runner, '2. retomada', servidor, comum)
+        rodada(runner, '3. do zero, via cache', servidor, comum + ['--recomecar'])
+    finally:
+        servidor.shutdown()
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark do armazenamento do rate limiter com vários workers no mesmo host.
+
+Sobe N processos (padrão 16, como um gunicorn -w 16) e em cada um faz
+--checagens chamadas 'hit' da estratégia configurada contra o mesmo
+armazenamento, medindo a latência de cada uma. Depois mede o que importa
+para o abuso: com um limite de '30 per hour' para um único IP, quantos
+hits são aceitos somando todos os workers (deveria ser 30, não 30 x N).
+
+    python benchmarks/bench_limiter.py
+    python benchmarks/bench_limiter.py --storage memory://
+    python benchmarks/bench_limiter.py --storage redis://localhost:6379
+
+Sem --storage usa um 'mmap://' num arquivo temporário.
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from limits import parse as parse_limit  # noqa: E402
+from limits.storage import storage_from_string  # noqa: E402
+from limits.strategies import STRATEGIES  # noqa: E402
+
+import observatorio.limiter_storage  # noqa: E402,F401  (registra 'mmap://')
+
+
+def _limiter(uri, estrategia):
+    return STRATEGIES[estrategia](storage_from_string(uri))
+
+
+def medir_latencia(uri, estrategia, checagens, ips, barreira, fila):
+    limiter = _limiter(uri, estrategia)
+    limite = parse_limit('1000000 per hour')
+    pid = os.getpid()
+    duracoes = []
+    barreira.wait()
+    for i in range(checagens):
+        ip = f'10.{pid % 256}.{i % ips // 256}.{i % 256}'
+        inicio = time.perf_counter_ns()
+        limiter.hit(limite, 'vote', ip)
+        duracoes.append(time.perf_counter_ns() - inicio)
+    fila.put(duracoes)
+
+
+def disputar_limite(uri, estrategia, tentativas, barreira, fila):
+    limiter = _limiter(uri, estrategia)
+    limite = parse_limit('30 per hour')
+    barreira.wait()
+    fila.put(sum(limiter.hit(limite, 'vote', '203.0.113.7') for _ in range(tentativas)))
+
+
+def rodar(alvo, workers, *args):
+    barreira = multiprocessing.Barrier(workers)
+    fila = multiprocessing.Queue()
+    processos = [multiprocessing.Process(target=alvo, args=(*args, barreira, fila)) for _ in range(workers)]
+    for p in processos:
+        p.start()
+    resultados = [fila.get() for _ in processos]
+    for p in processos:
+        p.join()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storage', default=None, help='URI do armazenamento (padrão: mmap:// temporário).')
+    parser.add_argument('--estrategia', default='sliding-window-counter', choices=['sliding-window-counter', 'fixed-window'])
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--checagens', type=int, default=20000, help='Hits por worker na medição de latência.')
+    parser.add_argument('--ips', type=int, default=5000, help='IPs distintos por worker.')
+    args = parser.parse_args()
+
+    uri = args.storage or 'mmap://' + os.path.join(tempfile.mkdtemp(prefix='bench-limiter-'), 'ratelimit.bin')
+    _limiter(uri, args.estrategia).storage.reset()
+    print(f'storage={uri} estratégia={args.estrategia} workers={args.workers}')
+
+    inicio = time.perf_counter()
+    duracoes = sorted(d for lista in rodar(medir_latencia, args.workers, uri, args.estrategia, args.checagens, args.ips)
+                      for d in lista)
+    total = time.perf_counter() - inicio
+    quantil = lambda q: duracoes[min(len(duracoes) - 1, int(q * len(duracoes)))] / 1000  # noqa: E731
+    print(f'{len(duracoes)} hits em {total:.2f} s ({len(duracoes) / total:,.0f}/s agregados)')
+    print(f'latência por hit (µs): média {statistics.fmean(duracoes) / 1000:.1f}  '
+          f'p50 {quantil(0.5):.1f}  p99 {quantil(0.99):.1f}  p99.9 {quantil(0.999):.1f}')
+
+    aceitos = rodar(disputar_limite, args.workers, uri, args.estrategia, 30)
+    print(f"limite '30 per hour' para um IP, {args.workers} workers x 30 tentativas: "
+          f'{sum(aceitos)} aceitos (esperado 30)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark do layout das tabelas de interação: antes (tabela única com IP,
+cidade e User-Agent em texto) e depois (particionada por mês, IP inet,
+cidade/User-Agent como ids nos dicionários cities/user_agents).
+
+Roda num banco de testes, dentro do schema 'bench_particoes' (apagado no
+fim), com dados sintéticos parecidos com os de produção: poucas centenas de
+User-Agents e cidades repetidos em todas as linhas.
+
+    DATABASE_URL=postgresql://localhost/observatorio_bench \\
+        python benchmarks/bench_particoes.py --linhas 2000000 --meses 12
+
+Relata, para cada layout: tamanho da tabela e dos índices (somando as
+partições e, no depois, os dicionários), tempo do VACUUM (ANALYZE) após a
+carga e após apagar 10% das linhas, e o tempo de descartar os meses mais
+antigos que a retenção (DELETE no antes, DROP das partições no depois).
+"""
+
+import argparse
+import os
+import time
+from datetime import date
+
+import psycopg2
+
+SCHEMA = 'bench_particoes'
+
+
+def primeiro_dia(meses_atras):
+    hoje = date.today()
+    total = hoje.year * 12 + hoje.month - 1 - meses_atras
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def tamanhos(cur, tabelas):
+    """(bytes de tabela, bytes de índice) somando as partições de cada tabela."""
+    dados = indices = 0
+    for tabela in tabelas:
+        cur.execute("""
+            SELECT COALESCE(SUM(pg_table_size(relid)), 0), COALESCE(SUM(pg_indexes_size(relid)), 0)
+            FROM pg_partition_tree(%s)
+        """, (tabela,))
+        tabela_bytes, indice_bytes = cur.fetchone()
+        dados += tabela_bytes
+        indices += indice_bytes
+    return dados, indices
+
+
+def cronometrar(cur, comando):
+    inicio = time.perf_counter()
+    cur.execute(comando)
+    return time.perf_counter() - inicio
+
+
+def semear(cur, linhas, meses, user_agents, cidades):
+    """Tabela 'origem' com os dados sintéticos, no formato texto do layout antigo."""
+    cur.execute(f"""
+        CREATE TABLE origem AS
+        SELECT g AS id,
+               (random() * 5000)::int + 1 AS relato_id,
+               md5(g::text)::uuid::text AS session_id,
+               CASE WHEN random() < 0.6 THEN 'acredito' ELSE 'cetico' END AS tipo_voto,
+               NOW() - random() * make_interval(days => {meses * 30}) AS criado_em,
+               format('%s.%s.%s.%s', 1 + (random() * 222)::int, (random() * 255)::int,
+                      (random() * 255)::int, 1 + (random() * 253)::int) AS ip_address,
+               format('Cidade %s, Estado %s', c, c % 27) AS city,
+               format('Mozilla/5.0 (Linux; Android %s; SM-A%s) AppleWebKit/537.36 (KHTML, like Gecko) '
+                      'Chrome/%s.0.%s.0 Mobile Safari/537.36', 8 + u % 7, 100 + u, 100 + u % 30, u) AS user_agent
+        FROM generate_series(1, {linhas}) g,
+             LATERAL (SELECT (random() * {cidades - 1})::int + g * 0 AS c,
+                             (random() * {user_agents - 1})::int + g * 0 AS u) aleatorios
+    """)
+
+
+def montar_antes(cur):
+    cur.execute("""
+        CREATE TABLE votos_antes (
+            id SERIAL PRIMARY KEY,
+            relato_id INTEGER NOT NULL,
+            session_id VARCHAR(36) NOT NULL,
+            tipo_voto VARCHAR(10) NOT NULL,
+            criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            ip_address VARCHAR(45),
+            city VARCHAR(100),
+            user_agent VARCHAR(255)
+        )
+    """)
+    cur.execute("""
+        INSERT INTO votos_antes SELECT id, relato_id, session_id, tipo_voto, criado_em, ip_address, city, user_agent
+        FROM origem
+    """)
+    cur.execute('CREATE INDEX ON votos_antes (relato_id, session_id)')
+
+
+def montar_depois(cur, meses):
+    cur.execute('CREATE TABLE cities (id SERIAL PRIMARY KEY, nome VARCHAR(100) NOT NULL UNIQUE)')
+    cur.execute('CREATE TABLE user_agents (id SERIAL PRIMARY KEY, texto VARCHAR(255) NOT NULL UNIQUE)')
+    cur.execute("""
+        CREATE TABLE votos_depois (
+            id SERIAL,
+            relato_id INTEGER NOT NULL,
+            session_id VARCHAR(36) NOT NULL,
+            tipo_voto VARCHAR(10) NOT NULL,
+            criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            ip_address INET,
+            city_id INTEGER REFERENCES cities(id),
+            user_agent_id INTEGER REFERENCES user_agents(id),
+            PRIMARY KEY (id, criado_em)
+        ) PARTITION BY RANGE (criado_em)
+    """)
+    cur.execute('CREATE INDEX ON votos_depois (relato_id, session_id)')
+    for atras in range(meses + 1, -2, -1):
+        mes, proximo = primeiro_dia(atras), primeiro_dia(atras - 1)
+        cur.execute(f"""
+            CREATE TABLE votos_depois_{mes:%Y_%m} PARTITION OF votos_depois
+            FOR VALUES FROM ('{mes}') TO ('{proximo}')
+        """)
+    cur.execute('INSERT INTO cities (nome) SELECT DISTINCT city FROM origem')
+    cur.execute('INSERT INTO user_agents (texto) SELECT DISTINCT user_agent FROM origem')
+    cur.execute("""
+        INSERT INTO votos_depois
+        SELECT o.id, o.relato_id, o.session_id, o.tipo_voto, o.criado_em, o.ip_address::inet, ci.id, ua.id
+        FROM origem o
+        JOIN cities ci ON ci.nome = o.city
+        JOIN user_agents ua ON ua.texto = o.user_agent
+    """)
+
+
+def medir(cur, rotulo, tabela, extras, retencao):
+    dados, indices = tamanhos(cur, [tabela] + extras)
+    vacuum_carga = cronometrar(cur, f'VACUUM (ANALYZE) {tabela}')
+    cur.execute(f'DELETE FROM {tabela} WHERE id % 10 = 0')
+    vacuum_delete = cronometrar(cur, f'VACUUM (ANALYZE) {tabela}')
+
+    limite = primeiro_dia(retencao)
+    if tabela == 'votos_antes':
+        descarte = cronometrar(cur, f"DELETE FROM votos_antes WHERE criado_em < '{limite}'")
+    else:
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'votos_depois'::regclass AND c.relname < %s
+        """, (f'votos_depois_{limite:%Y_%m}',))
+        antigas = [linha[0] for linha in cur.fetchall()]
+        inicio = time.perf_counter()
+        for particao in antigas:
+            cur.execute(f'ALTER TABLE votos_depois DETACH PARTITION {particao}')
+            cur.execute(f'DROP TABLE {particao}')
+        descarte = time.perf_counter() - inicio
+
+    print(f"{rotulo:<8} tabela {dados / 2**20:9.1f} MB   índices {indices / 2**20:8.1f} MB   "
+          f"vacuum carga {vacuum_carga:6.2f} s   vacuum após delete {vacuum_delete:6.2f} s   "
+          f"retenção {descarte:7.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, default=2_000_000)
+    parser.add_argument('--meses', type=int, default=12, help='Meses de histórico semeados.')
+    parser.add_argument('--retencao', type=int, default=6, help='Meses mantidos no teste de descarte.')
+    parser.add_argument('--user-agents', type=int, default=300)
+    parser.add_argument('--cidades', type=int, default=200)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True  # VACUUM não roda dentro de transação
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    cur.execute(f'CREATE SCHEMA {SCHEMA}')
+    cur.execute(f'SET search_path TO {SCHEMA}')
+    try:
+        print(f"Semeando {args.linhas} linhas em {args.meses} meses...")
+        semear(cur, args.linhas, args.meses, args.user_agents, args.cidades)
+        montar_antes(cur)
+        montar_depois(cur, args.meses)
+        medir(cur, 'antes', 'votos_antes', [], args.retencao)
+        medir(cur, 'depois', 'votos_depois', ['cities', 'user_agents'], args.retencao)
+    finally:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark dos prepared statements (db.executar): o mesmo conjunto de
+consultas de uma abertura de relato (usuário logado, relato, comentários,
+curtidas, voto e testemunha da sessão) enviado como texto, com parse e
+planejamento a cada chamada, e como EXECUTE de statements preparados.
+
+Roda num banco de testes, dentro do schema 'bench_preparadas' (apagado no
+fim), com dados sintéticos:
+
+    DATABASE_URL=postgresql://localhost/observatorio_bench \\
+        python benchmarks/bench_preparadas.py --requisicoes 2000
+
+Use uma conexão direta: atrás de um pooler em modo transação o PREPARE não
+vale entre transações (é o caso em que o app volta para texto).
+
+Relata, para cada modo: tempo médio por requisição (as 6 consultas) e o
+tempo de planejamento somado das 6, medido com EXPLAIN (ANALYZE, SUMMARY).
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+import psycopg2
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from observatorio.db import executar  # noqa: E402
+
+SCHEMA = 'bench_preparadas'
+
+# As mesmas consultas das rotas (routes_public.py)
+CONSULTAS = {
+    'usuario_por_id': 'SELECT id, google_id, nome, email, profile_pic_url, criado_em FROM users WHERE id = %s',
+    'relato': """
+        SELECT r.id, r.titulo, r.descricao, r.local, r.categoria, r.imagem_url, r.audio_url,
+               r.criado_em, r.votos_acredito, r.votos_cetico, r.votos_testemunha,
+               u.nome as autor_relato, u.id as autor_id,
+               (SELECT COUNT(*) FROM comentarios c WHERE c.relato_id = r.id) AS comment_count
+        FROM relatos r LEFT JOIN users u ON r.user_id = u.id
+        WHERE r.id = %s AND r.aprovado = TRUE
+    """,
+    'relato_comentarios': """
+        SELECT c.id, c.texto, c.criado_em, c.like_count, u.nome as autor, u.profile_pic_url, u.id as autor_id
+        FROM comentarios c JOIN users u ON c.user_id = u.id
+        WHERE c.relato_id = %s ORDER BY c.criado_em ASC
+    """,
+    'curtidas_da_sessao': 'SELECT comentario_id FROM comentarios_likes WHERE session_id = %s',
+    'voto_da_sessao': 'SELECT tipo_voto FROM votos WHERE relato_id = %s AND session_id = %s',
+    'testemunha_da_sessao': 'SELECT id FROM testemunhas WHERE relato_id = %s AND session_id = %s',
+}
+
+
+def semear(cur, relatos, usuarios):
+    cur.execute("""
+        CREATE TABLE users (id SERIAL PRIMARY KEY, google_id VARCHAR(255) UNIQUE NOT NULL,
+            nome VARCHAR(100) NOT NULL, email VARCHAR(255) UNIQUE NOT NULL, profile_pic_url VARCHAR(255),
+            criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE relatos (id SERIAL PRIMARY KEY, titulo VARCHAR(100) NOT NULL, descricao TEXT NOT NULL,
+            local VARCHAR(255) NOT NULL, categoria VARCHAR(50) NOT NULL, imagem_url VARCHAR(255), audio_url TEXT,
+            aprovado BOOLEAN NOT NULL DEFAULT FALSE, criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            votos_acredito INTEGER NOT NULL DEFAULT 0, votos_cetico INTEGER NOT NULL DEFAULT 0,
+            votos_testemunha INTEGER NOT NULL DEFAULT 0, user_id INTEGER REFERENCES users(id));
+        CREATE TABLE comentarios (id SERIAL PRIMARY KEY, relato_id INTEGER NOT NULL REFERENCES relatos(id),
+            texto VARCHAR(500) NOT NULL, criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            user_id INTEGER REFERENCES users(id), like_count INTEGER NOT NULL DEFAULT 0);
+        CREATE INDEX ON comentarios (relato_id);
+        CREATE TABLE votos (id SERIAL PRIMARY KEY, relato_id INTEGER NOT NULL, session_id VARCHAR(36) NOT NULL,
+            tipo_voto VARCHAR(10) NOT NULL);
+        CREATE INDEX ON votos (relato_id, session_id);
+        CREATE TABLE testemunhas (id SERIAL PRIMARY KEY, relato_id INTEGER NOT NULL, session_id VARCHAR(36) NOT NULL);
+        CREATE INDEX ON testemunhas (relato_id, session_id);
+        CREATE TABLE comentarios_likes (id SERIAL PRIMARY KEY, comentario_id INTEGER NOT NULL,
+            session_id VARCHAR(36) NOT NULL);
+        CREATE INDEX ON comentarios_likes (session_id);
+    """)
+    cur.execute(f"""
+        INSERT INTO users (google_id, nome, email)
+        SELECT 'g' || g, 'Usuário ' || g, 'u' || g || '@exemplo.org' FROM generate_series(1, {usuarios}) g;
+        INSERT INTO relatos (titulo, descricao, local, categoria, aprovado, user_id)
+        SELECT 'Relato ' || g, repeat('texto ', 50), 'Local ' || (g % 40), 'Aparição', g % 10 <> 0,
+               1 + (g % {usuarios}) FROM generate_series(1, {relatos}) g;
+        INSERT INTO comentarios (relato_id, texto, user_id)
+        SELECT 1 + (g % {relatos}), 'comentário ' || g, 1 + (g % {usuarios}) FROM generate_series(1, {relatos * 5}) g;
+        INSERT INTO votos (relato_id, session_id, tipo_voto)
+        SELECT 1 + (g % {relatos}), md5(g::text), 'acredito' FROM generate_series(1, {relatos * 20}) g;
+        INSERT INTO testemunhas (relato_id, session_id)
+        SELECT 1 + (g % {relatos}), md5(g::text) FROM generate_series(1, {relatos * 2}) g;
+        INSERT INTO comentarios_likes (comentario_id, session_id)
+        SELECT 1 + (g % {relatos * 5}), md5(g::text) FROM generate_series(1, {relatos * 10}) g;
+        ANALYZE;
+    """)
+
+
+def parametros(nome, relato_id, usuario_id, sessao):
+    return {
+        'usuario_por_id': (usuario_id,),
+        'relato': (relato_id,),
+        'relato_comentarios': (relato_id,),
+        'curtidas_da_sessao': (sessao,),
+        'voto_da_sessao': (relato_id, sessao),
+        'testemunha_da_sessao': (relato_id, sessao),
+    }[nome]
+
+
+def requisicao(cur, relatos, usuarios):
+    relato_id, usuario_id = random.randint(1, relatos), random.randint(1, usuarios)
+    sessao = f'{random.randint(1, relatos * 20):x}'
+    for nome, sql in CONSULTAS.items():
+        executar(cur, nome, sql, parametros(nome, relato_id, usuario_id, sessao))
+        cur.fetchall()
+    cur.connection.rollback()
+
+
+def planejamento(cur, preparado, relatos, usuarios):
+    """Tempo de planejamento (ms) somado das consultas de uma requisição, via EXPLAIN ANALYZE."""
+    total = 0.0
+    for nome, sql in CONSULTAS.items():
+        params = parametros(nome, random.randint(1, relatos), random.randint(1, usuarios), 'abc')
+        if preparado:
+            executar(cur, nome, sql, params)  # garante o PREPARE nesta conexão
+            cur.fetchall()
+            nome_preparado = f"{nome}_{zlib.crc32(sql.encode('utf-8')):08x}"  # como em db.executar
+            cur.execute(f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) EXECUTE {nome_preparado} "
+                        f"({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f'EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {sql}', params)
+        plano = cur.fetchone()[0]
+        plano = json.loads(plano) if isinstance(plano, str) else plano
+        total += plano[0]['Planning Time']
+    cur.connection.rollback()
+    return total
+
+
+def medir(rotulo, dsn, modo, args):
+    app = Flask(__name__)
+    app.config['DB_PREPARED_STATEMENTS'] = modo
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(f'SET search_path TO {SCHEMA}')
+    conn.commit()
+    with app.app_context():
+        # Aquecimento: cache do Postgres e, no modo preparado, o PREPARE e a
+        # troca para o plano genérico (depois de 5 execuções)
+        for _ in range(20):
+            requisicao(cur, args.relatos, args.usuarios)
+        inicio = time.perf_counter()
+        for _ in range(args.requisicoes):
+            requisicao(cur, args.relatos, args.usuarios)
+        media = (time.perf_counter() - inicio) / args.requisicoes * 1000
+        plano = sum(planejamento(cur, modo == 'true', args.relatos, args.usuarios) for _ in range(20)) / 20
+    conn.close()
+    print(f"{rotulo:<10} {media:7.3f} ms por requisição   planejamento {plano:6.3f} ms por requisição")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requisicoes', type=int, default=2000)
+    parser.add_argument('--relatos', type=int, default=20000)
+    parser.add_argument('--usuarios', type=int, default=2000)
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    cur.execute(f'CREATE SCHEMA {SCHEMA}')
+    cur.execute(f'SET search_path TO {SCHEMA}')
+    try:
+        print(f"Semeando {args.relatos} relatos...")
+        semear(cur, args.relatos, args.usuarios)
+        medir('texto', dsn, 'false', args)
+        medir('preparado', dsn, 'true', args)
+    finally:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark de uploads concorrentes de 10 MB nos backends de armazenamento.
+
+Cada upload simula o caminho da requisição: o corpo chega em blocos de
+64 KB e é gravado no arquivo temporário do RequestMidia (spool em disco
+acima de --spool), e então o backend o lê de volta em blocos. Com
+--estrategia buffer o arquivo é lido inteiro para a memória antes do envio,
+como fazia o 'cloudinary.uploader.upload' antigo, para comparação.
+
+    python benchmarks/bench_storage.py --backend local
+    python benchmarks/bench_storage.py --backend local --estrategia buffer
+
+    # MinIO local como stand-in do S3:
+    #   docker run -p 9000:9000 minio/minio server /data
+    #   (crie o bucket 'observatorio' no console antes)
+    S3_ACCESS_KEY_ID=minioadmin S3_SECRET_ACCESS_KEY=minioadmin \\
+        python benchmarks/bench_storage.py --backend s3 \\
+        --s3-endpoint http://localhost:9000 --s3-bucket observatorio
+
+Relata a vazão agregada (MB/s) e o pico de memória alocada pelo Python
+(tracemalloc) durante a rodada. Os objetos enviados são removidos no fim.
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from observatorio.storage import criar_storage  # noqa: E402
+
+BLOCO_REQUISICAO = 64 * 1024
+
+
+class ArquivoRecebido:
+    """Imita o FileStorage do Werkzeug: nome, mimetype e o stream já recebido."""
+
+    def __init__(self, stream, filename, mimetype):
+        self.stream = stream
+        self.filename = filename
+        self.mimetype = mimetype
+
+
+def receber(tamanho, spool):
+    """Grava 'tamanho' bytes em blocos num SpooledTemporaryFile, como o parser do multipart."""
+    arquivo = SpooledTemporaryFile(max_size=spool, mode='rb+')
+    bloco = os.urandom(BLOCO_REQUISICAO)
+    restante = tamanho
+    while restante > 0:
+        arquivo.write(bloco[:min(restante, BLOCO_REQUISICAO)])
+        restante -= BLOCO_REQUISICAO
+    arquivo.seek(0)
+    return arquivo
+
+
+def enviar(storage, tamanho, spool, estrategia):
+    stream = receber(tamanho, spool)
+    if estrategia == 'buffer':
+        stream = io.BytesIO(stream.read())
+    inicio = time.perf_counter()
+    objeto = storage.salvar(ArquivoRecebido(stream, 'bench.jpg', 'image/jpeg'), 'bench', tipo='imagem')
+    return objeto.chave, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['local', 's3', 'cloudinary'], default='local')
+    parser.add_argument('--estrategia', choices=['streaming', 'buffer'], default='streaming')
+    parser.add_argument('--concorrencia', default='1,4,8,16', help='Uploads simultâneos, separados por vírgula.')
+    parser.add_argument('--tamanho-mb', type=float, default=10.0)
+    parser.add_argument('--spool', type=int, default=256 * 1024, help='MEDIA_SPOOL_MAX_SIZE em bytes.')
+    parser.add_argument('--media-root', default=None, help='Diretório do backend local (padrão: temporário).')
+    parser.add_argument('--s3-endpoint', default=os.environ.get('S3_ENDPOINT_URL'))
+    parser.add_argument('--s3-bucket', default=os.environ.get('S3_BUCKET'))
+    args = parser.parse_args()
+
+    media_root = args.media_root or tempfile.mkdtemp(prefix='bench-storage-')
+    storage = criar_storage({
+        'MEDIA_BACKEND': args.backend,
+        'MEDIA_ROOT': media_root,
+        'S3_BUCKET': args.s3_bucket,
+        'S3_ENDPOINT_URL': args.s3_endpoint,
+        'S3_REGION': os.environ.get('S3_REGION'),
+        'S3_ACCESS_KEY_ID': os.environ.get('S3_ACCESS_KEY_ID'),
+        'S3_SECRET_ACCESS_KEY': os.environ.get('S3_SECRET_ACCESS_KEY'),
+    })
+    tamanho = int(args.tamanho_mb * 1024 * 1024)
+
+    print(f'backend={args.backend} estratégia={args.estrategia} arquivo={args.tamanho_mb:g} MB')
+    print(f'{"uploads":>8} {"MB/s":>9} {"p50 (s)":>9} {"máx (s)":>9} {"pico mem (MB)":>14}')
+    for concorrencia in (int(c) for c in args.concorrencia.split(',')):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            resultados = list(executor.map(
+                lambda _: enviar(storage, tamanho, args.spool, args.estrategia), range(concorrencia)
+            ))
+        total = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        duracoes = sorted(d for _, d in resultados)
+        vazao = concorrencia * tamanho / (1024 * 1024) / total
+        print(f'{concorrencia:>8} {vazao:>9.1f} {duracoes[len(duracoes) // 2]:>9.2f} '
+              f'{duracoes[-1]:>9.2f} {pico / (1024 * 1024):>14.1f}')
+        for chave, _ in resultados:
+            storage.remover(chave)
+
+
+if __name__ == '__main__':
+    main()
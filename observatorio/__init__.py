@@ -3,13 +3,14 @@
 import os
 import json
 import re # Importe a biblioteca de expressões regulares
+import time
 from markupsafe import Markup, escape # Importe Markup e escape
 from flask import Flask
 from dotenv import load_dotenv
-import cloudinary
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_wtf.csrf import CSRFProtect
+from . import limiter_storage  # registra os esquemas 'mmap://' e 'async+mmap://' no 'limits'
 
 # Inicializa o CSRFProtect
 csrf = CSRFProtect()
@@ -17,10 +18,18 @@ csrf = CSRFProtect()
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
 )
 
 def create_app(test_config=None):
+    # Tempo de cada fase da inicialização (consultado por 'flask startup-profile')
+    fases = []
+    inicio_fase = time.perf_counter()
+    def marcar_fase(nome):
+        nonlocal inicio_fase
+        agora = time.perf_counter()
+        fases.append((nome, agora - inicio_fase))
+        inicio_fase = agora
+
     load_dotenv()
     def nl2br(value):
         """Converte quebras de linha em <br> de forma segura."""
@@ -55,6 +64,7 @@ def create_app(test_config=None):
         MAIL_USE_TLS=os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', '1', 't'],
         MAIL_USERNAME=os.environ.get('MAIL_USERNAME'),
         MAIL_PASSWORD=os.environ.get('MAIL_PASSWORD'),
+        MAIL_TIMEOUT=float(os.environ.get('MAIL_TIMEOUT', 10)), # segundos por operação SMTP
         ADMIN_EMAIL=os.environ.get('ADMIN_EMAIL'), # O e-mail que receberá a notificação
         
         RECAPTCHA_SITE_KEY=os.environ.get('RECAPTCHA_SITE_KEY'),
@@ -70,7 +80,127 @@ def create_app(test_config=None):
         SESSION_COOKIE_SECURE=True,
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
-        DATABASE_URL=db_url
+        DATABASE_URL=db_url,
+        # Abre o pool de conexões em segundo plano logo após o boot
+        DB_WARMUP=os.environ.get('DB_WARMUP', 'false').lower() in ['true', '1', 't'],
+        # PREPARE das consultas quentes por conexão (db.executar) e cache de
+        # statements do asyncpg (modo ASGI): 'auto' desliga atrás de um pooler
+        # em modo transação ('-pooler' do Neon, porta 6432)
+        DB_PREPARED_STATEMENTS=os.environ.get('DB_PREPARED_STATEMENTS', 'auto').lower(),
+        # --- Ciclo de vida das conexões (o Neon suspende o compute ocioso; db.py) ---
+        # Conexões ociosas mantidas abertas e aquecidas (o pool fecha as excedentes)
+        DB_POOL_MIN=int(os.environ.get('DB_POOL_MIN', 1)),
+        # Keepalives TCP, em segundos (DB_KEEPALIVE_IDLE=0 desliga)
+        DB_KEEPALIVE_IDLE=int(os.environ.get('DB_KEEPALIVE_IDLE', 30)),
+        DB_KEEPALIVE_INTERVAL=int(os.environ.get('DB_KEEPALIVE_INTERVAL', 10)),
+        DB_KEEPALIVE_COUNT=int(os.environ.get('DB_KEEPALIVE_COUNT', 3)),
+        # Idade máxima de uma conexão; as ociosas são trocadas antes, em segundo plano (0 desliga)
+        DB_CONEXAO_VIDA_MAX=float(os.environ.get('DB_CONEXAO_VIDA_MAX', 1800)),
+        # Período da thread de manutenção do pool, em segundos (0: só aquece uma vez)
+        DB_MANUTENCAO_INTERVALO=float(os.environ.get('DB_MANUTENCAO_INTERVALO', 30)),
+        # Horas com tráfego esperado ('7-24', '7-12,18-24'; vazio: nunca), no fuso abaixo:
+        # nelas um 'SELECT 1' após DB_AQUECER_INTERVALO segundos sem uso mantém o compute acordado
+        DB_AQUECER_HORARIO=os.environ.get('DB_AQUECER_HORARIO', '7-24'),
+        DB_AQUECER_INTERVALO=float(os.environ.get('DB_AQUECER_INTERVALO', 240)),
+        DB_AQUECER_FUSO=os.environ.get('DB_AQUECER_FUSO', 'America/Sao_Paulo'),
+        # Connect acima disso conta como partida a frio em /admin/metricas
+        DB_PARTIDA_FRIA_SEGUNDOS=float(os.environ.get('DB_PARTIDA_FRIA_SEGUNDOS', 1.0)),
+
+        # Conexão do LISTEN de tempo real; precisa ser direta (um pooler em modo
+        # transação, como o '-pooler' do Neon, não entrega notificações)
+        DATABASE_LISTEN_URL=os.environ.get('DATABASE_LISTEN_URL'),
+        # No modo WSGI cada stream SSE (/relato/<id>/eventos) prende uma thread do
+        # servidor: limite por processo, bem abaixo das threads do waitress (acima
+        # dele a rota responde 503 e a página consulta /relato/<id>/contadores), e
+        # duração máxima, depois da qual o navegador reconecta
+        SSE_MAX_CONEXOES=int(os.environ.get('SSE_MAX_CONEXOES', 4)),
+        SSE_DURACAO_MAX=int(os.environ.get('SSE_DURACAO_MAX', 300)), # segundos
+
+        # --- Mídia armazenada localmente (derivadas de imagem geradas com Pillow) ---
+        MEDIA_ROOT=os.environ.get('MEDIA_ROOT', os.path.join(app.instance_path, 'media')),
+        MEDIA_URL=os.environ.get('MEDIA_URL', '/media/'),
+
+        # --- Backend de armazenamento de mídia: 'cloudinary', 'local' ou 's3' ---
+        MEDIA_BACKEND=os.environ.get('MEDIA_BACKEND', 'cloudinary'),
+        # Uploads acima disso vão para arquivo temporário em disco, não para a memória
+        MEDIA_SPOOL_MAX_SIZE=int(os.environ.get('MEDIA_SPOOL_MAX_SIZE', 256 * 1024)),
+        # Limites de tamanho das mídias do relato (o submit.js já comprime antes de enviar)
+        MAX_IMAGE_BYTES=int(os.environ.get('MAX_IMAGE_BYTES', 5 * 1024 * 1024)),
+        MAX_AUDIO_BYTES=int(os.environ.get('MAX_AUDIO_BYTES', 10 * 1024 * 1024)),
+        # Blocos dos uploads retomáveis até a montagem (padrão: instance/uploads)
+        UPLOADS_TMP_DIR=os.environ.get('UPLOADS_TMP_DIR'),
+        # S3 compatível (MinIO em desenvolvimento: S3_ENDPOINT_URL=http://localhost:9000)
+        S3_BUCKET=os.environ.get('S3_BUCKET'),
+        S3_ENDPOINT_URL=os.environ.get('S3_ENDPOINT_URL'),
+        S3_PUBLIC_URL=os.environ.get('S3_PUBLIC_URL'),
+        S3_REGION=os.environ.get('S3_REGION'),
+        S3_ACCESS_KEY_ID=os.environ.get('S3_ACCESS_KEY_ID'),
+        S3_SECRET_ACCESS_KEY=os.environ.get('S3_SECRET_ACCESS_KEY'),
+
+        # --- Rate limiting ---
+        # Contadores compartilhados por todos os workers do host (limiter_storage.py);
+        # com vários hosts, use redis://host:6379 (requirements-redis.txt)
+        RATELIMIT_STORAGE_URI=os.environ.get(
+            'RATELIMIT_STORAGE_URI',
+            'mmap://' + os.path.join(app.instance_path, 'ratelimit.bin') if limiter_storage.DISPONIVEL else 'memory://',
+        ),
+        RATELIMIT_STRATEGY=os.environ.get('RATELIMIT_STRATEGY', 'sliding-window-counter'),
+
+        # --- Controle de admissão (admissao.py) ---
+        ADMISSAO_ATIVA=os.environ.get('ADMISSAO_ATIVA', 'true').lower() in ['true', '1', 't'],
+        # Vagas simultâneas por processo (padrão: o tamanho do pool de conexões)
+        ADMISSAO_VAGAS=int(os.environ.get('ADMISSAO_VAGAS', 0)) or None,
+        ADMISSAO_FILA=int(os.environ.get('ADMISSAO_FILA', 32)),
+        ADMISSAO_ESPERA=float(os.environ.get('ADMISSAO_ESPERA', 5)), # segundos na fila antes do 503
+        ADMISSAO_RETRY_AFTER=int(os.environ.get('ADMISSAO_RETRY_AFTER', 5)),
+        # Páginas anônimas guardadas para servir em vez do 503 (0 desliga)
+        ADMISSAO_CACHE_ITENS=int(os.environ.get('ADMISSAO_CACHE_ITENS', 256)),
+        ADMISSAO_CACHE_IDADE_MAX=int(os.environ.get('ADMISSAO_CACHE_IDADE_MAX', 900)),
+
+        # --- Orçamentos de latência (budgets.py): ms das rotas sem @budget; 0 = sem limite ---
+        BUDGET_PADRAO_MS=int(os.environ.get('BUDGET_PADRAO_MS', 0)),
+
+        # --- Agregados diários (estatisticas.py) ---
+        ESTATISTICAS_FUSO=os.environ.get('ESTATISTICAS_FUSO', 'America/Sao_Paulo'), # fuso que define o "dia"
+        ESTATISTICAS_JANELA_DIAS=int(os.environ.get('ESTATISTICAS_JANELA_DIAS', 2)), # dias recentes sempre refeitos
+        # Segundos entre atualizações feitas pelos workers; 0 = só pelo CLI (cron)
+        ESTATISTICAS_INTERVALO=int(os.environ.get('ESTATISTICAS_INTERVALO', 300)),
+
+        # --- Renderização de templates ---
+        # Páginas grandes (fila do admin, relatos muito comentados) saem em streaming
+        TEMPLATES_STREAMING=os.environ.get('TEMPLATES_STREAMING', 'true').lower() in ['true', '1', 't'],
+        STREAMING_MIN_COMENTARIOS=int(os.environ.get('STREAMING_MIN_COMENTARIOS', 100)),
+        # Templates compilados em disco, reaproveitados por workers novos ('' desliga)
+        JINJA_CACHE_DIR=os.environ.get('JINJA_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache')),
+
+        # --- Cópia estática do site ('flask freeze', estatico.py) ---
+        FREEZE_DIR=os.environ.get('FREEZE_DIR', os.path.join(app.instance_path, 'estatico')),
+        FREEZE_URL_BASE=os.environ.get('FREEZE_URL_BASE'), # ex.: https://observatorio.example.org (sitemap)
+
+        # --- Registro de locais (locais.py) ---
+        LOCAIS_VERIFICAR_INTERVALO=float(os.environ.get('LOCAIS_VERIFICAR_INTERVALO', 60)), # segundos; 0 desliga a recarga
+        LOCAIS_SIMILARIDADE_MIN=float(os.environ.get('LOCAIS_SIMILARIDADE_MIN', 0.8)), # texto livre -> local conhecido
+        LOCAIS_CELULA_METROS=float(os.environ.get('LOCAIS_CELULA_METROS', 100)), # lado da célula da grade espacial
+
+        # --- Geocodificação dos locais ('flask geocode-locais', geocodificacao.py) ---
+        # O Nominatim exige um User-Agent que identifique o app, com contato
+        GEOCODE_USER_AGENT=os.environ.get('GEOCODE_USER_AGENT', 'observatorio-uem/1.0'),
+        GEOCODE_CACHE_DIR=os.environ.get('GEOCODE_CACHE_DIR', os.path.join(app.instance_path, 'geocode')),
+        GOOGLE_API_KEY=os.environ.get('GOOGLE_API_KEY'),
+
+        # --- Quase-duplicatas em relatos e comentários (similaridade.py) ---
+        # Jaccard estimado (MinHash) a partir do qual dois textos contam como cópias; 0 desliga
+        SIMILARIDADE_JACCARD_MIN=float(os.environ.get('SIMILARIDADE_JACCARD_MIN', 0.7)),
+        SIMILARIDADE_MIN_PALAVRAS=int(os.environ.get('SIMILARIDADE_MIN_PALAVRAS', 8)), # textos menores não são assinados
+        SIMILARIDADE_JANELA_DIAS=int(os.environ.get('SIMILARIDADE_JANELA_DIAS', 30)), # só compara com textos recentes
+        # Relato que é cópia de outro fica retido: sem upload de mídia e sem e-mail aos admins
+        SIMILARIDADE_RETER=os.environ.get('SIMILARIDADE_RETER', 'true').lower() in ['true', '1', 't'],
+
+        # --- Réplicas de leitura (opcional) ---
+        DATABASE_REPLICA_URLS=[u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()],
+        DB_REPLICA_MAX_LAG=float(os.environ.get('DB_REPLICA_MAX_LAG', 5)), # segundos
+        DB_REPLICA_CHECK_INTERVAL=float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 10)),
+        DB_PRIMARY_PIN_SECONDS=float(os.environ.get('DB_PRIMARY_PIN_SECONDS', 10)),
     )
 
     # Garante que a SECRET_KEY está definida, pois é crucial para o CSRF
@@ -92,30 +222,92 @@ def create_app(test_config=None):
             app.logger.error(f"ERRO CRÍTICO ao carregar 'locais_uem.json': {e}")
             return {}
 
+    marcar_fase('config')
+
     app.config['LOCAIS_UEM'] = load_locations()
     app.config['CATEGORIAS'] = ["Aparição", "Som Estranho", "Objeto Visto", "Sensação Estranha", "Outro Fenômeno"]
+    # Registro de locais (choices, casador de texto livre e grade espacial),
+    # recarregado da tabela 'locais' sem reinício
+    from . import locais
+    locais.init_app(app)
+    marcar_fase('locais')
 
-    cloudinary.config(
-        cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME'),
-        api_key = os.environ.get('CLOUDINARY_API_KEY'),
-        api_secret = os.environ.get('CLOUDINARY_API_SECRET'),
-        secure = True
-    )
+    # O SDK do backend de mídia (Cloudinary/boto3) só é importado no primeiro upload (storage.py)
 
     # Registra as extensões com o app
     csrf.init_app(app)
     limiter.init_app(app)
+    marcar_fase('extensoes')
 
     # --- REGISTRA O NOVO FILTRO NO AMBIENTE JINJA ---
     app.jinja_env.filters['nl2br'] = nl2br
 
+    # Bytecode dos templates em disco: um worker novo carrega o código já
+    # compilado em vez de analisar e compilar cada template na primeira
+    # requisição (a chave inclui o checksum do fonte, então edições invalidam)
+    if app.config['JINJA_CACHE_DIR']:
+        try:
+            os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+            from jinja2 import FileSystemBytecodeCache
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])
+        except OSError as e:
+            app.logger.warning(f"Cache de bytecode do Jinja desativado: {e}")
+
+    from . import imagens
+    imagens.init_app(app)
+
+    # url_for('static') com hash e a view de estáticos com cache imutável
+    from . import assets
+    assets.init_app(app)
+
+    from . import storage
+    storage.init_app(app)
+
+    # Antes do db: a vaga só é liberada depois que o close_db devolve a conexão
+    from . import admissao
+    admissao.init_app(app)
+
+    # O prazo começa depois da fila de admissão e antes da primeira conexão
+    from . import budgets
+    budgets.init_app(app)
+
     from . import db
     db.init_app(app)
+    marcar_fase('db')
+
+    from . import export
+    export.init_app(app)
+
+    from . import particoes
+    particoes.init_app(app)
+
+    from . import estatisticas
+    estatisticas.init_app(app)
+
+    from . import estatico
+    estatico.init_app(app)
+
+    from . import geocodificacao
+    geocodificacao.init_app(app)
+
+    from . import similaridade
+    similaridade.init_app(app)
+
+    from . import startup
+    startup.init_app(app)
 
     from . import routes_public
     routes_public.register_public_routes(app, limiter)
 
+    from . import uploads
+    uploads.register_upload_routes(app, limiter)
+
+    from . import routes_api
+    routes_api.register_api_routes(app, limiter)
+
     from . import routes_admin
     routes_admin.register_admin_routes(app)
+    marcar_fase('rotas')
 
+    app.extensions['startup_phases'] = fases
     return app
\ No newline at end of file
@@ -0,0 +1,258 @@
+# observatorio/admissao.py
+"""
+Controle de admissão: no máximo uma requisição por conexão do pool.
+
+Cada requisição que usa o banco ocupa uma vaga de um semáforo do processo
+com o mesmo tamanho do pool, ANTES de qualquer trabalho (upload,
+geolocalização, consultas). Sem vaga livre ela espera numa fila limitada,
+ordenada por classe de prioridade:
+
+    moderação (admin autenticado) > escrita (POST...) > leitura logada > leitura anônima
+
+Com a fila cheia, quem chega só entra se for mais prioritário que o último
+da fila, que é então descartado. Quem é descartado (ou espera mais que
+ADMISSAO_ESPERA) recebe um 503 rápido com Retry-After; leituras anônimas
+recebem, se houver, a última cópia da página guardada em memória.
+
+Views que não usam o pool (SSE, mídia local, métricas) são marcadas com
+@sem_admissao, abaixo do @app.route.
+"""
+
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+
+import psycopg2.pool
+from flask import Response, current_app, g, jsonify, request, session
+from flask.globals import request_ctx
+from flask_wtf.csrf import generate_csrf
+
+from . import metricas
+from .db import POOL_MAX_CONEXOES
+from .utils import is_admin_request
+
+MODERACAO, ESCRITA, LEITURA, ANONIMA = range(4)
+NOMES_CLASSES = ('moderacao', 'escrita', 'leitura', 'anonima')
+
+# O token CSRF da página guardada é trocado por este marcador e, ao servir
+# a cópia, por um token novo da sessão de quem pediu
+MARCADOR_CSRF = b'\x00csrf-token\x00'
+
+
+def sem_admissao(f):
+    """Marca uma view que não ocupa conexão do pool (não passa pela fila). Use abaixo do @app.route."""
+    f.sem_admissao = True
+    return f
+
+
+class _Espera:
+    __slots__ = ('evento', 'admitida')
+
+    def __init__(self):
+        self.evento = Event()
+        self.admitida = None
+
+
+class FilaAdmissao:
+    """Semáforo com fila de espera limitada e ordenada por prioridade (menor = mais prioritária)."""
+
+    def __init__(self, vagas, max_fila):
+        self.vagas = vagas
+        self.max_fila = max_fila
+        self.em_uso = 0
+        self._fila = []  # heap de (classe, ordem de chegada, _Espera)
+        self._ordem = itertools.count()
+        self._lock = Lock()
+
+    @property
+    def na_fila(self):
+        return len(self._fila)
+
+    def entrar(self, classe, espera_max):
+        """Ocupa uma vaga; devolve False se a requisição foi descartada ou esperou demais."""
+        with self._lock:
+            if self.em_uso < self.vagas and not self._fila:
+                self.em_uso += 1
+                return True
+            if len(self._fila) >= self.max_fila:
+                # ADMISSAO_FILA=0: sem fila, quem não acha vaga é descartado na hora
+                pior = max(self._fila) if self._fila else None
+                if pior is None or pior[0] <= classe:
+                    return False
+                # Quem chega é mais prioritário: descarta o último da fila
+                self._fila.remove(pior)
+                heapq.heapify(self._fila)
+                pior[2].admitida = False
+                pior[2].evento.set()
+            espera = _Espera()
+            heapq.heappush(self._fila, (classe, next(self._ordem), espera))
+
+        espera.evento.wait(espera_max)
+        with self._lock:
+            if espera.admitida is None:
+                # Tempo esgotado ainda na fila
+                self._fila = [item for item in self._fila if item[2] is not espera]
+                heapq.heapify(self._fila)
+                return False
+            return espera.admitida
+
+    def sair(self):
+        """Libera a vaga, passando-a direto ao primeiro da fila, se houver."""
+        with self._lock:
+            if self._fila:
+                _, _, espera = heapq.heappop(self._fila)
+                espera.admitida = True
+                espera.evento.set()
+            else:
+                self.em_uso -= 1
+
+
+class CachePaginas:
+    """Últimas páginas anônimas renderizadas (LRU), servidas só quando a requisição seria descartada."""
+
+    def __init__(self, max_itens, idade_max):
+        self.max_itens = max_itens
+        self.idade_max = idade_max
+        self._itens = OrderedDict()
+        self._lock = Lock()
+
+    def guardar(self, chave, corpo, content_type):
+        with self._lock:
+            self._itens[chave] = (time.time(), corpo, content_type)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def buscar(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+        if item is None or time.time() - item[0] > self.idade_max:
+            return None
+        return item
+
+
+def classificar():
+    if request.path.startswith('/admin') and is_admin_request():
+        return MODERACAO
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return ESCRITA
+    if session.get('user_id') is not None:
+        return LEITURA
+    return ANONIMA
+
+
+def resposta_sobrecarga():
+    """503 rápido com Retry-After: JSON para chamadas fetch, texto para navegação."""
+    mensagem = 'O servidor está sobrecarregado no momento. Tente novamente em alguns segundos.'
+    if 'text/html' in request.headers.get('Accept', ''):
+        response = Response(mensagem, 503, mimetype='text/plain')
+    else:
+        response = jsonify({'success': False, 'message': mensagem})
+        response.status_code = 503
+    response.headers['Retry-After'] = str(current_app.config['ADMISSAO_RETRY_AFTER'])
+    return response
+
+
+def pagina_guardada():
+    """Cópia guardada da página pedida, para uma leitura anônima (ou None)."""
+    if request.method != 'GET' or g.get('admissao_classe') != ANONIMA:
+        return None
+    cache = current_app.extensions['admissao_cache']
+    item = cache and cache.buscar(request.full_path)
+    if item is None:
+        return None
+    guardada_em, corpo, content_type = item
+    if MARCADOR_CSRF in corpo:
+        corpo = corpo.replace(MARCADOR_CSRF, generate_csrf().encode())
+    metricas.incrementar('observatorio_admissao_paginas_guardadas_total',
+                         ajuda='Requisições descartadas atendidas com uma cópia guardada da página.')
+    response = Response(corpo, 200, content_type=content_type)
+    response.headers['Age'] = str(int(time.time() - guardada_em))
+    response.headers['X-Cache'] = 'STALE'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def _admitir():
+    config = current_app.config
+    if not config['ADMISSAO_ATIVA'] or request.endpoint in (None, 'static'):
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    if getattr(view, 'sem_admissao', False):
+        return None
+
+    g.admissao_classe = classe = classificar()
+    nome = NOMES_CLASSES[classe]
+    inicio = time.perf_counter()
+    admitida = current_app.extensions['admissao'].entrar(classe, config['ADMISSAO_ESPERA'])
+    metricas.incrementar('observatorio_admissao_espera_segundos_total', time.perf_counter() - inicio,
+                         ajuda='Tempo total de espera na fila de admissão.', classe=nome)
+    if admitida:
+        g.admissao_vaga = True
+        metricas.incrementar('observatorio_admissao_admitidas_total',
+                             ajuda='Requisições admitidas.', classe=nome)
+        return None
+
+    metricas.incrementar('observatorio_admissao_descartadas_total',
+                         ajuda='Requisições descartadas (fila cheia ou espera esgotada).', classe=nome)
+    return pagina_guardada() or resposta_sobrecarga()
+
+
+def _guardar_pagina(response):
+    """Guarda a página anônima de uma view @read_only para servir sob sobrecarga."""
+    cache = current_app.extensions['admissao_cache']
+    if cache is None or not g.get('admissao_vaga') or g.admissao_classe != ANONIMA \
+            or request.method != 'GET' or response.status_code != 200 \
+            or response.mimetype != 'text/html' or response.is_streamed:
+        return response
+    view = current_app.view_functions.get(request.endpoint)
+    # Páginas com mensagens flash são de uma sessão específica
+    if not getattr(view, 'db_read_only', False) or request_ctx.flashes or session.get('_flashes'):
+        return response
+    corpo = response.get_data()
+    token = g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+    if token:
+        corpo = corpo.replace(token.encode(), MARCADOR_CSRF)
+    cache.guardar(request.full_path, corpo, response.content_type)
+    return response
+
+
+def _liberar(e=None):
+    if g.pop('admissao_vaga', None):
+        current_app.extensions['admissao'].sair()
+
+
+def _pool_esgotado(e):
+    """O pool recusou uma conexão (ex.: vagas do semáforo maiores que o pool): 503, não 500."""
+    current_app.logger.warning(f"Pool de conexões esgotado: {e}")
+    metricas.incrementar('observatorio_pool_esgotado_total', ajuda='Requisições que encontraram o pool esgotado.')
+    return resposta_sobrecarga()
+
+
+def init_app(app):
+    """
+    Registra a admissão. Deve vir depois do limiter (quem estoura o rate
+    limit nem entra na fila) e antes do db.init_app: o teardown que libera
+    a vaga precisa rodar depois do close_db devolver a conexão.
+    """
+    config = app.config
+    fila = FilaAdmissao(config['ADMISSAO_VAGAS'] or POOL_MAX_CONEXOES, config['ADMISSAO_FILA'])
+    app.extensions['admissao'] = fila
+    app.extensions['admissao_cache'] = (
+        CachePaginas(config['ADMISSAO_CACHE_ITENS'], config['ADMISSAO_CACHE_IDADE_MAX'])
+        if config['ADMISSAO_CACHE_ITENS'] else None
+    )
+
+    metricas.registrar_medidor('observatorio_admissao_fila', lambda: fila.na_fila,
+                               ajuda='Requisições esperando vaga na fila de admissão.')
+    metricas.registrar_medidor('observatorio_admissao_em_uso', lambda: fila.em_uso,
+                               ajuda='Vagas de admissão ocupadas.')
+    metricas.registrar_medidor('observatorio_admissao_vagas', lambda: fila.vagas,
+                               ajuda='Total de vagas de admissão (tamanho do pool).')
+
+    app.before_request(_admitir)
+    app.after_request(_guardar_pagina)
+    app.teardown_appcontext(_liberar)
+    app.register_error_handler(psycopg2.pool.PoolError, _pool_esgotado)
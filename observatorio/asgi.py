@@ -0,0 +1,397 @@
+# observatorio/asgi.py
+"""
+Modo de serviço ASGI (opcional).
+
+Os endpoints JSON de interação (vote, witness, like_comment) e uma API de
+leitura do mapa/relato rodam em asyncio com um pool nativo do asyncpg; o
+resto do app Flask é montado ao lado via WSGI e continua igual. A sessão é
+o mesmo cookie assinado do Flask, então 'session["sid"]' e o token CSRF
+valem nos dois lados.
+
+Uso:
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5011
+"""
+
+import asyncio
+import hmac
+import json
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadData, URLSafeTimedSerializer
+from limits import parse as parse_limit
+from limits.aio.strategies import STRATEGIES as ESTRATEGIAS_LIMITE
+from limits.storage import storage_from_string
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from . import create_app
+from .db import PIN_SESSION_KEY, dsn_usa_pooler, preparadas_ativas
+from .locais import registro_atual
+from .realtime import get_difusor, canal_relato, formatar_sse, TAMANHO_FILA_ASSINANTE
+from .routes_public import build_map_query, group_map_rows
+from .utils import get_city_from_ip
+
+
+class FlaskSession(dict):
+    """
+    Lê e grava o cookie de sessão do Flask fora do Flask, usando o mesmo
+    serializador assinado (SecureCookieSessionInterface).
+    """
+
+    def __init__(self, flask_app, request):
+        self.flask_app = flask_app
+        self.serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self.cookie_name = flask_app.config['SESSION_COOKIE_NAME']
+        self.modified = False
+        dados = {}
+        cookie = request.cookies.get(self.cookie_name)
+        if cookie and self.serializer is not None:
+            max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+            try:
+                dados = self.serializer.loads(cookie, max_age=max_age)
+            except BadData:
+                dados = {}
+        super().__init__(dados)
+
+    def __setitem__(self, key, value):
+        self.modified = True
+        super().__setitem__(key, value)
+
+    def save(self, response):
+        """Grava o cookie na resposta, com os mesmos atributos que o Flask usaria."""
+        if not self.modified or self.serializer is None:
+            return
+        interface = self.flask_app.session_interface
+        app = self.flask_app
+        max_age = None
+        if self.get('_permanent'):
+            max_age = int(app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(
+            self.cookie_name,
+            self.serializer.dumps(dict(self)),
+            max_age=max_age,
+            path=interface.get_cookie_path(app),
+            domain=interface.get_cookie_domain(app),
+            secure=interface.get_cookie_secure(app),
+            httponly=interface.get_cookie_httponly(app),
+            samesite=interface.get_cookie_samesite(app),
+        )
+
+    def ensure_sid(self):
+        if 'sid' not in self:
+            self['sid'] = str(uuid.uuid4())
+        return self['sid']
+
+
+def _asyncpg_dsn(dsn):
+    """Remove da URL os parâmetros que só a libpq entende (o asyncpg os trataria como server_settings)."""
+    partes = urlsplit(dsn)
+    query = [(k, v) for k, v in parse_qsl(partes.query) if k not in ('channel_binding', 'options')]
+    return urlunsplit(partes._replace(query=urlencode(query)))
+
+
+def _to_asyncpg_placeholders(query):
+    """Converte placeholders '%s' (psycopg2) em '$1, $2...' (asyncpg)."""
+    contador = iter(range(1, 1000))
+    return re.sub(r'%s', lambda _: f'${next(contador)}', query)
+
+
+def create_asgi_app(flask_app=None):
+    flask_app = flask_app or create_app()
+    config = flask_app.config
+    estado = {}
+
+    # Mesmo armazenamento e estratégia do Flask-Limiter: os contadores valem
+    # para todos os workers do uvicorn/gunicorn no host (limiter_storage.py)
+    limiter = ESTRATEGIAS_LIMITE[config['RATELIMIT_STRATEGY']](
+        storage_from_string('async+' + config['RATELIMIT_STORAGE_URI'])
+    )
+    limites = {
+        'vote': parse_limit('30 per hour'),
+        'witness': parse_limit('30 per hour'),
+        'like_comment': parse_limit('30 per minute'),
+        'api': parse_limit('120 per minute'),
+    }
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        opcoes = {}
+        # O asyncpg prepara cada consulta e guarda o statement por conexão;
+        # atrás de um pooler em modo transação (db._usa_pooler) o EXECUTE
+        # pode cair noutro backend ("prepared statement ... does not exist")
+        if not preparadas_ativas(config['DB_PREPARED_STATEMENTS'], lambda: dsn_usa_pooler(config['DATABASE_URL'])):
+            opcoes['statement_cache_size'] = 0
+        estado['pool'] = await asyncpg.create_pool(
+            _asyncpg_dsn(config['DATABASE_URL']),
+            min_size=1,
+            max_size=int(config.get('ASGI_DB_POOL_MAX', 10)),
+            **opcoes,
+        )
+        try:
+            yield
+        finally:
+            await estado['pool'].close()
+
+    def client_ip(request):
+        return request.headers.get('X-Forwarded-For', request.client.host if request.client else '')
+
+    async def rate_limited(request, nome):
+        if not config.get('RATELIMIT_ENABLED', True):
+            return False
+        return not await limiter.hit(limites[nome], nome, client_ip(request))
+
+    def csrf_valid(request, sessao):
+        """Mesma verificação do Flask-WTF: token do header assinado e igual ao da sessão."""
+        if not config.get('WTF_CSRF_ENABLED', True):
+            return True
+        token = request.headers.get('X-CSRFToken') or request.headers.get('X-CSRF-Token')
+        if not token or 'csrf_token' not in sessao:
+            return False
+        serializer = URLSafeTimedSerializer(
+            config.get('WTF_CSRF_SECRET_KEY') or config['SECRET_KEY'], salt='wtf-csrf-token'
+        )
+        try:
+            valor = serializer.loads(token, max_age=config.get('WTF_CSRF_TIME_LIMIT', 3600))
+        except BadData:
+            return False
+        return hmac.compare_digest(sessao['csrf_token'], valor)
+
+    def pin_primary(sessao):
+        """Após uma escrita, fixa a sessão no primário (mesma regra do db.py para as views Flask)."""
+        if config['DATABASE_REPLICA_URLS']:
+            sessao[PIN_SESSION_KEY] = time.time() + config['DB_PRIMARY_PIN_SECONDS']
+
+    def json_response(sessao, payload, status=200, background=None):
+        response = JSONResponse(payload, status_code=status, background=background)
+        sessao.save(response)
+        return response
+
+    def city_from_ip(ip_address):
+        with flask_app.app_context():
+            return get_city_from_ip(ip_address)
+
+    async def update_city(tabela, registro, ip_address):
+        """Busca a cidade em segundo plano (depois da resposta) e atualiza o registro."""
+        city = await asyncio.to_thread(city_from_ip, ip_address)
+        # criado_em junto do id limita o UPDATE à partição do mês
+        await estado['pool'].execute(
+            f'UPDATE {tabela} SET city_id = city_id_de($1) WHERE id = $2 AND criado_em = $3',
+            city, registro['id'], registro['criado_em']
+        )
+
+    async def notify_relato(conn, relato_id, payload):
+        """Mesmo evento emitido pelas views Flask (realtime.notify_relato), dentro da transação."""
+        await conn.execute('SELECT pg_notify($1, $2)', canal_relato(relato_id), json.dumps(payload))
+
+    async def preflight(request, nome):
+        sessao = FlaskSession(flask_app, request)
+        if await rate_limited(request, nome):
+            return sessao, json_response(sessao, {'success': False, 'message': 'Muitas requisições. Tente novamente mais tarde.'}, 429)
+        if not csrf_valid(request, sessao):
+            return sessao, json_response(sessao, {'success': False, 'message': 'Token CSRF inválido ou ausente.'}, 400)
+        return sessao, None
+
+    async def vote(request):
+        relato_id = request.path_params['relato_id']
+        tipo_voto = request.path_params['tipo_voto']
+        sessao, erro = await preflight(request, 'vote')
+        if erro:
+            return erro
+        sid = sessao.ensure_sid()
+        if tipo_voto not in ['acredito', 'cetico']:
+            return json_response(sessao, {'success': False, 'message': 'Tipo de voto inválido'}, 400)
+
+        ip_address = client_ip(request)
+        user_agent = request.headers.get('User-Agent')
+        coluna = 'votos_acredito' if tipo_voto == 'acredito' else 'votos_cetico'
+        async with estado['pool'].acquire() as conn:
+            async with conn.transaction():
+                if await conn.fetchval('SELECT 1 FROM votos WHERE relato_id = $1 AND session_id = $2', relato_id, sid):
+                    return json_response(sessao, {'success': False, 'message': 'Você já votou neste relato.'}, 403)
+                voto = await conn.fetchrow(
+                    'INSERT INTO votos (relato_id, session_id, tipo_voto, ip_address, user_agent_id) '
+                    'VALUES ($1, $2, $3, ip_ou_nulo($4), user_agent_id_de($5)) RETURNING id, criado_em',
+                    relato_id, sid, tipo_voto, ip_address, user_agent
+                )
+                contagens = await conn.fetchrow(
+                    f'UPDATE relatos SET {coluna} = {coluna} + 1 WHERE id = $1 RETURNING votos_acredito, votos_cetico',
+                    relato_id
+                )
+                await notify_relato(conn, relato_id, {
+                    'tipo': 'votos',
+                    'votos_acredito': contagens['votos_acredito'],
+                    'votos_cetico': contagens['votos_cetico'],
+                })
+        pin_primary(sessao)
+        return json_response(
+            sessao,
+            {'success': True, 'message': 'Voto computado!',
+             'votos_acredito': contagens['votos_acredito'], 'votos_cetico': contagens['votos_cetico']},
+            background=BackgroundTask(update_city, 'votos', voto, ip_address),
+        )
+
+    async def witness(request):
+        relato_id = request.path_params['relato_id']
+        sessao, erro = await preflight(request, 'witness')
+        if erro:
+            return erro
+        sid = sessao.ensure_sid()
+
+        ip_address = client_ip(request)
+        user_agent = request.headers.get('User-Agent')
+        async with estado['pool'].acquire() as conn:
+            async with conn.transaction():
+                if await conn.fetchval('SELECT 1 FROM testemunhas WHERE relato_id = $1 AND session_id = $2', relato_id, sid):
+                    return json_response(sessao, {'success': False, 'message': 'Você já interagiu com este relato.'}, 403)
+                testemunha = await conn.fetchrow(
+                    'INSERT INTO testemunhas (relato_id, session_id, ip_address, user_agent_id) '
+                    'VALUES ($1, $2, ip_ou_nulo($3), user_agent_id_de($4)) RETURNING id, criado_em',
+                    relato_id, sid, ip_address, user_agent
+                )
+                nova_contagem = await conn.fetchval(
+                    'UPDATE relatos SET votos_testemunha = votos_testemunha + 1 WHERE id = $1 RETURNING votos_testemunha',
+                    relato_id
+                )
+                await notify_relato(conn, relato_id, {'tipo': 'testemunhas', 'votos_testemunha': nova_contagem})
+        pin_primary(sessao)
+        return json_response(
+            sessao,
+            {'success': True, 'message': 'Testemunho registrado!', 'votos_testemunha': nova_contagem},
+            background=BackgroundTask(update_city, 'testemunhas', testemunha, ip_address),
+        )
+
+    async def like_comment(request):
+        comment_id = request.path_params['commentId']
+        sessao, erro = await preflight(request, 'like_comment')
+        if erro:
+            return erro
+        sid = sessao.ensure_sid()
+
+        ip_address = client_ip(request)
+        user_agent = request.headers.get('User-Agent')
+        background = None
+        async with estado['pool'].acquire() as conn:
+            async with conn.transaction():
+                # Mesma trava da versão Flask: sem UNIQUE na tabela particionada
+                await conn.execute('SELECT id FROM comentarios WHERE id = $1 FOR UPDATE', comment_id)
+                like = await conn.fetchrow(
+                    'SELECT id, criado_em FROM comentarios_likes WHERE comentario_id = $1 AND session_id = $2', comment_id, sid
+                )
+                if like:
+                    await conn.execute('DELETE FROM comentarios_likes WHERE id = $1 AND criado_em = $2',
+                                       like['id'], like['criado_em'])
+                    comentario = await conn.fetchrow(
+                        'UPDATE comentarios SET like_count = GREATEST(0, like_count - 1) WHERE id = $1 RETURNING relato_id, like_count',
+                        comment_id
+                    )
+                    action = 'unliked'
+                else:
+                    novo = await conn.fetchrow(
+                        'INSERT INTO comentarios_likes (comentario_id, session_id, ip_address, user_agent_id) '
+                        'VALUES ($1, $2, ip_ou_nulo($3), user_agent_id_de($4)) RETURNING id, criado_em',
+                        comment_id, sid, ip_address, user_agent
+                    )
+                    comentario = await conn.fetchrow(
+                        'UPDATE comentarios SET like_count = like_count + 1 WHERE id = $1 RETURNING relato_id, like_count',
+                        comment_id
+                    )
+                    background = BackgroundTask(update_city, 'comentarios_likes', novo, ip_address)
+                    action = 'liked'
+                like_count = comentario['like_count'] if comentario else 0
+                if comentario:
+                    await notify_relato(conn, comentario['relato_id'], {
+                        'tipo': 'like', 'comentario_id': comment_id, 'like_count': like_count
+                    })
+        pin_primary(sessao)
+        # 'contagens' sai como lista, igual à versão Flask (que serializa uma DictRow)
+        return json_response(sessao, {'success': True, 'contagens': [like_count], 'action': action}, background=background)
+
+    async def api_mapa(request):
+        if await rate_limited(request, 'api'):
+            return JSONResponse({'success': False, 'message': 'Muitas requisições.'}, status_code=429)
+        query, params = build_map_query(request.query_params, config['CATEGORIAS'])
+        rows = await estado['pool'].fetch(_to_asyncpg_placeholders(query), *params)
+        # variant_url lê MEDIA_URL de current_app (mídia local/S3): precisa do contexto do app
+        with flask_app.app_context():
+            marcadores = group_map_rows(rows, registro_atual(flask_app))
+        return JSONResponse(marcadores)
+
+    async def api_relato(request):
+        if await rate_limited(request, 'api'):
+            return JSONResponse({'success': False, 'message': 'Muitas requisições.'}, status_code=429)
+        relato_id = request.path_params['relato_id']
+        async with estado['pool'].acquire() as conn:
+            relato = await conn.fetchrow("""
+                SELECT r.id, r.titulo, r.descricao, r.local, r.categoria, r.imagem_url, r.audio_url,
+                       to_char(r.criado_em, 'DD/MM/YYYY') AS criado_em,
+                       r.votos_acredito, r.votos_cetico, r.votos_testemunha,
+                       u.nome AS autor_relato, u.id AS autor_id
+                FROM relatos r LEFT JOIN users u ON r.user_id = u.id
+                WHERE r.id = $1 AND r.aprovado = TRUE
+            """, relato_id)
+            if relato is None:
+                return JSONResponse({'success': False, 'message': 'Relato não encontrado.'}, status_code=404)
+            comentarios = await conn.fetch("""
+                SELECT c.id, c.texto, c.like_count, to_char(c.criado_em, 'DD/MM/YYYY HH24:MI') AS criado_em,
+                       u.nome AS autor, u.id AS autor_id
+                FROM comentarios c JOIN users u ON c.user_id = u.id
+                WHERE c.relato_id = $1 ORDER BY c.criado_em ASC
+            """, relato_id)
+        return JSONResponse({'relato': dict(relato), 'comentarios': [dict(c) for c in comentarios]})
+
+    async def relato_eventos(request):
+        """SSE dos contadores do relato; cada espectador é só uma corrotina, sem thread nem conexão própria."""
+        relato_id = request.path_params['relato_id']
+        loop = asyncio.get_running_loop()
+        fila = asyncio.Queue(maxsize=TAMANHO_FILA_ASSINANTE)
+
+        def enfileirar(payload):
+            if fila.full():
+                fila.get_nowait()
+            fila.put_nowait(payload)
+
+        def entregar(payload):
+            # Chamado pela thread do LISTEN
+            loop.call_soon_threadsafe(enfileirar, payload)
+
+        difusor = get_difusor(config.get('DATABASE_LISTEN_URL') or config['DATABASE_URL'])
+        difusor.assinar(relato_id, entregar)
+
+        async def gerar():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    try:
+                        payload = await asyncio.wait_for(fila.get(), timeout=15)
+                    except asyncio.TimeoutError:
+                        yield ': keepalive\n\n'
+                        continue
+                    yield formatar_sse(payload)
+            finally:
+                difusor.cancelar(relato_id, entregar)
+
+        return StreamingResponse(gerar(), media_type='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+
+    routes = [
+        Route('/vote/{relato_id:int}/{tipo_voto:str}', vote, methods=['POST']),
+        Route('/witness/{relato_id:int}', witness, methods=['POST']),
+        Route('/like_comment/{commentId:int}', like_comment, methods=['POST']),
+        Route('/relato/{relato_id:int}/eventos', relato_eventos, methods=['GET']),
+        Route('/api/mapa', api_mapa, methods=['GET']),
+        Route('/api/relato/{relato_id:int}', api_relato, methods=['GET']),
+        # Todo o resto continua no Flask
+        Mount('/', app=WSGIMiddleware(flask_app, workers=int(config.get('ASGI_WSGI_THREADS', 10)))),
+    ]
+    return Starlette(routes=routes, lifespan=lifespan)
@@ -0,0 +1,209 @@
+# observatorio/assets.py
+
+import glob
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+# Saída do build, dentro da pasta static (servida em /static/dist/...)
+DIST = 'dist'
+MANIFESTO = 'manifest.json'
+
+# Pacotes: um arquivo gerado a partir de vários, na ordem do layout.html
+PACOTES = {
+    'css/site.css': ['css/base.css', 'css/components.css', 'css/pages.css',
+                     'css/responsive.css', 'css/profile.css'],
+}
+# Arquivos versionados individualmente (imagens antes: o CSS aponta para elas)
+PADROES = ['images/*', 'css/*.css', 'js/*.js']
+# Tipos que ganham as variantes .gz/.br (PNG e JPEG já são comprimidos)
+COMPRIMIVEIS = {'.css', '.js', '.svg', '.ico', '.json'}
+# Um ano: os nomes com hash nunca mudam de conteúdo
+IDADE_IMUTAVEL = 365 * 24 * 3600
+
+URL_CSS = re.compile(r"""url\(\s*(['"]?)/static/([^'")]+)\1\s*\)""")
+
+
+def _minificar_css(texto):
+    """Usa o rcssmin (requirements-assets.txt) se instalado; senão só tira comentários e espaços."""
+    try:
+        import rcssmin
+        return rcssmin.cssmin(texto)
+    except ImportError:
+        texto = re.sub(r'/\*.*?\*/', '', texto, flags=re.S)
+        texto = re.sub(r'\s+', ' ', texto)
+        return re.sub(r'\s*([{};,])\s*', r'\1', texto).strip()
+
+
+def _minificar_js(texto):
+    """Usa o rjsmin (requirements-assets.txt) se instalado; senão mantém o arquivo como está."""
+    try:
+        import rjsmin
+        return rjsmin.jsmin(texto)
+    except ImportError:
+        return texto
+
+
+def _comprimir(caminho, dados):
+    """Grava <caminho>.gz e, com o pacote brotli, <caminho>.br, quando ficam menores que o original."""
+    variantes = [('.gz', gzip.compress(dados, compresslevel=9, mtime=0))]
+    try:
+        import brotli
+        variantes.append(('.br', brotli.compress(dados, quality=11)))
+    except ImportError:
+        pass
+    for extensao, comprimido in variantes:
+        if len(comprimido) < len(dados):
+            with open(caminho + extensao, 'wb') as f:
+                f.write(comprimido)
+
+
+def _processar(static_folder, nome, dados, manifesto):
+    """Minifica (CSS/JS), grava dist/<nome com hash> e as variantes comprimidas; registra no manifesto."""
+    raiz, extensao = os.path.splitext(nome)
+    if extensao == '.css':
+        texto = URL_CSS.sub(lambda m: f"url('/static/{manifesto.get(m.group(2), m.group(2))}')",
+                            dados.decode('utf-8'))
+        dados = _minificar_css(texto).encode('utf-8')
+    elif extensao == '.js':
+        dados = _minificar_js(dados.decode('utf-8')).encode('utf-8')
+
+    resumo = hashlib.sha256(dados).hexdigest()[:10]
+    destino = f"{DIST}/{raiz}.{resumo}{extensao}"
+    caminho = os.path.join(static_folder, *destino.split('/'))
+    if not os.path.exists(caminho):
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'wb') as f:
+            f.write(dados)
+        if extensao in COMPRIMIVEIS:
+            _comprimir(caminho, dados)
+    manifesto[nome] = destino
+
+
+def construir(static_folder):
+    """
+    Gera static/dist: cada arquivo de PADROES e cada pacote de PACOTES com o
+    hash do conteúdo no nome, mais as variantes .gz/.br. Grava o manifesto
+    (nome lógico -> arquivo em dist) e o retorna. Builds anteriores ficam em
+    dist (páginas em cache ainda podem apontar para elas); veja --limpar.
+    """
+    manifesto = {}
+    for padrao in PADROES:
+        for caminho in sorted(glob.glob(os.path.join(static_folder, padrao))):
+            nome = os.path.relpath(caminho, static_folder).replace(os.sep, '/')
+            with open(caminho, 'rb') as f:
+                _processar(static_folder, nome, f.read(), manifesto)
+    for pacote, partes in PACOTES.items():
+        dados = b''
+        for parte in partes:
+            with open(os.path.join(static_folder, *parte.split('/')), 'rb') as f:
+                dados += f.read() + b'\n'
+        _processar(static_folder, pacote, dados, manifesto)
+
+    with open(os.path.join(static_folder, DIST, MANIFESTO), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, sort_keys=True)
+    return manifesto
+
+
+def limpar(static_folder, manifesto):
+    """Remove de dist os arquivos que o manifesto atual não usa. Retorna quantos removeu."""
+    em_uso = {os.path.join(static_folder, *destino.split('/')) for destino in manifesto.values()}
+    em_uso |= {caminho + extensao for caminho in em_uso for extensao in ('.gz', '.br')}
+    em_uso.add(os.path.join(static_folder, DIST, MANIFESTO))
+    removidos = 0
+    for raiz, _, arquivos in os.walk(os.path.join(static_folder, DIST)):
+        for arquivo in arquivos:
+            caminho = os.path.join(raiz, arquivo)
+            if caminho not in em_uso:
+                os.remove(caminho)
+                removidos += 1
+    return removidos
+
+
+def carregar_manifesto(app):
+    """Lê static/dist/manifest.json; sem build (ou em modo debug) os arquivos saem direto de static/."""
+    caminho = os.path.join(app.static_folder, DIST, MANIFESTO)
+    if app.debug or not os.path.exists(caminho):
+        return {}
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def url_for_assets(endpoint, **values):
+    """url_for dos templates: 'static' aponta para a versão com hash quando ela existe no manifesto."""
+    if endpoint == 'static':
+        manifesto = current_app.extensions['assets']['manifesto']
+        if values.get('filename') in manifesto:
+            values['filename'] = manifesto[values['filename']]
+    return url_for(endpoint, **values)
+
+
+def pacote_urls(nome):
+    """URLs de um pacote de PACOTES: o arquivo único do build ou, sem build, as partes na ordem."""
+    if nome in current_app.extensions['assets']['manifesto']:
+        return [url_for_assets('static', filename=nome)]
+    return [url_for('static', filename=parte) for parte in PACOTES[nome]]
+
+
+def servir_static(filename):
+    """
+    Substitui a view 'static' do Flask. Arquivos do build (nomes com hash)
+    saem com cache de um ano + immutable e, se o navegador aceitar, na
+    variante .br ou .gz gravada no build. O resto segue o padrão do Flask.
+    """
+    assets = current_app.extensions['assets']
+    if filename not in assets['imutaveis']:
+        return current_app.send_static_file(filename)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    for codificacao, extensao in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[codificacao] and filename + extensao in assets['comprimidos']:
+            response = send_from_directory(current_app.static_folder, filename + extensao,
+                                           mimetype=mimetype, max_age=IDADE_IMUTAVEL)
+            response.headers['Content-Encoding'] = codificacao
+            break
+    else:
+        response = send_from_directory(current_app.static_folder, filename,
+                                       mimetype=mimetype, max_age=IDADE_IMUTAVEL)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@click.command('build-assets')
+@click.option('--limpar', 'remover_antigos', is_flag=True, help='Remove de static/dist os arquivos de builds anteriores.')
+@with_appcontext
+def build_assets_command(remover_antigos):
+    """Gera static/dist: CSS/JS minificados e versionados por hash, com variantes .gz/.br."""
+    static_folder = current_app.static_folder
+    manifesto = construir(static_folder)
+    click.echo(f"{len(manifesto)} arquivo(s) no manifesto {DIST}/{MANIFESTO}.")
+    if remover_antigos:
+        click.echo(f"{limpar(static_folder, manifesto)} arquivo(s) antigo(s) removido(s).")
+
+
+def init_app(app):
+    """Carrega o manifesto, instala o url_for dos templates e a view de arquivos estáticos."""
+    manifesto = carregar_manifesto(app)
+    comprimidos = set()
+    for destino in manifesto.values():
+        for extensao in ('.gz', '.br'):
+            if os.path.exists(os.path.join(app.static_folder, *destino.split('/')) + extensao):
+                comprimidos.add(destino + extensao)
+    app.extensions['assets'] = {
+        'manifesto': manifesto,
+        'imutaveis': set(manifesto.values()),
+        'comprimidos': comprimidos,
+    }
+    app.jinja_env.globals['url_for'] = url_for_assets
+    app.jinja_env.globals['pacote_urls'] = pacote_urls
+    app.view_functions['static'] = servir_static
+    app.cli.add_command(build_assets_command)
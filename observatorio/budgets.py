@@ -0,0 +1,112 @@
+# observatorio/budgets.py
+"""
+Orçamentos de latência por rota.
+
+    @app.route('/')
+    @read_only
+    @budget(ms=300)
+    def index(): ...
+
+Com um orçamento, a requisição ganha um prazo (g.prazo) e:
+- cada transação da requisição recebe 'statement_timeout' (SET LOCAL) igual
+  ao orçamento (db.py), então nenhuma consulta sozinha segura a conexão
+  além dele;
+- as chamadas de rede feitas durante a requisição (ip-api, Cloudinary)
+  usam como timeout o tempo que resta (prazo_restante);
+- se o Postgres cancelar a consulta (QueryCanceled) ou o código chamar
+  verificar_prazo() com o prazo vencido, a view devolve uma resposta
+  degradada: a função 'degradar' da própria rota, a cópia guardada da
+  página (admissao.py) ou um 503 com Retry-After.
+
+Estouros (respostas entregues depois do prazo) e respostas degradadas são
+contados por endpoint em /admin/metricas.
+"""
+
+import time
+
+import psycopg2.errors
+from flask import current_app, g, has_request_context, request
+
+from . import metricas
+
+
+class OrcamentoEsgotado(Exception):
+    """O prazo da requisição venceu antes de uma etapa que não vale mais a pena fazer."""
+
+
+def budget(ms, degradar=None):
+    """
+    Declara o orçamento da view em milissegundos. 'degradar' é uma função
+    sem argumentos que monta a resposta reduzida. Use abaixo do @app.route.
+    """
+    def decorador(f):
+        f.budget_ms = ms
+        f.budget_degradar = degradar
+        return f
+    return decorador
+
+
+def prazo_restante(padrao, minimo=0.05):
+    """
+    Segundos até o prazo da requisição, limitados a 'padrao' (o timeout
+    usado sem orçamento, ou fora de uma requisição). Nunca menos que 'minimo',
+    para que uma chamada de rede ainda tenha alguma chance.
+    """
+    prazo = g.get('prazo') if has_request_context() else None
+    if prazo is None:
+        return padrao
+    return max(minimo, min(padrao, prazo - time.monotonic()))
+
+
+def prazo_vencido():
+    prazo = g.get('prazo') if has_request_context() else None
+    return prazo is not None and time.monotonic() >= prazo
+
+
+def verificar_prazo():
+    """Levanta OrcamentoEsgotado se o prazo da requisição já passou."""
+    if prazo_vencido():
+        raise OrcamentoEsgotado()
+
+
+def _iniciar_prazo():
+    view = current_app.view_functions.get(request.endpoint)
+    ms = getattr(view, 'budget_ms', None) or current_app.config['BUDGET_PADRAO_MS']
+    if ms:
+        g.budget_ms = ms
+        g.prazo = time.monotonic() + ms / 1000
+
+
+def _contar_estouro(response):
+    prazo = g.get('prazo')
+    if prazo is not None and time.monotonic() > prazo:
+        metricas.incrementar('observatorio_budget_estourado_total', endpoint=request.endpoint,
+                             ajuda='Respostas entregues depois do orçamento da rota.')
+    return response
+
+
+def _resposta_degradada(e):
+    """Consulta cancelada pelo statement_timeout ou prazo vencido: resposta reduzida em vez de 500."""
+    from .admissao import pagina_guardada, resposta_sobrecarga
+
+    if isinstance(e, psycopg2.errors.QueryCanceled) and 'prazo' not in g:
+        # Cancelamento que não veio de um orçamento: segue como erro comum
+        raise e
+    current_app.logger.warning(f"Orçamento de {g.get('budget_ms')} ms esgotado em {request.endpoint}: {e}")
+    metricas.incrementar('observatorio_budget_degradadas_total', endpoint=request.endpoint,
+                         ajuda='Respostas degradadas por orçamento esgotado.')
+    if 'db' in g and not g.db.closed:
+        g.db.rollback()
+    view = current_app.view_functions.get(request.endpoint)
+    degradar = getattr(view, 'budget_degradar', None)
+    if degradar is not None:
+        return degradar()
+    return pagina_guardada() or resposta_sobrecarga()
+
+
+def init_app(app):
+    """Registra o prazo por requisição. Deve vir antes do db.init_app (o get_db lê g.budget_ms)."""
+    app.before_request(_iniciar_prazo)
+    app.after_request(_contar_estouro)
+    app.register_error_handler(psycopg2.errors.QueryCanceled, _resposta_degradada)
+    app.register_error_handler(OrcamentoEsgotado, _resposta_degradada)
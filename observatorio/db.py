@@ -1,62 +1,631 @@
 # observatorio/db.py
 
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import psycopg2.pool
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request, session
 import os
+import time
+import itertools
+import re
+import select
+import weakref
+import zlib
+from datetime import datetime
+from functools import wraps
+from threading import Lock, Thread
+from zoneinfo import ZoneInfo
+
+from . import metricas
 
 # Variável global para armazenar o pool de conexões.
-# Será inicializada uma única vez quando a aplicação iniciar.
+# É criada sob demanda na primeira requisição que precisar do banco
+# (ou pela thread de aquecimento, se DB_WARMUP estiver ativo).
 pool = None
+_pool_lock = Lock()
+
+# Conexões por pool; a admissão (admissao.py) usa o mesmo número de vagas
+POOL_MAX_CONEXOES = 10
+
+# Ajustes do pool e das conexões, definidos em init_app a partir da config
+# (o pool também é criado fora do contexto da aplicação, pela thread de manutenção)
+_ajustes = {'minconn': 1, 'vida_max': 0, 'partida_fria': 1.0, 'conexao': {}}
+
+# Estado do aquecimento, para /healthz/ready e /admin/metricas
+_estado = {'aquecido': False, 'erro': None, 'schema': None, 'ultima_conexao': 0.0}
+_manutencao_lock = Lock()
+
+
+def _registrar_conexao(segundos):
+    """Métricas de abertura de conexão; 'requisicao' é latência que algum usuário esperou."""
+    origem = 'requisicao' if has_request_context() else 'fundo'
+    _estado['ultima_conexao'] = segundos
+    metricas.incrementar('observatorio_db_conexoes_total', ajuda='Conexões abertas com o banco.', origem=origem)
+    metricas.incrementar('observatorio_db_conexao_segundos_total', segundos,
+                         ajuda='Tempo total gasto abrindo conexões com o banco.', origem=origem)
+    if segundos >= _ajustes['partida_fria']:
+        metricas.incrementar('observatorio_db_partidas_frias_total',
+                             ajuda='Conexões mais lentas que DB_PARTIDA_FRIA_SEGUNDOS (compute acordando).',
+                             origem=origem)
+
+
+class PoolConexoes(psycopg2.pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool que mede cada connect e anota quando cada conexão
+    foi aberta. Conexões com mais de 'vida_max' segundos são fechadas ao
+    voltar para o pool; as ociosas são trocadas antes disso pela manutenção
+    (renovar), que abre as substitutas fora do lock, sem fazer nenhuma
+    requisição esperar o connect.
+
+    Atenção: o pool do psycopg2 fecha a conexão devolvida quando já há
+    'minconn' ociosas, então 'minconn' é também o máximo de conexões
+    ociosas (quentes) mantidas abertas.
+    """
+
+    def __init__(self, minconn, maxconn, *args, vida_max=0, **kwargs):
+        self.vida_max = vida_max
+        self.abertas_em = weakref.WeakKeyDictionary()
+        self.ultimo_uso = time.monotonic()
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        inicio = time.perf_counter()
+        conn = super()._connect(key)
+        _registrar_conexao(time.perf_counter() - inicio)
+        self.abertas_em[conn] = time.monotonic()
+        return conn
+
+    def _abrir(self):
+        """Abre uma conexão com os parâmetros do pool, sem entregá-la a ninguém (e sem o lock)."""
+        inicio = time.perf_counter()
+        conn = psycopg2.connect(*self._args, **self._kwargs)
+        _registrar_conexao(time.perf_counter() - inicio)
+        self.abertas_em[conn] = time.monotonic()
+        return conn
+
+    def _guardar(self, conn):
+        """Põe entre as ociosas uma conexão de _abrir(), se ainda houver espaço; senão a fecha."""
+        with self._lock:
+            if not self.closed and len(self._pool) < self.minconn \
+                    and len(self._pool) + len(self._used) < self.maxconn:
+                self._pool.append(conn)
+                return True
+        conn.close()
+        return False
+
+    def idade(self, conn):
+        return time.monotonic() - self.abertas_em.get(conn, time.monotonic())
+
+    def getconn(self, key=None):
+        self.ultimo_uso = time.monotonic()
+        return super().getconn(key)
+
+    def putconn(self, conn=None, key=None, close=False):
+        if self.vida_max and conn is not None and self.idade(conn) >= self.vida_max:
+            close = True
+        super().putconn(conn, key, close)
+
+    def descartar_mortas(self):
+        """
+        Fecha as conexões ociosas que o servidor já encerrou (o Neon derruba
+        as conexões ao suspender o compute). Uma conexão ociosa viva não tem
+        nada para ler no socket; se tiver, é o aviso de término ou o EOF.
+        Não manda nada ao banco, então não o acorda. Retorna quantas fechou.
+        """
+        with self._lock:
+            mortas = [c for c in self._pool if c.closed or select.select([c], [], [], 0)[0]]
+            for conn in mortas:
+                self._pool.remove(conn)
+        for conn in mortas:
+            conn.close()
+        if mortas:
+            metricas.incrementar('observatorio_db_conexoes_descartadas_total', len(mortas),
+                                 ajuda='Conexões ociosas encerradas pelo servidor e descartadas.')
+        return len(mortas)
+
+    def renovar(self, margem, substituir=True):
+        """
+        Troca as conexões ociosas que passam de vida_max nos próximos 'margem'
+        segundos por conexões novas, abertas antes de a velha sair do pool.
+        Com substituir=False só fecha as que já venceram. Retorna quantas trocou.
+        """
+        if not self.vida_max:
+            return 0
+        limite = self.vida_max - (margem if substituir else 0)
+        with self._lock:
+            velhas = [c for c in self._pool if self.idade(c) >= limite]
+        trocadas = 0
+        for velha in velhas:
+            nova = self._abrir() if substituir else None
+            with self._lock:
+                livre = not self.closed and velha in self._pool
+                if livre:
+                    self._pool.remove(velha)
+                    if nova is not None:
+                        self._pool.append(nova)
+            if livre:
+                velha.close()
+                trocadas += 1
+            elif nova is not None:
+                # A velha foi pega por uma requisição nesse meio tempo
+                self._guardar(nova)
+        return trocadas
+
+    def completar(self):
+        """Abre conexões (fora do lock) até haver 'minconn' ociosas. Retorna quantas abriu."""
+        abertas = 0
+        while True:
+            with self._lock:
+                if self.closed or len(self._pool) >= self.minconn \
+                        or len(self._pool) + len(self._used) >= self.maxconn:
+                    return abertas
+            if not self._guardar(self._abrir()):
+                return abertas
+            abertas += 1
+
+    def pingar(self):
+        """'SELECT 1' numa conexão do pool: mantém o compute acordado e confirma que o banco responde."""
+        conn = self.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+        except psycopg2.Error:
+            self.putconn(conn, close=True)
+            raise
+        self.putconn(conn)
+
+
+def _criar_pool(dsn):
+    """Cria o pool de conexões (PoolConexoes), com os keepalives TCP de DB_KEEPALIVE_*."""
+    # ThreadedConnectionPool: o waitress atende requisições em várias threads
+    # e a thread de manutenção também usa o pool. Só a primeira conexão é
+    # aberta aqui (a requisição que cria o pool espera por ela); as demais
+    # até DB_POOL_MIN são abertas pela manutenção, em segundo plano.
+    novo = PoolConexoes(1, POOL_MAX_CONEXOES, dsn=dsn, vida_max=_ajustes['vida_max'],
+                        connection_factory=ConexaoComPrazo, **_ajustes['conexao'])
+    novo.minconn = max(1, _ajustes['minconn'])
+    return novo
+
+def get_pool(dsn=None):
+    """
+    Retorna o pool de conexões, criando-o na primeira chamada.
+    Abrir a primeira conexão com o Neon pode levar segundos (compute suspenso),
+    por isso isso não é feito durante o create_app().
+    """
+    global pool
+    if pool is None:
+        with _pool_lock:
+            if pool is None:
+                dsn = dsn or current_app.config['DATABASE_URL']
+                start = time.time()
+                try:
+                    pool = _criar_pool(dsn)
+                except psycopg2.OperationalError as e:
+                    raise RuntimeError(f"Could not create database connection pool: {e}")
+                print(f"Pool de conexões criado em {time.time() - start:.2f} segundos.")
+    return pool
+
+def aquecer_pool(dsn):
+    """
+    Cria o pool, abre as DB_POOL_MIN conexões e executa um 'SELECT 1', para
+    acordar o banco antes da primeira requisição. Retorna True se deu certo
+    (a partir daí /healthz/ready responde 200).
+    """
+    try:
+        p = get_pool(dsn)
+        p.completar()
+        p.pingar()
+        verificar_schema(p)
+    except Exception as e:
+        _estado['erro'] = str(e)
+        print(f"Falha no aquecimento do pool de conexões: {e}")
+        return False
+    _estado.update(aquecido=True, erro=None)
+    return True
+
+def verificar_schema(p):
+    """
+    Confere se o banco já passou pela conversão das tabelas de interação
+    (particoes.py). Sem ela toda escrita de voto, testemunha, curtida ou
+    comentário falha: o worker fica fora do balanceador (/healthz/ready
+    503) até alguém rodar 'flask init-db' ou 'flask migrar-particoes'.
+    """
+    from .particoes import migracoes_pendentes
+
+    conn = p.getconn()
+    try:
+        cur = conn.cursor()
+        pendentes = migracoes_pendentes(cur)
+        cur.close()
+        conn.rollback()
+    finally:
+        p.putconn(conn)
+    if pendentes:
+        _estado['schema'] = f"tabelas a converter: {', '.join(pendentes)}; rode 'flask init-db'"
+        print(f"CRITICAL: schema desatualizado ({_estado['schema']}).")
+    else:
+        _estado['schema'] = None
+    return pendentes
+
+def horas_aquecimento(texto):
+    """'7-12,18-24' -> {7, ..., 11, 18, ..., 23}; '22-2' atravessa a meia-noite; vazio: nenhuma."""
+    horas = set()
+    for faixa in filter(None, (parte.strip() for parte in texto.split(','))):
+        inicio, fim = (int(h) for h in faixa.split('-'))
+        horas.update(h % 24 for h in range(inicio, fim if fim > inicio else fim + 24))
+    return horas
+
+def _loop_manutencao(dsn, intervalo, horas, fuso, ping_apos):
+    """
+    Thread de cada worker. Aquece o pool (tentando de novo a cada
+    'intervalo' até conseguir) e depois, a cada 'intervalo' segundos:
+    descarta as conexões ociosas mortas e, nas horas de tráfego esperado,
+    renova as que estão perto de vida_max, faz um 'SELECT 1' se o banco
+    ficou 'ping_apos' segundos sem uso (o Neon suspende o compute ocioso)
+    e completa as DB_POOL_MIN ociosas. Fora dessas horas só fecha as
+    vencidas, deixando o compute suspender. Com intervalo 0, só aquece.
+    """
+    zona = ZoneInfo(fuso)
+    while not aquecer_pool(dsn):
+        if not intervalo:
+            return
+        time.sleep(intervalo)
+    while intervalo:
+        time.sleep(intervalo)
+        try:
+            p = get_pool(dsn)
+            p.descartar_mortas()
+            if _estado['schema']:
+                # Volta a ficar pronto sozinho depois da migração
+                verificar_schema(p)
+            if datetime.now(zona).hour in horas:
+                p.renovar(margem=2 * intervalo)
+                if time.monotonic() - p.ultimo_uso >= ping_apos:
+                    p.pingar()
+                p.completar()
+            else:
+                p.renovar(margem=0, substituir=False)
+            _estado['erro'] = None
+        except Exception as e:
+            _estado['erro'] = str(e)
+            print(f"Falha na manutenção do pool de conexões: {e}")
+
+def _iniciar_manutencao(app=None):
+    """Uma vez por processo: no boot (DB_WARMUP) ou na primeira requisição do worker."""
+    app = app or current_app._get_current_object()
+    if app.extensions.get('db_manutencao'):
+        return
+    with _manutencao_lock:
+        if app.extensions.get('db_manutencao'):
+            return
+        app.extensions['db_manutencao'] = True
+    config = app.config
+    Thread(
+        target=_loop_manutencao,
+        args=(config['DATABASE_URL'], config['DB_MANUTENCAO_INTERVALO'],
+              horas_aquecimento(config['DB_AQUECER_HORARIO']), config['DB_AQUECER_FUSO'],
+              config['DB_AQUECER_INTERVALO']),
+        daemon=True,
+    ).start()
+
+def estado_pool():
+    """Resumo para /healthz/ready: pronto após o primeiro aquecimento, enquanto o banco responder."""
+    p = pool
+    return {
+        'pronto': _estado['aquecido'] and _estado['erro'] is None and _estado['schema'] is None,
+        'schema': _estado['schema'],
+        'conexoes_ociosas': len(p._pool) if p else 0,
+        'conexoes_em_uso': len(p._used) if p else 0,
+        'ultima_conexao_segundos': round(_estado['ultima_conexao'], 3),
+    }
+
+# --- RÉPLICAS DE LEITURA ---
+# Pools das réplicas (DATABASE_REPLICA_URLS), criados sob demanda, e o estado
+# de saúde de cada uma: {'dsn': {'lag': segundos ou None, 'checado_em': t, 'ativa': bool}}
+replica_pools = {}
+_replicas_estado = {}
+_replicas_lock = Lock()
+_replica_rodizio = itertools.count()
+
+# Chave da sessão que "fixa" o usuário no primário logo após uma escrita,
+# para que ele leia o que acabou de escrever (read-your-writes).
+PIN_SESSION_KEY = 'db_primario_ate'
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+def read_only(f):
+    """
+    Marca uma view como somente leitura: em requisições GET ela pode ser
+    atendida por uma réplica. Use abaixo do @app.route.
+    """
+    f.db_read_only = True
+    return f
+
+def pin_primary(segundos=None):
+    """Fixa a sessão atual no primário por alguns segundos (após uma escrita)."""
+    segundos = segundos if segundos is not None else current_app.config['DB_PRIMARY_PIN_SECONDS']
+    session[PIN_SESSION_KEY] = time.time() + segundos
+
+def _checar_replica(dsn, max_lag):
+    """Mede o atraso de replicação de uma réplica e a ejeta se estiver acima do limite ou inacessível."""
+    lag = None
+    try:
+        replica_pool = _get_replica_pool(dsn)
+        conn = replica_pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute(LAG_SQL)
+            lag = float(cur.fetchone()[0])
+            cur.close()
+            conn.rollback()
+        finally:
+            replica_pool.putconn(conn)
+    except Exception as e:
+        print(f"Réplica indisponível, ejetada temporariamente: {e}")
+    with _replicas_lock:
+        estado = _replicas_estado[dsn]
+        estado['lag'] = lag
+        estado['ativa'] = lag is not None and lag <= max_lag
+        estado['checando'] = False
+
+def _get_replica_pool(dsn):
+    if dsn not in replica_pools:
+        with _replicas_lock:
+            if dsn not in replica_pools:
+                replica_pools[dsn] = _criar_pool(dsn)
+    return replica_pools[dsn]
+
+def _replica_disponivel():
+    """
+    Escolhe (em rodízio) uma réplica saudável, ou None se não houver.
+    O atraso de cada réplica é checado em segundo plano a cada
+    DB_REPLICA_CHECK_INTERVAL segundos; até a primeira checagem terminar,
+    a réplica não recebe tráfego.
+    """
+    config = current_app.config
+    agora = time.time()
+    ativas = []
+    for dsn in config['DATABASE_REPLICA_URLS']:
+        with _replicas_lock:
+            estado = _replicas_estado.setdefault(dsn, {'lag': None, 'checado_em': 0, 'ativa': False, 'checando': False})
+            if not estado['checando'] and agora - estado['checado_em'] >= config['DB_REPLICA_CHECK_INTERVAL']:
+                estado['checando'] = True
+                estado['checado_em'] = agora
+                Thread(target=_checar_replica, args=(dsn, config['DB_REPLICA_MAX_LAG']), daemon=True).start()
+            if estado['ativa']:
+                ativas.append(dsn)
+    if not ativas:
+        return None
+    return ativas[next(_replica_rodizio) % len(ativas)]
+
+def _escolher_destino():
+    """
+    Decide, no início da requisição, se ela pode ir para uma réplica:
+    só GET/HEAD em views marcadas com @read_only e sessões não fixadas no primário.
+    """
+    g.db_destino = 'primario'
+    if not current_app.config['DATABASE_REPLICA_URLS'] or request.method not in ('GET', 'HEAD'):
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'db_read_only', False):
+        return
+    if session.get(PIN_SESSION_KEY, 0) > time.time():
+        return
+    g.db_destino = 'replica'
+
+def _fixar_apos_escrita(response):
+    """Depois de uma requisição de escrita que usou o primário, fixa a sessão nele."""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and g.get('db_usou_primario') \
+            and current_app.config['DATABASE_REPLICA_URLS']:
+        pin_primary()
+    return response
+
+class ConexaoComPrazo(psycopg2.extensions.connection):
+    """
+    Conexão que, com 'prazo_ms' definido, começa cada transação com
+    statement_timeout local a ela (set_config(..., true), o SET LOCAL):
+    logo ao ser ajustada e de novo após cada commit/rollback. Nada fica na
+    sessão: a conexão volta ao pool (e a quem a usar fora de requisições, ou
+    a outros clientes do backend, atrás de um pooler) sem o orçamento.
+    """
+    prazo_ms = 0
+
+    def aplicar_prazo(self):
+        cur = self.cursor()
+        cur.execute("SELECT set_config('statement_timeout', %s, true)", (str(self.prazo_ms),))
+        cur.close()
+
+    def commit(self):
+        super().commit()
+        if self.prazo_ms:
+            self.aplicar_prazo()
+
+    def rollback(self):
+        super().rollback()
+        if self.prazo_ms:
+            self.aplicar_prazo()
+
+def _ajustar_statement_timeout(conn):
+    """
+    Aplica às transações da requisição o orçamento dela (budgets.py) como
+    statement_timeout; close_db o desliga antes de devolver a conexão.
+    """
+    conn.prazo_ms = int(g.get('budget_ms') or 0)
+    if conn.prazo_ms:
+        conn.aplicar_prazo()
+
+# --- PREPARED STATEMENTS ---
+# Consultas quentes (executar()) são preparadas uma vez por conexão do pool,
+# na primeira vez que cada conexão as usa; depois vão como EXECUTE, sem novo
+# parse e, após as primeiras execuções, com o plano genérico em cache. Para
+# cada conexão guardamos o conjunto de nomes já preparados, ou None quando
+# ela passa por um pooler em modo transação (PgBouncer, '-pooler' do Neon):
+# lá o PREPARE fica em um backend e o EXECUTE pode cair em outro.
+_preparadas = weakref.WeakKeyDictionary()
+
+def _pooler_em(parametros):
+    """Heurística pelo host/porta: '-pooler' (Neon) ou 6432 (padrão do PgBouncer)."""
+    return '-pooler' in (parametros.get('host') or '') or str(parametros.get('port')) == '6432'
+
+def _usa_pooler(conn):
+    return _pooler_em(conn.get_dsn_parameters())
+
+def dsn_usa_pooler(dsn):
+    """Mesma heurística de _usa_pooler a partir da URL/DSN (ex.: para o pool do asyncpg)."""
+    return _pooler_em(psycopg2.extensions.parse_dsn(dsn))
+
+def preparadas_ativas(modo, usa_pooler):
+    """DB_PREPARED_STATEMENTS: 'true', 'false' ou 'auto' (só sem pooler; usa_pooler() só é chamada aí)."""
+    return modo == 'true' or (modo == 'auto' and not usa_pooler())
+
+def _preparadas_da_conexao(conn):
+    if conn not in _preparadas:
+        ativo = preparadas_ativas(current_app.config['DB_PREPARED_STATEMENTS'], lambda: _usa_pooler(conn))
+        _preparadas[conn] = set() if ativo else None
+    return _preparadas[conn]
+
+def executar(cur, nome, sql, params=()):
+    """
+    Executa 'sql' (placeholders %s, sem '%' literal) como o prepared
+    statement 'nome' na conexão do cursor, preparando-o antes se for a
+    primeira vez nela. Variações do mesmo SQL (ex.: filtros do mapa) ganham
+    nomes distintos pelo checksum do texto. Sem suporte (pooler ou
+    DB_PREPARED_STATEMENTS=false), é um cur.execute comum.
+    Evite 'SELECT *': um ALTER TABLE que mude as colunas invalida o plano
+    ('cached plan must not change result type').
+    """
+    preparadas = _preparadas_da_conexao(cur.connection)
+    if preparadas is None:
+        cur.execute(sql, params)
+        return
+    nome = f"{nome}_{zlib.crc32(sql.encode('utf-8')):08x}"
+    if nome not in preparadas:
+        posicao = itertools.count(1)
+        cur.execute(f"PREPARE {nome} AS {re.sub('%s', lambda _: f'${next(posicao)}', sql)}")
+        preparadas.add(nome)
+    if params:
+        cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {nome}")
 
 def get_db():
     """
     Obtém uma conexão do pool para a requisição atual.
     Verifica se a conexão está ativa antes de retorná-la, estabelecendo
     uma nova conexão se a anterior estiver fechada.
+    Requisições somente leitura podem receber uma conexão de réplica.
     """
     # Acessa a conexão no contexto 'g' da request.
     # A propriedade 'closed' em uma conexão psycopg2 é 0 se estiver aberta.
     if 'db' not in g or g.db.closed:
+        if 'db' in g:
+            # Conexão caiu: libera a vaga dela no pool de origem
+            g.db_pool.putconn(g.pop('db'), close=True)
         try:
             # Se não há conexão em 'g' ou se a existente foi fechada,
             # obtemos uma nova do pool.
-            g.db = pool.getconn()
-        except psycopg2.OperationalError as e:
+            db_pool = None
+            if g.get('db_destino') == 'replica':
+                dsn = _replica_disponivel()
+                if dsn:
+                    try:
+                        db_pool = _get_replica_pool(dsn)
+                        g.db = db_pool.getconn()
+                    except psycopg2.OperationalError as e:
+                        current_app.logger.warning(f"Falha ao usar réplica, usando o primário: {e}")
+                        with _replicas_lock:
+                            _replicas_estado[dsn]['ativa'] = False
+                        db_pool = None
+            if db_pool is None:
+                db_pool = get_pool()
+                g.db = db_pool.getconn()
+                g.db_usou_primario = True
+            g.db_pool = db_pool
+            _ajustar_statement_timeout(g.db)
+        except (psycopg2.OperationalError, RuntimeError) as e:
             current_app.logger.critical(f"CRITICAL: Não foi possível obter uma conexão do pool: {e}")
             # Lança a exceção para que o Flask possa retornar um erro 500.
             raise
     return g.db
 
+def iterar_linhas(nome, consulta, params=(), itersize=200):
+    """
+    Gera as linhas (DictRow) de 'consulta' por um cursor nomeado (server-side),
+    buscando 'itersize' por vez: com stream_template, cada lote vira HTML e
+    sai para o cliente antes do próximo ser buscado. 'nome' deve ser único
+    entre os cursores abertos na mesma requisição.
+    """
+    cur = get_db().cursor(name=nome, cursor_factory=psycopg2.extras.DictCursor)
+    cur.itersize = itersize
+    try:
+        cur.execute(consulta, params)
+        yield from cur
+    finally:
+        cur.close()
+
 def close_db(e=None):
     """
     Devolve a conexão de volta ao pool ou a fecha se ocorreu um erro.
     """
     db = g.pop('db', None)
+    db_pool = g.pop('db_pool', pool)
 
     if db is not None:
+        # O prazo por transação é só desta requisição: sem ele, o rollback
+        # do pool não abre outra transação na conexão ociosa
+        if isinstance(db, ConexaoComPrazo):
+            db.prazo_ms = 0
         # Se houve uma exceção durante a request (e is not None) ou se a conexão
         # já está fechada, é mais seguro descartar a conexão em vez de devolvê-la ao pool.
         # Isso evita que uma conexão em estado inconsistente seja reutilizada.
         if e is None and not db.closed:
-            pool.putconn(db)
+            db_pool.putconn(db)
         else:
             # Fecha a conexão permanentemente. O pool criará uma nova quando necessário.
-            db.close()
+            # (close=True também libera a vaga que ela ocupava no pool)
+            db_pool.putconn(db, close=True)
 
-def init_db():
-    """Executa o ficheiro schema.sql para criar as tabelas na base de dados."""
-    # Pega uma conexão temporária para inicializar o banco
-    conn = pool.getconn()
-    cur = conn.cursor()
+def executar_schema(cur):
+    """Executa o schema.sql no cursor dado, sem commit (a transação é de quem chama)."""
     schema_path = os.path.join(current_app.root_path, '..', 'schema.sql')
     with open(schema_path, 'r', encoding='utf-8') as f:
         cur.execute(f.read())
-    conn.commit()
-    cur.close()
-    # Devolve a conexão
-    pool.putconn(conn)
+
+
+def init_db():
+    """
+    Executa o ficheiro schema.sql para criar as tabelas na base de dados.
+    Num banco de antes do particionamento, converte também as tabelas de
+    interação (particoes.migrar): o CREATE TABLE IF NOT EXISTS do schema.sql
+    não mudaria as tabelas existentes.
+    """
+    from .particoes import migrar, relatar_migracao
+
+    # Pega uma conexão temporária para inicializar o banco
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        copiadas, comentarios = migrar(cur)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # Devolve a conexão
+        pool.putconn(conn)
+    relatar_migracao(copiadas, comentarios)
     click.echo('Base de dados PostgreSQL inicializada.')
 
 @click.command('init-db')
@@ -67,8 +636,7 @@ def init_db_command():
     
     @with_appcontext
     def wrapped_init_db():
-        # A inicialização do pool acontece em init_app, então
-        # o pool já estará disponível aqui.
+        # O pool é criado sob demanda por get_pool().
         init_db()
         click.echo('Base de dados inicializada com sucesso.')
     
@@ -77,19 +645,38 @@ def init_db_command():
 
 def init_app(app):
     """Registra funções da base de dados com a aplicação Flask."""
-    global pool
-    
-    # Cria o pool de conexões UMA ÚNICA VEZ quando a aplicação é inicializada.
-    # minconn=1, maxconn=10 -> Começa com 1 conexão e pode crescer até 10.
-    if pool is None:
-        try:
-            pool = psycopg2.pool.SimpleConnectionPool(
-                1, 10, dsn=app.config['DATABASE_URL']
-            )
-        except psycopg2.OperationalError as e:
-            app.logger.critical(f"FALHA CRÍTICA: Não foi possível criar o pool de conexões com o DB. {e}")
-            raise RuntimeError(f"Could not create database connection pool: {e}")
-    
+    config = app.config
+    keepalive = {}
+    if config['DB_KEEPALIVE_IDLE']:
+        # Sem keepalives, uma conexão ociosa cortada no caminho (NAT, proxy)
+        # só é percebida quando uma requisição tenta usá-la
+        keepalive = {'keepalives': 1, 'keepalives_idle': config['DB_KEEPALIVE_IDLE'],
+                     'keepalives_interval': config['DB_KEEPALIVE_INTERVAL'],
+                     'keepalives_count': config['DB_KEEPALIVE_COUNT']}
+    _ajustes.update(minconn=config['DB_POOL_MIN'], vida_max=config['DB_CONEXAO_VIDA_MAX'],
+                    partida_fria=config['DB_PARTIDA_FRIA_SEGUNDOS'], conexao=keepalive)
+    # Horário ou fuso inválidos falham já no boot, não dentro da thread
+    horas_aquecimento(config['DB_AQUECER_HORARIO'])
+    ZoneInfo(config['DB_AQUECER_FUSO'])
+
+    metricas.registrar_medidor('observatorio_db_ultima_conexao_segundos', lambda: _estado['ultima_conexao'],
+                               ajuda='Duração do último connect ao banco.')
+    metricas.registrar_medidor('observatorio_db_conexoes_ociosas', lambda: len(pool._pool) if pool else 0,
+                               ajuda='Conexões abertas e ociosas no pool do primário.')
+
+    # O pool NÃO é criado aqui: ele é aberto pela thread de manutenção, que
+    # começa no boot com DB_WARMUP ativo (sem atrasar o início do servidor)
+    # ou na primeira requisição do worker (ex.: a sonda de /healthz/ready).
+    if not app.testing:
+        if config['DB_WARMUP'] and pool is None:
+            _iniciar_manutencao(app)
+        app.before_request(_iniciar_manutencao)
+
+    # Roteamento primário/réplica por requisição. Registrado antes das rotas,
+    # para rodar antes de qualquer before_request que use o banco.
+    app.before_request(_escolher_destino)
+    app.after_request(_fixar_apos_escrita)
+
     # Registra o close_db para ser chamado ao final de cada requisição.
     app.teardown_appcontext(close_db)
     
@@ -0,0 +1,244 @@
+# observatorio/estatico.py
+
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import click
+import psycopg2.extras
+from flask import current_app, g, render_template
+from flask.cli import with_appcontext
+from markupsafe import escape
+
+from .db import get_db
+from .locais import registro_atual
+from .routes_public import build_map_query, group_map_rows, consultar_rankings
+
+# Arquivo (dentro do diretório de saída) com as marcas d'água da última build
+ARQUIVO_MARCAS = '.freeze.json'
+# Linhas cujo atualizado_em é até MARGEM anterior à marca são refeitas de novo:
+# cobre transações que gravaram NOW() antes da build anterior mas só fizeram
+# commit depois dela
+MARGEM = timedelta(minutes=5)
+# Relatos buscados e renderizados por vez
+LOTE = 200
+# Limite de URLs por arquivo do protocolo sitemaps.org
+URLS_POR_SITEMAP = 50000
+
+
+def _escrever(caminho, conteudo):
+    """
+    Grava 'conteudo' (str ou bytes) de forma atômica. Não toca no arquivo se
+    ele já tem exatamente esse conteúdo, para manter a data de modificação
+    (e o ETag do nginx/CDN). Retorna True se gravou.
+    """
+    dados = conteudo.encode('utf-8') if isinstance(conteudo, str) else conteudo
+    try:
+        with open(caminho, 'rb') as f:
+            if f.read() == dados:
+                return False
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'wb') as f:
+        f.write(dados)
+    os.replace(temporario, caminho)
+    return True
+
+
+def _pagina(destino, *partes):
+    """Caminho de uma página: <destino>/<partes>/index.html (servida como /<partes>)."""
+    return os.path.join(destino, *partes, 'index.html')
+
+
+def _ler_marcas(destino):
+    try:
+        with open(os.path.join(destino, ARQUIVO_MARCAS), encoding='utf-8') as f:
+            return {tabela: datetime.fromisoformat(valor) for tabela, valor in json.load(f).items()}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _gravar_marcas(destino, marcas):
+    _escrever(os.path.join(destino, ARQUIVO_MARCAS),
+              json.dumps({tabela: valor.isoformat() for tabela, valor in marcas.items()}, indent=2))
+
+
+def _alterados(linhas, marca, destino, prefixo):
+    """Ids a renderizar: alterados desde a marca (com a MARGEM) ou sem página gerada."""
+    limite = marca - MARGEM if marca else None
+    return [linha['id'] for linha in linhas
+            if limite is None or linha['atualizado_em'] >= limite
+            or not os.path.exists(_pagina(destino, prefixo, str(linha['id'])))]
+
+
+def _remover_orfaos(destino, prefixo, ids_validos):
+    """Apaga páginas de relatos/lendas que não existem mais (excluídos ou despublicados)."""
+    pasta = os.path.join(destino, prefixo)
+    if not os.path.isdir(pasta):
+        return 0
+    removidas = 0
+    for nome in os.listdir(pasta):
+        if re.fullmatch(r'\d+', nome) and int(nome) not in ids_validos:
+            caminho = _pagina(destino, prefixo, nome)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+            os.rmdir(os.path.join(pasta, nome))
+            removidas += 1
+    return removidas
+
+
+def _renderizar_relatos(cur, destino, ids):
+    """Renderiza as páginas dos relatos em 'ids', em lotes (2 consultas por lote)."""
+    gravadas = 0
+    for inicio in range(0, len(ids), LOTE):
+        lote = ids[inicio:inicio + LOTE]
+        cur.execute("""
+            SELECT r.*, u.nome as autor_relato, u.id as autor_id,
+                   (SELECT COUNT(*) FROM comentarios c WHERE c.relato_id = r.id) AS comment_count
+            FROM relatos r LEFT JOIN users u ON r.user_id = u.id
+            WHERE r.id = ANY(%s) AND r.aprovado = TRUE
+        """, (lote,))
+        relatos = cur.fetchall()
+        cur.execute("""
+            SELECT c.*, u.nome as autor, u.profile_pic_url, u.id as autor_id
+            FROM comentarios c JOIN users u ON c.user_id = u.id
+            WHERE c.relato_id = ANY(%s) ORDER BY c.relato_id, c.criado_em ASC
+        """, (lote,))
+        comentarios = {}
+        for comentario in cur.fetchall():
+            comentarios.setdefault(comentario['relato_id'], []).append(comentario)
+
+        for relato in relatos:
+            # Mesmo contexto da view 'relato' para um visitante anônimo sem sessão
+            html = render_template('relato.html',
+                                   relato=relato,
+                                   comentarios=comentarios.get(relato['id'], []),
+                                   voto_usuario=None,
+                                   testemunha_usuario=None,
+                                   site_key=current_app.config['RECAPTCHA_SITE_KEY'],
+                                   show_captcha=False,
+                                   comment_form=None,
+                                   report_form=None,
+                                   liked_comments=set(),
+                                   estatico=True)
+            gravadas += _escrever(_pagina(destino, 'relato', str(relato['id'])), html)
+    return gravadas
+
+
+def _sitemap(destino, url_base, entradas):
+    """
+    Grava sitemap.xml com (caminho, lastmod). Acima de URLS_POR_SITEMAP, as
+    URLs vão para sitemap-N.xml e sitemap.xml vira o índice deles.
+    """
+    def urlset(parte):
+        linhas = ['<?xml version="1.0" encoding="UTF-8"?>',
+                  '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+        for caminho, lastmod in parte:
+            linhas.append(f'  <url><loc>{escape(url_base + caminho)}</loc>'
+                          + (f'<lastmod>{lastmod.isoformat(timespec="seconds")}</lastmod>' if lastmod else '')
+                          + '</url>')
+        linhas.append('</urlset>')
+        return '\n'.join(linhas) + '\n'
+
+    partes = [entradas[i:i + URLS_POR_SITEMAP] for i in range(0, len(entradas), URLS_POR_SITEMAP)] or [[]]
+    if len(partes) == 1:
+        _escrever(os.path.join(destino, 'sitemap.xml'), urlset(partes[0]))
+        return
+    indice = ['<?xml version="1.0" encoding="UTF-8"?>',
+              '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for numero, parte in enumerate(partes, start=1):
+        _escrever(os.path.join(destino, f'sitemap-{numero}.xml'), urlset(parte))
+        indice.append(f'  <sitemap><loc>{escape(url_base)}/sitemap-{numero}.xml</loc></sitemap>')
+    indice.append('</sitemapindex>')
+    _escrever(os.path.join(destino, 'sitemap.xml'), '\n'.join(indice) + '\n')
+
+
+def congelar(destino, url_base, completo=False):
+    """
+    Gera (ou atualiza) a cópia estática do site em 'destino':
+
+        relato/<id>/index.html, lenda/<id>/index.html, lendas/index.html,
+        rankings/index.html, mapa.json e sitemap.xml
+
+    Só relatos aprovados e lendas alterados desde a última build (coluna
+    atualizado_em, mantida por trigger) são renderizados de novo; páginas de
+    relatos excluídos ou despublicados são apagadas. Rankings, mapa e
+    sitemap são refeitos a cada execução, mas só regravados se mudaram.
+    Deve rodar dentro de um contexto de requisição (url_for e templates).
+    Retorna um dicionário com as contagens.
+    """
+    marcas = {} if completo else _ler_marcas(destino)
+    config = current_app.config
+    g.user = None
+    cur = get_db().cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+    cur.execute('SELECT id, atualizado_em FROM relatos WHERE aprovado = TRUE ORDER BY id')
+    relatos = cur.fetchall()
+    cur.execute('SELECT id, atualizado_em FROM lendas ORDER BY id')
+    lendas = cur.fetchall()
+
+    relatos_alterados = _alterados(relatos, marcas.get('relatos'), destino, 'relato')
+    resultado = {'relatos': _renderizar_relatos(cur, destino, relatos_alterados)}
+    resultado['relatos_removidos'] = _remover_orfaos(destino, 'relato', {r['id'] for r in relatos})
+
+    lendas_alteradas = set(_alterados(lendas, marcas.get('lendas'), destino, 'lenda'))
+    resultado['lendas_removidas'] = _remover_orfaos(destino, 'lenda', {l['id'] for l in lendas})
+    resultado['lendas'] = 0
+    if lendas_alteradas or resultado['lendas_removidas'] or not os.path.exists(_pagina(destino, 'lendas')):
+        cur.execute('SELECT * FROM lendas ORDER BY titulo ASC')
+        todas_lendas = cur.fetchall()
+        _escrever(_pagina(destino, 'lendas'), render_template('lendas.html', lendas=todas_lendas, estatico=True))
+        for lenda in todas_lendas:
+            if lenda['id'] in lendas_alteradas:
+                html = render_template('lenda.html', lenda=lenda, estatico=True)
+                resultado['lendas'] += _escrever(_pagina(destino, 'lenda', str(lenda['id'])), html)
+
+    top_relatos, top_locais = consultar_rankings(cur)
+    _escrever(_pagina(destino, 'rankings'),
+              render_template('rankings.html', top_relatos=top_relatos, top_locais=top_locais, estatico=True))
+
+    # Payload do mapa sem filtros, no mesmo formato que o index.html embute
+    query, params = build_map_query({}, config['CATEGORIAS'])
+    cur.execute(query, tuple(params))
+    mapa = group_map_rows(cur.fetchall(), registro_atual())
+    _escrever(os.path.join(destino, 'mapa.json'), json.dumps(mapa, ensure_ascii=False, separators=(',', ':')))
+    cur.close()
+
+    url_base = url_base.rstrip('/')
+    entradas = [('/', None), ('/lendas', None), ('/rankings', None)]
+    entradas += [(f"/relato/{r['id']}", r['atualizado_em']) for r in relatos]
+    entradas += [(f"/lenda/{l['id']}", l['atualizado_em']) for l in lendas]
+    _sitemap(destino, url_base, entradas)
+
+    # A nova marca é o maior atualizado_em visto (relógio do banco, não o local)
+    for tabela, linhas in (('relatos', relatos), ('lendas', lendas)):
+        if linhas:
+            marcas[tabela] = max(linha['atualizado_em'] for linha in linhas)
+    _gravar_marcas(destino, marcas)
+    return resultado
+
+
+@click.command('freeze')
+@click.option('--destino', help='Diretório de saída (padrão: FREEZE_DIR).')
+@click.option('--url-base', help='URL pública do site, usada no sitemap (padrão: FREEZE_URL_BASE).')
+@click.option('--completo', is_flag=True, help="Ignora as marcas d'água e renderiza todas as páginas.")
+@with_appcontext
+def freeze_command(destino, url_base, completo):
+    """Gera as páginas estáticas de relatos aprovados, lendas e rankings, o mapa.json e o sitemap."""
+    destino = destino or current_app.config['FREEZE_DIR']
+    url_base = url_base or current_app.config['FREEZE_URL_BASE']
+    if not url_base:
+        raise click.UsageError('Defina FREEZE_URL_BASE ou passe --url-base (o sitemap exige URLs absolutas).')
+
+    with current_app.test_request_context('/', base_url=url_base):
+        resultado = congelar(destino, url_base, completo)
+    click.echo(f"Build estática em {destino}: {resultado['relatos']} relato(s) e "
+               f"{resultado['lendas']} lenda(s) regravados; {resultado['relatos_removidos']} relato(s) e "
+               f"{resultado['lendas_removidas']} lenda(s) removidos.")
+
+
+def init_app(app):
+    """Registra o comando 'flask freeze' no CLI do Flask."""
+    app.cli.add_command(freeze_command)
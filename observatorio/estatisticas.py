@@ -0,0 +1,286 @@
+# observatorio/estatisticas.py
+"""
+Agregados diários (tabela estatisticas_diarias) por dia, local e categoria.
+
+A atualização é incremental por marca d'água: para cada tabela de origem
+guarda-se o maior id já agregado, e só os dias das linhas novas são
+recalculados (DELETE + INSERT ... GROUP BY do intervalo, numa transação).
+Os últimos ESTATISTICAS_JANELA_DIAS dias são sempre recalculados, o que
+cobre linhas com id menor que a marca mas confirmadas depois dela. Dias
+antigos alterados pela moderação (aprovação, exclusão) são marcados em
+estatisticas_pendentes por marcar_relato()/marcar_comentario().
+
+Nos dias anteriores à partição mais antiga de votos/testemunhas (já
+arquivados por 'flask arquivar-particoes') só relatos e comentários são
+recalculados: os agregados são o único registro que sobra das interações.
+
+Roda numa thread de cada worker a cada ESTATISTICAS_INTERVALO segundos
+(um advisory lock garante uma execução por vez) ou por cron:
+
+    flask atualizar-estatisticas
+    flask atualizar-estatisticas --desde 2024-01-01   # reprocessa o histórico
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from zoneinfo import ZoneInfo
+
+import click
+import psycopg2
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Tabelas cujas linhas novas entram nos agregados
+FONTES = ('relatos', 'comentarios', 'votos', 'testemunhas')
+
+# Chave do pg_advisory_xact_lock da atualização
+CHAVE_LOCK = 726354
+
+_thread_lock = Lock()
+
+# Primeiro dia ainda presente nas tabelas de interação particionadas (None sem partições)
+INICIO_DADOS_SQL = r"""
+    SELECT MAX(inicio) FROM (
+        SELECT MIN(to_date(right(c.relname, 7), 'YYYY_MM')) AS inicio
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname IN ('votos', 'testemunhas') AND c.relname ~ '_\d{4}_\d{2}$'
+        GROUP BY p.relname
+    ) particoes
+"""
+
+# Eventos de cada tabela de origem: (dia, local, categoria) e as colunas do agregado
+EVENTOS_SQL = {
+    'relatos': """
+        SELECT (r.criado_em AT TIME ZONE %(fuso)s)::date AS dia, r.local, r.categoria,
+               1 AS relatos, r.aprovado::int AS aprovados, 0 AS acredito, 0 AS cetico,
+               0 AS testemunhas, 0 AS comentarios
+        FROM relatos r
+        WHERE r.criado_em >= %(desde)s AND r.criado_em < %(ate)s
+    """,
+    'votos': """
+        SELECT (v.criado_em AT TIME ZONE %(fuso)s)::date, r.local, r.categoria,
+               0, 0, (v.tipo_voto = 'acredito')::int, (v.tipo_voto = 'cetico')::int, 0, 0
+        FROM votos v JOIN relatos r ON r.id = v.relato_id
+        WHERE v.criado_em >= %(desde)s AND v.criado_em < %(ate)s
+    """,
+    'testemunhas': """
+        SELECT (t.criado_em AT TIME ZONE %(fuso)s)::date, r.local, r.categoria, 0, 0, 0, 0, 1, 0
+        FROM testemunhas t JOIN relatos r ON r.id = t.relato_id
+        WHERE t.criado_em >= %(desde)s AND t.criado_em < %(ate)s
+    """,
+    'comentarios': """
+        SELECT (c.criado_em AT TIME ZONE %(fuso)s)::date, r.local, r.categoria, 0, 0, 0, 0, 0, 1
+        FROM comentarios c JOIN relatos r ON r.id = c.relato_id
+        WHERE c.criado_em >= %(desde)s AND c.criado_em < %(ate)s
+    """,
+}
+
+RECALCULAR_SQL = """
+    INSERT INTO estatisticas_diarias (dia, local, categoria, relatos, relatos_aprovados,
+                                      votos_acredito, votos_cetico, testemunhas, comentarios)
+    SELECT dia, local, categoria, SUM(relatos), SUM(aprovados), SUM(acredito), SUM(cetico),
+           SUM(testemunhas), SUM(comentarios)
+    FROM ({eventos}) eventos
+    GROUP BY dia, local, categoria
+"""
+
+# Dias cujas interações já foram arquivadas: só relatos e comentários são
+# refeitos; votos e testemunhas agregados antes do arquivamento ficam
+RECALCULAR_PARCIAL_SQL = RECALCULAR_SQL + """
+    ON CONFLICT (dia, local, categoria) DO UPDATE SET
+        relatos = EXCLUDED.relatos,
+        relatos_aprovados = EXCLUDED.relatos_aprovados,
+        comentarios = EXCLUDED.comentarios
+"""
+
+
+def marcar_relato(cur, relato_id, fuso):
+    """
+    Marca para recálculo o dia do relato e os dias das suas interações.
+    Chame antes de aprovar ou excluir o relato, na mesma transação.
+    """
+    cur.execute("""
+        INSERT INTO estatisticas_pendentes (dia)
+        SELECT (criado_em AT TIME ZONE %(fuso)s)::date FROM relatos WHERE id = %(id)s
+        UNION SELECT (criado_em AT TIME ZONE %(fuso)s)::date FROM votos WHERE relato_id = %(id)s
+        UNION SELECT (criado_em AT TIME ZONE %(fuso)s)::date FROM testemunhas WHERE relato_id = %(id)s
+        UNION SELECT (criado_em AT TIME ZONE %(fuso)s)::date FROM comentarios WHERE relato_id = %(id)s
+        ON CONFLICT (dia) DO NOTHING
+    """, {'id': relato_id, 'fuso': fuso})
+
+
+def marcar_comentario(cur, comentario_id, fuso):
+    """Marca para recálculo o dia de um comentário que vai ser excluído."""
+    cur.execute("""
+        INSERT INTO estatisticas_pendentes (dia)
+        SELECT (criado_em AT TIME ZONE %s)::date FROM comentarios WHERE id = %s
+        ON CONFLICT (dia) DO NOTHING
+    """, (fuso, comentario_id))
+
+
+def _intervalos(dias):
+    """Agrupa dias em intervalos contíguos [início, fim) de datas."""
+    intervalos = []
+    for dia in sorted(dias):
+        if intervalos and intervalos[-1][1] == dia:
+            intervalos[-1][1] = dia + timedelta(days=1)
+        else:
+            intervalos.append([dia, dia + timedelta(days=1)])
+    return intervalos
+
+
+def recalcular(cur, inicio, fim, fuso, inicio_dados=None):
+    """
+    Refaz os agregados dos dias [inicio, fim). Antes de 'inicio_dados'
+    (interações arquivadas) o recálculo é parcial.
+    """
+    if inicio_dados is not None and inicio < inicio_dados:
+        corte = min(fim, inicio_dados)
+        _recalcular_parcial(cur, inicio, corte, fuso)
+        if corte == fim:
+            return
+        inicio = corte
+    cur.execute('DELETE FROM estatisticas_diarias WHERE dia >= %s AND dia < %s', (inicio, fim))
+    eventos = ' UNION ALL '.join(EVENTOS_SQL[tabela] for tabela in FONTES)
+    cur.execute(RECALCULAR_SQL.format(eventos=eventos), _parametros(inicio, fim, fuso))
+
+
+def _recalcular_parcial(cur, inicio, fim, fuso):
+    cur.execute("""
+        UPDATE estatisticas_diarias SET relatos = 0, relatos_aprovados = 0, comentarios = 0
+        WHERE dia >= %s AND dia < %s
+    """, (inicio, fim))
+    eventos = ' UNION ALL '.join(EVENTOS_SQL[tabela] for tabela in ('relatos', 'comentarios'))
+    cur.execute(RECALCULAR_PARCIAL_SQL.format(eventos=eventos), _parametros(inicio, fim, fuso))
+    cur.execute("""
+        DELETE FROM estatisticas_diarias
+        WHERE dia >= %s AND dia < %s
+          AND relatos = 0 AND votos_acredito = 0 AND votos_cetico = 0 AND testemunhas = 0 AND comentarios = 0
+    """, (inicio, fim))
+
+
+def _parametros(inicio, fim, fuso):
+    zona = ZoneInfo(fuso)
+    # Limites como timestamptz: o planner poda as partições de votos/testemunhas
+    return {
+        'fuso': fuso,
+        'desde': datetime.combine(inicio, datetime.min.time(), zona),
+        'ate': datetime.combine(fim, datetime.min.time(), zona),
+    }
+
+
+def atualizar_estatisticas(conn, fuso, janela_dias, desde=None):
+    """
+    Atualiza os agregados a partir das marcas d'água. Retorna a lista de
+    intervalos recalculados, ou None se outra execução estava em andamento.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (CHAVE_LOCK,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+
+        cur.execute('SELECT tabela, ultimo_id FROM estatisticas_marcas')
+        marcas = dict(cur.fetchall())
+        hoje = datetime.now(ZoneInfo(fuso)).date()
+        inicio_recente = hoje - timedelta(days=janela_dias)
+        novas_marcas = {}
+        for tabela in FONTES:
+            cur.execute(
+                f'SELECT MAX(id), MIN((criado_em AT TIME ZONE %s)::date) FROM {tabela} WHERE id > %s',
+                (fuso, marcas.get(tabela, 0))
+            )
+            maior_id, primeiro_dia = cur.fetchone()
+            if maior_id is not None:
+                novas_marcas[tabela] = maior_id
+                inicio_recente = min(inicio_recente, primeiro_dia)
+        if desde is not None:
+            inicio_recente = min(inicio_recente, desde)
+        cur.execute(INICIO_DADOS_SQL)
+        inicio_dados = cur.fetchone()[0]
+
+        cur.execute('DELETE FROM estatisticas_pendentes WHERE dia < %s RETURNING dia', (inicio_recente,))
+        dias = {linha[0] for linha in cur.fetchall()}
+        intervalos = _intervalos(dias) + [[inicio_recente, hoje + timedelta(days=1)]]
+        for inicio, fim in intervalos:
+            recalcular(cur, inicio, fim, fuso, inicio_dados)
+
+        for tabela, maior_id in novas_marcas.items():
+            cur.execute("""
+                INSERT INTO estatisticas_marcas (tabela, ultimo_id, atualizado_em) VALUES (%s, %s, NOW())
+                ON CONFLICT (tabela) DO UPDATE SET ultimo_id = EXCLUDED.ultimo_id, atualizado_em = NOW()
+            """, (tabela, maior_id))
+        cur.execute('DELETE FROM estatisticas_pendentes WHERE dia >= %s', (inicio_recente,))
+        conn.commit()
+        return intervalos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _loop_atualizacao(dsn, fuso, janela_dias, intervalo):
+    """Thread de cada worker: conexão própria, fora do pool das requisições."""
+    while True:
+        # Espalha os workers para não disputarem o lock no mesmo instante
+        time.sleep(intervalo * random.uniform(0.8, 1.2))
+        try:
+            conn = psycopg2.connect(dsn)
+            try:
+                atualizar_estatisticas(conn, fuso, janela_dias)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Falha ao atualizar as estatísticas: {e}")
+
+
+def _iniciar_thread():
+    """Na primeira requisição do worker (comandos do CLI não iniciam a thread)."""
+    app = current_app._get_current_object()
+    if app.extensions.get('estatisticas_thread'):
+        return
+    with _thread_lock:
+        if app.extensions.get('estatisticas_thread'):
+            return
+        app.extensions['estatisticas_thread'] = True
+    config = app.config
+    Thread(
+        target=_loop_atualizacao,
+        args=(config['DATABASE_URL'], config['ESTATISTICAS_FUSO'], config['ESTATISTICAS_JANELA_DIAS'],
+              config['ESTATISTICAS_INTERVALO']),
+        daemon=True,
+    ).start()
+
+
+@click.command('atualizar-estatisticas')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Recalcula também todos os dias a partir desta data (AAAA-MM-DD).')
+@with_appcontext
+def atualizar_estatisticas_command(desde):
+    """Atualiza os agregados diários (estatisticas_diarias) a partir das marcas d'água."""
+    from .db import get_pool
+    config = current_app.config
+    conn = get_pool().getconn()
+    try:
+        intervalos = atualizar_estatisticas(conn, config['ESTATISTICAS_FUSO'], config['ESTATISTICAS_JANELA_DIAS'],
+                                            desde.date() if desde else None)
+    finally:
+        get_pool().putconn(conn)
+    if intervalos is None:
+        click.echo("Outra atualização das estatísticas está em andamento.")
+        return
+    for inicio, fim in intervalos:
+        click.echo(f"Recalculado: {inicio.isoformat()} a {(fim - timedelta(days=1)).isoformat()}")
+
+
+def init_app(app):
+    """Registra o comando do CLI e, com ESTATISTICAS_INTERVALO > 0, a atualização periódica."""
+    app.cli.add_command(atualizar_estatisticas_command)
+    if app.config['ESTATISTICAS_INTERVALO'] > 0 and not app.testing:
+        app.before_request(_iniciar_thread)
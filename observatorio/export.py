@@ -0,0 +1,293 @@
+# observatorio/export.py
+
+import io
+import json
+import queue
+import sys
+import zlib
+from datetime import date, timedelta
+from threading import Thread, Event
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from psycopg2.extensions import encodings
+
+from .db import get_db
+
+
+def _metadados(alias):
+    """Colunas de origem (IP, cidade e User-Agent decodificados) e os JOINs nos dicionários."""
+    colunas = [f'{alias}.ip_address', f'ci_{alias}.nome AS city', f'ua_{alias}.texto AS user_agent']
+    joins = (f' LEFT JOIN cities ci_{alias} ON ci_{alias}.id = {alias}.city_id'
+             f' LEFT JOIN user_agents ua_{alias} ON ua_{alias}.id = {alias}.user_agent_id')
+    return colunas, joins
+
+
+# Tabelas que podem ser exportadas. As colunas e os filtros são fixos (whitelist),
+# de modo que nenhum valor vindo da URL ou do terminal entra no SQL sem parâmetro.
+EXPORTAVEIS = {
+    'relatos': {
+        'colunas': ['r.id', 'r.titulo', 'r.descricao', 'r.local', 'r.categoria', 'r.imagem_url',
+                    'r.audio_url', 'r.aprovado', 'r.criado_em', 'r.votos_acredito', 'r.votos_cetico',
+                    'r.votos_testemunha', 'r.user_id', 'r.ip_address', 'r.city', 'r.user_agent'],
+        'origem': 'relatos r',
+        'data': 'r.criado_em',
+        'status': {'aprovados': 'r.aprovado', 'pendentes': 'NOT r.aprovado'},
+    },
+    'comentarios': {
+        'colunas': ['c.id', 'c.relato_id', 'c.user_id', 'c.texto', 'c.denunciado', 'c.like_count',
+                    'c.criado_em'] + _metadados('c')[0],
+        'origem': 'comentarios c JOIN relatos r ON r.id = c.relato_id' + _metadados('c')[1],
+        'data': 'c.criado_em',
+        'status': {'denunciados': 'c.denunciado', 'normais': 'NOT c.denunciado'},
+    },
+    'votos': {
+        'colunas': ['v.id', 'v.relato_id', 'v.session_id', 'v.tipo_voto', 'v.criado_em'] + _metadados('v')[0],
+        'origem': 'votos v JOIN relatos r ON r.id = v.relato_id' + _metadados('v')[1],
+        'data': 'v.criado_em',
+        'status': {'acredito': "v.tipo_voto = 'acredito'", 'cetico': "v.tipo_voto = 'cetico'"},
+    },
+    'testemunhas': {
+        'colunas': ['t.id', 't.relato_id', 't.session_id', 't.criado_em'] + _metadados('t')[0],
+        'origem': 'testemunhas t JOIN relatos r ON r.id = t.relato_id' + _metadados('t')[1],
+        'data': 't.criado_em',
+        'status': {},
+    },
+    'comentarios_likes': {
+        'colunas': ['l.id', 'l.comentario_id', 'c.relato_id', 'l.session_id', 'l.criado_em'] + _metadados('l')[0],
+        'origem': 'comentarios_likes l JOIN comentarios c ON c.id = l.comentario_id '
+                  'JOIN relatos r ON r.id = c.relato_id' + _metadados('l')[1],
+        'data': 'l.criado_em',
+        'status': {},
+    },
+}
+
+FORMATOS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Quantidade de linhas buscadas por ida ao servidor no cursor nomeado
+ITERSIZE = 2000
+# Tamanho aproximado de cada pedaço enviado ao cliente
+TAMANHO_CHUNK = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Filtro ou tabela inválidos para exportação."""
+
+
+def _parse_data(valor, nome):
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ExportError(f"Data inválida em '{nome}': use o formato AAAA-MM-DD.")
+
+
+def montar_consulta(tabela, de=None, ate=None, status=None, local=None):
+    """
+    Monta a consulta de exportação de uma tabela com os filtros informados.
+    Retorna (consulta, params, nomes_das_colunas).
+    """
+    config = EXPORTAVEIS.get(tabela)
+    if config is None:
+        raise ExportError(f"Tabela '{tabela}' não pode ser exportada.")
+
+    condicoes = []
+    params = []
+
+    data_inicio = _parse_data(de, 'de')
+    data_fim = _parse_data(ate, 'ate')
+    if data_inicio:
+        condicoes.append(f"{config['data']} >= %s")
+        params.append(data_inicio)
+    if data_fim:
+        # 'ate' é inclusivo: considera o dia inteiro
+        condicoes.append(f"{config['data']} < %s")
+        params.append(data_fim + timedelta(days=1))
+    if status:
+        if status not in config['status']:
+            raise ExportError(f"Status '{status}' não se aplica à tabela '{tabela}'.")
+        condicoes.append(config['status'][status])
+    if local:
+        condicoes.append('r.local = %s')
+        params.append(local)
+
+    consulta = 'SELECT {colunas} FROM {origem}'.format(
+        colunas=', '.join(config['colunas']), origem=config['origem']
+    )
+    if condicoes:
+        consulta += ' WHERE ' + ' AND '.join(condicoes)
+    consulta += ' ORDER BY {data}, 1'.format(data=config['data'])
+
+    nomes = [coluna.split(' AS ')[-1].split('.')[-1] for coluna in config['colunas']]
+    return consulta, params, nomes
+
+
+def iter_ndjson(db, consulta, params, nomes):
+    """
+    Gera o resultado em NDJSON usando um cursor nomeado (server-side), de modo
+    que apenas ITERSIZE linhas ficam em memória por vez.
+    """
+    cur = db.cursor(name='export_ndjson')
+    cur.itersize = ITERSIZE
+    try:
+        cur.execute(consulta, params)
+        buffer = io.StringIO()
+        for row in cur:
+            buffer.write(json.dumps(dict(zip(nomes, row)), default=str, ensure_ascii=False))
+            buffer.write('\n')
+            if buffer.tell() >= TAMANHO_CHUNK:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+    finally:
+        cur.close()
+
+
+class _FilaWriter:
+    """Objeto 'arquivo' que o copy_expert usa para escrever; repassa os dados a uma fila limitada."""
+
+    def __init__(self, fila, cancelado):
+        self.fila = fila
+        self.cancelado = cancelado
+
+    def write(self, data):
+        if self.cancelado.is_set():
+            raise IOError("Exportação cancelada pelo cliente.")
+        self.fila.put(data)
+
+
+def iter_copy_csv(db, consulta, params):
+    """
+    Gera o resultado em CSV direto do 'COPY (SELECT ...) TO STDOUT'.
+    O COPY roda numa thread auxiliar e escreve numa fila limitada; como a
+    fila bloqueia quando cheia, o consumo de memória fica constante mesmo
+    que o cliente seja lento.
+    """
+    cur = db.cursor()
+    copy_sql = 'COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER true)'.format(
+        consulta=cur.mogrify(consulta, params).decode(encodings[db.encoding])
+    )
+    fila = queue.Queue(maxsize=16)
+    cancelado = Event()
+    fim = object()
+    erros = []
+
+    def executar_copy():
+        try:
+            cur.copy_expert(copy_sql, _FilaWriter(fila, cancelado))
+        except Exception as e:
+            erros.append(e)
+        finally:
+            fila.put(fim)
+
+    thread = Thread(target=executar_copy, daemon=True)
+    thread.start()
+    concluido = False
+    try:
+        pedaco = bytearray()
+        while True:
+            item = fila.get()
+            if item is fim:
+                break
+            pedaco += item if isinstance(item, bytes) else item.encode('utf-8')
+            if len(pedaco) >= TAMANHO_CHUNK:
+                yield bytes(pedaco)
+                pedaco.clear()
+        concluido = True
+        if pedaco:
+            yield bytes(pedaco)
+        if erros:
+            raise erros[0]
+    finally:
+        if not concluido:
+            # Cliente desconectou no meio: cancela o COPY no servidor e libera a thread
+            cancelado.set()
+            db.cancel()
+        while thread.is_alive():
+            try:
+                fila.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        cur.close()
+        if not concluido:
+            # A conexão pode ter ficado no meio do protocolo de COPY: fecha em vez
+            # de devolvê-la ao pool (o close_db descarta conexões fechadas)
+            db.close()
+
+
+def comprimir_gzip(chunks):
+    """Comprime um gerador de bytes em gzip, pedaço por pedaço."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            dados = compressor.compress(chunk)
+            if dados:
+                yield dados
+    finally:
+        # Repassa o fechamento (cliente desconectado) ao gerador de origem
+        chunks.close()
+    yield compressor.flush()
+
+
+def gerar_exportacao(tabela, formato='csv', de=None, ate=None, status=None, local=None, gzip=False):
+    """
+    Retorna um gerador com os bytes da exportação pedida, pronto para ser
+    usado numa resposta em streaming ou escrito num arquivo.
+    """
+    if formato not in FORMATOS:
+        raise ExportError(f"Formato '{formato}' inválido. Use: {', '.join(FORMATOS)}.")
+    consulta, params, nomes = montar_consulta(tabela, de, ate, status, local)
+    db = get_db()
+    if formato == 'csv':
+        chunks = iter_copy_csv(db, consulta, params)
+    else:
+        chunks = iter_ndjson(db, consulta, params, nomes)
+    return comprimir_gzip(chunks) if gzip else chunks
+
+
+def nome_arquivo(tabela, formato, gzip=False):
+    nome = f"{tabela}_{date.today().isoformat()}.{formato}"
+    return nome + '.gz' if gzip else nome
+
+
+@click.command('exportar')
+@click.argument('tabela', type=click.Choice(sorted(EXPORTAVEIS)))
+@click.option('--formato', type=click.Choice(sorted(FORMATOS)), default='csv', show_default=True)
+@click.option('--saida', default='-', help="Arquivo de saída ('-' para a saída padrão).")
+@click.option('--de', help='Data inicial (AAAA-MM-DD).')
+@click.option('--ate', help='Data final, inclusiva (AAAA-MM-DD).')
+@click.option('--status', help='Filtro de status (ex.: aprovados, pendentes, denunciados).')
+@click.option('--local', help='Filtra pelo local do relato.')
+@click.option('--gzip', 'usar_gzip', is_flag=True, help='Comprime a saída com gzip.')
+@with_appcontext
+def exportar_command(tabela, formato, saida, de, ate, status, local, usar_gzip):
+    """Exporta relatos ou interações em CSV/NDJSON, em streaming."""
+    try:
+        chunks = gerar_exportacao(tabela, formato, de, ate, status, local, usar_gzip)
+    except ExportError as e:
+        raise click.BadParameter(str(e))
+
+    arquivo = sys.stdout.buffer if saida == '-' else open(saida, 'wb')
+    total = 0
+    try:
+        for chunk in chunks:
+            arquivo.write(chunk)
+            total += len(chunk)
+    finally:
+        if arquivo is not sys.stdout.buffer:
+            arquivo.close()
+    if saida != '-':
+        click.echo(f"Exportação de '{tabela}' concluída: {total} bytes escritos em {saida}.")
+    current_app.logger.info(f"Exportação de '{tabela}' ({formato}) gerou {total} bytes.")
+
+
+def init_app(app):
+    """Registra o comando de exportação no CLI do Flask."""
+    app.cli.add_command(exportar_command)
@@ -2,7 +2,7 @@
 
 from flask_wtf import FlaskForm
 from wtforms import (
-    StringField, TextAreaField, SelectField, FileField, SubmitField
+    StringField, TextAreaField, SelectField, FileField, HiddenField, SubmitField
 )
 from wtforms.validators import DataRequired, Length, Optional
 
@@ -29,6 +29,9 @@ class SubmitForm(FlaskForm):
     outro_local_texto = StringField('Especifique o Local')
     imagem = FileField('Enviar Imagem (opcional, até 5MB)')
     audio = FileField('Enviar Áudio (opcional, até 10MB)')
+    # IDs de uploads retomáveis já concluídos (preenchidos pelo submit.js)
+    imagem_upload_id = HiddenField()
+    audio_upload_id = HiddenField()
     submit = SubmitField('Enviar Relato')
 
 class CommentForm(FlaskForm):
@@ -0,0 +1,398 @@
+# observatorio/geocodificacao.py
+"""
+Geocodificação em lote dos locais ('flask geocode-locais'), no lugar do
+antigo consulta_locais.py.
+
+Cada provedor (Nominatim, Google) tem o seu balde de tokens, dividido pelos
+seus trabalhadores assíncronos; os provedores formam uma cadeia: o que o
+primeiro não encontra vai para a fila do segundo, que já trabalha em
+paralelo. As respostas ficam em cache no disco e cada local resolvido é
+anotado num checkpoint (JSON Lines): interrompido, o comando continua de
+onde parou. No fim, mostra a diferença para o arquivo atual e grava o
+arquivo novo; 'flask importar-locais --arquivo ...' leva o resultado para
+a tabela.
+
+A URL de cada provedor pode ser trocada (--url nominatim=http://...), para
+rodar contra um servidor local que imite a API (benchmarks/bench_geocode.py).
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import statistics
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Tentativas por consulta em erros temporários (429, 5xx, rede)
+TENTATIVAS = 3
+TIMEOUT = 10
+
+
+class ErroProvedor(Exception):
+    """Falha que não adianta repetir (chave inválida, requisição recusada)."""
+
+
+class ErroTemporario(ErroProvedor):
+    """Limite excedido, erro do servidor ou de rede: vale tentar de novo depois de 'espera' segundos."""
+
+    def __init__(self, mensagem, espera=None):
+        super().__init__(mensagem)
+        self.espera = espera
+
+
+class BaldeTokens:
+    """
+    Limitador por balde de tokens para corrotinas: 'taxa' tokens por segundo,
+    até 'capacidade' acumulados. O lock é mantido durante a espera, então os
+    trabalhadores saem na ordem em que chegaram.
+    """
+
+    def __init__(self, taxa, capacidade=1):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = capacidade
+        self._atualizado = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def retirar(self):
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado) * self.taxa)
+                self._atualizado = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.taxa)
+
+
+class Provedor:
+    """
+    Interface de um geocodificador. Subclasses definem 'nome', 'url' e 'taxa'
+    padrão, os parâmetros da consulta e como ler a resposta. buscar() é
+    síncrono (roda numa thread) e devolve o JSON cru, que vai para o cache.
+    """
+
+    nome = None
+    url = None
+    taxa = 1.0
+
+    def __init__(self, url=None, taxa=None, user_agent=None, chave=None):
+        self.url = url or self.url
+        self.taxa = taxa or self.taxa
+        self.user_agent = user_agent
+        self.chave = chave
+
+    def parametros(self, consulta):
+        raise NotImplementedError
+
+    def interpretar(self, dados):
+        """[lat, lon] do primeiro resultado, ou None se não encontrou."""
+        raise NotImplementedError
+
+    def buscar(self, consulta):
+        # Importado aqui: o módulo entra no create_app() e o requests pesa no boot
+        import requests
+        try:
+            resposta = requests.get(self.url, params=self.parametros(consulta),
+                                    headers={'User-Agent': self.user_agent}, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            raise ErroTemporario(str(e))
+        if resposta.status_code == 429 or resposta.status_code >= 500:
+            espera = resposta.headers.get('Retry-After')
+            raise ErroTemporario(f"HTTP {resposta.status_code}",
+                                 float(espera) if espera and espera.isdigit() else None)
+        if resposta.status_code >= 400:
+            raise ErroProvedor(f"HTTP {resposta.status_code}")
+        return resposta.json()
+
+
+class Nominatim(Provedor):
+    """OpenStreetMap. A política de uso pede no máximo 1 req/s e um User-Agent com contato."""
+
+    nome = 'nominatim'
+    url = 'https://nominatim.openstreetmap.org/search'
+    taxa = 1.0
+
+    def parametros(self, consulta):
+        return {'q': consulta, 'format': 'json', 'limit': 1, 'addressdetails': 0}
+
+    def interpretar(self, dados):
+        return [float(dados[0]['lat']), float(dados[0]['lon'])] if dados else None
+
+
+class Google(Provedor):
+    """Geocoding API do Google (GOOGLE_API_KEY)."""
+
+    nome = 'google'
+    url = 'https://maps.googleapis.com/maps/api/geocode/json'
+    taxa = 5.0
+
+    def parametros(self, consulta):
+        return {'address': consulta, 'key': self.chave}
+
+    def buscar(self, consulta):
+        if not self.chave:
+            raise ErroProvedor("Defina GOOGLE_API_KEY para usar o provedor 'google'.")
+        dados = super().buscar(consulta)
+        if dados.get('status') == 'OVER_QUERY_LIMIT':
+            raise ErroTemporario('OVER_QUERY_LIMIT')
+        if dados.get('status') not in ('OK', 'ZERO_RESULTS'):
+            raise ErroProvedor(dados.get('status', 'resposta inválida'))
+        return dados
+
+    def interpretar(self, dados):
+        if not dados.get('results'):
+            return None
+        local = dados['results'][0]['geometry']['location']
+        return [local['lat'], local['lng']]
+
+
+PROVEDORES = {classe.nome: classe for classe in (Nominatim, Google)}
+
+
+class CacheRespostas:
+    """Respostas cruas em <pasta>/<provedor>/<sha1 da consulta>.json; 'não encontrado' também fica."""
+
+    def __init__(self, pasta, ler=True):
+        self.pasta = pasta
+        self.ler_ativo = ler
+
+    def _caminho(self, provedor, consulta):
+        resumo = hashlib.sha1(consulta.encode('utf-8')).hexdigest()
+        return os.path.join(self.pasta, provedor, f'{resumo}.json')
+
+    def ler(self, provedor, consulta):
+        if not self.ler_ativo:
+            return None
+        try:
+            with open(self._caminho(provedor, consulta), encoding='utf-8') as f:
+                return json.load(f)['resposta']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def gravar(self, provedor, consulta, resposta):
+        caminho = self._caminho(provedor, consulta)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f'{caminho}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump({'consulta': consulta, 'resposta': resposta}, f, ensure_ascii=False)
+        os.replace(temporario, caminho)
+
+
+class Checkpoint:
+    """
+    Locais já resolvidos, um JSON por linha, gravados assim que cada um
+    termina. A primeira linha guarda os parâmetros da execução: retomar com
+    outros parâmetros exige --recomecar.
+    """
+
+    def __init__(self, caminho, parametros, recomecar=False):
+        self.caminho = caminho
+        self.feitos = {}
+        if recomecar and os.path.exists(caminho):
+            os.remove(caminho)
+        if os.path.exists(caminho):
+            linhas = []
+            with open(caminho, encoding='utf-8') as f:
+                for linha in f:
+                    try:
+                        linhas.append(json.loads(linha))
+                    except ValueError:
+                        pass  # última linha cortada por uma interrupção no meio da gravação
+            if linhas and linhas[0].get('parametros') != parametros:
+                raise click.UsageError(f"O checkpoint {caminho} é de outra execução (outros provedores, "
+                                       "arquivo ou cidade). Use --recomecar.")
+            self.feitos = {linha['nome']: linha for linha in linhas[1:]}
+        else:
+            os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+            with open(caminho, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'parametros': parametros}, ensure_ascii=False) + '\n')
+
+    def registrar(self, nome, coords, provedor):
+        linha = {'nome': nome, 'coords': coords, 'provedor': provedor}
+        self.feitos[nome] = linha
+        with open(self.caminho, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(linha, ensure_ascii=False) + '\n')
+
+
+async def _consultar(provedor, balde, cache, consulta):
+    """Resposta do cache ou do provedor (com o token do balde e novas tentativas), já interpretada."""
+    dados = cache.ler(provedor.nome, consulta)
+    if dados is None:
+        for tentativa in range(TENTATIVAS):
+            await balde.retirar()
+            try:
+                dados = await asyncio.to_thread(provedor.buscar, consulta)
+                break
+            except ErroTemporario as e:
+                if tentativa == TENTATIVAS - 1:
+                    raise
+                await asyncio.sleep(e.espera or 2 ** tentativa)
+        cache.gravar(provedor.nome, consulta, dados)
+    return provedor.interpretar(dados)
+
+
+async def geocodificar(nomes, provedores, cache, checkpoint, cidade, trabalhadores=2, aviso=print):
+    """
+    Resolve 'nomes' pela cadeia de provedores, com 'trabalhadores' corrotinas
+    por provedor. Quem não foi encontrado (ou deu erro) num provedor passa
+    para a fila do seguinte. Retorna {nome: mensagem} dos que deram erro no
+    último provedor que os consultou: esses não entram no checkpoint e são
+    tentados de novo na próxima vez.
+    """
+    filas = [asyncio.Queue() for _ in provedores]
+    baldes = [BaldeTokens(provedor.taxa) for provedor in provedores]
+    erros = {}
+
+    async def trabalhador(indice):
+        provedor, fila = provedores[indice], filas[indice]
+        while True:
+            nome = await fila.get()
+            try:
+                try:
+                    coords = await _consultar(provedor, baldes[indice], cache, f'{nome}, {cidade}')
+                    erros.pop(nome, None)
+                except Exception as e:
+                    # Qualquer erro (inclusive resposta em formato inesperado) fica
+                    # com o nome: um trabalhador morto travaria o fila.join()
+                    coords = None
+                    erros[nome] = f'{provedor.nome}: {e}'
+                if coords is None and indice + 1 < len(filas):
+                    filas[indice + 1].put_nowait(nome)
+                elif nome not in erros:
+                    checkpoint.registrar(nome, coords, provedor.nome if coords else None)
+                    aviso(f"{nome}: {coords or 'não encontrado'}" + (f' ({provedor.nome})' if coords else ''))
+            finally:
+                fila.task_done()
+
+    for nome in nomes:
+        filas[0].put_nowait(nome)
+    tarefas = [asyncio.create_task(trabalhador(indice))
+               for indice in range(len(provedores)) for _ in range(trabalhadores)]
+    # Os nomes só andam para a frente na cadeia: esvaziada a fila i, nada mais chega a ela
+    for fila in filas:
+        await fila.join()
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas, return_exceptions=True)
+    return erros
+
+
+def distancia_m(a, b):
+    """Distância em metros entre dois [lat, lon] (haversine)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+def comparar(atuais, feitos, distancia_max):
+    """
+    Diferença entre as coordenadas atuais e as encontradas. Resultados a
+    mais de 'distancia_max' metros do centro dos locais atuais (mediana) são
+    'suspeitos' (homônimos em outra cidade) e não são aplicados.
+    Retorna (movidos, suspeitos, nao_encontrados, iguais).
+    """
+    centro = [statistics.median(c[0] for c in atuais.values()), statistics.median(c[1] for c in atuais.values())]
+    movidos, suspeitos, nao_encontrados, iguais = [], [], [], 0
+    for nome, antigas in atuais.items():
+        feito = feitos.get(nome)
+        if feito is None:
+            continue
+        novas = feito['coords']
+        if novas is None:
+            nao_encontrados.append(nome)
+        elif distancia_m(centro, novas) > distancia_max:
+            suspeitos.append((nome, novas, distancia_m(centro, novas)))
+        elif distancia_m(antigas, novas) < 1:
+            iguais += 1
+        else:
+            movidos.append((nome, antigas, novas, distancia_m(antigas, novas), feito['provedor']))
+    movidos.sort(key=lambda m: -m[3])
+    return movidos, suspeitos, nao_encontrados, iguais
+
+
+def _pares(valores, opcao):
+    """('nominatim=http://...', ...) -> {'nominatim': 'http://...'}."""
+    pares = {}
+    for valor in valores:
+        nome, sep, resto = valor.partition('=')
+        if not sep or nome not in PROVEDORES:
+            raise click.BadParameter(f"use PROVEDOR=VALOR, com PROVEDOR em {', '.join(PROVEDORES)}", param_hint=opcao)
+        pares[nome] = resto
+    return pares
+
+
+@click.command('geocode-locais')
+@click.option('--provedor', 'nomes_provedores', multiple=True, type=click.Choice(list(PROVEDORES)),
+              help='Provedor, na ordem da cadeia (repita a opção). Padrão: nominatim.')
+@click.option('--url', 'urls', multiple=True, metavar='PROVEDOR=URL', help='Troca a URL de um provedor.')
+@click.option('--taxa', 'taxas', multiple=True, metavar='PROVEDOR=REQ/S', help='Troca o limite de um provedor.')
+@click.option('--trabalhadores', default=2, show_default=True, help='Corrotinas por provedor.')
+@click.option('--arquivo', type=click.Path(exists=True, dir_okay=False), help='Padrão: locais_uem.json do projeto.')
+@click.option('--saida', help='Padrão: locais_uem_atualizado.json, ao lado do arquivo.')
+@click.option('--cidade', default='Maringá, Paraná, Brasil', show_default=True, help='Acrescentado a cada consulta.')
+@click.option('--distancia-max', default=5000.0, show_default=True,
+              help='Metros do centro dos locais atuais acima dos quais o resultado é ignorado.')
+@click.option('--so-diff', is_flag=True, help='Só mostra a diferença, sem gravar a saída.')
+@click.option('--sem-cache', is_flag=True, help='Consulta de novo mesmo o que está em cache (e atualiza o cache).')
+@click.option('--recomecar', is_flag=True, help='Descarta o checkpoint e começa do zero.')
+@with_appcontext
+def geocode_locais_command(nomes_provedores, urls, taxas, trabalhadores, arquivo, saida, cidade,
+                           distancia_max, so_diff, sem_cache, recomecar):
+    """Geocodifica os locais do JSON pelos provedores, com cache e checkpoint, e mostra a diferença."""
+    config = current_app.config
+    arquivo = arquivo or os.path.join(current_app.root_path, '..', 'locais_uem.json')
+    saida = saida or os.path.join(os.path.dirname(arquivo), 'locais_uem_atualizado.json')
+    nomes_provedores = nomes_provedores or ('nominatim',)
+    urls, taxas = _pares(urls, '--url'), _pares(taxas, '--taxa')
+    try:
+        provedores = [PROVEDORES[nome](url=urls.get(nome), taxa=float(taxas[nome]) if nome in taxas else None,
+                                       user_agent=config['GEOCODE_USER_AGENT'], chave=config['GOOGLE_API_KEY'])
+                      for nome in nomes_provedores]
+    except ValueError:
+        raise click.BadParameter('a taxa deve ser um número de requisições por segundo', param_hint='--taxa')
+
+    with open(arquivo, encoding='utf-8') as f:
+        original = json.load(f)
+    atuais = {nome: coords for nome, coords in original.items() if not nome.startswith('_')}
+
+    parametros = {'arquivo': os.path.abspath(arquivo), 'provedores': list(nomes_provedores), 'cidade': cidade}
+    checkpoint = Checkpoint(os.path.join(config['GEOCODE_CACHE_DIR'], 'checkpoint.jsonl'), parametros, recomecar)
+    pendentes = [nome for nome in atuais if nome not in checkpoint.feitos]
+    click.echo(f"{len(atuais) - len(pendentes)} local(is) já no checkpoint; {len(pendentes)} a consultar "
+               f"({' -> '.join(nomes_provedores)}).")
+    cache = CacheRespostas(config['GEOCODE_CACHE_DIR'], ler=not sem_cache)
+    erros = asyncio.run(geocodificar(pendentes, provedores, cache, checkpoint, cidade, trabalhadores, click.echo))
+
+    movidos, suspeitos, nao_encontrados, iguais = comparar(atuais, checkpoint.feitos, distancia_max)
+    click.echo('')
+    for nome, antigas, novas, distancia, provedor in movidos:
+        click.echo(f"~ {nome}: {antigas} -> {novas} ({distancia:.0f} m, {provedor})")
+    for nome, novas, distancia in suspeitos:
+        click.echo(f"! {nome}: {novas} está a {distancia / 1000:.1f} km do campus; ignorado")
+    for nome in nao_encontrados:
+        click.echo(f"? {nome}: não encontrado; mantido")
+    for nome, mensagem in sorted(erros.items()):
+        click.echo(f"x {nome}: {mensagem}; será tentado de novo")
+    click.echo(f"{len(movidos)} movido(s), {iguais} igual(is), {len(suspeitos)} suspeito(s), "
+               f"{len(nao_encontrados)} não encontrado(s), {len(erros)} com erro.")
+
+    if so_diff:
+        return
+    # Mesma ordem e comentários do arquivo original; só os movidos mudam
+    novas_coords = {nome: novas for nome, _, novas, _, _ in movidos}
+    atualizado = {nome: novas_coords.get(nome, valor) for nome, valor in original.items()}
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(atualizado, f, ensure_ascii=False, indent=4)
+    click.echo(f"Gravado em {saida}. Para aplicar: flask importar-locais --arquivo {saida}")
+
+
+def init_app(app):
+    """Registra o comando 'flask geocode-locais' no CLI do Flask."""
+    app.cli.add_command(geocode_locais_command)
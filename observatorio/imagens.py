@@ -0,0 +1,130 @@
+# observatorio/imagens.py
+
+import os
+import re
+from contextlib import contextmanager
+from threading import Lock, get_ident
+
+from flask import abort, current_app, send_from_directory
+from markupsafe import Markup, escape
+
+from .admissao import sem_admissao
+
+# Variantes servidas para cada imagem: nome -> lado máximo em pixels.
+# 'full' é o tamanho armazenado (o upload já é limitado a 1920x1080).
+VARIANTES = {
+    'thumb': 320,
+    'medium': 960,
+    'full': 1920,
+}
+
+# Transformação do Cloudinary inserida após '/image/upload/' na URL
+_CLOUDINARY_UPLOAD = re.compile(r'^(https?://res\.cloudinary\.com/[^/]+/image/upload/)(.*)$')
+
+# Uma trava por arquivo de destino: pedidos da mesma variante esperam quem
+# já a está gerando, e variantes diferentes são geradas em paralelo.
+# destino -> [trava, pedidos usando a entrada]; a entrada sai com o último
+_travas = {}
+_travas_lock = Lock()
+
+
+def _media_url():
+    return current_app.config.get('MEDIA_URL', '/media/')
+
+
+def variant_url(url, variante='thumb'):
+    """
+    Retorna a URL da variante pedida de uma imagem armazenada.
+    - Cloudinary: transformação na própria URL (c_limit, q_auto, f_auto).
+    - Armazenamento local (MEDIA_URL): derivada gerada com Pillow sob demanda.
+    - Qualquer outra URL é devolvida como está.
+    """
+    if not url or variante == 'full' or variante not in VARIANTES:
+        return url
+    lado = VARIANTES[variante]
+    match = _CLOUDINARY_UPLOAD.match(url)
+    if match:
+        return f"{match.group(1)}c_limit,w_{lado},h_{lado},q_auto,f_auto/{match.group(2)}"
+    media_url = _media_url()
+    if url.startswith(media_url):
+        return f"{media_url}_variantes/{variante}/{url[len(media_url):]}"
+    return url
+
+
+def srcset(url):
+    """Monta o atributo 'srcset' com todas as variantes da imagem."""
+    if not url:
+        return ''
+    candidatos = {}
+    for variante, lado in VARIANTES.items():
+        candidatos.setdefault(variant_url(url, variante), lado)
+    # URL externa sem variantes: o 'src' sozinho basta
+    if len(candidatos) < 2:
+        return ''
+    return Markup(', '.join(f"{escape(c)} {lado}w" for c, lado in candidatos.items()))
+
+
+@contextmanager
+def _travar_destino(destino):
+    with _travas_lock:
+        entrada = _travas.setdefault(destino, [Lock(), 0])
+        entrada[1] += 1
+    try:
+        with entrada[0]:
+            yield
+    finally:
+        with _travas_lock:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del _travas[destino]
+
+
+def gerar_variante(origem, destino, lado):
+    """Gera (uma vez) a derivada reduzida de uma imagem local, preservando o formato."""
+    from PIL import Image, ImageOps
+
+    with _travar_destino(destino):
+        if os.path.exists(destino) and os.path.getmtime(destino) >= os.path.getmtime(origem):
+            return
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with Image.open(origem) as img:
+            formato = img.format or 'JPEG'
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((lado, lado))
+            if formato == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            # Nome próprio do processo/thread: outro worker pode gerar a mesma variante
+            temporario = f'{destino}.{os.getpid()}.{get_ident()}.tmp'
+            img.save(temporario, format=formato, optimize=True, quality=80)
+        os.replace(temporario, destino)
+
+
+def init_app(app):
+    """Registra os filtros Jinja das variantes e a rota das derivadas locais."""
+    app.jinja_env.filters['img_variant'] = variant_url
+    app.jinja_env.filters['img_srcset'] = srcset
+
+    media_url = app.config.get('MEDIA_URL', '/media/')
+    # Como a mídia original (storage.py): cada srcset pede várias variantes
+    from . import limiter
+
+    @app.route(f'{media_url}_variantes/<string:variante>/<path:caminho>')
+    @limiter.exempt
+    @sem_admissao
+    def media_variante(variante, caminho):
+        if variante not in VARIANTES or variante == 'full':
+            abort(404)
+        raiz = app.config['MEDIA_ROOT']
+        origem = os.path.realpath(os.path.join(raiz, caminho))
+        if not origem.startswith(os.path.realpath(raiz) + os.sep) or not os.path.isfile(origem):
+            abort(404)
+        pasta_variantes = os.path.join(raiz, '_variantes', variante)
+        try:
+            gerar_variante(origem, os.path.join(pasta_variantes, caminho), VARIANTES[variante])
+        except ImportError:
+            # Sem Pillow instalado: serve o original
+            return send_from_directory(raiz, caminho, max_age=86400)
+        except OSError as e:
+            current_app.logger.error(f"Falha ao gerar variante '{variante}' de {caminho}: {e}")
+            return send_from_directory(raiz, caminho, max_age=86400)
+        return send_from_directory(pasta_variantes, caminho, max_age=30 * 86400)
@@ -0,0 +1,321 @@
+# observatorio/limiter_storage.py
+"""
+Armazenamento do rate limiter compartilhado entre os workers do host.
+
+Com 'memory://' cada processo do gunicorn/waitress tinha seus próprios
+contadores: o limite efetivo de vote/submit/like_comment crescia com o
+número de workers e zerava a cada restart. Este backend guarda os
+contadores numa tabela de tamanho fixo num arquivo mapeado em memória
+(mmap compartilhado), então todos os processos do host enxergam os mesmos
+valores e eles sobrevivem a um restart (os prazos são epoch).
+
+Registra os esquemas 'mmap://' (Flask-Limiter) e 'async+mmap://' (modo
+ASGI) no registro do 'limits':
+
+    RATELIMIT_STORAGE_URI=mmap:///var/run/observatorio/ratelimit.bin
+    RATELIMIT_STORAGE_URI=mmap:///dev/shm/observatorio-ratelimit?faixas=512&slots=128
+
+Layout: um cabeçalho seguido de 'faixas' tabelas independentes de
+endereçamento aberto (sondagem linear) com 'slots' posições cada. A chave
+vira um hash de 64 bits; o hash escolhe a faixa e a posição inicial. Cada
+faixa tem sua trava: um threading.Lock (entre threads do processo) mais um
+lockf num byte do arquivo (entre processos), de modo que duas chaves em
+faixas diferentes nunca disputam a mesma trava. Posições expiradas são
+reaproveitadas; se a sondagem não achar vaga, a entrada que expira primeiro
+é descartada.
+
+Para vários hosts, use 'redis://' (requirements-redis.txt).
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+from hashlib import blake2b
+from math import floor
+from urllib.parse import parse_qs, urlparse
+
+from limits.aio.storage import SlidingWindowCounterSupport as AsyncSlidingWindowCounterSupport
+from limits.aio.storage import Storage as AsyncStorage
+from limits.storage import SlidingWindowCounterSupport, Storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lockf, o app cai para 'memory://'
+    fcntl = None
+
+DISPONIVEL = fcntl is not None
+
+MAGICO = b'OBSRL002'
+CABECALHO = struct.Struct('<8sII')  # mágico, número de faixas, slots por faixa
+INICIO_SLOTS = 64
+SLOT = struct.Struct('<Qdqq')  # hash da chave (0 = vazio), expiração (epoch), contador, extra
+
+FAIXAS_PADRAO = 256
+SLOTS_PADRAO = 256
+# Posições visitadas antes de desistir e descartar a entrada mais próxima de expirar
+LIMITE_SONDAGEM = 32
+# As entradas de janela deslizante usam um hash próprio, separado do contador fixo
+SUFIXO_JANELA = '\x00janela'
+
+
+def hash_chave(chave):
+    valor = int.from_bytes(blake2b(chave.encode('utf-8'), digest_size=8).digest(), 'little')
+    return valor or 1
+
+
+def caminho_do_uri(uri):
+    """'mmap:///abs/arquivo' ou 'mmap://relativo/arquivo' -> (caminho, opções)."""
+    partes = urlparse(uri)
+    caminho = partes.netloc + partes.path
+    if not caminho:
+        raise ValueError(f"URI do rate limiter sem caminho de arquivo: {uri}")
+    opcoes = {k: v[-1] for k, v in parse_qs(partes.query).items()}
+    return caminho, opcoes
+
+
+class ArmazenamentoCompartilhado(Storage, SlidingWindowCounterSupport):
+    """Contadores de janela fixa e de janela deslizante num mmap compartilhado."""
+
+    STORAGE_SCHEME = ['mmap']
+
+    def __init__(self, uri=None, wrap_exceptions=False, faixas=None, slots=None, **options):
+        caminho, opcoes = caminho_do_uri(uri)
+        faixas = int(faixas or opcoes.get('faixas', FAIXAS_PADRAO))
+        slots = int(slots or opcoes.get('slots', SLOTS_PADRAO))
+        self.caminho = caminho
+        self._abrir(caminho, faixas, slots)
+        self._travas = [threading.Lock() for _ in range(self.faixas)]
+        # Depois de um fork (gunicorn --preload) as travas de thread recomeçam livres;
+        # o mmap é MAP_SHARED e as travas lockf pertencem a cada processo
+        os.register_at_fork(after_in_child=self._reiniciar_travas)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    def _abrir(self, caminho, faixas, slots):
+        pasta = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(pasta, exist_ok=True)
+        self._fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o600)
+        # Trava o arquivo inteiro enquanto o primeiro worker cria a tabela
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            cabecalho = os.pread(self._fd, CABECALHO.size, 0)
+            if len(cabecalho) == CABECALHO.size and cabecalho[:8] == MAGICO:
+                # Tabela já existente: vale o formato gravado, não o pedido
+                _, faixas, slots = CABECALHO.unpack(cabecalho)
+            else:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, INICIO_SLOTS + faixas * slots * SLOT.size)
+                os.pwrite(self._fd, CABECALHO.pack(MAGICO, faixas, slots), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self.faixas = faixas
+        self.slots = slots
+        self._mm = mmap.mmap(self._fd, INICIO_SLOTS + faixas * slots * SLOT.size)
+
+    def _reiniciar_travas(self):
+        self._travas = [threading.Lock() for _ in range(self.faixas)]
+
+    def _travar(self, faixa):
+        self._travas[faixa].acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, faixa)
+        except BaseException:
+            self._travas[faixa].release()
+            raise
+
+    def _destravar(self, faixa):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, faixa)
+        finally:
+            self._travas[faixa].release()
+
+    def _posicao(self, chave):
+        h = hash_chave(chave)
+        return h, h % self.faixas, (h // self.faixas) % self.slots
+
+    def _localizar(self, h, faixa, inicial, agora):
+        """
+        Procura a chave na faixa (com a trava já tomada). Devolve
+        (posição, contador, expiração); se a chave não existe ou expirou,
+        devolve a posição onde gravá-la com contador 0.
+        """
+        base = INICIO_SLOTS + faixa * self.slots * SLOT.size
+        vaga = None
+        descartavel, menor_expiracao = None, None
+        for i in range(min(LIMITE_SONDAGEM, self.slots)):
+            pos = base + ((inicial + i) % self.slots) * SLOT.size
+            atual, expira, contador, _ = SLOT.unpack_from(self._mm, pos)
+            if atual == h:
+                if expira <= agora:
+                    return pos, 0, 0.0
+                return pos, contador, expira
+            if atual == 0:
+                return (vaga if vaga is not None else pos), 0, 0.0
+            if vaga is None and expira <= agora:
+                vaga = pos
+            if menor_expiracao is None or expira < menor_expiracao:
+                descartavel, menor_expiracao = pos, expira
+        return (vaga if vaga is not None else descartavel), 0, 0.0
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError)
+
+    def incr(self, key, expiry, amount=1):
+        """
+        Incrementa o contador da chave; o prazo é definido quando o contador
+        nasce (ou renasce depois de expirar), como no MemoryStorage.
+        """
+        h, faixa, inicial = self._posicao(key)
+        self._travar(faixa)
+        try:
+            agora = time.time()
+            pos, contador, expira = self._localizar(h, faixa, inicial, agora)
+            if contador == 0 and expira <= agora:
+                expira = agora + expiry
+            contador += amount
+            SLOT.pack_into(self._mm, pos, h, expira, contador, 0)
+        finally:
+            self._destravar(faixa)
+        return contador
+
+    def _ler(self, key):
+        h, faixa, inicial = self._posicao(key)
+        self._travar(faixa)
+        try:
+            _, contador, expira = self._localizar(h, faixa, inicial, time.time())
+        finally:
+            self._destravar(faixa)
+        return contador, expira
+
+    def get(self, key):
+        return self._ler(key)[0]
+
+    def get_expiry(self, key):
+        _, expira = self._ler(key)
+        return expira or time.time()
+
+    def clear(self, key):
+        h, faixa, inicial = self._posicao(key)
+        self._travar(faixa)
+        try:
+            pos, contador, _ = self._localizar(h, faixa, inicial, time.time())
+            if contador:
+                # Mantém o hash na posição para não quebrar a sequência de sondagem
+                SLOT.pack_into(self._mm, pos, h, 0.0, 0, 0)
+        finally:
+            self._destravar(faixa)
+
+    def check(self):
+        return not self._mm.closed
+
+    def reset(self):
+        """Zera a tabela inteira; devolve quantas entradas ainda estavam valendo."""
+        vazio = bytes(self.slots * SLOT.size)
+        removidas = 0
+        for faixa in range(self.faixas):
+            base = INICIO_SLOTS + faixa * self.slots * SLOT.size
+            self._travar(faixa)
+            try:
+                agora = time.time()
+                for i in range(self.slots):
+                    atual, expira, _, _ = SLOT.unpack_from(self._mm, base + i * SLOT.size)
+                    if atual and expira > agora:
+                        removidas += 1
+                self._mm[base:base + len(vazio)] = vazio
+            finally:
+                self._destravar(faixa)
+        return removidas
+
+    # --- Janela deslizante ---
+    # As janelas atual e anterior ficam na mesma posição (contador = atual,
+    # extra = anterior, expiração = fim da janela seguinte), então um hit é
+    # uma única leitura-e-escrita sob a trava, sem a corrida do MemoryStorage.
+
+    def _janela(self, pos, h, expiry, agora):
+        """(anterior, ttl_anterior, atual, ttl_atual) da janela que contém 'agora'."""
+        atual_h, expira, atual, anterior = SLOT.unpack_from(self._mm, pos)
+        janela = int(agora // expiry)
+        gravada = round(expira / expiry) - 2 if atual_h == h and expira > agora else None
+        if gravada == janela - 1:
+            anterior, atual = atual, 0
+        elif gravada != janela:
+            anterior, atual = 0, 0
+        ttl_anterior = 0.0 if anterior == 0 else (1 - (((agora - expiry) / expiry) % 1)) * expiry
+        ttl_atual = (1 - ((agora / expiry) % 1)) * expiry + expiry
+        return anterior, ttl_anterior, atual, ttl_atual
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        h, faixa, inicial = self._posicao(key + SUFIXO_JANELA)
+        self._travar(faixa)
+        try:
+            agora = time.time()
+            pos, _, _ = self._localizar(h, faixa, inicial, agora)
+            anterior, ttl_anterior, atual, _ = self._janela(pos, h, expiry, agora)
+            if floor(anterior * ttl_anterior / expiry + atual) + amount > limit:
+                return False
+            janela = int(agora // expiry)
+            SLOT.pack_into(self._mm, pos, h, float((janela + 2) * expiry), atual + amount, anterior)
+            return True
+        finally:
+            self._destravar(faixa)
+
+    def get_sliding_window(self, key, expiry):
+        h, faixa, inicial = self._posicao(key + SUFIXO_JANELA)
+        self._travar(faixa)
+        try:
+            agora = time.time()
+            pos, _, _ = self._localizar(h, faixa, inicial, agora)
+            return self._janela(pos, h, expiry, agora)
+        finally:
+            self._destravar(faixa)
+
+    def clear_sliding_window(self, key, expiry):
+        self.clear(key + SUFIXO_JANELA)
+
+
+class ArmazenamentoCompartilhadoAsync(AsyncStorage, AsyncSlidingWindowCounterSupport):
+    """
+    Versão 'async+mmap://' para o modo ASGI. As operações levam
+    microssegundos e não fazem I/O de rede, então rodam direto no loop.
+    """
+
+    STORAGE_SCHEME = ['async+mmap']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self._sincrono = ArmazenamentoCompartilhado(uri.removeprefix('async+'), **options)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return self._sincrono.base_exceptions
+
+    async def incr(self, key, expiry, amount=1):
+        return self._sincrono.incr(key, expiry, amount)
+
+    async def get(self, key):
+        return self._sincrono.get(key)
+
+    async def get_expiry(self, key):
+        return self._sincrono.get_expiry(key)
+
+    async def check(self):
+        return self._sincrono.check()
+
+    async def reset(self):
+        return self._sincrono.reset()
+
+    async def clear(self, key):
+        return self._sincrono.clear(key)
+
+    async def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        return self._sincrono.acquire_sliding_window_entry(key, limit, expiry, amount)
+
+    async def get_sliding_window(self, key, expiry):
+        return self._sincrono.get_sliding_window(key, expiry)
+
+    async def clear_sliding_window(self, key, expiry):
+        return self._sincrono.clear_sliding_window(key, expiry)
@@ -0,0 +1,293 @@
+# observatorio/locais.py
+"""
+Registro de locais do campus: nomes e coordenadas, com as choices dos
+formulários já montadas, um casador por trigramas que leva o texto livre de
+'Outro Local' ao local conhecido que ele cita e uma grade espacial para o
+local mais próximo de um ponto (usada pelo mapa).
+
+Os locais ficam na tabela 'locais' ('flask importar-locais' carrega o
+locais_uem.json, que também é o registro do boot e a reserva enquanto a
+tabela estiver vazia). Cada versão do registro é um RegistroLocais imutável,
+trocado inteiro: a requisição que pegou uma referência continua com uma
+versão consistente. A troca não exige reinício: a cada
+LOCAIS_VERIFICAR_INTERVALO segundos uma thread compara locais_versao
+(incrementada por trigger a cada alteração na tabela) com a carregada.
+"""
+
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from threading import Lock, Thread
+from types import MappingProxyType
+
+import click
+import psycopg2.extras
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .db import get_pool
+
+# Opção do formulário para locais fora da lista (o texto livre vem em outro campo)
+OUTRO = 'Outro Local / Não Listado'
+# Prefixo de relatos antigos com local em texto livre
+PREFIXO_OUTRO = 'Outro:'
+COORDS_PADRAO = (-23.4065, -51.9395)
+# Metros por grau de latitude
+METROS_GRAU = 111320
+# Anéis da grade percorridos antes de cair na busca exaustiva (ponto longe do campus)
+MAX_ANEIS = 50
+# Textos livres resolvidos guardados por versão do registro
+MAX_RESOLVIDOS = 10000
+
+
+def _normalizar(texto):
+    """Minúsculas, sem acentos nem pontuação; 'C-34' e 'c 34' viram 'c34', '01' vira '1'."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[^a-z0-9]+', ' ', texto)
+    texto = re.sub(r'\b([a-z])\s?(\d)', r'\1\2', texto)
+    return re.sub(r'\b0+(\d)', r'\1', texto).strip()
+
+
+def trigramas(texto):
+    """Trigramas como os do pg_trgm: cada palavra com dois espaços antes e um depois."""
+    saida = set()
+    for palavra in _normalizar(texto).split():
+        palavra = f'  {palavra} '
+        saida.update(palavra[i:i + 3] for i in range(len(palavra) - 2))
+    return frozenset(saida)
+
+
+def _apelidos(nome):
+    """Formas de escrever um local: o nome, o nome sem os parênteses e as siglas entre eles."""
+    apelidos = {nome, re.sub(r'\s*\([^)]*\)', '', nome)}
+    apelidos.update(re.findall(r'\(([^)]+)\)', nome))
+    return {a.strip() for a in apelidos if a.strip()}
+
+
+class GradeEspacial:
+    """
+    Índice de pontos em células quadradas de 'celula' metros (projeção
+    equirretangular em torno da latitude média, exata o bastante na escala
+    do campus). A busca percorre anéis de células a partir da do ponto e
+    para quando nenhum anel seguinte pode ter algo mais perto.
+    """
+
+    def __init__(self, pontos, celula):
+        self.pontos = tuple(pontos)  # (nome, lat, lon)
+        self.celula = celula
+        lat_media = sum(p[1] for p in self.pontos) / len(self.pontos) if self.pontos else 0
+        self._escala_lon = METROS_GRAU * math.cos(math.radians(lat_media))
+        celulas = defaultdict(list)
+        self._xy = []
+        for indice, (_, lat, lon) in enumerate(self.pontos):
+            x, y = self._projetar(lat, lon)
+            self._xy.append((x, y))
+            celulas[(int(x // celula), int(y // celula))].append(indice)
+        self._celulas = {chave: tuple(indices) for chave, indices in celulas.items()}
+        chaves = self._celulas.keys()
+        self._limites = (min(i for i, _ in chaves), max(i for i, _ in chaves),
+                         min(j for _, j in chaves), max(j for _, j in chaves)) if chaves else None
+
+    def _projetar(self, lat, lon):
+        return lon * self._escala_lon, lat * METROS_GRAU
+
+    def _anel(self, ci, cj, raio):
+        if raio == 0:
+            yield ci, cj
+            return
+        for i in range(ci - raio, ci + raio + 1):
+            yield i, cj - raio
+            yield i, cj + raio
+        for j in range(cj - raio + 1, cj + raio):
+            yield ci - raio, j
+            yield ci + raio, j
+
+    def proximos(self, lat, lon, k=1, raio=None):
+        """Até k (nome, lat, lon, distância em metros) mais próximos, opcionalmente até 'raio' metros."""
+        if not self.pontos:
+            return []
+        x, y = self._projetar(lat, lon)
+        ci, cj = int(x // self.celula), int(y // self.celula)
+        imin, imax, jmin, jmax = self._limites
+        ultimo_anel = max(ci - imin, imax - ci, cj - jmin, jmax - cj)
+
+        def distancia(indice):
+            px, py = self._xy[indice]
+            return math.hypot(px - x, py - y)
+
+        if ultimo_anel > MAX_ANEIS:
+            candidatos = [(distancia(i), i) for i in range(len(self.pontos))]
+        else:
+            candidatos = []
+            for anel in range(ultimo_anel + 1):
+                for chave in self._anel(ci, cj, anel):
+                    candidatos.extend((distancia(i), i) for i in self._celulas.get(chave, ()))
+                # Pontos dos anéis seguintes estão a pelo menos anel * celula metros
+                limite = anel * self.celula
+                if raio is not None and limite > raio:
+                    break
+                if len(candidatos) >= k and sorted(candidatos)[k - 1][0] <= limite:
+                    break
+        candidatos.sort()
+        return [(self.pontos[i][0], self.pontos[i][1], self.pontos[i][2], d)
+                for d, i in candidatos[:k] if raio is None or d <= raio]
+
+
+class RegistroLocais:
+    """
+    Uma versão do registro. Tudo é calculado no construtor e não muda
+    depois (o cache de textos livres resolvidos só cresce e é por versão).
+    """
+
+    def __init__(self, coordenadas, versao=None, similaridade_min=0.8, celula=100):
+        coords = {nome: (float(lat), float(lon)) for nome, (lat, lon) in coordenadas.items()}
+        self.versao = versao
+        self.coordenadas = MappingProxyType(coords)
+        self.nomes = tuple(sorted(coords))
+        self.choices = tuple((nome, nome) for nome in self.nomes)
+        self.choices_submit = (('', 'Selecione um local...'),) + self.choices
+        self.padrao = coords.get(OUTRO, COORDS_PADRAO)
+        self.similaridade_min = similaridade_min
+
+        lugares = [nome for nome in self.nomes if nome != OUTRO]
+        self._apelidos = tuple((nome, tri) for nome in lugares
+                               for tri in map(trigramas, sorted(_apelidos(nome))) if tri)
+        indice = defaultdict(list)
+        for posicao, (_, tri) in enumerate(self._apelidos):
+            for trigrama in tri:
+                indice[trigrama].append(posicao)
+        self._indice = {trigrama: tuple(posicoes) for trigrama, posicoes in indice.items()}
+        self.grade = GradeEspacial([(nome, *coords[nome]) for nome in lugares], celula)
+        self._resolvidos = {}
+
+    def casar(self, texto):
+        """
+        Local conhecido citado em 'texto', ou None. A nota de cada apelido é
+        a maior entre a similaridade de trigramas (como a do pg_trgm) e a
+        fração dos trigramas do apelido presentes no texto, que cobre o nome
+        escrito no meio de uma frase ('perto do RU'). Só os apelidos com algum
+        trigrama em comum (índice invertido) são avaliados.
+        """
+        consulta = trigramas(texto)
+        comuns = Counter(posicao for trigrama in consulta for posicao in self._indice.get(trigrama, ()))
+        melhor, melhor_nota = None, 0.0
+        for posicao, em_comum in comuns.items():
+            nome, tri = self._apelidos[posicao]
+            nota = max(em_comum / (len(tri) + len(consulta) - em_comum), em_comum / len(tri))
+            if nota > melhor_nota or (nota == melhor_nota and nome < melhor):
+                melhor, melhor_nota = nome, nota
+        return melhor if melhor_nota >= self.similaridade_min else None
+
+    def resolver(self, local):
+        """Nome do local conhecido para o 'local' de um relato (exato ou texto livre), ou None."""
+        if local in self.coordenadas and local != OUTRO:
+            return local
+        if local not in self._resolvidos:
+            texto = local[len(PREFIXO_OUTRO):] if local.startswith(PREFIXO_OUTRO) else local
+            nome = self.casar(texto)
+            if len(self._resolvidos) >= MAX_RESOLVIDOS:
+                return nome
+            self._resolvidos[local] = nome
+        return self._resolvidos[local]
+
+    def coordenadas_de(self, local):
+        """(lat, lon) do local; texto livre não reconhecido fica no ponto padrão."""
+        nome = self.resolver(local)
+        return self.coordenadas[nome] if nome else self.padrao
+
+    def proximos(self, lat, lon, k=1, raio=None):
+        return self.grade.proximos(lat, lon, k, raio)
+
+
+def _novo_registro(coordenadas, versao, config):
+    return RegistroLocais(coordenadas, versao, config['LOCAIS_SIMILARIDADE_MIN'], config['LOCAIS_CELULA_METROS'])
+
+
+def _recarregar(app, estado):
+    """Thread: lê locais_versao e, se mudou, a tabela inteira, e troca o registro."""
+    try:
+        pool = get_pool(app.config['DATABASE_URL'])
+        conn = pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT versao FROM locais_versao')
+            linha = cur.fetchone()
+            versao = linha[0] if linha else None
+            if versao is not None and versao != estado['registro'].versao:
+                cur.execute('SELECT nome, lat, lon FROM locais')
+                coordenadas = {nome: (lat, lon) for nome, lat, lon in cur.fetchall()}
+                # Tabela vazia (ainda sem 'flask importar-locais'): fica o locais_uem.json
+                estado['registro'] = _novo_registro(coordenadas or app.config['LOCAIS_UEM'], versao, app.config)
+                print(f"Registro de locais recarregado: versão {versao}, {len(estado['registro'].nomes)} locais.")
+            cur.close()
+            conn.rollback()
+        finally:
+            pool.putconn(conn)
+    except Exception as e:
+        print(f"Falha ao verificar a versão dos locais: {e}")
+    finally:
+        estado['verificando'] = False
+
+
+def registro_atual(app=None):
+    """
+    O registro vigente. Se já passou LOCAIS_VERIFICAR_INTERVALO desde a
+    última checagem, dispara outra em segundo plano (a requisição não espera).
+    """
+    app = app or current_app._get_current_object()
+    estado = app.extensions['locais']
+    intervalo = app.config['LOCAIS_VERIFICAR_INTERVALO']
+    if intervalo > 0 and not app.testing and time.monotonic() >= estado['verificar_em']:
+        with estado['lock']:
+            if estado['verificando'] or time.monotonic() < estado['verificar_em']:
+                return estado['registro']
+            estado['verificando'] = True
+            estado['verificar_em'] = time.monotonic() + intervalo
+        Thread(target=_recarregar, args=(app, estado), daemon=True).start()
+    return estado['registro']
+
+
+@click.command('importar-locais')
+@click.option('--arquivo', type=click.Path(exists=True, dir_okay=False),
+              help='JSON no formato do locais_uem.json (padrão: o do projeto).')
+@click.option('--podar', is_flag=True, help='Remove da tabela os locais que não estão no arquivo.')
+@with_appcontext
+def importar_locais_command(arquivo, podar):
+    """Carrega (upsert) os locais do JSON na tabela 'locais'; os workers recarregam sozinhos."""
+    arquivo = arquivo or os.path.join(current_app.root_path, '..', 'locais_uem.json')
+    with open(arquivo, encoding='utf-8') as f:
+        locais = {nome: coords for nome, coords in json.load(f).items() if not nome.startswith('_')}
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO locais (nome, lat, lon) VALUES %s
+            ON CONFLICT (nome) DO UPDATE SET lat = EXCLUDED.lat, lon = EXCLUDED.lon
+            WHERE (locais.lat, locais.lon) IS DISTINCT FROM (EXCLUDED.lat, EXCLUDED.lon)
+        """, [(nome, lat, lon) for nome, (lat, lon) in locais.items()])
+        removidos = 0
+        if podar:
+            cur.execute('DELETE FROM locais WHERE NOT (nome = ANY(%s))', (list(locais),))
+            removidos = cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        pool.putconn(conn)
+    click.echo(f"{len(locais)} local(is) importado(s) de {arquivo}; {removidos} removido(s).")
+
+
+def init_app(app):
+    """Monta o registro inicial a partir de LOCAIS_UEM (locais_uem.json) e registra o comando."""
+    app.extensions['locais'] = {
+        'registro': _novo_registro(app.config['LOCAIS_UEM'], None, app.config),
+        'verificar_em': 0.0,
+        'verificando': False,
+        'lock': Lock(),
+    }
+    app.cli.add_command(importar_locais_command)
@@ -0,0 +1,70 @@
+# observatorio/metricas.py
+"""
+Métricas do processo em formato texto do Prometheus (GET /admin/metricas).
+
+Contadores são acumulados aqui; medidores (valores instantâneos, como a
+profundidade da fila de admissão) são funções consultadas na hora da
+leitura. Os valores são por processo: cada worker expõe os seus, com o pid
+como rótulo.
+"""
+
+import os
+from collections import defaultdict
+from threading import Lock
+
+_lock = Lock()
+_contadores = defaultdict(float)
+_medidores = {}
+_ajuda = {}
+
+
+def _chave(nome, rotulos):
+    return nome, tuple(sorted(rotulos.items()))
+
+
+def incrementar(nome, valor=1, ajuda=None, **rotulos):
+    """Soma 'valor' ao contador 'nome' com os rótulos dados."""
+    with _lock:
+        _contadores[_chave(nome, rotulos)] += valor
+        if ajuda:
+            _ajuda.setdefault(nome, ajuda)
+
+
+def registrar_medidor(nome, funcao, ajuda=None, **rotulos):
+    """Registra uma função sem argumentos cujo retorno é o valor atual do medidor."""
+    with _lock:
+        _medidores[_chave(nome, rotulos)] = funcao
+        if ajuda:
+            _ajuda.setdefault(nome, ajuda)
+
+
+def valor(nome, **rotulos):
+    with _lock:
+        return _contadores.get(_chave(nome, rotulos), 0)
+
+
+def _linha(nome, rotulos, valor_atual):
+    rotulos = rotulos + (('pid', str(os.getpid())),)
+    texto = ','.join(f'{k}="{v}"' for k, v in rotulos)
+    return f'{nome}{{{texto}}} {valor_atual:g}'
+
+
+def texto_prometheus():
+    with _lock:
+        contadores = sorted(_contadores.items())
+        medidores = sorted(_medidores.items(), key=lambda item: item[0])
+        ajuda = dict(_ajuda)
+
+    linhas = []
+    vistos = set()
+    for tipo, itens in (('counter', contadores), ('gauge', medidores)):
+        for (nome, rotulos), valor_atual in itens:
+            if nome not in vistos:
+                vistos.add(nome)
+                if nome in ajuda:
+                    linhas.append(f'# HELP {nome} {ajuda[nome]}')
+                linhas.append(f'# TYPE {nome} {tipo}')
+            if callable(valor_atual):
+                valor_atual = valor_atual()
+            linhas.append(_linha(nome, rotulos, valor_atual))
+    return '\n'.join(linhas) + '\n'
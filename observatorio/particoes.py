@@ -0,0 +1,306 @@
+# observatorio/particoes.py
+"""
+Manutenção das tabelas de interação particionadas por mês (schema.sql):
+votos, testemunhas e comentarios_likes.
+
+    flask migrar-particoes            # uma vez, em bancos anteriores ao particionamento
+                                      # (o 'flask init-db' também converte)
+    flask criar-particoes --meses 3   # mensalmente (cron): partições dos próximos meses
+    flask arquivar-particoes --meses 12 --destino /backups/interacoes
+
+O arquivamento grava cada partição mais antiga que a retenção num CSV
+gzip (com a cidade e o User-Agent já decodificados), desanexa e apaga a
+partição. Com as linhas antigas some também a memória de "esta sessão já
+votou/testemunhou/curtiu": a retenção deve ser bem maior que a vida da sessão.
+"""
+
+import gzip
+import os
+import re
+from datetime import date
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from psycopg2 import sql
+
+from .db import executar_schema, get_pool
+
+# Colunas próprias de cada tabela (além de ip_address, city_id e user_agent_id)
+TABELAS_PARTICIONADAS = {
+    'votos': ['id', 'relato_id', 'session_id', 'tipo_voto', 'criado_em'],
+    'testemunhas': ['id', 'relato_id', 'session_id', 'criado_em'],
+    'comentarios_likes': ['id', 'comentario_id', 'session_id', 'criado_em'],
+}
+
+
+def _tipo_tabela(cur, tabela):
+    """'p' (particionada), 'r' (tabela comum) ou None."""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    linha = cur.fetchone()
+    return linha[0] if linha else None
+
+
+def _preencher_dicionarios(cur, origem):
+    """Cadastra em cities/user_agents os valores distintos das colunas texto de 'origem'."""
+    cur.execute(sql.SQL(
+        "INSERT INTO cities (nome) SELECT DISTINCT LEFT(city, 100) FROM {} WHERE city IS NOT NULL "
+        "ON CONFLICT (nome) DO NOTHING"
+    ).format(sql.Identifier(origem)))
+    cur.execute(sql.SQL(
+        "INSERT INTO user_agents (texto) SELECT DISTINCT LEFT(user_agent, 255) FROM {} WHERE user_agent IS NOT NULL "
+        "ON CONFLICT (texto) DO NOTHING"
+    ).format(sql.Identifier(origem)))
+
+
+def _renomear_antiga(cur, tabela):
+    """Libera os nomes da tabela, da sequência e dos índices para o schema.sql recriá-los."""
+    cur.execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s)
+    """, (tabela,))
+    for (indice,) in cur.fetchall():
+        cur.execute(sql.SQL('ALTER INDEX {} RENAME TO {}').format(
+            sql.Identifier(indice), sql.Identifier(f'{indice}_antigo')))
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (tabela,))
+    sequencia = cur.fetchone()[0]
+    if sequencia:
+        cur.execute(sql.SQL('ALTER SEQUENCE {} RENAME TO {}').format(
+            sql.SQL(sequencia), sql.Identifier(f'{tabela}_antiga_id_seq')))
+    cur.execute(sql.SQL('ALTER TABLE {} RENAME TO {}').format(
+        sql.Identifier(tabela), sql.Identifier(f'{tabela}_antiga')))
+
+
+def _copiar_antiga(cur, tabela):
+    """Copia as linhas de <tabela>_antiga para a tabela particionada, codificando os metadados."""
+    antiga = f'{tabela}_antiga'
+    cur.execute(sql.SQL('SELECT MIN(criado_em) FROM {}').format(sql.Identifier(antiga)))
+    desde = cur.fetchone()[0]
+    if desde is not None:
+        cur.execute('SELECT criar_particoes_mensais(%s, 3, %s::date)', (tabela, desde))
+    _preencher_dicionarios(cur, antiga)
+
+    colunas = TABELAS_PARTICIONADAS[tabela]
+    cur.execute(sql.SQL("""
+        INSERT INTO {tabela} ({colunas}, ip_address, city_id, user_agent_id)
+        SELECT {colunas_a}, ip_ou_nulo(a.ip_address), ci.id, ua.id
+        FROM {antiga} a
+        LEFT JOIN cities ci ON ci.nome = LEFT(a.city, 100)
+        LEFT JOIN user_agents ua ON ua.texto = LEFT(a.user_agent, 255)
+    """).format(
+        tabela=sql.Identifier(tabela),
+        colunas=sql.SQL(', ').join(map(sql.Identifier, colunas)),
+        colunas_a=sql.SQL(', ').join(sql.Identifier('a', c) for c in colunas),
+        antiga=sql.Identifier(antiga),
+    ))
+    copiadas = cur.rowcount
+    # A sequência nova continua depois do maior id copiado
+    cur.execute(sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {}")
+                .format(sql.Identifier(tabela)), (tabela,))
+    return copiadas
+
+
+def _converter_comentarios(cur):
+    """Troca city/user_agent em texto por ids e o ip_address por inet na tabela comentarios."""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'comentarios' AND column_name = 'city'
+    """)
+    if cur.fetchone() is None:
+        return False
+    cur.execute("""
+        ALTER TABLE comentarios
+            ADD COLUMN IF NOT EXISTS city_id INTEGER REFERENCES cities(id),
+            ADD COLUMN IF NOT EXISTS user_agent_id INTEGER REFERENCES user_agents(id)
+    """)
+    _preencher_dicionarios(cur, 'comentarios')
+    cur.execute("""
+        UPDATE comentarios SET
+            city_id = (SELECT id FROM cities WHERE nome = LEFT(comentarios.city, 100)),
+            user_agent_id = (SELECT id FROM user_agents WHERE texto = LEFT(comentarios.user_agent, 255))
+    """)
+    cur.execute("""
+        ALTER TABLE comentarios
+            ALTER COLUMN ip_address TYPE INET USING ip_ou_nulo(ip_address),
+            DROP COLUMN city,
+            DROP COLUMN user_agent
+    """)
+    return True
+
+
+def migracoes_pendentes(cur):
+    """
+    O que ainda falta converter num banco anterior ao particionamento: as
+    INSERTs das rotas gravam city_id/user_agent_id, então qualquer item
+    desta lista faz votos, testemunhas, curtidas ou comentários falharem.
+    """
+    pendentes = [tabela for tabela in TABELAS_PARTICIONADAS if _tipo_tabela(cur, tabela) == 'r']
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'comentarios' AND column_name = 'city'
+    """)
+    if cur.fetchone() is not None:
+        pendentes.append('comentarios')
+    return pendentes
+
+
+def migrar(cur, manter_antigas=False):
+    """
+    Aplica o schema.sql convertendo antes o que for de antes do
+    particionamento (sem commit). Num banco novo ou já convertido é só o
+    schema.sql. Retorna ({tabela: linhas copiadas}, comentarios convertidos?).
+    """
+    antigas = [tabela for tabela in TABELAS_PARTICIONADAS if _tipo_tabela(cur, tabela) == 'r']
+    for tabela in antigas:
+        _renomear_antiga(cur, tabela)
+    executar_schema(cur)
+    comentarios = _converter_comentarios(cur)
+    copiadas = {}
+    for tabela in antigas:
+        copiadas[tabela] = _copiar_antiga(cur, tabela)
+        if not manter_antigas:
+            cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(f'{tabela}_antiga')))
+    return copiadas, comentarios
+
+
+def relatar_migracao(copiadas, comentarios):
+    if comentarios:
+        click.echo("comentarios: metadados convertidos para inet/ids.")
+    for tabela, linhas in copiadas.items():
+        click.echo(f"{tabela}: {linhas} linha(s) copiadas para a tabela particionada.")
+
+
+@click.command('migrar-particoes')
+@click.option('--manter-antigas', is_flag=True, help='Não apaga as tabelas antigas (<tabela>_antiga) após a cópia.')
+@with_appcontext
+def migrar_particoes_command(manter_antigas):
+    """
+    Converte votos, testemunhas e comentarios_likes em tabelas particionadas
+    por mês e passa os metadados (IP, cidade, User-Agent) de todas as tabelas
+    de interação para inet/ids. Roda numa única transação e bloqueia as
+    tabelas durante a cópia: use numa janela de manutenção. Também aplica o
+    schema.sql; o 'flask init-db' faz o mesmo quando encontra tabelas antigas.
+    """
+    conn = get_pool().getconn()
+    try:
+        cur = conn.cursor()
+        copiadas, comentarios = migrar(cur, manter_antigas)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        get_pool().putconn(conn)
+    relatar_migracao(copiadas, comentarios)
+    if not copiadas:
+        click.echo("As tabelas de interação já são particionadas.")
+
+
+@click.command('criar-particoes')
+@click.option('--meses', default=3, show_default=True, help='Quantos meses à frente devem ter partição.')
+@with_appcontext
+def criar_particoes_command(meses):
+    """Cria as partições mensais que faltam, do mês atual até --meses à frente."""
+    conn = get_pool().getconn()
+    try:
+        cur = conn.cursor()
+        for tabela in TABELAS_PARTICIONADAS:
+            if _tipo_tabela(cur, tabela) != 'p':
+                click.echo(f"{tabela}: ainda não é particionada; rode 'flask migrar-particoes'.")
+                continue
+            cur.execute('SELECT criar_particoes_mensais(%s, %s)', (tabela, meses))
+            criadas = cur.fetchone()[0]
+            cur.execute(sql.SQL('SELECT COUNT(*) FROM {}').format(sql.Identifier(f'{tabela}_padrao')))
+            na_padrao = cur.fetchone()[0]
+            click.echo(f"{tabela}: {criadas} partição(ões) criada(s).")
+            if na_padrao:
+                click.echo(f"  Aviso: {na_padrao} linha(s) na partição padrão (fora de qualquer mês criado).")
+        conn.commit()
+        cur.close()
+    finally:
+        get_pool().putconn(conn)
+
+
+def particoes_antigas(cur, tabela, meses):
+    """Partições mensais de 'tabela' cujo mês terminou antes do início da janela de retenção."""
+    hoje = date.today()
+    total = hoje.year * 12 + hoje.month - 1 - meses
+    limite = date(total // 12, total % 12 + 1, 1)
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    """, (tabela,))
+    padrao = re.compile(rf'^{re.escape(tabela)}_(\d{{4}})_(\d{{2}})$')
+    antigas = []
+    for (nome,) in cur.fetchall():
+        encontrado = padrao.match(nome)
+        if encontrado and date(int(encontrado[1]), int(encontrado[2]), 1) < limite:
+            antigas.append(nome)
+    return antigas
+
+
+def arquivar_particao(cur, tabela, particao, destino):
+    """Grava a partição em <destino>/<particao>.csv.gz; retorna o caminho do arquivo."""
+    colunas = TABELAS_PARTICIONADAS[tabela]
+    consulta = sql.SQL("""
+        SELECT {colunas}, p.ip_address, ci.nome AS city, ua.texto AS user_agent
+        FROM {particao} p
+        LEFT JOIN cities ci ON ci.id = p.city_id
+        LEFT JOIN user_agents ua ON ua.id = p.user_agent_id
+        ORDER BY p.criado_em, p.id
+    """).format(
+        colunas=sql.SQL(', ').join(sql.Identifier('p', c) for c in colunas),
+        particao=sql.Identifier(particao),
+    )
+    caminho = os.path.join(destino, f'{particao}.csv.gz')
+    parcial = caminho + '.parcial'
+    with gzip.open(parcial, 'wb') as arquivo:
+        copy_sql = sql.SQL('COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)').format(consulta)
+        cur.copy_expert(copy_sql.as_string(cur), arquivo)
+    # Só aparece com o nome final depois de escrito por inteiro
+    os.replace(parcial, caminho)
+    return caminho
+
+
+@click.command('arquivar-particoes')
+@click.option('--meses', default=12, show_default=True, help='Meses completos mantidos no banco, além do atual.')
+@click.option('--destino', help='Pasta dos arquivos CSV gzip (padrão: instance/arquivo).')
+@click.option('--manter', is_flag=True, help='Só desanexa as partições arquivadas, sem apagá-las.')
+@click.option('--simular', is_flag=True, help='Lista as partições que seriam arquivadas, sem alterar nada.')
+@with_appcontext
+def arquivar_particoes_command(meses, destino, manter, simular):
+    """Arquiva (CSV gzip), desanexa e apaga as partições de interação mais antigas que a retenção."""
+    destino = destino or os.path.join(current_app.instance_path, 'arquivo')
+    if not simular:
+        os.makedirs(destino, exist_ok=True)
+    conn = get_pool().getconn()
+    try:
+        cur = conn.cursor()
+        for tabela in TABELAS_PARTICIONADAS:
+            for particao in particoes_antigas(cur, tabela, meses):
+                if simular:
+                    click.echo(f"{particao}: seria arquivada.")
+                    continue
+                # O arquivo é escrito antes de qualquer alteração: se falhar, a partição continua anexada
+                caminho = arquivar_particao(cur, tabela, particao, destino)
+                cur.execute(sql.SQL('ALTER TABLE {} DETACH PARTITION {}').format(
+                    sql.Identifier(tabela), sql.Identifier(particao)))
+                if not manter:
+                    cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(particao)))
+                conn.commit()
+                click.echo(f"{particao}: arquivada em {caminho}" + (" (desanexada)." if manter else " e removida."))
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        get_pool().putconn(conn)
+
+
+def init_app(app):
+    """Registra os comandos de manutenção das partições no CLI do Flask."""
+    app.cli.add_command(migrar_particoes_command)
+    app.cli.add_command(criar_particoes_command)
+    app.cli.add_command(arquivar_particoes_command)
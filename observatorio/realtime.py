@@ -0,0 +1,174 @@
+# observatorio/realtime.py
+
+import json
+import os
+import queue
+import select
+import time
+from collections import defaultdict
+from threading import Lock, Thread
+
+import psycopg2
+import psycopg2.extensions
+from flask import current_app
+
+# Fila de cada assinante SSE: se um cliente lento acumular mais eventos que
+# isso, os mais antigos são descartados (só o contador mais recente importa).
+TAMANHO_FILA_ASSINANTE = 32
+
+
+def canal_relato(relato_id):
+    return f"relato_{int(relato_id)}"
+
+
+def notify_relato(cur, relato_id, payload):
+    """
+    Emite 'NOTIFY relato_<id>' com os novos contadores. Deve ser chamado
+    dentro da transação da escrita: o Postgres só entrega a notificação no
+    commit (e a descarta num rollback).
+    """
+    cur.execute('SELECT pg_notify(%s, %s)', (canal_relato(relato_id), json.dumps(payload)))
+
+
+class Difusor:
+    """
+    Mantém UMA conexão dedicada com 'LISTEN' por processo e distribui os
+    eventos em memória para qualquer número de assinantes (streams SSE).
+
+    Os canais são assinados sob demanda: 'LISTEN relato_<id>' quando entra o
+    primeiro espectador daquele relato e 'UNLISTEN' quando sai o último.
+    Todos os comandos rodam na thread do listener; as outras threads só
+    enfileiram o pedido e acordam o select() por um pipe.
+    """
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.assinantes = defaultdict(set)  # relato_id -> {callback, ...}
+        self.lock = Lock()
+        self.comandos = queue.Queue()
+        self.thread = None
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+
+    def assinar(self, relato_id, callback):
+        """Registra um callback que recebe o payload (str JSON) de cada evento do relato."""
+        with self.lock:
+            primeiro = not self.assinantes[relato_id]
+            self.assinantes[relato_id].add(callback)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._loop, name='difusor-listen', daemon=True)
+                self.thread.start()
+        if primeiro:
+            self._enfileirar('LISTEN', relato_id)
+
+    def cancelar(self, relato_id, callback):
+        with self.lock:
+            self.assinantes[relato_id].discard(callback)
+            ultimo = not self.assinantes[relato_id]
+            if ultimo:
+                del self.assinantes[relato_id]
+        if ultimo:
+            self._enfileirar('UNLISTEN', relato_id)
+
+    def assinar_fila(self, relato_id):
+        """Atalho para views síncronas: retorna uma queue.Queue alimentada com os eventos do relato."""
+        fila = queue.Queue(maxsize=TAMANHO_FILA_ASSINANTE)
+
+        def entregar(payload):
+            try:
+                fila.put_nowait(payload)
+            except queue.Full:
+                try:
+                    fila.get_nowait()
+                except queue.Empty:
+                    pass
+                fila.put_nowait(payload)
+
+        fila.callback = entregar
+        self.assinar(relato_id, entregar)
+        return fila
+
+    def _enfileirar(self, comando, relato_id):
+        self.comandos.put((comando, relato_id))
+        os.write(self._wake_w, b'x')
+
+    def _conectar(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        # Reassina os canais de quem já estava assistindo (reconexão)
+        with self.lock:
+            canais = [canal_relato(relato_id) for relato_id in self.assinantes]
+        cur = conn.cursor()
+        for canal in canais:
+            cur.execute(f'LISTEN {canal}')
+        cur.close()
+        return conn
+
+    def _processar_comandos(self, conn):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        cur = conn.cursor()
+        while True:
+            try:
+                comando, relato_id = self.comandos.get_nowait()
+            except queue.Empty:
+                break
+            cur.execute(f'{comando} {canal_relato(relato_id)}')
+        cur.close()
+
+    def _despachar(self, notificacao):
+        try:
+            relato_id = int(notificacao.channel.rsplit('_', 1)[1])
+        except (IndexError, ValueError):
+            return
+        with self.lock:
+            callbacks = list(self.assinantes.get(relato_id, ()))
+        for callback in callbacks:
+            try:
+                callback(notificacao.payload)
+            except Exception as e:
+                print(f"Difusor: falha ao entregar evento de {notificacao.channel}: {e}")
+
+    def _loop(self):
+        espera = 1
+        while True:
+            conn = None
+            try:
+                conn = self._conectar()
+                espera = 1
+                while True:
+                    self._processar_comandos(conn)
+                    prontos, _, _ = select.select([conn, self._wake_r], [], [], 30)
+                    if conn in prontos:
+                        conn.poll()
+                        while conn.notifies:
+                            self._despachar(conn.notifies.pop(0))
+            except Exception as e:
+                print(f"Difusor: conexão LISTEN perdida ({e}); reconectando em {espera}s.")
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+_difusor = None
+_difusor_lock = Lock()
+
+
+def get_difusor(dsn=None):
+    """Retorna o difusor deste processo (um só LISTEN por processo), criando-o no primeiro uso."""
+    global _difusor
+    if _difusor is None:
+        with _difusor_lock:
+            if _difusor is None:
+                config = current_app.config
+                _difusor = Difusor(dsn or config.get('DATABASE_LISTEN_URL') or config['DATABASE_URL'])
+    return _difusor
+
+
+def formatar_sse(payload):
+    return f"data: {payload}\n\n"
@@ -1,97 +1,182 @@
 # observatorio/routes_admin.py
 
-from flask import render_template, request, flash, current_app, url_for
-from collections import defaultdict
-import cloudinary.uploader
+from flask import render_template, request, flash, current_app, url_for, Response, stream_with_context
 import psycopg2.extras
 from threading import Thread
-from .db import get_db
-from .utils import auth_required, safe_redirect,send_approval_notification
+from .db import get_db, iterar_linhas
+from .utils import auth_required, safe_redirect,send_approval_notification, render_streaming
+from .storage import (
+    get_storage, StorageError, PASTA_LENDAS, sha256_arquivo,
+    buscar_media, registrar_media, referenciar_media, liberar_media, remover_midias,
+)
 from .forms import AdminActionForm, LendaForm
+from .export import gerar_exportacao, nome_arquivo, ExportError, FORMATOS
+from .admissao import sem_admissao
+from .budgets import budget
+from . import metricas
+from .estatisticas import marcar_comentario, marcar_relato
+from .locais import registro_atual
+from .similaridade import listar_grupos, separar, TIPOS
 
 def register_admin_routes(app):
     """Registra todas as rotas de admin na instância principal do Flask."""
 
-    def delete_cloudinary_midia(url, resource_type='image'):
-        """Deleta uma midia do Cloudinary dado seu URL completo."""
-        if not url: return
-        try:
-            public_id = '/'.join(url.split('/')[-2:]).split('.')[0]
-            if resource_type in ['video', 'audio']:
-                cloudinary.uploader.destroy(public_id, resource_type='video')
-            else:
-                cloudinary.uploader.destroy(public_id)
-        except Exception as e:
-            current_app.logger.error(f"Erro ao deletar midia do Cloudinary ({url}): {e}")
+    def salvar_imagem_lenda(cur, imagem_file):
+        """Envia a imagem de uma lenda, reaproveitando o objeto se o conteúdo já existe."""
+        sha256 = sha256_arquivo(imagem_file)
+        existente = buscar_media(cur, sha256, 'imagem')
+        if existente:
+            return existente
+        storage = get_storage()
+        return registrar_media(cur, storage, sha256, 'imagem', storage.salvar(imagem_file, PASTA_LENDAS))
 
     @app.route('/admin')
     @auth_required
     def admin():
         return safe_redirect('admin_relatos')
 
+    @app.route('/admin/metricas')
+    @sem_admissao
+    @auth_required
+    def admin_metricas():
+        """Métricas do processo (admissão, pool) no formato texto do Prometheus."""
+        return Response(metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/admin/relatos')
     @auth_required
+    @budget(ms=2000)
     def admin_relatos():
-        db = get_db()
-        cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
+        """
+        Fila de moderação em streaming: cada relato já vem com os comentários
+        (json_agg) de um cursor nomeado, e as linhas saem para o navegador à
+        medida que são buscadas, sem montar a lista inteira em memória.
+        """
         filtro_status = request.args.get('filtro', 'pendentes')
-        
+
+        condicoes = {
+            'pendentes': 'WHERE NOT r.aprovado',
+            'aprovados': 'WHERE r.aprovado',
+            'denunciados': 'WHERE EXISTS (SELECT 1 FROM comentarios d WHERE d.relato_id = r.id AND d.denunciado)',
+        }
+        ordem = 'r.aprovado ASC, r.id DESC' if filtro_status == 'todos' else 'r.id DESC'
         query = """
-            SELECT r.*, COUNT(c.id) as comment_count
+            SELECT r.*, c.comment_count, c.comentarios
             FROM relatos r
-            LEFT JOIN comentarios c ON r.id = c.relato_id
-        """
-        params = []
-
-        if filtro_status == 'pendentes':
-            query += ' WHERE r.aprovado = %s'
-            params.append(False)
-        elif filtro_status == 'aprovados':
-            query += ' WHERE r.aprovado = %s'
-            params.append(True)
-        elif filtro_status == 'denunciados':
-            cur.execute('SELECT DISTINCT relato_id FROM comentarios WHERE denunciado = TRUE')
-            denunciados_ids_rows = cur.fetchall()
-            denunciados_ids = [row['relato_id'] for row in denunciados_ids_rows]
-            if not denunciados_ids:
-                query += ' WHERE 1 = 0'
-            else:
-                placeholders = ', '.join(['%s'] * len(denunciados_ids))
-                query += f' WHERE r.id IN ({placeholders})'
-                params.extend(denunciados_ids)
-
-        query += ' GROUP BY r.id'
-
-        if filtro_status == 'todos':
-            query += ' ORDER BY r.aprovado ASC, r.id DESC'
-        else:
-            query += ' ORDER BY r.id DESC'
-
-        cur.execute(query, tuple(params))
-        relatos_filtrados = cur.fetchall()
-
-        # Esta busca de comentários agora é usada principalmente para a seção de denunciados
-        cur.execute('SELECT * FROM comentarios ORDER BY criado_em DESC')
-        todos_comentarios = cur.fetchall()
-
+            LEFT JOIN LATERAL (
+                SELECT COUNT(*) AS comment_count,
+                       COALESCE(json_agg(json_build_object(
+                           'id', cm.id, 'autor', cm.autor, 'texto', cm.texto,
+                           'denunciado', cm.denunciado, 'ip_address', host(cm.ip_address),
+                           'city', ci.nome
+                       ) ORDER BY cm.criado_em DESC), '[]') AS comentarios
+                FROM comentarios cm
+                LEFT JOIN cities ci ON ci.id = cm.city_id
+                WHERE cm.relato_id = r.id
+            ) c ON TRUE
+            {where}
+            ORDER BY {ordem}
+        """.format(where=condicoes.get(filtro_status, ''), ordem=ordem)
+
+        cur = get_db().cursor()
         cur.execute('SELECT COUNT(id) FROM comentarios WHERE denunciado = TRUE')
         denuncias_count = cur.fetchone()[0]
-
         cur.close()
 
-        comentarios_por_relato = defaultdict(list)
-        for comentario in todos_comentarios:
-            comentarios_por_relato[comentario['relato_id']].append(dict(comentario))
-
         action_form = AdminActionForm()
 
-        return render_template('admin.html',
-                               relatos=relatos_filtrados,
-                               filtro_ativo=filtro_status,
-                               comentarios=comentarios_por_relato,
-                               denuncias_count=denuncias_count,
-                               action_form=action_form)
+        return render_streaming('admin.html',
+                                relatos=iterar_linhas('admin_relatos', query),
+                                filtro_ativo=filtro_status,
+                                denuncias_count=denuncias_count,
+                                action_form=action_form)
+
+    @app.route('/admin/export/<string:tabela>')
+    @auth_required
+    def admin_export(tabela):
+        """
+        Exporta relatos ou interações em streaming (CSV via COPY, NDJSON via cursor nomeado).
+        Filtros: ?formato=csv|ndjson&de=AAAA-MM-DD&ate=AAAA-MM-DD&status=...&local=...&gzip=1
+        """
+        formato = request.args.get('formato', 'csv')
+        usar_gzip = request.args.get('gzip', '').lower() in ['1', 'true', 'sim']
+        try:
+            chunks = gerar_exportacao(
+                tabela, formato,
+                de=request.args.get('de'),
+                ate=request.args.get('ate'),
+                status=request.args.get('status'),
+                local=request.args.get('local'),
+                gzip=usar_gzip,
+            )
+        except ExportError as e:
+            return Response(str(e), 400, mimetype='text/plain')
+
+        headers = {
+            'Content-Disposition': f'attachment; filename="{nome_arquivo(tabela, formato, usar_gzip)}"',
+            'X-Accel-Buffering': 'no',
+        }
+        mimetype = 'application/gzip' if usar_gzip else FORMATOS[formato]
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+    def aprovar_relato(cur, relato_id):
+        """Aprova o relato (sem commit) e retorna título e e-mail do autor para a notificação."""
+        marcar_relato(cur, relato_id, current_app.config['ESTATISTICAS_FUSO'])
+        cur.execute('UPDATE relatos SET aprovado = TRUE WHERE id = %s', (relato_id,))
+        cur.execute("""
+            SELECT r.titulo, u.email
+            FROM relatos r
+            LEFT JOIN users u ON r.user_id = u.id
+            WHERE r.id = %s
+        """, (relato_id,))
+        return cur.fetchone()
+
+    def notificar_aprovacao(relato_id, relato_info):
+        # --- CÓDIGO PARA ENVIAR E-MAIL AO USUÁRIO ---
+        # Verifica se o relato foi encontrado e se tem um e-mail de usuário associado
+        if relato_info and relato_info['email']:
+            try:
+                # Gera a URL completa para o relato
+                relato_url = url_for('relato', relato_id=relato_id, _external=True)
+
+                # Prepara os dados para a função de e-mail
+                email_data = {
+                    'titulo': relato_info['titulo'],
+                    'relato_url': relato_url
+                }
+                
+                app_context = current_app._get_current_object()
+                
+                # Inicia a thread para enviar o e-mail em segundo plano
+                email_thread = Thread(
+                    target=send_approval_notification,
+                    args=(app_context, relato_info['email'], email_data)
+                )
+                email_thread.start()
+            except Exception as e:
+                current_app.logger.error(f"Erro ao iniciar a thread de e-mail de aprovação: {e}")
+
+    def excluir_relato(cur, relato_id):
+        """
+        Exclui o relato (sem commit), liberando as mídias dele. Retorna as
+        mídias a remover do backend com remover_midias() após o commit.
+        """
+        cur.execute('SELECT imagem_url, imagem_key, audio_url, audio_key FROM relatos WHERE id = %s', (relato_id,))
+        midia = cur.fetchone()
+        pendentes = []
+        if midia:
+            # Mídias compartilhadas (mesmo conteúdo) só saem do backend na última referência
+            pendentes.append(liberar_media(cur, midia['imagem_key'], midia['imagem_url'], tipo='imagem'))
+            pendentes.append(liberar_media(cur, midia['audio_key'], midia['audio_url'], tipo='audio'))
+
+        marcar_relato(cur, relato_id, current_app.config['ESTATISTICAS_FUSO'])
+        cur.execute('DELETE FROM relatos WHERE id = %s', (relato_id,))
+        return pendentes
+
+    def excluir_comentario(cur, comment_id):
+        """Exclui o comentário (sem commit); retorna False se ele não existe."""
+        marcar_comentario(cur, comment_id, current_app.config['ESTATISTICAS_FUSO'])
+        cur.execute('DELETE FROM comentarios WHERE id = %s', (comment_id,))
+        return cur.rowcount > 0
 
     @app.route('/admin/approve/<int:relato_id>', methods=['POST'])
     @auth_required
@@ -100,42 +185,10 @@ def register_admin_routes(app):
         if form.validate_on_submit():
             db = get_db()
             cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute('UPDATE relatos SET aprovado = TRUE WHERE id = %s', (relato_id,))
-            cur.execute("""
-                SELECT r.titulo, u.email
-                FROM relatos r
-                LEFT JOIN users u ON r.user_id = u.id
-                WHERE r.id = %s
-            """, (relato_id,))
-            relato_info = cur.fetchone()
-
+            relato_info = aprovar_relato(cur, relato_id)
             db.commit()
             cur.close()
-
-            # --- CÓDIGO PARA ENVIAR E-MAIL AO USUÁRIO ---
-            # Verifica se o relato foi encontrado e se tem um e-mail de usuário associado
-            if relato_info and relato_info['email']:
-                try:
-                    # Gera a URL completa para o relato
-                    relato_url = url_for('relato', relato_id=relato_id, _external=True)
-
-                    # Prepara os dados para a função de e-mail
-                    email_data = {
-                        'titulo': relato_info['titulo'],
-                        'relato_url': relato_url
-                    }
-                    
-                    app_context = current_app._get_current_object()
-                    
-                    # Inicia a thread para enviar o e-mail em segundo plano
-                    email_thread = Thread(
-                        target=send_approval_notification,
-                        args=(app_context, relato_info['email'], email_data)
-                    )
-                    email_thread.start()
-                except Exception as e:
-                    current_app.logger.error(f"Erro ao iniciar a thread de e-mail de aprovação: {e}")
-
+            notificar_aprovacao(relato_id, relato_info)
             flash(f'Relato #{relato_id} foi aprovado com sucesso!')
         else:
             flash('Erro de validação ao aprovar o relato.')
@@ -148,15 +201,10 @@ def register_admin_routes(app):
         if form.validate_on_submit():
             db = get_db()
             cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute('SELECT imagem_url, audio_url FROM relatos WHERE id = %s', (relato_id,))
-            midia = cur.fetchone()
-            if midia:
-                delete_cloudinary_midia(midia['imagem_url'], resource_type='image')
-                delete_cloudinary_midia(midia['audio_url'], resource_type='audio')
-
-            cur.execute('DELETE FROM relatos WHERE id = %s', (relato_id,))
+            pendentes = excluir_relato(cur, relato_id)
             db.commit()
             cur.close()
+            remover_midias(get_storage(), pendentes)
             flash(f'Relato #{relato_id} e seus dados associados foram excluídos!')
         else:
             flash('Erro de validação ao deletar o relato.')
@@ -170,9 +218,9 @@ def register_admin_routes(app):
         if form.validate_on_submit():
             db = get_db()
             cur = db.cursor()
-            cur.execute('DELETE FROM comentarios WHERE id = %s', (comment_id,))
+            excluido = excluir_comentario(cur, comment_id)
             db.commit()
-            if cur.rowcount > 0:
+            if excluido:
                 flash(f'Comentário #{comment_id} foi excluído com sucesso!')
             else:
                 flash('Comentário não encontrado.')
@@ -199,6 +247,64 @@ def register_admin_routes(app):
             flash('Erro de validação ao remover denúncia.')
         return safe_redirect('admin_relatos', filtro='denunciados')
 
+    @app.route('/admin/duplicados')
+    @auth_required
+    @budget(ms=2000)
+    def admin_duplicados():
+        """
+        Grupos de quase-duplicatas (similaridade.py): relatos com alguma cópia
+        pendente e comentários copiados, cada grupo com a raiz (o texto mais
+        antigo) primeiro, para aprovar ou excluir em lote.
+        """
+        cur = get_db().cursor(cursor_factory=psycopg2.extras.DictCursor)
+        grupos_relatos = listar_grupos(cur, 'relato', somente_pendentes=True)
+        grupos_comentarios = listar_grupos(cur, 'comentario')
+        cur.close()
+        return render_template('admin_duplicados.html',
+                               grupos_relatos=grupos_relatos,
+                               grupos_comentarios=grupos_comentarios,
+                               action_form=AdminActionForm())
+
+    @app.route('/admin/duplicados/<string:tipo>', methods=['POST'])
+    @auth_required
+    def moderar_duplicados(tipo):
+        """
+        Ação em lote sobre os itens marcados de um grupo: 'excluir', 'aprovar'
+        (só relatos) ou 'separar' (falso positivo: tira os itens do grupo).
+        """
+        form = AdminActionForm()
+        acao = request.form.get('acao')
+        ids = request.form.getlist('ids', type=int)
+        if tipo not in TIPOS or acao not in ('excluir', 'aprovar', 'separar') or (tipo == 'comentario' and acao == 'aprovar'):
+            flash('Ação inválida.')
+        elif not form.validate_on_submit():
+            flash('Erro de validação na ação em lote.')
+        elif not ids:
+            flash('Nenhum item marcado.')
+        else:
+            db = get_db()
+            cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            aprovados, pendentes = [], []
+            if acao == 'separar':
+                separar(cur, tipo, ids)
+            else:
+                for item_id in ids:
+                    if tipo == 'comentario':
+                        excluir_comentario(cur, item_id)
+                    elif acao == 'excluir':
+                        pendentes.extend(excluir_relato(cur, item_id))
+                    else:
+                        aprovados.append((item_id, aprovar_relato(cur, item_id)))
+            db.commit()
+            cur.close()
+            remover_midias(get_storage(), pendentes)
+            for relato_id, relato_info in aprovados:
+                notificar_aprovacao(relato_id, relato_info)
+            rotulo = 'relato(s)' if tipo == 'relato' else 'comentário(s)'
+            verbo = {'excluir': 'excluído(s)', 'aprovar': 'aprovado(s)', 'separar': 'separado(s) do grupo'}[acao]
+            flash(f'{len(ids)} {rotulo} {verbo}.')
+        return safe_redirect('admin_duplicados')
+
     @app.route('/admin/lendas')
     @auth_required
     def admin_lendas():
@@ -214,8 +320,7 @@ def register_admin_routes(app):
     @auth_required
     def add_lenda():
         form = LendaForm()
-        locais_choices = sorted(current_app.config['LOCAIS_UEM'].keys())
-        form.local.choices = [(l, l) for l in locais_choices]
+        form.local.choices = registro_atual().choices
 
         if form.validate_on_submit():
             titulo = form.titulo.data
@@ -223,19 +328,25 @@ def register_admin_routes(app):
             local = form.local.data
             imagem_file = form.imagem.data
             imagem_url = None
+            imagem_key = None
 
+            db = get_db()
+            cur = db.cursor()
+            antiga = None
             if imagem_file:
                 try:
-                    upload_result = cloudinary.uploader.upload(imagem_file, folder="observatorio_uem_lendas")
-                    imagem_url = upload_result.get('secure_url')
-                except Exception as e:
+                    imagem_key, imagem_url = salvar_imagem_lenda(cur, imagem_file)
+                    db.commit()
+                except StorageError as e:
+                    db.rollback()
+                    cur.close()
                     flash(f'Erro no upload da imagem: {e}')
                     return render_template('admin_lenda_form.html', form=form, title="Adicionar Nova Lenda")
 
-            db = get_db()
-            cur = db.cursor()
-            cur.execute('INSERT INTO lendas (titulo, descricao, local, imagem_url) VALUES (%s, %s, %s, %s)',
-                       (titulo, descricao, local, imagem_url))
+            if imagem_key:
+                referenciar_media(cur, imagem_key)
+            cur.execute('INSERT INTO lendas (titulo, descricao, local, imagem_url, imagem_key) VALUES (%s, %s, %s, %s, %s)',
+                       (titulo, descricao, local, imagem_url, imagem_key))
             db.commit()
             cur.close()
             flash('Nova lenda adicionada com sucesso!')
@@ -256,8 +367,7 @@ def register_admin_routes(app):
             return safe_redirect('admin_lendas')
 
         form = LendaForm(obj=lenda)
-        locais_choices = sorted(current_app.config['LOCAIS_UEM'].keys())
-        form.local.choices = [(l, l) for l in locais_choices]
+        form.local.choices = registro_atual().choices
 
         if form.validate_on_submit():
             titulo = form.titulo.data
@@ -265,23 +375,30 @@ def register_admin_routes(app):
             local = form.local.data
             imagem_file = form.imagem.data
             imagem_url = lenda['imagem_url']
+            imagem_key = lenda['imagem_key']
 
+            db_conn = get_db()
+            cur_conn = db_conn.cursor()
+            antiga = None
             if imagem_file:
                 try:
-                    upload_result = cloudinary.uploader.upload(imagem_file, folder="observatorio_uem_lendas")
-                    imagem_url = upload_result.get('secure_url')
-                    # Deleta imagem antiga se uma nova foi enviada com sucesso
-                    delete_cloudinary_midia(lenda['imagem_url'])
-                except Exception as e:
+                    imagem_key, imagem_url = salvar_imagem_lenda(cur_conn, imagem_file)
+                    db_conn.commit()
+                except StorageError as e:
+                    db_conn.rollback()
+                    cur_conn.close()
                     flash(f'Erro no upload da nova imagem: {e}')
                     return render_template('admin_lenda_form.html', form=form, title=f"Editar Lenda #{lenda['id']}")
+                if imagem_key != lenda['imagem_key']:
+                    referenciar_media(cur_conn, imagem_key)
+                    # Libera a imagem antiga se uma nova foi enviada com sucesso
+                    antiga = liberar_media(cur_conn, lenda['imagem_key'], lenda['imagem_url'])
 
-            db_conn = get_db()
-            cur_conn = db_conn.cursor()
-            cur_conn.execute('UPDATE lendas SET titulo = %s, descricao = %s, local = %s, imagem_url = %s WHERE id = %s',
-                       (titulo, descricao, local, imagem_url, lenda_id))
+            cur_conn.execute('UPDATE lendas SET titulo = %s, descricao = %s, local = %s, imagem_url = %s, imagem_key = %s WHERE id = %s',
+                       (titulo, descricao, local, imagem_url, imagem_key, lenda_id))
             db_conn.commit()
             cur_conn.close()
+            remover_midias(get_storage(), [antiga])
             flash(f'Lenda #{lenda_id} atualizada com sucesso!')
             return safe_redirect('admin_lendas')
 
@@ -294,12 +411,13 @@ def register_admin_routes(app):
         if form.validate_on_submit():
             db = get_db()
             cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute('SELECT imagem_url FROM lendas WHERE id = %s', (lenda_id,))
+            cur.execute('SELECT imagem_url, imagem_key FROM lendas WHERE id = %s', (lenda_id,))
             lenda = cur.fetchone()
             if lenda:
-                delete_cloudinary_midia(lenda['imagem_url'])
+                antiga = liberar_media(cur, lenda['imagem_key'], lenda['imagem_url'])
                 cur.execute('DELETE FROM lendas WHERE id = %s', (lenda_id,))
                 db.commit()
+                remover_midias(get_storage(), [antiga])
                 flash(f'Lenda #{lenda_id} foi excluída com sucesso!')
             else:
                 flash("Lenda não encontrada.")
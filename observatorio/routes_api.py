@@ -0,0 +1,461 @@
+# observatorio/routes_api.py
+
+import base64
+import binascii
+import json
+from datetime import date, datetime, timedelta
+
+import psycopg2.extras
+from flask import current_app, jsonify, request, url_for
+
+from .budgets import budget
+from .db import get_db, read_only
+from .imagens import variant_url
+from .locais import registro_atual
+
+LIMITE_PADRAO = 20
+LIMITE_MAXIMO = 100
+# Quantos valores de categoria/local um filtro aceita
+MAX_VALORES_FILTRO = 20
+
+# Ordenações da listagem: colunas da chave do cursor, na ordem do ORDER BY
+# (todas DESC). Cada uma tem o índice parcial correspondente no schema.sql.
+ORDENACOES = {
+    'recentes': ('criado_em', 'id'),
+    'acredito': ('votos_acredito', 'id'),
+}
+# Listas do perfil de um investigador (índices por user_id no schema.sql)
+LISTAS_USUARIO = {
+    'relatos_usuario': ('criado_em', 'id'),
+    'comentarios_usuario': ('criado_em', 'id'),
+}
+# Colunas da chave de cada tipo de cursor; o tipo vai dentro do cursor
+# para que um cursor não seja aceito em outra listagem
+CHAVES_CURSOR = {**ORDENACOES, **LISTAS_USUARIO}
+# Tamanho do trecho do comentário mostrado nas listas do perfil
+TRECHO_COMENTARIO = 80
+
+# Métricas de /api/stats sobre as colunas de estatisticas_diarias (só relatos aprovados são públicos)
+METRICAS_STATS = {
+    'relatos': 'relatos_aprovados',
+    'votos': 'votos_acredito + votos_cetico',
+    'acredito': 'votos_acredito',
+    'cetico': 'votos_cetico',
+    'testemunhas': 'testemunhas',
+    'comentarios': 'comentarios',
+}
+# Agrupamento da série temporal: argumento do date_trunc
+INTERVALOS_STATS = {'dia': 'day', 'semana': 'week', 'mes': 'month'}
+DIAS_STATS_PADRAO = 90
+MAX_PONTOS_STATS = 1000
+# Máximo de locais em /api/locais/proximos
+MAX_PROXIMOS = 10
+
+
+class ApiError(Exception):
+    """Parâmetro inválido na API: vira um 400 com a mensagem em JSON."""
+
+
+def valores_lista(args, nome):
+    """Aceita '?nome=a&nome=b' e '?nome=a,b'; remove vazios e repetidos."""
+    valores = []
+    for item in args.getlist(nome):
+        for valor in item.split(','):
+            valor = valor.strip()
+            if valor and valor not in valores:
+                valores.append(valor)
+    if len(valores) > MAX_VALORES_FILTRO:
+        raise ApiError(f"No máximo {MAX_VALORES_FILTRO} valores em '{nome}'.")
+    return valores
+
+
+def ler_datas(args):
+    """Lê 'desde' e 'ate' (AAAA-MM-DD, ambos inclusivos); cada um pode ser None."""
+    try:
+        desde = date.fromisoformat(args['desde']) if args.get('desde') else None
+        ate = date.fromisoformat(args['ate']) if args.get('ate') else None
+    except ValueError:
+        raise ApiError("Datas devem estar no formato AAAA-MM-DD.")
+    if desde and ate and desde > ate:
+        raise ApiError("'desde' não pode ser depois de 'ate'.")
+    return desde, ate
+
+
+def intervalo_datas(args):
+    """
+    Lê 'desde' e 'ate' (AAAA-MM-DD, ambos inclusivos) e o atalho antigo
+    'periodo=ultimo_mes'. Retorna (condições, params) sobre criado_em.
+    """
+    condicoes, params = [], []
+    desde, ate = ler_datas(args)
+    if desde:
+        condicoes.append('criado_em >= %s')
+        params.append(desde)
+    if ate:
+        condicoes.append('criado_em < %s')
+        params.append(ate + timedelta(days=1))
+    if args.get('periodo') == 'ultimo_mes':
+        condicoes.append("criado_em >= NOW() - INTERVAL '1 month'")
+    return condicoes, params
+
+
+def ler_limite(args):
+    try:
+        limite = int(args.get('limite', LIMITE_PADRAO))
+    except ValueError:
+        raise ApiError("'limite' deve ser um número.")
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+
+def codificar_cursor(ordem, linha):
+    chave = [linha[coluna] for coluna in CHAVES_CURSOR[ordem]]
+    chave = [v.isoformat() if isinstance(v, datetime) else v for v in chave]
+    texto = json.dumps([ordem] + chave, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, ordem):
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise ApiError("Cursor inválido.")
+    if not isinstance(dados, list) or len(dados) != len(CHAVES_CURSOR[ordem]) + 1 or dados[0] != ordem:
+        raise ApiError("Cursor inválido para esta ordenação.")
+    chave = dados[1:]
+    # Tipos conferidos aqui para um cursor adulterado não chegar ao banco como erro 500
+    try:
+        if CHAVES_CURSOR[ordem][0] == 'criado_em':
+            datetime.fromisoformat(chave[0])
+        else:
+            chave[0] = int(chave[0])
+        chave[-1] = int(chave[-1])
+    except (TypeError, ValueError):
+        raise ApiError("Cursor inválido.")
+    return chave
+
+
+def build_relatos_query(args, categorias_config):
+    """
+    Monta a consulta paginada da listagem de relatos aprovados. Retorna
+    (query, params, ordem, limite); a consulta busca limite + 1 linhas para
+    saber se há próxima página.
+    """
+    ordem = args.get('ordem', 'recentes')
+    if ordem not in ORDENACOES:
+        raise ApiError(f"'ordem' deve ser um de: {', '.join(ORDENACOES)}.")
+    limite = ler_limite(args)
+
+    condicoes, params = ['aprovado'], []
+
+    categorias = valores_lista(args, 'categoria')
+    desconhecidas = [c for c in categorias if c not in categorias_config]
+    if desconhecidas:
+        raise ApiError(f"Categoria desconhecida: {desconhecidas[0]}.")
+    if categorias:
+        condicoes.append('categoria = ANY(%s)')
+        params.append(categorias)
+
+    locais = valores_lista(args, 'local')
+    if locais:
+        condicoes.append('local = ANY(%s)')
+        params.append(locais)
+
+    condicoes_datas, params_datas = intervalo_datas(args)
+    condicoes.extend(condicoes_datas)
+    params.extend(params_datas)
+
+    colunas = ORDENACOES[ordem]
+    if args.get('cursor'):
+        chave = decodificar_cursor(args['cursor'], ordem)
+        # Comparação de linha: casa com o índice (col DESC, id DESC) e pula direto para a página
+        condicoes.append(f"({', '.join(colunas)}) < ({', '.join(['%s'] * len(colunas))})")
+        params.extend(chave)
+
+    query = """
+        SELECT id, titulo, local, categoria, criado_em, imagem_url,
+               votos_acredito, votos_cetico, votos_testemunha
+        FROM relatos
+        WHERE {condicoes}
+        ORDER BY {ordem}
+        LIMIT %s
+    """.format(condicoes=' AND '.join(condicoes), ordem=', '.join(f'{c} DESC' for c in colunas))
+    params.append(limite + 1)
+    return query, params, ordem, limite
+
+
+def _pagina(cur, query, params, lista, cursor, limite):
+    """Executa a consulta de uma lista do perfil (limite + 1 linhas); retorna (linhas, proximo)."""
+    chave = decodificar_cursor(cursor, lista) if cursor else None
+    cur.execute(query.format(depois_de='AND (criado_em, id) < (%s, %s)' if chave else ''),
+                (*params, *(chave or ()), limite + 1))
+    linhas = cur.fetchall()
+    proximo = codificar_cursor(lista, linhas[limite - 1]) if len(linhas) > limite else None
+    return [dict(linha) for linha in linhas[:limite]], proximo
+
+
+def listar_relatos_usuario(cur, user_id, cursor=None, limite=LIMITE_PADRAO):
+    """Página de relatos de um investigador, só com as colunas da lista. 'cur' deve ser um RealDictCursor."""
+    return _pagina(cur, """
+        SELECT id, titulo, aprovado, criado_em
+        FROM relatos
+        WHERE user_id = %s {depois_de}
+        ORDER BY criado_em DESC, id DESC
+        LIMIT %s
+    """, (user_id,), 'relatos_usuario', cursor, limite)
+
+
+def listar_comentarios_usuario(cur, user_id, cursor=None, limite=LIMITE_PADRAO):
+    """Página de comentários de um investigador: trecho do texto e título do relato."""
+    return _pagina(cur, """
+        SELECT c.id, c.relato_id, c.criado_em, r.titulo AS relato_titulo,
+               LEFT(c.texto, %s) AS trecho, LENGTH(c.texto) > %s AS truncado
+        FROM (
+            SELECT id, relato_id, criado_em, texto
+            FROM comentarios
+            WHERE user_id = %s {depois_de}
+            ORDER BY criado_em DESC, id DESC
+            LIMIT %s
+        ) c
+        JOIN relatos r ON r.id = c.relato_id
+        ORDER BY c.criado_em DESC, c.id DESC
+    """, (TRECHO_COMENTARIO, TRECHO_COMENTARIO, user_id), 'comentarios_usuario', cursor, limite)
+
+
+def resposta_paginada(nome, itens, proximo, endpoint, **valores):
+    """
+    JSON {nome: itens, 'proximo': cursor} com o link da página seguinte no
+    header 'Link' e ETag (If-None-Match devolve 304).
+    """
+    response = jsonify({nome: itens, 'proximo': proximo})
+    if proximo:
+        argumentos = request.args.to_dict(flat=False)
+        argumentos['cursor'] = proximo
+        response.headers['Link'] = f'<{url_for(endpoint, _external=True, **valores, **argumentos)}>; rel="next"'
+    # Sempre revalida; o ETag (hash do corpo) poupa a transferência quando nada mudou
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def _periodos(inicio, fim, intervalo):
+    """Início de cada período (dia, semana ou mês) entre as datas, para preencher a série com zeros."""
+    if intervalo == 'semana':
+        inicio -= timedelta(days=inicio.weekday())
+    elif intervalo == 'mes':
+        inicio = inicio.replace(day=1)
+    periodos = []
+    while inicio <= fim:
+        periodos.append(inicio)
+        if intervalo == 'dia':
+            inicio += timedelta(days=1)
+        elif intervalo == 'semana':
+            inicio += timedelta(days=7)
+        else:
+            inicio = (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return periodos
+
+
+def build_stats_query(args, categorias_config):
+    """
+    Monta a consulta de /api/stats sobre estatisticas_diarias. Retorna
+    (query, params, parametros_resolvidos).
+    """
+    tipo = args.get('tipo', 'serie')
+    if tipo not in ('serie', 'grade'):
+        raise ApiError("'tipo' deve ser 'serie' ou 'grade'.")
+    metrica = args.get('metrica', 'relatos')
+    if metrica not in METRICAS_STATS:
+        raise ApiError(f"'metrica' deve ser um de: {', '.join(METRICAS_STATS)}.")
+    intervalo = args.get('intervalo', 'dia')
+    if intervalo not in INTERVALOS_STATS:
+        raise ApiError(f"'intervalo' deve ser um de: {', '.join(INTERVALOS_STATS)}.")
+
+    desde, ate = ler_datas(args)
+    ate = ate or date.today()
+    desde = desde or ate - timedelta(days=DIAS_STATS_PADRAO - 1)
+    if tipo == 'serie' and len(_periodos(desde, ate, intervalo)) > MAX_PONTOS_STATS:
+        raise ApiError(f"No máximo {MAX_PONTOS_STATS} pontos por série; aumente o 'intervalo' ou encurte as datas.")
+
+    condicoes, params = ['dia >= %s', 'dia <= %s'], [desde, ate]
+    categorias = valores_lista(args, 'categoria')
+    desconhecidas = [c for c in categorias if c not in categorias_config]
+    if desconhecidas:
+        raise ApiError(f"Categoria desconhecida: {desconhecidas[0]}.")
+    if categorias:
+        condicoes.append('categoria = ANY(%s)')
+        params.append(categorias)
+    locais = valores_lista(args, 'local')
+    if locais:
+        condicoes.append('local = ANY(%s)')
+        params.append(locais)
+
+    expressao = METRICAS_STATS[metrica]
+    if tipo == 'serie':
+        query = """
+            SELECT date_trunc(%s, dia)::date AS periodo, SUM({expressao}) AS valor
+            FROM estatisticas_diarias
+            WHERE {condicoes}
+            GROUP BY periodo
+        """
+        params.insert(0, INTERVALOS_STATS[intervalo])
+    else:
+        query = """
+            SELECT local, categoria, SUM({expressao}) AS valor
+            FROM estatisticas_diarias
+            WHERE {condicoes}
+            GROUP BY local, categoria
+            HAVING SUM({expressao}) > 0
+        """
+    query = query.format(expressao=expressao, condicoes=' AND '.join(condicoes))
+    resolvidos = {'tipo': tipo, 'metrica': metrica, 'intervalo': intervalo, 'desde': desde, 'ate': ate}
+    return query, params, resolvidos
+
+
+def montar_grade(linhas, categorias_config, registro):
+    """
+    Matriz local x categoria para heatmap, com as coordenadas do local (como
+    no mapa). Textos livres que o registro reconhece somam no local conhecido.
+    """
+    por_local = {}
+    for local, categoria, valor in linhas:
+        local = registro.resolver(local) or local
+        if local not in por_local:
+            coords = registro.coordenadas_de(local)
+            por_local[local] = {'local': local, 'lat': coords[0], 'lon': coords[1],
+                                'total': 0, 'valores': [0] * len(categorias_config)}
+        celula = por_local[local]
+        if categoria in categorias_config:
+            celula['valores'][categorias_config.index(categoria)] += int(valor)
+        celula['total'] += int(valor)
+    return sorted(por_local.values(), key=lambda c: (-c['total'], c['local']))
+
+
+def ler_ponto(args):
+    """Lê 'lat', 'lon' e os opcionais 'k' (1 a MAX_PROXIMOS) e 'raio' (metros) de /api/locais/proximos."""
+    try:
+        lat, lon = float(args['lat']), float(args['lon'])
+        k = int(args.get('k', 1))
+        raio = float(args['raio']) if args.get('raio') else None
+    except (KeyError, ValueError):
+        raise ApiError("Informe 'lat' e 'lon' numéricos ('k' inteiro e 'raio' em metros são opcionais).")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (raio is not None and raio <= 0):
+        raise ApiError("Coordenadas ou raio fora do intervalo válido.")
+    return lat, lon, max(1, min(k, MAX_PROXIMOS)), raio
+
+
+def register_api_routes(app, limiter):
+    """Registra a API JSON pública (somente leitura)."""
+
+    @app.errorhandler(ApiError)
+    def api_error(e):
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    @app.route('/api/relatos')
+    @limiter.limit("120 per minute")
+    @read_only
+    @budget(ms=300)
+    def api_relatos():
+        """
+        Lista relatos aprovados com paginação por cursor (keyset).
+
+        Filtros: categoria e local (repetidos ou separados por vírgula),
+        desde/ate (AAAA-MM-DD), ordem=recentes|acredito, limite (até 100).
+        A resposta traz 'proximo' (cursor da página seguinte, ou null) e o
+        mesmo link no header 'Link'. Com ETag: If-None-Match devolve 304.
+        """
+        query, params, ordem, limite = build_relatos_query(request.args, current_app.config['CATEGORIAS'])
+
+        cur = get_db().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(query, tuple(params))
+        linhas = cur.fetchall()
+        cur.close()
+
+        proximo = codificar_cursor(ordem, linhas[limite - 1]) if len(linhas) > limite else None
+        relatos = []
+        for linha in linhas[:limite]:
+            relato = dict(linha)
+            relato['criado_em'] = relato['criado_em'].isoformat()
+            relato['imagem_thumb'] = variant_url(relato['imagem_url'], 'thumb')
+            relatos.append(relato)
+
+        return resposta_paginada('relatos', relatos, proximo, 'api_relatos')
+
+    @app.route('/api/users/<int:user_id>/relatos')
+    @limiter.limit("120 per minute")
+    @read_only
+    @budget(ms=300)
+    def api_user_relatos(user_id):
+        """Relatos de um investigador, do mais recente ao mais antigo (cursor e limite como em /api/relatos)."""
+        cur = get_db().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        relatos, proximo = listar_relatos_usuario(cur, user_id, request.args.get('cursor'), ler_limite(request.args))
+        cur.close()
+        for relato in relatos:
+            relato['criado_em'] = relato['criado_em'].isoformat()
+        return resposta_paginada('relatos', relatos, proximo, 'api_user_relatos', user_id=user_id)
+
+    @app.route('/api/users/<int:user_id>/comentarios')
+    @limiter.limit("120 per minute")
+    @read_only
+    @budget(ms=300)
+    def api_user_comentarios(user_id):
+        """Comentários de um investigador com o trecho inicial do texto e o título do relato."""
+        cur = get_db().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        comentarios, proximo = listar_comentarios_usuario(cur, user_id, request.args.get('cursor'),
+                                                          ler_limite(request.args))
+        cur.close()
+        for comentario in comentarios:
+            comentario['criado_em'] = comentario['criado_em'].isoformat()
+        return resposta_paginada('comentarios', comentarios, proximo, 'api_user_comentarios', user_id=user_id)
+
+    @app.route('/api/stats')
+    @limiter.limit("60 per minute")
+    @read_only
+    @budget(ms=300)
+    def api_stats():
+        """
+        Séries temporais e grades para heatmap, lidas só dos agregados diários
+        (estatisticas_diarias), nunca de relatos ou das tabelas de interação.
+
+        tipo=serie (padrão): [{periodo, valor}] por dia|semana|mes ('intervalo'),
+        com zeros nos períodos sem dados. tipo=grade: locais com coordenadas,
+        total e 'valores' na ordem de 'categorias'. Comuns: metrica
+        (relatos, votos, acredito, cetico, testemunhas, comentarios),
+        desde/ate (padrão: últimos 90 dias), categoria e local.
+        """
+        config = current_app.config
+        query, params, resolvidos = build_stats_query(request.args, config['CATEGORIAS'])
+        cur = get_db().cursor()
+        cur.execute(query, tuple(params))
+        linhas = cur.fetchall()
+        cur.close()
+
+        dados = dict(resolvidos, desde=resolvidos['desde'].isoformat(), ate=resolvidos['ate'].isoformat())
+        if resolvidos['tipo'] == 'serie':
+            valores = {periodo: int(valor) for periodo, valor in linhas}
+            dados['serie'] = [
+                {'periodo': periodo.isoformat(), 'valor': valores.get(periodo, 0)}
+                for periodo in _periodos(resolvidos['desde'], resolvidos['ate'], resolvidos['intervalo'])
+            ]
+        else:
+            dados['categorias'] = config['CATEGORIAS']
+            dados['locais'] = montar_grade(linhas, config['CATEGORIAS'], registro_atual())
+
+        response = jsonify(dados)
+        # Os agregados mudam no máximo a cada ESTATISTICAS_INTERVALO segundos
+        response.headers['Cache-Control'] = 'public, max-age=60'
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @app.route('/api/locais/proximos')
+    @limiter.limit("60 per minute")
+    def api_locais_proximos():
+        """
+        Locais conhecidos mais próximos de lat/lon (grade espacial do registro,
+        sem consulta ao banco): os 'k' primeiros, até 'raio' metros se dado.
+        """
+        lat, lon, k, raio = ler_ponto(request.args)
+        locais = [{'local': nome, 'lat': lat_local, 'lon': lon_local, 'distancia_m': round(distancia)}
+                  for nome, lat_local, lon_local, distancia in registro_atual().proximos(lat, lon, k, raio)]
+        response = jsonify({'success': True, 'locais': locais})
+        response.headers['Cache-Control'] = 'public, max-age=300'
+        return response
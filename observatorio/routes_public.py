@@ -1,50 +1,194 @@
 # observatorio/routes_public.py
 
 import uuid
+import json
 from flask import (
     render_template, request, url_for, flash, redirect, g,
-    jsonify, session, current_app
+    jsonify, session, current_app, Response
 )
 import traceback
+import psycopg2.errors
 import psycopg2.extras
-from authlib.integrations.flask_client import OAuth
 import os
-from .db import get_db
-from .utils import get_request_metadata, safe_redirect,get_city_from_ip,log_register, upload_audio_task, upload_image_task,send_new_relato_notification
+from flask_wtf.csrf import generate_csrf
+from .db import get_db, read_only, iterar_linhas, executar, estado_pool
+from .admissao import sem_admissao, pagina_guardada
+from .budgets import budget, prazo_restante
+from .utils import render_streaming, get_request_metadata, safe_redirect,get_city_from_ip,log_register, upload_audio_task, upload_image_task,send_new_relato_notification, load_oidc_metadata
 from .forms import SubmitForm, CommentForm, AdminActionForm
+from .realtime import get_difusor, notify_relato, formatar_sse
+from .imagens import variant_url
+from .storage import get_storage, sha256_arquivo, buscar_media, registrar_media, referenciar_media, ObjetoArmazenado
+from .uploads import consumir_upload, validar_midia, UploadError
+from .locais import registro_atual, OUTRO
+from .similaridade import classificar
+from .routes_api import intervalo_datas, ApiError, listar_relatos_usuario, listar_comentarios_usuario
+import queue
 import time 
-from threading import Thread
+from threading import Thread, BoundedSemaphore
+from . import metricas
+
+def build_map_query(args, categorias_config):
+    """
+    Monta a consulta do mapa (relatos aprovados agrupados por local) a partir
+    dos filtros da query string. Retorna (query, params) com placeholders '%s'.
+    """
+    conditions = ['aprovado = %s']
+    params = [True]
+    filter_category = args.get('categoria')
+    search_query = args.get('q', '').strip()
+
+    if filter_category and filter_category in categorias_config:
+        conditions.append('categoria = %s')
+        params.append(filter_category)
+    try:
+        date_conditions, date_params = intervalo_datas(args)
+    except ApiError:
+        # Datas inválidas no mapa: ignora o filtro em vez de quebrar a página
+        date_conditions, date_params = [], []
+    conditions.extend(date_conditions)
+    params.extend(date_params)
+    if search_query:
+        conditions.append('(LOWER(titulo) LIKE %s OR LOWER(descricao) LIKE %s)')
+        search_term = f"%{search_query.lower()}%"
+        params.extend([search_term, search_term])
+
+    query = """
+        SELECT 
+            local,
+            json_agg(
+                json_build_object(
+                    'id', id,
+                    'titulo', titulo,
+                    'local', local,
+                    'categoria', categoria,
+                    'criado_em', to_char(criado_em, 'DD/MM/YYYY'),
+                    'imagem_url', imagem_url
+                ) ORDER BY id DESC
+            ) as relatos_json
+        FROM relatos
+        WHERE {where_conditions}
+        GROUP BY local
+    """.format(where_conditions=' AND '.join(conditions))
+    return query, params
+
+def group_map_rows(locais_agrupados_db, registro):
+    """
+    Converte as linhas agrupadas por local no payload de marcadores usado
+    pelo map.js. Locais que o registro (locais.py) leva ao mesmo ponto, como
+    um texto livre que cita um local conhecido, dividem o mesmo marcador.
+    """
+    marcadores = {}
+    for local_agrupado in locais_agrupados_db:
+        relatos_json = local_agrupado['relatos_json']
+        if isinstance(relatos_json, str):
+            relatos_json = json.loads(relatos_json)
+
+        # O popup do mapa só precisa da miniatura, não da imagem em tamanho cheio
+        for relato in relatos_json:
+            relato['imagem_thumb'] = variant_url(relato.pop('imagem_url', None), 'thumb')
+
+        coords = registro.coordenadas_de(local_agrupado['local'])
+        if coords in marcadores:
+            marcador = marcadores[coords]
+            marcador['relatos'] = sorted(marcador['relatos'] + relatos_json, key=lambda r: r['id'], reverse=True)
+        else:
+            marcadores[coords] = {
+                "lat": coords[0],
+                "lon": coords[1],
+                "relatos": relatos_json  # Usamos o JSON diretamente do banco
+            }
+    return list(marcadores.values())
+
+def consultar_rankings(cur):
+    """Top 10 relatos por votos 'acredito' e top 10 locais por relatos aprovados."""
+    cur.execute("""
+        SELECT id, titulo, votos_acredito FROM relatos
+        WHERE aprovado = TRUE AND votos_acredito > 0
+        ORDER BY votos_acredito DESC, criado_em DESC LIMIT 10;
+    """)
+    top_relatos = cur.fetchall()
+    cur.execute("SELECT 1 FROM estatisticas_marcas WHERE tabela = 'relatos'")
+    if cur.fetchone() is None:
+        # Agregados nunca calculados (refresher parado, banco novo): direto de relatos
+        cur.execute("""
+            SELECT local, COUNT(*) as total_relatos FROM relatos WHERE aprovado = TRUE
+            GROUP BY local ORDER BY total_relatos DESC, local ASC LIMIT 10;
+        """)
+        return top_relatos, cur.fetchall()
+    # Contagem por local vem dos agregados diários (estatisticas.py), menos os
+    # dias que a moderação mudou desde a última atualização deles (aprovação e
+    # exclusão marcam o dia em estatisticas_pendentes, na mesma transação):
+    # esses são contados direto em relatos. Relatos novos entram pendentes de
+    # aprovação, então nada fica de fora até o próximo ciclo do refresher.
+    cur.execute("""
+        WITH contagens AS (
+            SELECT local, SUM(relatos_aprovados) AS total FROM estatisticas_diarias
+            WHERE dia NOT IN (SELECT dia FROM estatisticas_pendentes)
+            GROUP BY local
+            UNION ALL
+            SELECT r.local, COUNT(*) FROM estatisticas_pendentes p
+            JOIN relatos r ON r.criado_em >= p.dia::timestamp AT TIME ZONE %(fuso)s
+                          AND r.criado_em < (p.dia + 1)::timestamp AT TIME ZONE %(fuso)s
+            WHERE r.aprovado = TRUE
+            GROUP BY r.local
+        )
+        SELECT local, SUM(total) as total_relatos FROM contagens
+        GROUP BY local HAVING SUM(total) > 0
+        ORDER BY total_relatos DESC, local ASC LIMIT 10;
+    """, {'fuso': current_app.config['ESTATISTICAS_FUSO']})
+    top_locais = cur.fetchall()
+    return top_relatos, top_locais
 
 def register_public_routes(app, limiter):
     """Registra todas as rotas públicas na instância principal do Flask."""
 
-    oauth = OAuth(app)
-    google = oauth.register(
-        name='google',
-        client_id=app.config['GOOGLE_CLIENT_ID'],
-        client_secret=app.config['GOOGLE_CLIENT_SECRET'],
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-        client_kwargs={'scope': 'openid email profile'}
-    )
+    oauth_clients = {}
+    # Vagas de streams SSE deste processo (SSE_MAX_CONEXOES)
+    vagas_sse = BoundedSemaphore(max(1, app.config['SSE_MAX_CONEXOES']))
+
+    def get_google():
+        """
+        Cria o cliente OAuth do Google no primeiro login. O Authlib e os
+        metadados OpenID (em cache no disco) só são carregados aqui.
+        """
+        if 'google' not in oauth_clients:
+            from authlib.integrations.flask_client import OAuth
+            oauth = OAuth(app)
+            oauth_clients['google'] = oauth.register(
+                name='google',
+                client_id=app.config['GOOGLE_CLIENT_ID'],
+                client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+                client_kwargs={'scope': 'openid email profile'},
+                **load_oidc_metadata(app, 'https://accounts.google.com/.well-known/openid-configuration')
+            )
+        return oauth_clients['google']
 
     @app.before_request
     def load_logged_in_user():
-        user_id = session.get('user_id')
         g.user = None
+        # Estáticos não leem a sessão: sem consulta ao banco e sem 'Vary: Cookie',
+        # que impediria o cache compartilhado dos assets imutáveis (assets.py)
+        if request.endpoint == 'static':
+            return
+        user_id = session.get('user_id')
         if user_id is not None:
             db = get_db()
             cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute('SELECT * FROM users WHERE id = %s', (user_id,))
+            executar(cur, 'usuario_por_id',
+                     'SELECT id, google_id, nome, email, profile_pic_url, criado_em FROM users WHERE id = %s',
+                     (user_id,))
             g.user = cur.fetchone()
             cur.close()
 
     @app.route('/login')
     def login():
         redirect_uri = url_for('authorize', _external=True)
-        return google.authorize_redirect(redirect_uri)
+        return get_google().authorize_redirect(redirect_uri)
 
     @app.route('/authorize')
     def authorize():
+        google = get_google()
         token = google.authorize_access_token()
         user_info = google.parse_id_token(token, nonce=session.get('nonce'))
         db = get_db()
@@ -72,71 +216,33 @@ def register_public_routes(app, limiter):
         return redirect(url_for('index'))
 
 
+    def index_degradado():
+        """Mapa sem marcadores (ou a última cópia guardada) quando a consulta estoura o orçamento."""
+        guardada = pagina_guardada()
+        if guardada is not None:
+            return guardada
+        flash('O mapa está demorando para carregar. Tente novamente em instantes.')
+        return render_template('index.html', locais_para_mapa=[], categorias=current_app.config['CATEGORIAS'])
+
     @app.route('/')
+    @read_only
+    @budget(ms=300, degradar=index_degradado)
     def index():
         db = get_db()
         cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
 
-        conditions = ['aprovado = %s']
-        params = [True]
-        filter_category = request.args.get('categoria')
-        filter_period = request.args.get('periodo')
-        search_query = request.args.get('q', '').strip()
-        
         categorias_config = current_app.config['CATEGORIAS']
-        locais_uem_config = current_app.config['LOCAIS_UEM']
-
-        if filter_category and filter_category in categorias_config:
-            conditions.append('categoria = %s')
-            params.append(filter_category)
-        if filter_period == 'ultimo_mes':
-            conditions.append("criado_em >= NOW() - INTERVAL '1 month'")
-        if search_query:
-            conditions.append('(LOWER(titulo) LIKE %s OR LOWER(descricao) LIKE %s)')
-            search_term = f"%{search_query.lower()}%"
-            params.extend([search_term, search_term])
-
-        query = """
-            SELECT 
-                local,
-                json_agg(
-                    json_build_object(
-                        'id', id,
-                        'titulo', titulo,
-                        'local', local,
-                        'categoria', categoria,
-                        'criado_em', to_char(criado_em, 'DD/MM/YYYY'),
-                        'imagem_url', imagem_url
-                    ) ORDER BY id DESC
-                ) as relatos_json
-            FROM relatos
-            WHERE {where_conditions}
-            GROUP BY local
-        """.format(where_conditions=' AND '.join(conditions))
+        query, params = build_map_query(request.args, categorias_config)
+
         current_app.logger.info("Iniciando processamento do relato.")
         db_start = time.time()    
         
-        cur.execute(query, tuple(params))
+        # Cada combinação de filtros vira um statement preparado próprio
+        executar(cur, 'mapa', query, tuple(params))
         locais_agrupados_db = cur.fetchall()
         cur.close()
         current_app.logger.info(f"sql para fantasmas no mapa: {time.time() - db_start:.2f} segundos.")
-        # Processamento em Python agora é muito mais leve
-        locais_para_mapa = []
-        default_coords = locais_uem_config.get("Outro Local / Não Listado", [-23.4065, -51.9395])
-
-        for local_agrupado in locais_agrupados_db:
-            local_key = local_agrupado['local']
-            
-            # A lógica para encontrar as coordenadas permanece a mesma
-            coords = default_coords if local_key.startswith('Outro:') else locais_uem_config.get(local_key, default_coords)
-            
-            locais_para_mapa.append({
-                "lat": coords[0],
-                "lon": coords[1],
-                "relatos": local_agrupado['relatos_json']  # Usamos o JSON diretamente do banco
-            })
-
+        locais_para_mapa = group_map_rows(locais_agrupados_db, registro_atual())
 
         return render_template('index.html',
                             locais_para_mapa=locais_para_mapa,
@@ -144,11 +250,15 @@ def register_public_routes(app, limiter):
 
     @app.route('/submit', methods=('GET', 'POST'))
     @limiter.limit("5 per minute")
+    @budget(ms=30000)
     def submit():
         form = SubmitForm()
 
-        locais_choices = sorted(current_app.config['LOCAIS_UEM'].keys())
-        form.local.choices = [('', 'Selecione um local...')] + [(l, l) for l in locais_choices]
+        registro = registro_atual()
+        form.local.choices = registro.choices_submit
+        # Vindo do mapa ('Relatar algo aqui'), o local mais próximo do clique já vem escolhido
+        if request.method == 'GET' and request.args.get('local') in registro.coordenadas:
+            form.local.data = request.args['local']
 
         categorias_choices = current_app.config['CATEGORIAS']
         form.categoria.choices = [('', 'Selecione uma categoria...')] + [(c, c) for c in categorias_choices]
@@ -165,81 +275,139 @@ def register_public_routes(app, limiter):
             local_selecionado = form.local.data
             categoria = form.categoria.data
             outro_local_texto = form.outro_local_texto.data.strip()
-            imagem_file = form.imagem.data
-            audio_file = form.audio.data
+            # Com upload retomável (submit.js) o arquivo já está no backend e só vem o ID
+            imagem_file = None if form.imagem_upload_id.data else form.imagem.data
+            audio_file = None if form.audio_upload_id.data else form.audio.data
 
             # Dicionário para coletar os resultados das threads
             upload_results = {}
             threads = []
+            storage = get_storage()
 
-            if imagem_file:
-                imagem_file.seek(0, os.SEEK_END)
-                if imagem_file.tell() > (5 * 1024 * 1024):
-                    flash('A imagem enviada é muito grande. O limite é de 5 MB.')
-                    return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
-                imagem_file.seek(0)
-                image_thread = Thread(target=upload_image_task, args=(imagem_file, upload_results))
+            # Tamanho e formato real (magic bytes) antes de qualquer upload
+            try:
+                for tipo, arquivo in (('imagem', imagem_file), ('audio', audio_file)):
+                    if arquivo:
+                        arquivo.seek(0, os.SEEK_END)
+                        tamanho = arquivo.tell()
+                        arquivo.seek(0)
+                        validar_midia(arquivo, tipo, tamanho)
+            except UploadError as e:
+                flash(str(e))
+                return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
+
+            db = get_db()
+            cur = db.cursor()
+            # Cópia quase idêntica de um relato recente (onda de spam, reenvio):
+            # entra no grupo de duplicatas da fila e, com SIMILARIDADE_RETER, fica
+            # retida antes de gastar upload de mídia e e-mail aos admins
+            minhash, minhash_bandas, duplicata_de = classificar(cur, 'relato', descricao)
+            retido = duplicata_de is not None and current_app.config['SIMILARIDADE_RETER']
+            if retido:
+                current_app.logger.info(f"Relato retido como cópia do #{duplicata_de}; mídia anexada descartada.")
+                imagem_file = audio_file = None
+
+            # Conteúdo já armazenado (reenvio, foto repetida) é reaproveitado sem upload
+            hashes = {}
+            for tipo, arquivo in (('imagem', imagem_file), ('audio', audio_file)):
+                if arquivo:
+                    hashes[tipo] = sha256_arquivo(arquivo)
+                    existente = buscar_media(cur, hashes[tipo], tipo)
+                    if existente:
+                        upload_results[f'{tipo}_key'], upload_results[f'{tipo}_url'] = existente
+            db.commit()
+
+            if imagem_file and 'imagem_key' not in upload_results:
+                image_thread = Thread(target=upload_image_task, args=(storage, imagem_file, upload_results, prazo_restante(60)))
                 threads.append(image_thread)
                 image_thread.start()
 
-            if audio_file:
-                # Validação de tamanho
-                audio_file.seek(0, os.SEEK_END)
-                if audio_file.tell() > (10 * 1024 * 1024):
-                    flash('O arquivo de áudio é muito grande. O limite é de 10 MB.')
-                    return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
-                audio_file.seek(0)
-
-                audio_thread = Thread(target=upload_audio_task, args=(audio_file, upload_results))
+            if audio_file and 'audio_key' not in upload_results:
+                audio_thread = Thread(target=upload_audio_task, args=(storage, audio_file, upload_results, prazo_restante(60)))
                 threads.append(audio_thread)
                 audio_thread.start()
 
             for thread in threads:
                 thread.join()
 
+            # Registra os objetos novos (ref_count 0 até o relato ser gravado)
+            for tipo, sha256 in hashes.items():
+                if upload_results.get(f'{tipo}_key'):
+                    objeto = ObjetoArmazenado(upload_results[f'{tipo}_key'], upload_results[f'{tipo}_url'])
+                    upload_results[f'{tipo}_key'], upload_results[f'{tipo}_url'] = registrar_media(cur, storage, sha256, tipo, objeto)
+            db.commit()
+
 
             if 'image_error' in upload_results:
+                cur.close()
                 flash(upload_results['image_error'])
                 return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
             if 'audio_error' in upload_results:
+                cur.close()
                 flash(upload_results['audio_error'])
                 return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
 
             imagem_url = upload_results.get('imagem_url')
+            imagem_key = upload_results.get('imagem_key')
             audio_url = upload_results.get('audio_url')
+            audio_key = upload_results.get('audio_key')
             
-            local_final = outro_local_texto if local_selecionado == 'Outro Local / Não Listado' else local_selecionado
+            local_final = outro_local_texto if local_selecionado == OUTRO else local_selecionado
             ip_address, city, user_agent = get_request_metadata()
             user_id = g.user['id'] if g.user else None
             
             db_start = time.time()
-            db = get_db()
-            cur = db.cursor()
+            # O relato só referencia uploads concluídos desta sessão, na mesma transação.
+            # Retido, não consome nenhum: sem uso, o 'flask limpar-uploads' remove
+            # o upload e a mídia dele (ref_count 0) depois de vencido
+            uploads_do_form = () if retido else (('imagem', form.imagem_upload_id.data),
+                                                 ('audio', form.audio_upload_id.data))
+            for tipo, upload_id in uploads_do_form:
+                if not upload_id:
+                    continue
+                midia = consumir_upload(cur, upload_id, tipo)
+                if midia is None:
+                    db.rollback()
+                    cur.close()
+                    flash('O envio do arquivo não foi concluído. Anexe-o novamente.')
+                    return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
+                if tipo == 'imagem':
+                    imagem_key, imagem_url = midia
+                else:
+                    audio_key, audio_url = midia
+            for chave in (imagem_key, audio_key):
+                if chave and not referenciar_media(cur, chave):
+                    db.rollback()
+                    cur.close()
+                    flash('Houve um erro ao salvar o arquivo enviado. Tente novamente.')
+                    return render_template('submit.html', form=form, site_key=site_key, show_captcha=show_captcha)
             cur.execute(
-                'INSERT INTO relatos (titulo, descricao, local, categoria, imagem_url, audio_url, ip_address, city, user_agent, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                (titulo, descricao, local_final, categoria, imagem_url, audio_url, ip_address, city, user_agent, user_id)
+                'INSERT INTO relatos (titulo, descricao, local, categoria, imagem_url, imagem_key, audio_url, audio_key, ip_address, city, user_agent, user_id, minhash, minhash_bandas, duplicata_de) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                (titulo, descricao, local_final, categoria, imagem_url, imagem_key, audio_url, audio_key, ip_address, city, user_agent, user_id, minhash, minhash_bandas, duplicata_de)
             )
             db.commit()
             cur.close()
 
             # --- CÓDIGO NOVO PARA ENVIAR E-MAIL ---
-            try:
-                app_context = current_app._get_current_object() 
-                admin_link_completo = url_for('admin_relatos', _external=True)
-                # Prepara os dados do relato para o e-mail
-                relato_para_email = {
-                    'titulo': titulo,
-                    'local': local_final,
-                    'descricao': descricao,
-                    'admin_link': admin_link_completo
-                }
-                email_thread = Thread(
-                    target=send_new_relato_notification, 
-                    args=(app_context, relato_para_email)
-                )
-                email_thread.start()
-            except Exception as e:
-                current_app.logger.error(f"Erro ao iniciar a thread de e-mail: {e}")
+            # Relatos retidos não notificam: aparecem no grupo de duplicatas da fila
+            if not retido:
+                try:
+                    app_context = current_app._get_current_object() 
+                    admin_link_completo = url_for('admin_relatos', _external=True)
+                    # Prepara os dados do relato para o e-mail
+                    relato_para_email = {
+                        'titulo': titulo,
+                        'local': local_final,
+                        'descricao': descricao,
+                        'admin_link': admin_link_completo
+                    }
+                    email_thread = Thread(
+                        target=send_new_relato_notification, 
+                        args=(app_context, relato_para_email)
+                    )
+                    email_thread.start()
+                except Exception as e:
+                    current_app.logger.error(f"Erro ao iniciar a thread de e-mail: {e}")
             
             current_app.logger.info(f"Operação de banco de dados levou: {time.time() - db_start:.2f} segundos.")
             current_app.logger.info(f"Processamento total levou: {time.time() - start_time:.2f} segundos.")
@@ -251,33 +419,50 @@ def register_public_routes(app, limiter):
 
 
     @app.route('/relato/<int:relato_id>')
+    @read_only
+    @budget(ms=500)
     def relato(relato_id):
         start_time = time.time()
         db = get_db()
         cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute('SELECT r.*, u.nome as autor_relato, u.id as autor_id FROM relatos r LEFT JOIN users u ON r.user_id = u.id WHERE r.id = %s AND r.aprovado = TRUE', (relato_id,))
+        executar(cur, 'relato', """
+            SELECT r.id, r.titulo, r.descricao, r.local, r.categoria, r.imagem_url, r.audio_url,
+                   r.criado_em, r.votos_acredito, r.votos_cetico, r.votos_testemunha,
+                   u.nome as autor_relato, u.id as autor_id,
+                   (SELECT COUNT(*) FROM comentarios c WHERE c.relato_id = r.id) AS comment_count
+            FROM relatos r LEFT JOIN users u ON r.user_id = u.id
+            WHERE r.id = %s AND r.aprovado = TRUE
+        """, (relato_id,))
         relato_db = cur.fetchone()
         if relato_db is None:
             cur.close()
             flash("Este relato não foi encontrado ou ainda não foi aprovado.")
             return safe_redirect('index')
-        cur.execute("""
-            SELECT c.*, u.nome as autor, u.profile_pic_url, u.id as autor_id
+        # Relatos com muitos comentários saem em streaming, lidos por um cursor
+        # nomeado; os demais são renderizados em memória e continuam podendo ir
+        # para o cache de páginas da admissão (que ignora respostas em streaming)
+        em_streaming = relato_db['comment_count'] >= current_app.config['STREAMING_MIN_COMENTARIOS']
+        comentarios_query = """
+            SELECT c.id, c.texto, c.criado_em, c.like_count, u.nome as autor, u.profile_pic_url, u.id as autor_id
             FROM comentarios c JOIN users u ON c.user_id = u.id
             WHERE c.relato_id = %s ORDER BY c.criado_em ASC
-        """, (relato_id,))
-        comentarios_db = cur.fetchall()
+        """
+        if em_streaming:
+            comentarios_db = iterar_linhas('relato_comentarios', comentarios_query, (relato_id,))
+        else:
+            executar(cur, 'relato_comentarios', comentarios_query, (relato_id,))
+            comentarios_db = cur.fetchall()
         # Verifica quais comentários o usuário da sessão atual já curtiu
         liked_comments = set()
         if 'sid' in session:
             session_id = session.get('sid')
-            cur.execute('SELECT comentario_id FROM comentarios_likes WHERE session_id = %s', (session_id,))
+            executar(cur, 'curtidas_da_sessao', 'SELECT comentario_id FROM comentarios_likes WHERE session_id = %s', (session_id,))
             # Cria um conjunto (set) com os IDs dos comentários curtidos para uma verificação rápida
             liked_comments = {row['comentario_id'] for row in cur.fetchall()}
 
-        cur.execute('SELECT tipo_voto FROM votos WHERE relato_id = %s AND session_id = %s', (relato_id, session.get('sid')))
+        executar(cur, 'voto_da_sessao', 'SELECT tipo_voto FROM votos WHERE relato_id = %s AND session_id = %s', (relato_id, session.get('sid')))
         voto_usuario = cur.fetchone()
-        cur.execute('SELECT id FROM testemunhas WHERE relato_id = %s AND session_id = %s', (relato_id, session.get('sid')))
+        executar(cur, 'testemunha_da_sessao', 'SELECT id FROM testemunhas WHERE relato_id = %s AND session_id = %s', (relato_id, session.get('sid')))
         testemunha_usuario = cur.fetchone()
         cur.close()
 
@@ -285,7 +470,8 @@ def register_public_routes(app, limiter):
         report_form = AdminActionForm()
         current_app.logger.info(f"Operação de banco de dados geral levou(abertura do relato): {time.time() - start_time:.2f} segundos.")
         
-        return render_template('relato.html',
+        renderizar = render_streaming if em_streaming else render_template
+        return renderizar('relato.html',
                                relato=relato_db,
                                comentarios=comentarios_db,
                                voto_usuario=voto_usuario,
@@ -296,8 +482,87 @@ def register_public_routes(app, limiter):
                                report_form=report_form,
                                liked_comments=liked_comments)
 
+    @app.route('/relato/<int:relato_id>/eventos')
+    @limiter.limit("20 per minute")
+    @sem_admissao
+    def relato_eventos(relato_id):
+        """
+        Server-Sent Events com os contadores do relato em tempo real.
+        Não usa conexão do pool: os eventos vêm do único LISTEN do processo.
+        Cada stream ocupa uma thread do servidor WSGI enquanto dura, então há
+        no máximo SSE_MAX_CONEXOES por processo (as demais recebem 503 e o
+        relato.js passa a consultar /relato/<id>/contadores) e cada uma termina depois
+        de SSE_DURACAO_MAX segundos. No modo ASGI (asgi.py) a rota é servida
+        sem prender threads e estes limites não se aplicam.
+        """
+        if not vagas_sse.acquire(blocking=False):
+            metricas.incrementar('observatorio_sse_recusadas_total',
+                                 ajuda='Streams SSE recusados por falta de vaga (SSE_MAX_CONEXOES)')
+            return Response('Atualizações ao vivo indisponíveis no momento.\n', 503,
+                            mimetype='text/plain', headers={'Retry-After': '60'})
+        difusor = get_difusor()
+        fila = difusor.assinar_fila(relato_id)
+        fim = time.monotonic() + current_app.config['SSE_DURACAO_MAX']
+
+        def gerar():
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < fim:
+                try:
+                    payload = fila.get(timeout=15)
+                except queue.Empty:
+                    # Comentário SSE para manter a conexão viva atrás de proxies
+                    yield ': keepalive\n\n'
+                    continue
+                yield formatar_sse(payload)
+
+        def liberar():
+            # Via call_on_close: roda mesmo se o servidor fechar a resposta
+            # antes de iterar o gerador (cliente que desconectou logo)
+            difusor.cancelar(relato_id, fila.callback)
+            vagas_sse.release()
+
+        resposta = Response(gerar(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        resposta.call_on_close(liberar)
+        return resposta
+
+    @app.route('/relato/<int:relato_id>/contadores')
+    @limiter.limit("30 per minute")
+    @read_only
+    @budget(ms=300)
+    def relato_contadores(relato_id):
+        """
+        Contadores atuais do relato em JSON: votos, testemunhas e curtidas por
+        comentário. É o fallback do relato.js quando o stream SSE é recusado
+        (503 sem vaga) ou cai: a página consulta esta rota periodicamente.
+        """
+        cur = get_db().cursor(cursor_factory=psycopg2.extras.DictCursor)
+        executar(cur, 'relato_contadores', """
+            SELECT votos_acredito, votos_cetico, votos_testemunha
+            FROM relatos WHERE id = %s AND aprovado = TRUE
+        """, (relato_id,))
+        contagens = cur.fetchone()
+        if contagens is None:
+            cur.close()
+            return jsonify({'success': False, 'message': 'Relato não encontrado.'}), 404
+        executar(cur, 'relato_contadores_comentarios',
+                 'SELECT id, like_count FROM comentarios WHERE relato_id = %s', (relato_id,))
+        comentarios = {str(linha['id']): linha['like_count'] for linha in cur.fetchall()}
+        cur.close()
+        response = jsonify({
+            'votos_acredito': contagens['votos_acredito'],
+            'votos_cetico': contagens['votos_cetico'],
+            'votos_testemunha': contagens['votos_testemunha'],
+            'comentarios': comentarios,
+        })
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
     @app.route('/relato/<int:relato_id>/comment', methods=['POST'])
     @limiter.limit("10 per minute")
+    @budget(ms=2000)
     def add_comment(relato_id):
         if g.user is None:
             flash("Você precisa estar logado para comentar.")
@@ -309,10 +574,16 @@ def register_public_routes(app, limiter):
             ip_address, city, user_agent = get_request_metadata()
             db = get_db()
             cur = db.cursor()
+            # Cópias quase idênticas (mesmo texto em vários relatos) são agrupadas
+            # para exclusão em lote em /admin/duplicados
+            minhash, minhash_bandas, duplicata_de = classificar(cur, 'comentario', texto)
             cur.execute(
-                'INSERT INTO comentarios (relato_id, texto, user_id, ip_address, city, user_agent) VALUES (%s, %s, %s, %s, %s, %s)',
-                (relato_id, texto, g.user['id'], ip_address, city, user_agent)
+                'INSERT INTO comentarios (relato_id, texto, user_id, ip_address, city_id, user_agent_id, minhash, minhash_bandas, duplicata_de) '
+                'VALUES (%s, %s, %s, ip_ou_nulo(%s), city_id_de(%s), user_agent_id_de(%s), %s, %s, %s) RETURNING id',
+                (relato_id, texto, g.user['id'], ip_address, city, user_agent, minhash, minhash_bandas, duplicata_de)
             )
+            comentario_id = cur.fetchone()[0]
+            notify_relato(cur, relato_id, {'tipo': 'comentario', 'comentario_id': comentario_id})
             db.commit()
             cur.close()
             flash("Comentário adicionado!")
@@ -324,46 +595,82 @@ def register_public_routes(app, limiter):
         return safe_redirect('relato', relato_id=relato_id)
 
     @app.route('/profile/<int:user_id>')
+    @read_only
+    @budget(ms=500)
     def profile(user_id):
         db = get_db()
-        cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute('SELECT * FROM users WHERE id = %s', (user_id,))
+        cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        # Contadores do cabeçalho vêm de user_stats (mantida por triggers no banco)
+        cur.execute("""
+            SELECT u.id, u.nome, u.profile_pic_url, u.criado_em,
+                   COALESCE(s.relatos_count, 0) AS relatos_count,
+                   COALESCE(s.comentarios_count, 0) AS comentarios_count,
+                   COALESCE(s.votos_recebidos, 0) AS votos_recebidos
+            FROM users u LEFT JOIN user_stats s ON s.user_id = u.id
+            WHERE u.id = %s
+        """, (user_id,))
         user = cur.fetchone()
         if user is None:
+            cur.close()
             flash("Investigador não encontrado.")
             return redirect(url_for('index'))
-        cur.execute('SELECT * FROM relatos WHERE user_id = %s ORDER BY criado_em DESC', (user_id,))
-        relatos = cur.fetchall()
-        cur.execute("""
-            SELECT c.*, r.titulo as relato_titulo
-            FROM comentarios c JOIN relatos r ON c.relato_id = r.id
-            WHERE c.user_id = %s ORDER BY c.criado_em DESC
-        """, (user_id,))
-        comentarios = cur.fetchall()
+        # Só a primeira página de cada lista; as seguintes vêm da API (static/js/profile.js)
+        relatos, relatos_proximo = listar_relatos_usuario(cur, user_id)
+        comentarios, comentarios_proximo = listar_comentarios_usuario(cur, user_id)
         cur.close()
-        return render_template('profile.html', user=user, relatos=relatos, comentarios=comentarios)
+        return render_template('profile.html', user=user,
+                               relatos=relatos, relatos_proximo=relatos_proximo,
+                               comentarios=comentarios, comentarios_proximo=comentarios_proximo)
 
     @app.route('/rankings')
+    @read_only
+    @budget(ms=500)
     def rankings():
         db = get_db()
         cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("""
-            SELECT id, titulo, votos_acredito FROM relatos
-            WHERE aprovado = TRUE AND votos_acredito > 0
-            ORDER BY votos_acredito DESC, criado_em DESC LIMIT 10;
-        """)
-        top_relatos = cur.fetchall()
-        cur.execute("""
-            SELECT local, COUNT(id) as total_relatos FROM relatos
-            WHERE aprovado = TRUE GROUP BY local
-            ORDER BY total_relatos DESC, local ASC LIMIT 10;
-        """)
-        top_locais = cur.fetchall()
+        top_relatos, top_locais = consultar_rankings(cur)
         cur.close()
         return render_template('rankings.html', top_relatos=top_relatos, top_locais=top_locais)
 
+    @app.route('/csrf-token')
+    @limiter.limit("30 per minute")
+    @sem_admissao
+    def csrf_token_sessao():
+        """
+        Token CSRF da sessão para as páginas estáticas do 'flask freeze'
+        (estatico.py), que saem sem token: o relato.js pede este na primeira
+        ação (voto, testemunha, curtida ou denúncia).
+        """
+        response = jsonify({'csrf_token': generate_csrf()})
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @app.route('/healthz/live')
+    @limiter.exempt
+    @sem_admissao
+    def healthz_live():
+        """Liveness: o processo atende requisições (não toca no banco)."""
+        return Response('ok', mimetype='text/plain', headers={'Cache-Control': 'no-store'})
+
+    @app.route('/healthz/ready')
+    @limiter.exempt
+    @sem_admissao
+    def healthz_ready():
+        """
+        Readiness para o balanceador: 503 até o pool de conexões estar
+        aquecido (db.aquecer_pool) e enquanto a manutenção do pool falhar.
+        Não abre conexão: a primeira sonda só dispara o aquecimento, em
+        segundo plano, para o worker não receber tráfego com o banco frio.
+        """
+        estado = estado_pool()
+        response = jsonify(estado)
+        response.status_code = 200 if estado['pronto'] else 503
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
     @app.route('/report_comment/<int:comment_id>', methods=['POST'])
     @limiter.limit("15 per hour")
+    @budget(ms=1000)
     def report_comment(comment_id):
         form = AdminActionForm()
         if not form.validate_on_submit():
@@ -387,6 +694,7 @@ def register_public_routes(app, limiter):
     
     @app.route('/like_comment/<int:commentId>', methods=['POST'])
     @limiter.limit("30 per minute")
+    @budget(ms=1500)
     def like_comment(commentId):
         start_time = time.time()
         if 'sid' not in session:
@@ -397,15 +705,18 @@ def register_public_routes(app, limiter):
         try:
             # ETAPA 1: VERIFICAR VOTO EXISTENTE
             check_start = time.time()
-            cur.execute('SELECT id FROM comentarios_likes WHERE comentario_id = %s AND session_id = %s', (commentId, session['sid']))
+            # Trava o comentário: curtidas da mesma sessão não podem se cruzar
+            # (a tabela particionada não tem UNIQUE (comentario_id, session_id))
+            cur.execute('SELECT id FROM comentarios WHERE id = %s FOR UPDATE', (commentId,))
+            executar(cur, 'curtida_da_sessao', 'SELECT id, criado_em FROM comentarios_likes WHERE comentario_id = %s AND session_id = %s', (commentId, session['sid']))
             voto_existente = cur.fetchone()
             log_register(time.time() - check_start, f"LikeToggle: Verificação de voto existente para comentário {commentId}")
 
             if voto_existente:
                 # --- LÓGICA DE UNLIKE ---
                 db_op_start = time.time()
-                cur.execute('DELETE FROM comentarios_likes WHERE id = %s', (voto_existente['id'],))
-                cur.execute('UPDATE comentarios SET like_count = GREATEST(0, like_count - 1) WHERE id = %s', (commentId,))
+                cur.execute('DELETE FROM comentarios_likes WHERE id = %s AND criado_em = %s', (voto_existente['id'], voto_existente['criado_em']))
+                cur.execute('UPDATE comentarios SET like_count = GREATEST(0, like_count - 1) WHERE id = %s RETURNING relato_id, like_count', (commentId,))
                 log_register(time.time() - db_op_start, f"LikeToggle: UNLIKE no comentário {commentId}")
                 action = 'unliked'
             else:
@@ -413,13 +724,21 @@ def register_public_routes(app, limiter):
                 db_op_start = time.time()
                 ip_address, city, user_agent = get_request_metadata()
                 cur.execute(
-                    'INSERT INTO comentarios_likes (comentario_id, session_id, ip_address, city, user_agent) VALUES (%s, %s, %s, %s, %s)',
+                    'INSERT INTO comentarios_likes (comentario_id, session_id, ip_address, city_id, user_agent_id) '
+                    'VALUES (%s, %s, ip_ou_nulo(%s), city_id_de(%s), user_agent_id_de(%s))',
                     (commentId, session['sid'], ip_address, city, user_agent)
                 )
-                cur.execute('UPDATE comentarios SET like_count = like_count + 1 WHERE id = %s', (commentId,))
+                cur.execute('UPDATE comentarios SET like_count = like_count + 1 WHERE id = %s RETURNING relato_id, like_count', (commentId,))
                 log_register(time.time() - db_op_start, f"LikeToggle: LIKE no comentário {commentId}")
                 action = 'liked'
             
+            # Avisa quem está com o relato aberto (entregue no commit)
+            comentario = cur.fetchone()
+            if comentario:
+                notify_relato(cur, comentario['relato_id'], {
+                    'tipo': 'like', 'comentario_id': commentId, 'like_count': comentario['like_count']
+                })
+
             # ETAPA FINAL: COMMIT E BUSCA DE CONTAGEM
             commit_start = time.time()
             db.commit()
@@ -434,6 +753,11 @@ def register_public_routes(app, limiter):
             log_register(time.time() - start_time, f"LikeToggle: Processo total '{action}' finalizado para comentário {commentId}")
             return jsonify({'success': True, 'contagens': contagens, 'action': action}), 200
 
+        except psycopg2.errors.QueryCanceled:
+            # statement_timeout do orçamento: o handler de budgets.py faz o
+            # rollback e devolve a resposta degradada em vez do 500 abaixo
+            cur.close()
+            raise
         except Exception as e:
             db.rollback()
             cur.close()
@@ -445,6 +769,7 @@ def register_public_routes(app, limiter):
     
     @app.route('/vote/<int:relato_id>/<string:tipo_voto>', methods=['POST'])
     @limiter.limit("30 per hour")
+    @budget(ms=1500)
     def vote(relato_id, tipo_voto):
         start_time = time.time()
         if 'sid' not in session:
@@ -457,7 +782,7 @@ def register_public_routes(app, limiter):
         try:
             # ETAPA 1: VERIFICAR VOTO EXISTENTE
             check_start = time.time()
-            cur.execute('SELECT * FROM votos WHERE relato_id = %s AND session_id = %s', (relato_id, session['sid']))
+            executar(cur, 'votou', 'SELECT 1 FROM votos WHERE relato_id = %s AND session_id = %s', (relato_id, session['sid']))
             voto_existente = cur.fetchone()
             log_register(time.time() - check_start, f"Voto: Verificação de voto existente para relato {relato_id}")
 
@@ -469,7 +794,8 @@ def register_public_routes(app, limiter):
             insert_start = time.time()
             ip_address, city, user_agent = get_request_metadata()
             cur.execute(
-                'INSERT INTO votos (relato_id, session_id, tipo_voto, ip_address, city, user_agent) VALUES (%s, %s, %s, %s, %s, %s)',
+                'INSERT INTO votos (relato_id, session_id, tipo_voto, ip_address, city_id, user_agent_id) '
+                'VALUES (%s, %s, %s, ip_ou_nulo(%s), city_id_de(%s), user_agent_id_de(%s))',
                 (relato_id, session['sid'], tipo_voto, ip_address, city, user_agent)
             )
             log_register(time.time() - insert_start, f"Voto: Inserção na tabela 'votos'")
@@ -477,24 +803,30 @@ def register_public_routes(app, limiter):
             # ETAPA 3: ATUALIZAR CONTAGEM
             update_start = time.time()
             coluna = 'votos_acredito' if tipo_voto == 'acredito' else 'votos_cetico'
-            cur.execute(f'UPDATE relatos SET {coluna} = {coluna} + 1 WHERE id = %s', (relato_id,))
+            executar(cur, 'somar_voto', f'UPDATE relatos SET {coluna} = {coluna} + 1 WHERE id = %s RETURNING votos_acredito, votos_cetico', (relato_id,))
+            contagens = cur.fetchone()
             log_register(time.time() - update_start, f"Voto: Update na tabela 'relatos'")
+
+            # Avisa quem está com o relato aberto (entregue no commit)
+            notify_relato(cur, relato_id, {
+                'tipo': 'votos',
+                'votos_acredito': contagens['votos_acredito'],
+                'votos_cetico': contagens['votos_cetico'],
+            })
             
             # ETAPA 4: COMMIT
             commit_start = time.time()
             db.commit()
-            log_register(time.time() - commit_start, "Voto: db.commit()")
-
-            # ETAPA 5: BUSCAR CONTAGENS FINAIS
-            fetch_start = time.time()
-            cur.execute('SELECT votos_acredito, votos_cetico FROM relatos WHERE id = %s', (relato_id,))
-            contagens = cur.fetchone()
             cur.close()
-            log_register(time.time() - fetch_start, "Voto: Busca de contagens finais")
+            log_register(time.time() - commit_start, "Voto: db.commit()")
             
             log_register(time.time() - start_time, f"Voto: Processo total finalizado com sucesso para relato {relato_id}")
             return jsonify({'success': True, 'message': 'Voto computado!', 'votos_acredito': contagens['votos_acredito'], 'votos_cetico': contagens['votos_cetico']})
 
+        except psycopg2.errors.QueryCanceled:
+            # Orçamento esgotado: fica para o handler de budgets.py
+            cur.close()
+            raise
         except Exception as e:
             db.rollback()
             cur.close()
@@ -507,7 +839,7 @@ def register_public_routes(app, limiter):
         
     
     
-    def update_witness_metadata_task(witness_id, ip_address, user_agent):
+    def update_witness_metadata_task(witness_id, criado_em, ip_address, user_agent):
         """
         Busca a cidade e atualiza o registro da testemunha.
         Executada em segundo plano.
@@ -518,8 +850,9 @@ def register_public_routes(app, limiter):
             db = get_db()
             cur = db.cursor()
             cur.execute(
-                'UPDATE testemunhas SET ip_address = %s, city = %s, user_agent = %s WHERE id = %s',
-                (ip_address, city, user_agent, witness_id)
+                'UPDATE testemunhas SET ip_address = ip_ou_nulo(%s), city_id = city_id_de(%s), user_agent_id = user_agent_id_de(%s) '
+                'WHERE id = %s AND criado_em = %s',  # criado_em limita a busca a uma partição
+                (ip_address, city, user_agent, witness_id, criado_em)
             )
             db.commit()
             cur.close()
@@ -527,6 +860,7 @@ def register_public_routes(app, limiter):
 
     @app.route('/witness/<int:relato_id>', methods=['POST'])
     @limiter.limit("30 per hour")
+    @budget(ms=1500)
     def witness(relato_id):
         start_time = time.time()
         
@@ -537,7 +871,7 @@ def register_public_routes(app, limiter):
         log_register(time.time() - db_connection_time, "registro testemunha(conexão)")
         cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
         db_select_testemunhas_time = time.time()
-        cur.execute('SELECT * FROM testemunhas WHERE relato_id = %s AND session_id = %s', (relato_id, session['sid']))
+        executar(cur, 'testemunhou', 'SELECT 1 FROM testemunhas WHERE relato_id = %s AND session_id = %s', (relato_id, session['sid']))
         if cur.fetchone():
             cur.close()
             return jsonify({'success': False, 'message': 'Você já interagiu com este relato.'}), 403
@@ -549,24 +883,24 @@ def register_public_routes(app, limiter):
 
         db_insere_testemunha_time = time.time()
         cur.execute(
-            'INSERT INTO testemunhas (relato_id, session_id) VALUES (%s, %s) RETURNING id',
+            'INSERT INTO testemunhas (relato_id, session_id) VALUES (%s, %s) RETURNING id, criado_em',
             (relato_id, session['sid'])
         )
-        witness_id = cur.fetchone()['id']
+        witness_id, witness_criado_em = cur.fetchone()
         log_register(time.time() - db_insere_testemunha_time, "registro testemunha(insert)")
         
         db_atualiza_relato_time = time.time()
-        cur.execute('UPDATE relatos SET votos_testemunha = votos_testemunha + 1 WHERE id = %s', (relato_id,))
+        executar(cur, 'somar_testemunha', 'UPDATE relatos SET votos_testemunha = votos_testemunha + 1 WHERE id = %s RETURNING votos_testemunha', (relato_id,))
+        nova_contagem = cur.fetchone()['votos_testemunha']
+        notify_relato(cur, relato_id, {'tipo': 'testemunhas', 'votos_testemunha': nova_contagem})
         db.commit()
         log_register(time.time() - db_atualiza_relato_time, "registro testemunha(update relato)" )
         
         metadata_time = time.time()
-        metadata_thread = Thread(target=update_witness_metadata_task, args=(witness_id, ip_address, user_agent))
+        metadata_thread = Thread(target=update_witness_metadata_task, args=(witness_id, witness_criado_em, ip_address, user_agent))
         metadata_thread.start()
         log_register(time.time() - metadata_time, "registro testemunha(metadata)")
         
-        cur.execute('SELECT votos_testemunha FROM relatos WHERE id = %s', (relato_id,))
-        nova_contagem = cur.fetchone()['votos_testemunha']
         cur.close()
         total_time = time.time() - start_time
 
@@ -575,6 +909,8 @@ def register_public_routes(app, limiter):
         return jsonify({'success': True, 'message': 'Testemunho registrado!', 'votos_testemunha': nova_contagem})
     
     @app.route('/lendas')
+    @read_only
+    @budget(ms=300)
     def lendas():
         db = get_db()
         cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -584,10 +920,12 @@ def register_public_routes(app, limiter):
         return render_template('lendas.html', lendas=todas_lendas)
 
     @app.route('/lenda/<int:lenda_id>')
+    @read_only
+    @budget(ms=300)
     def lenda(lenda_id):
         db = get_db()
         cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute('SELECT * FROM lendas WHERE id = %s', (lenda_id,))
+        executar(cur, 'lenda', 'SELECT id, titulo, descricao, local, imagem_url FROM lendas WHERE id = %s', (lenda_id,))
         lenda_db = cur.fetchone()
         cur.close()
         if lenda_db is None:
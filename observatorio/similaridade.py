@@ -0,0 +1,235 @@
+# observatorio/similaridade.py
+
+import hashlib
+import re
+import struct
+import unicodedata
+
+import click
+import psycopg2.extras
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .db import get_db, executar
+from . import metricas
+
+# Assinatura MinHash de HASHES valores (mínimos de HASHES funções de hash
+# sobre o conjunto de palavras e pares de palavras do texto): a fração de
+# posições iguais entre duas assinaturas estima o Jaccard entre os textos.
+# Para a busca (LSH), a assinatura é cortada em BANDAS faixas de LINHAS
+# valores, e cada faixa vira uma chave de 64 bits; textos com Jaccard alto
+# quase sempre coincidem em alguma chave (0,7 -> ~99%, 0,3 -> ~12%), e um
+# índice GIN sobre o array de chaves (schema.sql) faz o papel das tabelas de
+# consulta por faixa: a busca lê só os candidatos, sem varrer a tabela.
+HASHES = 64
+BANDAS = 16
+LINHAS = HASHES // BANDAS
+# Candidatos lidos por busca: numa onda de spam grande todos caem nas mesmas
+# faixas, e os mais antigos bastam para achar a raiz do grupo
+MAX_CANDIDATOS = 200
+
+# Tabela e coluna de texto de cada tipo indexado
+TIPOS = {
+    'relato': ('relatos', 'descricao'),
+    'comentario': ('comentarios', 'texto'),
+}
+
+
+def _palavras(texto):
+    """Minúsculas, sem acentos nem pontuação, separadas em palavras."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9]+', ' ', texto).split()
+
+
+def minhash(texto, min_palavras=1):
+    """
+    Assinatura MinHash (lista de HASHES inteiros de 32 bits com sinal, como
+    um INTEGER[]) das palavras e pares de palavras do texto normalizado. Os
+    HASHES valores de cada atributo saem de uma única chamada ao SHAKE-128.
+    Retorna None para textos com menos de 'min_palavras' palavras: "que
+    medo!" repetido por muita gente não é spam, e textos curtos demais
+    coincidem à toa.
+    """
+    palavras = _palavras(texto or '')
+    if not palavras or len(palavras) < min_palavras:
+        return None
+    atributos = set(palavras)
+    atributos.update(f'{a} {b}' for a, b in zip(palavras, palavras[1:]))
+    formato = struct.Struct(f'<{HASHES}i')
+    valores = [formato.unpack(hashlib.shake_128(a.encode('utf-8')).digest(formato.size)) for a in atributos]
+    return list(map(min, zip(*valores)))
+
+
+def bandas(assinatura):
+    """Chaves LSH da assinatura: um inteiro de 64 bits com sinal (BIGINT) por faixa."""
+    chaves = []
+    for banda in range(BANDAS):
+        trecho = struct.pack(f'<H{LINHAS}i', banda, *assinatura[banda * LINHAS:(banda + 1) * LINHAS])
+        chaves.append(int.from_bytes(hashlib.blake2b(trecho, digest_size=8).digest(), 'big', signed=True))
+    return chaves
+
+
+def jaccard(a, b):
+    """Jaccard estimado entre dois textos: fração das posições iguais das assinaturas."""
+    return sum(x == y for x, y in zip(a, b)) / HASHES
+
+
+def buscar_parecidos(cur, tipo, assinatura, chaves, jaccard_min, janela_dias, antes_de=None):
+    """
+    Linhas de 'tipo' criadas nos últimos 'janela_dias' dias (e com id menor
+    que 'antes_de', se dado) com Jaccard estimado de pelo menos
+    'jaccard_min' com 'assinatura' (de chaves LSH 'chaves'). Retorna [(id, raiz, jaccard)], do mais
+    parecido para o menos (e, no empate, do mais antigo); 'raiz' é o
+    primeiro texto do grupo de duplicatas.
+    """
+    tabela, _ = TIPOS[tipo]
+    sql = f"""
+        SELECT id, minhash, COALESCE(duplicata_de, id) AS raiz
+        FROM {tabela}
+        WHERE minhash_bandas && %s::bigint[]
+          AND criado_em >= NOW() - make_interval(days => %s)
+        ORDER BY id
+        LIMIT {MAX_CANDIDATOS}
+    """
+    executar(cur, f'parecidos_{tipo}', sql, (chaves, janela_dias))
+    parecidos = []
+    for linha_id, outra, raiz in cur.fetchall():
+        if antes_de is not None and linha_id >= antes_de:
+            continue
+        similaridade = jaccard(assinatura, outra)
+        if similaridade >= jaccard_min:
+            parecidos.append((linha_id, raiz, similaridade))
+    parecidos.sort(key=lambda p: (-p[2], p[0]))
+    return parecidos
+
+
+def classificar(cur, tipo, texto, antes_de=None, janela_dias=None):
+    """
+    Assinatura de um texto novo, suas chaves LSH e a raiz do grupo de
+    quase-duplicatas em que ele cai: (minhash, bandas, raiz). Tudo None se
+    o texto é curto demais para ser assinado; raiz None se ele é inédito ou
+    se a detecção está desligada (SIMILARIDADE_JACCARD_MIN = 0).
+    """
+    config = current_app.config
+    assinatura = minhash(texto, config['SIMILARIDADE_MIN_PALAVRAS'])
+    if assinatura is None:
+        return None, None, None
+    chaves = bandas(assinatura)
+    if not config['SIMILARIDADE_JACCARD_MIN']:
+        return assinatura, chaves, None
+    parecidos = buscar_parecidos(cur, tipo, assinatura, chaves, config['SIMILARIDADE_JACCARD_MIN'],
+                                 janela_dias or config['SIMILARIDADE_JANELA_DIAS'], antes_de)
+    if not parecidos:
+        return assinatura, chaves, None
+    metricas.incrementar('observatorio_duplicatas_total', ajuda='Textos novos que caíram num grupo de quase-duplicatas',
+                         tipo=tipo)
+    return assinatura, chaves, parecidos[0][1]
+
+
+def listar_grupos(cur, tipo, somente_pendentes=False):
+    """
+    Grupos de quase-duplicatas para a moderação em lote: [(raiz, [linhas])],
+    dos grupos mais recentes para os mais antigos, com a raiz primeiro em
+    cada grupo. Só grupos com alguma cópia na janela SIMILARIDADE_JANELA_DIAS
+    (e, com 'somente_pendentes', alguma cópia de relato ainda não aprovada).
+    """
+    if tipo == 'relato':
+        colunas = 'r.id, r.titulo, r.descricao AS texto, r.local, r.aprovado, r.criado_em, r.imagem_url, r.audio_url, r.ip_address, r.city'
+        tabela, filtro = 'relatos', ' AND NOT aprovado' if somente_pendentes else ''
+    else:
+        colunas = ('r.id, r.texto, r.relato_id, r.denunciado, r.criado_em, host(r.ip_address) AS ip_address, '
+                   'COALESCE(u.nome, r.autor) AS autor')
+        tabela, filtro = 'comentarios', ''
+    juncao = 'LEFT JOIN users u ON u.id = r.user_id' if tipo == 'comentario' else ''
+    cur.execute(f"""
+        WITH raizes AS (
+            SELECT DISTINCT duplicata_de AS id FROM {tabela}
+            WHERE duplicata_de IS NOT NULL
+              AND criado_em >= NOW() - make_interval(days => %s){filtro}
+        )
+        SELECT {colunas}, COALESCE(r.duplicata_de, r.id) AS raiz
+        FROM (
+            SELECT id FROM raizes
+            UNION ALL
+            SELECT d.id FROM {tabela} d JOIN raizes ON d.duplicata_de = raizes.id
+        ) membros
+        JOIN {tabela} r ON r.id = membros.id
+        {juncao}
+        ORDER BY raiz DESC, (r.duplicata_de IS NOT NULL), r.id
+    """, (current_app.config['SIMILARIDADE_JANELA_DIAS'],))
+    grupos = []
+    for linha in cur.fetchall():
+        if not grupos or grupos[-1][0] != linha['raiz']:
+            grupos.append((linha['raiz'], []))
+        grupos[-1][1].append(linha)
+    return grupos
+
+
+def separar(cur, tipo, ids):
+    """
+    Tira as linhas 'ids' de 'tipo' dos seus grupos (falso positivo), sem
+    commit. Se alguma delas é raiz, o grupo continua com as cópias que
+    sobram: a mais antiga vira a raiz e as demais passam a apontar para ela.
+    """
+    tabela, _ = TIPOS[tipo]
+    cur.execute(f"""
+        WITH novas_raizes AS (
+            SELECT duplicata_de AS raiz, MIN(id) AS nova
+            FROM {tabela}
+            WHERE duplicata_de = ANY(%s) AND NOT id = ANY(%s)
+            GROUP BY duplicata_de
+        )
+        UPDATE {tabela} t SET duplicata_de = NULLIF(n.nova, t.id)
+        FROM novas_raizes n
+        WHERE t.duplicata_de = n.raiz AND NOT t.id = ANY(%s)
+    """, (ids, ids, ids))
+    cur.execute(f'UPDATE {tabela} SET duplicata_de = NULL WHERE id = ANY(%s)', (ids,))
+
+
+@click.command('indexar-textos')
+@click.option('--tipo', type=click.Choice(sorted(TIPOS)), multiple=True,
+              help='Só este tipo (repetível; padrão: todos).')
+@click.option('--refazer', is_flag=True, help='Recalcula também as assinaturas e grupos já gravados.')
+@click.option('--janela-dias', default=3650, show_default=True,
+              help='Só procura duplicatas entre textos criados nos últimos N dias.')
+@click.option('--lote', default=1000, show_default=True, help='Linhas por transação.')
+@with_appcontext
+def indexar_textos_command(tipo, refazer, janela_dias, lote):
+    """Grava assinaturas MinHash e grupos de duplicatas de relatos e comentários antigos."""
+    db = get_db()
+    cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    for nome in tipo or sorted(TIPOS):
+        tabela, coluna = TIPOS[nome]
+        if refazer:
+            cur.execute(f'UPDATE {tabela} SET minhash = NULL, minhash_bandas = NULL, duplicata_de = NULL')
+            db.commit()
+        # Em ordem de id: a raiz de cada grupo é sempre o texto mais antigo
+        ultimo, assinados, duplicatas = 0, 0, 0
+        while True:
+            cur.execute(f'SELECT id, {coluna} AS texto FROM {tabela} WHERE id > %s AND minhash IS NULL '
+                        f'ORDER BY id LIMIT %s', (ultimo, lote))
+            linhas = cur.fetchall()
+            if not linhas:
+                break
+            for linha in linhas:
+                # Só compara com linhas anteriores: a raiz é a mais antiga e não há ciclos
+                assinatura, chaves, raiz = classificar(cur, nome, linha['texto'], antes_de=linha['id'],
+                                                       janela_dias=janela_dias)
+                if assinatura is None:
+                    continue
+                cur.execute(f'UPDATE {tabela} SET minhash = %s, minhash_bandas = %s, duplicata_de = %s WHERE id = %s',
+                            (assinatura, chaves, raiz, linha['id']))
+                assinados += 1
+                duplicatas += raiz is not None
+            db.commit()
+            ultimo = linhas[-1]['id']
+        click.echo(f"{tabela}: {assinados} assinatura(s) gravada(s), {duplicatas} em grupos de duplicatas.")
+    cur.close()
+
+
+def init_app(app):
+    """Confere a configuração e registra o comando 'flask indexar-textos'."""
+    if not 0 <= app.config['SIMILARIDADE_JACCARD_MIN'] <= 1:
+        raise ValueError("SIMILARIDADE_JACCARD_MIN deve estar entre 0 e 1.")
+    app.cli.add_command(indexar_textos_command)
@@ -0,0 +1,82 @@
+# observatorio/startup.py
+
+import os
+import subprocess
+import sys
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+def medir_imports():
+    """
+    Executa o create_app() num processo novo com '-X importtime' e retorna
+    uma lista de (modulo, profundidade, self_us, cumulativo_us) dos imports
+    de topo (profundidade 0) e dos que eles puxam diretamente (profundidade 1).
+    """
+    raiz = os.path.abspath(os.path.join(current_app.root_path, '..'))
+    codigo = 'from observatorio import create_app; create_app()'
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', codigo],
+        cwd=raiz, env=os.environ.copy(), capture_output=True, text=True
+    )
+    imports = []
+    for linha in resultado.stderr.splitlines():
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        try:
+            self_us, cumulativo_us, modulo = linha[len('import time:'):].split('|')
+        except ValueError:
+            continue
+        # Cada nível de import aninhado acrescenta dois espaços de indentação
+        profundidade = (len(modulo) - len(modulo.lstrip()) - 1) // 2
+        if profundidade > 1:
+            continue
+        imports.append((modulo.strip(), profundidade, int(self_us), int(cumulativo_us)))
+    return imports, resultado.returncode
+
+
+@click.command('startup-profile')
+@click.option('--top', default=15, show_default=True, help='Quantos imports listar.')
+@click.option('--com-db', is_flag=True, help='Mede também a abertura do pool e a primeira conexão.')
+@with_appcontext
+def startup_profile_command(top, com_db):
+    """Mostra o custo de inicialização do app: imports (-X importtime) e fases do create_app()."""
+    imports, returncode = medir_imports()
+    if returncode != 0:
+        click.echo('Aviso: o processo de medição terminou com erro; os números podem estar incompletos.')
+
+    total_us = sum(cumulativo for _, profundidade, _, cumulativo in imports if profundidade == 0)
+    click.echo(f"Tempo total de imports: {total_us / 1000:.1f} ms.")
+    click.echo(f"{'módulo':<45}{'self (ms)':>12}{'cumulativo (ms)':>18}")
+    mais_lentos = sorted(imports, key=lambda i: i[3], reverse=True)[:top]
+    for modulo, profundidade, self_us, cumulativo_us in mais_lentos:
+        nome = ('  ' * profundidade) + modulo
+        click.echo(f"{nome:<45}{self_us / 1000:>12.1f}{cumulativo_us / 1000:>18.1f}")
+
+    click.echo('')
+    click.echo('Fases do create_app():')
+    for nome, segundos in current_app.extensions.get('startup_phases', []):
+        click.echo(f"  {nome:<20}{segundos * 1000:>10.1f} ms")
+
+    if com_db:
+        from .db import get_pool
+        start = time.perf_counter()
+        pool = get_pool()
+        pool_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        conn = pool.getconn()
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+        pool.putconn(conn)
+        click.echo(f"  {'pool (1a conexão)':<20}{pool_ms:>10.1f} ms")
+        click.echo(f"  {'SELECT 1':<20}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+
+
+def init_app(app):
+    """Registra o comando de perfil de inicialização no CLI do Flask."""
+    app.cli.add_command(startup_profile_command)
@@ -0,0 +1,403 @@
+# observatorio/storage.py
+
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from collections import namedtuple
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app, send_from_directory
+
+from .admissao import sem_admissao
+
+# Resultado de um upload: a chave do objeto no backend (gravada no banco,
+# usada para excluir) e a URL pública servida nas páginas.
+ObjetoArmazenado = namedtuple('ObjetoArmazenado', ['chave', 'url'])
+
+# Arquivo a enviar quando não há um FileStorage (ex.: upload retomável montado em disco)
+ArquivoMidia = namedtuple('ArquivoMidia', ['stream', 'filename', 'mimetype'])
+
+# Pastas (prefixos de chave) de cada tipo de mídia
+PASTA_IMAGENS = 'observatorio_uem_imagens'
+PASTA_AUDIOS = 'observatorio_uem_audios'
+PASTA_LENDAS = 'observatorio_uem_lendas'
+
+# Tamanho dos blocos lidos do arquivo temporário e enviados ao backend
+TAMANHO_BLOCO = 1024 * 1024
+# O Cloudinary e o multipart do S3 exigem partes de pelo menos 5 MB
+TAMANHO_PARTE_REMOTA = 6 * 1024 * 1024
+
+_EXTENSAO_VALIDA = re.compile(r'^\.[a-z0-9]{1,8}$')
+
+
+class StorageError(Exception):
+    """Falha ao gravar ou remover uma mídia no backend de armazenamento."""
+
+
+class ArquivoComHash(SpooledTemporaryFile):
+    """SpooledTemporaryFile que calcula o SHA-256 do conteúdo à medida que ele é escrito."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def write(self, dados):
+        self.sha256.update(dados)
+        return super().write(dados)
+
+
+class RequestMidia(Request):
+    """
+    Request que grava os arquivos do multipart num SpooledTemporaryFile
+    pequeno: acima de MEDIA_SPOOL_MAX_SIZE o upload vai para o disco, e o
+    backend o lê de volta em blocos. Nenhum arquivo fica inteiro na memória.
+    O hash do conteúdo sai pronto do recebimento (deduplicação em 'media').
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limite = current_app.config.get('MEDIA_SPOOL_MAX_SIZE', 256 * 1024)
+        return ArquivoComHash(max_size=limite, mode='rb+')
+
+
+def sha256_arquivo(arquivo):
+    """
+    SHA-256 (hex) de um arquivo recebido. Usa o hash calculado durante o
+    recebimento quando existe; senão lê o arquivo em blocos e volta ao início.
+    """
+    stream = getattr(arquivo, 'stream', arquivo)
+    calculado = getattr(stream, 'sha256', None)
+    if calculado is not None:
+        return calculado.hexdigest()
+    sha256 = hashlib.sha256()
+    stream.seek(0)
+    for bloco in iter(lambda: stream.read(TAMANHO_BLOCO), b''):
+        sha256.update(bloco)
+    stream.seek(0)
+    return sha256.hexdigest()
+
+
+def _extensao(nome_arquivo):
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    return extensao if _EXTENSAO_VALIDA.match(extensao) else ''
+
+
+def nova_chave(pasta, nome_arquivo=None):
+    """Gera uma chave única '<pasta>/<uuid><ext>' para um novo objeto."""
+    return f"{pasta}/{uuid.uuid4().hex}{_extensao(nome_arquivo)}"
+
+
+def _nome_e_tipo(arquivo):
+    """Nome original e content-type de um FileStorage (ou de um arquivo comum)."""
+    return getattr(arquivo, 'filename', None) or getattr(arquivo, 'name', None), getattr(arquivo, 'mimetype', None)
+
+
+class ArmazenamentoCloudinary:
+    """Backend Cloudinary: envio em partes com 'upload_large'; a chave é o public_id."""
+
+    nome = 'cloudinary'
+
+    def salvar(self, arquivo, pasta, tipo='imagem', timeout=None):
+        from .utils import cloudinary_uploader
+
+        nome_arquivo, _ = _nome_e_tipo(arquivo)
+        opcoes = {'folder': pasta, 'chunk_size': TAMANHO_PARTE_REMOTA, 'filename': nome_arquivo or 'upload'}
+        if timeout is not None:
+            # Vale para cada requisição HTTP do upload (uma por parte)
+            opcoes['timeout'] = timeout
+        if tipo == 'audio':
+            opcoes['resource_type'] = 'video'
+            opcoes['transformation'] = [{'audio_codec': 'mp3', 'bit_rate': '64k'}]
+        else:
+            opcoes['resource_type'] = 'image'
+            opcoes['transformation'] = [{'width': 1920, 'height': 1080, 'crop': 'limit'}, {'quality': 'auto', 'fetch_format': 'auto'}]
+        stream = getattr(arquivo, 'stream', arquivo)
+        try:
+            resultado = cloudinary_uploader().upload_large(stream, **opcoes)
+        except Exception as e:
+            raise StorageError(f"Falha no upload para o Cloudinary: {e}") from e
+        if not resultado or not resultado.get('public_id'):
+            raise StorageError("O Cloudinary não retornou o public_id do upload.")
+        return ObjetoArmazenado(resultado['public_id'], resultado.get('secure_url'))
+
+    def remover(self, chave, tipo='imagem'):
+        from .utils import cloudinary_uploader
+
+        resource_type = 'video' if tipo == 'audio' else 'image'
+        try:
+            cloudinary_uploader().destroy(chave, resource_type=resource_type)
+        except Exception as e:
+            raise StorageError(f"Falha ao remover '{chave}' do Cloudinary: {e}") from e
+
+    @staticmethod
+    def chave_de_url(url):
+        """Recupera o public_id de uma URL do Cloudinary (linhas antigas, sem coluna de chave)."""
+        return '/'.join(url.split('/')[-2:]).split('.')[0]
+
+
+class ArmazenamentoLocal:
+    """Backend em disco: grava sob MEDIA_ROOT e serve em MEDIA_URL."""
+
+    nome = 'local'
+
+    def __init__(self, raiz, url_base='/media/'):
+        self.raiz = raiz
+        self.url_base = url_base if url_base.endswith('/') else url_base + '/'
+
+    def _caminho(self, chave):
+        caminho = os.path.realpath(os.path.join(self.raiz, chave))
+        if not caminho.startswith(os.path.realpath(self.raiz) + os.sep):
+            raise StorageError(f"Chave fora de MEDIA_ROOT: {chave}")
+        return caminho
+
+    def salvar(self, arquivo, pasta, tipo='imagem', timeout=None):
+        nome_arquivo, _ = _nome_e_tipo(arquivo)
+        chave = nova_chave(pasta, nome_arquivo)
+        destino = self._caminho(chave)
+        temporario = destino + '.parcial'
+        stream = getattr(arquivo, 'stream', arquivo)
+        try:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            with open(temporario, 'wb') as saida:
+                shutil.copyfileobj(stream, saida, TAMANHO_BLOCO)
+            os.replace(temporario, destino)
+        except OSError as e:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise StorageError(f"Falha ao gravar '{chave}' em disco: {e}") from e
+        return ObjetoArmazenado(chave, self.url(chave))
+
+    def remover(self, chave, tipo='imagem'):
+        try:
+            os.remove(self._caminho(chave))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise StorageError(f"Falha ao remover '{chave}' do disco: {e}") from e
+        # Derivadas geradas sob demanda (observatorio/imagens.py)
+        pasta_variantes = os.path.join(self.raiz, '_variantes')
+        if os.path.isdir(pasta_variantes):
+            for variante in os.listdir(pasta_variantes):
+                try:
+                    os.remove(os.path.join(pasta_variantes, variante, chave))
+                except OSError:
+                    pass
+
+    def url(self, chave):
+        return f"{self.url_base}{chave}"
+
+
+class ArmazenamentoS3:
+    """
+    Backend S3 compatível (AWS, MinIO, R2...). O boto3 é opcional e só é
+    importado aqui; o envio usa 'upload_fileobj', que lê o arquivo em partes
+    e faz upload multipart acima de TAMANHO_PARTE_REMOTA.
+    """
+
+    nome = 's3'
+
+    def __init__(self, bucket, endpoint_url=None, url_publica=None, regiao=None, access_key=None, secret_key=None):
+        if not bucket:
+            raise StorageError("S3_BUCKET não está configurado.")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.regiao = regiao
+        self.access_key = access_key
+        self.secret_key = secret_key
+        if url_publica:
+            self.url_publica = url_publica.rstrip('/')
+        elif endpoint_url:
+            # MinIO e afins: path-style
+            self.url_publica = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.url_publica = f"https://{bucket}.s3.amazonaws.com"
+        self._cliente = None
+
+    def _get_cliente(self):
+        if self._cliente is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise StorageError("O backend S3 requer o pacote 'boto3'.") from e
+            # O cliente do boto3 é thread-safe; um por processo basta
+            self._cliente = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                region_name=self.regiao,
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+            )
+        return self._cliente
+
+    def salvar(self, arquivo, pasta, tipo='imagem', timeout=None):
+        # 'timeout' é ignorado: o boto3 usa os timeouts de conexão/leitura do cliente
+        cliente = self._get_cliente()
+        from boto3.s3.transfer import TransferConfig
+
+        nome_arquivo, content_type = _nome_e_tipo(arquivo)
+        chave = nova_chave(pasta, nome_arquivo)
+        extras = {'ContentType': content_type} if content_type else {}
+        config = TransferConfig(
+            multipart_threshold=TAMANHO_PARTE_REMOTA,
+            multipart_chunksize=TAMANHO_PARTE_REMOTA,
+            max_concurrency=2,
+        )
+        stream = getattr(arquivo, 'stream', arquivo)
+        try:
+            cliente.upload_fileobj(stream, self.bucket, chave, ExtraArgs=extras, Config=config)
+        except Exception as e:
+            raise StorageError(f"Falha no upload de '{chave}' para o S3: {e}") from e
+        return ObjetoArmazenado(chave, self.url(chave))
+
+    def remover(self, chave, tipo='imagem'):
+        try:
+            self._get_cliente().delete_object(Bucket=self.bucket, Key=chave)
+        except StorageError:
+            raise
+        except Exception as e:
+            raise StorageError(f"Falha ao remover '{chave}' do S3: {e}") from e
+
+    def url(self, chave):
+        return f"{self.url_publica}/{chave}"
+
+
+def criar_storage(config):
+    """Instancia o backend escolhido em MEDIA_BACKEND ('cloudinary', 'local' ou 's3')."""
+    backend = config.get('MEDIA_BACKEND', 'cloudinary')
+    if backend == 'cloudinary':
+        return ArmazenamentoCloudinary()
+    if backend == 'local':
+        return ArmazenamentoLocal(config['MEDIA_ROOT'], config.get('MEDIA_URL', '/media/'))
+    if backend == 's3':
+        return ArmazenamentoS3(
+            config.get('S3_BUCKET'),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            url_publica=config.get('S3_PUBLIC_URL'),
+            regiao=config.get('S3_REGION'),
+            access_key=config.get('S3_ACCESS_KEY_ID'),
+            secret_key=config.get('S3_SECRET_ACCESS_KEY'),
+        )
+    raise StorageError(f"MEDIA_BACKEND desconhecido: {backend}")
+
+
+def get_storage():
+    """Retorna o backend de armazenamento do app atual."""
+    return current_app.extensions['storage']
+
+
+# --- Deduplicação por conteúdo (tabela 'media') ---
+# Cada arquivo distinto é enviado ao backend uma única vez. O fluxo é em duas
+# fases para não vazar referências quando o relato/lenda acaba não sendo
+# gravado: 'buscar_media'/'registrar_media' garantem o objeto (ref_count 0 se
+# novo) e 'referenciar_media', na transação do INSERT, conta a referência.
+# Objetos que ficam sem referência são removidos por 'flask limpar-uploads'.
+
+def buscar_media(cur, sha256, tipo):
+    """Retorna ObjetoArmazenado já existente para esse conteúdo, ou None."""
+    cur.execute(
+        'UPDATE media SET atualizado_em = NOW() WHERE sha256 = %s AND tipo = %s RETURNING chave, url',
+        (sha256, tipo)
+    )
+    linha = cur.fetchone()
+    return ObjetoArmazenado(linha[0], linha[1]) if linha else None
+
+
+def registrar_media(cur, storage, sha256, tipo, objeto):
+    """
+    Registra um objeto recém-enviado. Se outro envio do mesmo conteúdo
+    registrou primeiro, remove a cópia redundante e retorna a existente.
+    """
+    cur.execute(
+        'INSERT INTO media (sha256, tipo, chave, url) VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT (sha256, tipo) DO NOTHING RETURNING chave',
+        (sha256, tipo, objeto.chave, objeto.url)
+    )
+    if cur.fetchone():
+        return objeto
+    existente = buscar_media(cur, sha256, tipo)
+    if existente is None:
+        # A linha concorrente foi removida nesse meio tempo: fica com o objeto enviado
+        return registrar_media(cur, storage, sha256, tipo, objeto)
+    try:
+        storage.remover(objeto.chave, tipo)
+    except StorageError as e:
+        current_app.logger.error(f"Erro ao remover cópia duplicada ({objeto.chave}): {e}")
+    return existente
+
+
+def referenciar_media(cur, chave):
+    """
+    Conta mais uma referência ao objeto. Retorna False se ele não existe mais
+    (removido entre a busca e a gravação); objetos de antes da tabela 'media'
+    não são contados.
+    """
+    cur.execute('UPDATE media SET ref_count = ref_count + 1 WHERE chave = %s', (chave,))
+    return cur.rowcount > 0
+
+
+def liberar_media(cur, chave, url, tipo='imagem'):
+    """
+    Descarta uma referência, sem tocar no backend (a transação ainda pode
+    ser desfeita). Retorna (chave, url, tipo) quando o objeto deve sair do
+    backend depois do commit, com remover_midias(): na última referência ou,
+    sem linha em 'media' (mídia anterior à deduplicação), sempre. Senão, None.
+    """
+    if chave:
+        cur.execute(
+            'UPDATE media SET ref_count = GREATEST(ref_count - 1, 0) WHERE chave = %s RETURNING ref_count',
+            (chave,)
+        )
+        linha = cur.fetchone()
+        if linha is not None:
+            if linha[0] > 0:
+                return None
+            cur.execute('DELETE FROM media WHERE chave = %s AND ref_count = 0', (chave,))
+    if not chave and not url:
+        return None
+    return chave, url, tipo
+
+
+def remover_midias(storage, pendentes):
+    """
+    Remove do backend as mídias devolvidas por liberar_media. Chame depois
+    do commit: num rollback a linha de 'media' volta, e o objeto tem de
+    continuar lá. Se o processo cair entre os dois, sobra só um objeto órfão.
+    """
+    for midia in pendentes:
+        if midia:
+            remover_midia(storage, *midia)
+
+
+def remover_midia(storage, chave, url, tipo='imagem'):
+    """
+    Remove uma mídia pela chave. Linhas anteriores à coluna de chave só têm a
+    URL do Cloudinary; nesse caso o public_id é recuperado da própria URL.
+    Erros são registrados e não interrompem a exclusão do registro.
+    """
+    try:
+        if chave:
+            storage.remover(chave, tipo)
+        elif url and 'res.cloudinary.com' in url:
+            cloudinary = storage if isinstance(storage, ArmazenamentoCloudinary) else ArmazenamentoCloudinary()
+            cloudinary.remover(ArmazenamentoCloudinary.chave_de_url(url), tipo)
+    except StorageError as e:
+        current_app.logger.error(f"Erro ao deletar mídia ({chave or url}): {e}")
+
+
+def init_app(app):
+    """Cria o backend de armazenamento, instala o RequestMidia e serve a mídia local."""
+    app.request_class = RequestMidia
+    app.extensions['storage'] = criar_storage(app.config)
+
+    media_url = app.config.get('MEDIA_URL', '/media/')
+
+    # Uma página com muitas miniaturas passaria dos limites padrão por IP
+    # (e, atrás de um NAT, bloquearia a rede inteira): a mídia fica fora deles
+    from . import limiter
+
+    @app.route(f'{media_url}<path:chave>')
+    @limiter.exempt
+    @sem_admissao
+    def media(chave):
+        return send_from_directory(app.config['MEDIA_ROOT'], chave, max_age=30 * 86400)
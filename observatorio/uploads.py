@@ -0,0 +1,472 @@
+# observatorio/uploads.py
+
+import base64
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+
+import click
+import psycopg2.extras
+from flask import current_app, jsonify, request, session, url_for
+from flask.cli import with_appcontext
+
+from .db import get_db, get_pool
+from .storage import (
+    PASTA_AUDIOS, PASTA_IMAGENS, ArquivoMidia, StorageError, get_storage, remover_midia,
+    buscar_media, registrar_media,
+)
+
+# Uploads retomáveis no estilo do protocolo tus (https://tus.io):
+#   POST  /uploads        cria a sessão (Upload-Length, Upload-Metadata)
+#   PATCH /uploads/<id>   grava um bloco a partir de Upload-Offset
+#   HEAD  /uploads/<id>   informa até onde o upload já chegou
+# Diferente do tus puro, blocos podem chegar fora de ordem e em paralelo:
+# cada PATCH vira um arquivo '<offset>.part' e o Upload-Offset devolvido é o
+# fim do trecho contíguo a partir do zero. Um bloco não pode sobrepor bytes
+# já recebidos (só o reenvio idêntico, mesmo offset e tamanho, substitui a
+# parte), então o disco usado por upload nunca passa do Upload-Length. Quando o arquivo inteiro chega, ele
+# é montado e enviado ao backend de mídia; o relato só referencia o ID.
+
+TUS_VERSAO = '1.0.0'
+
+# Limite de tamanho por tipo de mídia (o mesmo vale para o envio direto em /submit)
+CONFIG_LIMITES = {
+    'imagem': 'MAX_IMAGE_BYTES',
+    'audio': 'MAX_AUDIO_BYTES',
+}
+PASTAS = {
+    'imagem': PASTA_IMAGENS,
+    'audio': PASTA_AUDIOS,
+}
+
+# Assinaturas (magic bytes) aceitas: (mimetype, ((offset, bytes), ...)).
+# O submit.js envia WebP/JPEG e Ogg Opus (ou WAV); os demais cobrem quem
+# envia o arquivo original, sem JavaScript ou sem suporte a compressão.
+ASSINATURAS = {
+    'imagem': (
+        ('image/jpeg', ((0, b'\xff\xd8\xff'),)),
+        ('image/png', ((0, b'\x89PNG\r\n\x1a\n'),)),
+        ('image/gif', ((0, b'GIF87a'),)),
+        ('image/gif', ((0, b'GIF89a'),)),
+        ('image/webp', ((0, b'RIFF'), (8, b'WEBP'))),
+    ),
+    'audio': (
+        ('audio/ogg', ((0, b'OggS'),)),
+        ('audio/webm', ((0, b'\x1a\x45\xdf\xa3'),)),
+        ('audio/wav', ((0, b'RIFF'), (8, b'WAVE'))),
+        ('audio/mpeg', ((0, b'ID3'),)),
+        ('audio/mp4', ((4, b'ftyp'),)),
+        ('audio/flac', ((0, b'fLaC'),)),
+        ('audio/amr', ((0, b'#!AMR'),)),
+    ),
+}
+TAMANHO_CABECALHO = 16
+
+# Maior bloco aceito num PATCH
+TAMANHO_MAX_BLOCO = 4 * 1024 * 1024
+TAMANHO_BLOCO_LEITURA = 64 * 1024
+# Montagem ('montando') mais antiga que isso é de um processo que morreu no
+# meio: o próximo PATCH/HEAD ou o 'flask limpar-uploads' a devolve a 'pendente'
+MONTAGEM_MAX_SEGUNDOS = 600
+
+
+class UploadError(Exception):
+    """Pedido de upload inválido; 'status' é o código HTTP da resposta."""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def limite_bytes(tipo):
+    """Tamanho máximo aceito para o tipo de mídia (MAX_IMAGE_BYTES / MAX_AUDIO_BYTES)."""
+    return current_app.config[CONFIG_LIMITES[tipo]]
+
+
+def detectar_formato(cabecalho, tipo):
+    """Retorna o mimetype reconhecido pelos primeiros bytes do arquivo, ou None."""
+    for mimetype, partes in ASSINATURAS[tipo]:
+        if all(cabecalho[offset:offset + len(magic)] == magic for offset, magic in partes):
+            return mimetype
+    # Quadro MPEG sem tag ID3 (MP3 ou AAC ADTS): 11 bits de sincronismo
+    if tipo == 'audio' and len(cabecalho) >= 2 and cabecalho[0] == 0xff and cabecalho[1] & 0xe0 == 0xe0:
+        return 'audio/mpeg'
+    return None
+
+
+def validar_midia(stream, tipo, tamanho):
+    """
+    Confere tamanho e conteúdo real de um arquivo antes de enviá-lo ao
+    backend. Lê só o cabeçalho e volta o stream para o início. Retorna o
+    mimetype detectado; levanta UploadError se o arquivo for recusado.
+    """
+    limite = limite_bytes(tipo)
+    if tamanho > limite:
+        raise UploadError(f"Arquivo muito grande. O limite é de {limite // (1024 * 1024)} MB.", 413)
+    cabecalho = stream.read(TAMANHO_CABECALHO)
+    stream.seek(0)
+    mimetype = detectar_formato(cabecalho, tipo)
+    if mimetype is None:
+        nome = 'imagem' if tipo == 'imagem' else 'áudio'
+        raise UploadError(f"Formato de {nome} não suportado.", 415)
+    return mimetype
+
+
+def _pasta_uploads():
+    return current_app.config.get('UPLOADS_TMP_DIR') or os.path.join(current_app.instance_path, 'uploads')
+
+
+def _pasta_upload(upload_id):
+    return os.path.join(_pasta_uploads(), upload_id)
+
+
+def parse_metadata(cabecalho):
+    """Decodifica o Upload-Metadata do tus: 'chave base64,chave base64'."""
+    metadados = {}
+    for par in (cabecalho or '').split(','):
+        par = par.strip()
+        if not par:
+            continue
+        chave, _, valor = par.partition(' ')
+        try:
+            metadados[chave] = base64.b64decode(valor).decode('utf-8') if valor else ''
+        except (ValueError, UnicodeDecodeError):
+            raise UploadError(f"Upload-Metadata inválido para '{chave}'.")
+    return metadados
+
+
+def partes_recebidas(upload_id):
+    """Lista (offset, tamanho) dos blocos gravados em disco, ordenados por offset."""
+    pasta = _pasta_upload(upload_id)
+    partes = []
+    try:
+        nomes = os.listdir(pasta)
+    except FileNotFoundError:
+        return partes
+    for nome in nomes:
+        if nome.endswith('.part'):
+            offset = int(nome[:-len('.part')])
+            partes.append((offset, os.path.getsize(os.path.join(pasta, nome))))
+    partes.sort()
+    return partes
+
+
+def offset_contiguo(partes):
+    """Fim do trecho contíguo a partir do byte zero."""
+    fim = 0
+    for offset, tamanho in partes:
+        if offset > fim:
+            break
+        fim = max(fim, offset + tamanho)
+    return fim
+
+
+def _faixas(partes):
+    """Faixas recebidas, mescladas, no formato 'ini-fim,ini-fim' (fim exclusivo)."""
+    faixas = []
+    for offset, tamanho in partes:
+        if faixas and offset <= faixas[-1][1]:
+            faixas[-1][1] = max(faixas[-1][1], offset + tamanho)
+        else:
+            faixas.append([offset, offset + tamanho])
+    return ','.join(f"{ini}-{fim}" for ini, fim in faixas)
+
+
+def _buscar_upload(cur, upload_id):
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise UploadError('Upload não encontrado.', 404)
+    cur.execute('SELECT * FROM uploads WHERE id = %s', (upload_id,))
+    upload = cur.fetchone()
+    if upload is None or upload['dono'] != session.get('sid'):
+        raise UploadError('Upload não encontrado.', 404)
+    return upload
+
+
+def criar_upload(tamanho, metadados):
+    """Registra uma nova sessão de upload e retorna seu ID."""
+    tipo = metadados.get('tipo')
+    if tipo not in CONFIG_LIMITES:
+        raise UploadError("Upload-Metadata deve informar 'tipo' (imagem ou audio).")
+    if tamanho <= 0:
+        raise UploadError('Upload-Length inválido.')
+    limite = limite_bytes(tipo)
+    if tamanho > limite:
+        raise UploadError(f"Arquivo muito grande. O limite é de {limite // (1024 * 1024)} MB.", 413)
+
+    if 'sid' not in session:
+        session['sid'] = str(uuid.uuid4())
+    upload_id = str(uuid.uuid4())
+    os.makedirs(_pasta_upload(upload_id), exist_ok=True)
+
+    db = get_db()
+    cur = db.cursor()
+    cur.execute(
+        'INSERT INTO uploads (id, dono, tipo, tamanho, nome_arquivo, content_type) VALUES (%s, %s, %s, %s, %s, %s)',
+        (upload_id, session['sid'], tipo, tamanho, metadados.get('filename', '')[:255], metadados.get('filetype', '')[:100])
+    )
+    db.commit()
+    cur.close()
+    return upload_id
+
+
+def _conferir_faixa(upload, offset, tamanho_bloco):
+    """
+    Recusa um bloco que sobreponha bytes já recebidos, a não ser o reenvio
+    idêntico de uma parte (mesmo offset e tamanho), que apenas a substitui.
+    """
+    fim = offset + tamanho_bloco
+    for inicio, tamanho in partes_recebidas(upload['id']):
+        if inicio == offset and tamanho == tamanho_bloco:
+            continue
+        if inicio < fim and offset < inicio + tamanho:
+            raise UploadError(f"Bloco sobrepõe bytes já recebidos ({inicio}-{inicio + tamanho}).", 409)
+
+
+def gravar_bloco(upload, offset, stream, tamanho_bloco):
+    """Grava um bloco do corpo da requisição em disco, lendo-o em pedaços."""
+    if upload['status'] != 'pendente':
+        raise UploadError('Este upload já foi concluído.', 409)
+    if offset < 0 or tamanho_bloco <= 0 or offset + tamanho_bloco > upload['tamanho']:
+        raise UploadError('Upload-Offset fora do tamanho declarado.', 409)
+    if tamanho_bloco > TAMANHO_MAX_BLOCO:
+        raise UploadError('Bloco muito grande.', 413)
+    _conferir_faixa(upload, offset, tamanho_bloco)
+
+    pasta = _pasta_upload(upload['id'])
+    destino = os.path.join(pasta, f"{offset}.part")
+    temporario = f"{destino}.{uuid.uuid4().hex}.tmp"
+    recebido = 0
+    try:
+        with open(temporario, 'wb') as saida:
+            while True:
+                pedaco = stream.read(TAMANHO_BLOCO_LEITURA)
+                if not pedaco:
+                    break
+                recebido += len(pedaco)
+                if recebido > tamanho_bloco:
+                    raise UploadError('Corpo maior que o Content-Length.', 400)
+                saida.write(pedaco)
+        if recebido != tamanho_bloco:
+            # Conexão caiu no meio do bloco: descarta, o cliente reenvia
+            raise UploadError('Bloco incompleto.', 400)
+        # De novo, agora com o bloco inteiro: um PATCH paralelo pode ter
+        # gravado uma parte sobreposta enquanto este lia o corpo
+        _conferir_faixa(upload, offset, tamanho_bloco)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+def montar_upload(upload):
+    """
+    Concatena os blocos e envia o arquivo ao backend de mídia. O 'UPDATE ...
+    WHERE status = pendente' garante que só um dos PATCHes paralelos que
+    completaram o arquivo faça a montagem; uma montagem vencida (processo
+    que morreu no meio, ver MONTAGEM_MAX_SEGUNDOS) é retomada do zero. O
+    SHA-256 é calculado durante a concatenação: conteúdo já armazenado é
+    reaproveitado sem novo upload.
+    """
+    db = get_db()
+    cur = db.cursor()
+    cur.execute(
+        "UPDATE uploads SET status = 'montando', montando_desde = NOW() WHERE id = %s AND (status = 'pendente' "
+        "OR (status = 'montando' AND montando_desde < NOW() - make_interval(secs => %s)))",
+        (upload['id'], MONTAGEM_MAX_SEGUNDOS)
+    )
+    db.commit()
+    if cur.rowcount == 0:
+        cur.close()
+        return False
+
+    pasta = _pasta_upload(upload['id'])
+    montado = os.path.join(pasta, 'montado')
+    sha256 = hashlib.sha256()
+    try:
+        with open(montado, 'wb') as saida:
+            for offset, tamanho in partes_recebidas(upload['id']):
+                with open(os.path.join(pasta, f"{offset}.part"), 'rb') as parte:
+                    # Blocos sobrepostos (reenvios) são pulados até o ponto já escrito
+                    parte.seek(saida.tell() - offset)
+                    for bloco in iter(lambda: parte.read(TAMANHO_BLOCO_LEITURA), b''):
+                        sha256.update(bloco)
+                        saida.write(bloco)
+        with open(montado, 'rb') as arquivo:
+            try:
+                mimetype = validar_midia(arquivo, upload['tipo'], os.path.getsize(montado))
+            except UploadError:
+                # Conteúdo recusado: descarta o upload inteiro
+                cur.execute("DELETE FROM uploads WHERE id = %s", (upload['id'],))
+                db.commit()
+                cur.close()
+                shutil.rmtree(pasta, ignore_errors=True)
+                raise
+            sha256 = sha256.hexdigest()
+            objeto = buscar_media(cur, sha256, upload['tipo'])
+            db.commit()
+            if objeto is None:
+                storage = get_storage()
+                novo = storage.salvar(
+                    ArquivoMidia(arquivo, upload['nome_arquivo'], mimetype),
+                    PASTAS[upload['tipo']],
+                    tipo=upload['tipo'],
+                )
+                objeto = registrar_media(cur, storage, sha256, upload['tipo'], novo)
+    except (OSError, StorageError) as e:
+        current_app.logger.error(f"Falha ao montar o upload {upload['id']}: {e}")
+        cur.execute("UPDATE uploads SET status = 'pendente', montando_desde = NULL WHERE id = %s", (upload['id'],))
+        db.commit()
+        cur.close()
+        raise UploadError('Falha ao armazenar o arquivo. Tente novamente.', 500)
+
+    cur.execute(
+        "UPDATE uploads SET status = 'concluido', chave = %s, url = %s, sha256 = %s WHERE id = %s",
+        (objeto.chave, objeto.url, sha256, upload['id'])
+    )
+    db.commit()
+    cur.close()
+    shutil.rmtree(pasta, ignore_errors=True)
+    return True
+
+
+def _montagem_vencida(upload):
+    """True se o upload está 'montando' há mais de MONTAGEM_MAX_SEGUNDOS."""
+    desde = upload.get('montando_desde')
+    return (upload['status'] == 'montando' and desde is not None
+            and (datetime.now(timezone.utc) - desde).total_seconds() > MONTAGEM_MAX_SEGUNDOS)
+
+
+def consumir_upload(cur, upload_id, tipo):
+    """
+    Marca um upload concluído da sessão atual como usado e retorna (chave, url).
+    Roda na mesma transação do INSERT do relato. Retorna None se o ID não
+    for um upload concluído, do tipo certo e ainda não usado.
+    """
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        return None
+    cur.execute(
+        "UPDATE uploads SET status = 'usado' WHERE id = %s AND dono = %s AND tipo = %s AND status = 'concluido' "
+        "RETURNING chave, url",
+        (upload_id, session.get('sid'), tipo)
+    )
+    return cur.fetchone()
+
+
+def _cabecalhos(**extras):
+    cabecalhos = {'Tus-Resumable': TUS_VERSAO, 'Cache-Control': 'no-store'}
+    cabecalhos.update({k.replace('_', '-'): str(v) for k, v in extras.items()})
+    return cabecalhos
+
+
+def register_upload_routes(app, limiter):
+    """Registra as rotas de upload retomável e o comando de limpeza."""
+
+    @app.errorhandler(UploadError)
+    def upload_error(e):
+        return jsonify({'status': 'error', 'message': str(e)}), e.status, _cabecalhos()
+
+    @app.route('/uploads', methods=['POST'])
+    @limiter.limit("20 per hour")
+    def upload_criar():
+        try:
+            tamanho = int(request.headers.get('Upload-Length', ''))
+        except ValueError:
+            raise UploadError('Upload-Length é obrigatório.')
+        upload_id = criar_upload(tamanho, parse_metadata(request.headers.get('Upload-Metadata')))
+        return '', 201, _cabecalhos(
+            Location=url_for('upload_status', upload_id=upload_id),
+            Upload_Offset=0,
+            Upload_Id=upload_id,
+        )
+
+    # PATCH e HEAD têm limites próprios, por upload e por IP, acima do padrão:
+    # um arquivo de 10 MB são dezenas de blocos (e reenvios), mas um único
+    # upload não pode receber PATCHes sem fim
+    @app.route('/uploads/<upload_id>', methods=['HEAD', 'PATCH'])
+    @limiter.limit("120 per minute", key_func=lambda: f"upload:{request.view_args['upload_id']}")
+    @limiter.limit("600 per minute")
+    def upload_status(upload_id):
+        db = get_db()
+        cur = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        upload = _buscar_upload(cur, upload_id)
+        cur.close()
+
+        # PATCH repetido depois da montagem (resposta perdida no caminho): nada a gravar
+        if request.method == 'PATCH' and upload['status'] == 'pendente':
+            if request.mimetype != 'application/offset+octet-stream':
+                raise UploadError('Content-Type deve ser application/offset+octet-stream.', 415)
+            try:
+                offset = int(request.headers.get('Upload-Offset', ''))
+            except ValueError:
+                raise UploadError('Upload-Offset é obrigatório.')
+            gravar_bloco(upload, offset, request.stream, request.content_length or 0)
+
+        partes = partes_recebidas(upload_id)
+        recebido = offset_contiguo(partes)
+        if recebido >= upload['tamanho'] and (upload['status'] == 'pendente' or _montagem_vencida(upload)):
+            montar_upload(upload)
+        elif upload['status'] in ('concluido', 'usado', 'montando'):
+            recebido = upload['tamanho']
+
+        return '', (204 if request.method == 'PATCH' else 200), _cabecalhos(
+            Upload_Offset=recebido,
+            Upload_Length=upload['tamanho'],
+            Upload_Received=_faixas(partes),
+        )
+
+    app.cli.add_command(limpar_uploads_command)
+
+
+@click.command('limpar-uploads')
+@click.option('--horas', default=24, show_default=True, help='Idade mínima dos uploads abandonados.')
+@with_appcontext
+def limpar_uploads_command(horas):
+    """
+    Remove uploads abandonados e as mídias que ficaram sem nenhuma
+    referência, e devolve a 'pendente' montagens vencidas.
+    """
+    conn = get_pool().getconn()
+    try:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(
+            "UPDATE uploads SET status = 'pendente', montando_desde = NULL "
+            "WHERE status = 'montando' AND montando_desde < NOW() - make_interval(secs => %s)",
+            (MONTAGEM_MAX_SEGUNDOS,)
+        )
+        montagens_vencidas = cur.rowcount
+        cur.execute(
+            "DELETE FROM uploads WHERE status <> 'usado' AND criado_em < NOW() - make_interval(hours => %s) "
+            "RETURNING id",
+            (horas,)
+        )
+        uploads_removidos = [linha['id'] for linha in cur.fetchall()]
+        # Objetos enviados cujo relato/lenda nunca foi gravado (ref_count 0),
+        # desde que nenhum upload pendente de uso ainda aponte para eles
+        cur.execute(
+            """
+            DELETE FROM media m
+            WHERE m.ref_count = 0 AND m.atualizado_em < NOW() - make_interval(hours => %s)
+              AND NOT EXISTS (SELECT 1 FROM uploads u WHERE u.sha256 = m.sha256 AND u.status <> 'usado')
+            RETURNING chave, url, tipo
+            """,
+            (horas,)
+        )
+        midias_removidas = cur.fetchall()
+        conn.commit()
+        cur.close()
+    finally:
+        get_pool().putconn(conn)
+
+    for upload_id in uploads_removidos:
+        shutil.rmtree(_pasta_upload(str(upload_id)), ignore_errors=True)
+    storage = get_storage()
+    for midia in midias_removidas:
+        remover_midia(storage, midia['chave'], midia['url'], tipo=midia['tipo'])
+    click.echo(f"{len(uploads_removidos)} upload(s) abandonado(s) e {len(midias_removidas)} mídia(s) sem referência removidos; "
+               f"{montagens_vencidas} montagem(ns) vencida(s) devolvida(s) a 'pendente'.")
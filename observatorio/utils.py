@@ -1,21 +1,62 @@
 # observatorio/utils.py
 
-import requests
+import os
 from functools import wraps
 from urllib.parse import urlparse, urljoin
-from flask import request, Response, url_for, redirect, current_app
-import cloudinary
-import cloudinary.uploader
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from flask import (
+    request, Response, url_for, redirect, current_app,
+    render_template, stream_template, get_flashed_messages
+)
+from flask_wtf.csrf import generate_csrf
+
+# requests, cloudinary e smtplib são importados sob demanda (dentro das funções)
+# para não pesar no tempo de inicialização do app.
+
+_cloudinary_configurado = False
+
+def cloudinary_uploader():
+    """Importa e configura o Cloudinary no primeiro uso, retornando o módulo 'cloudinary.uploader'."""
+    global _cloudinary_configurado
+    import cloudinary
+    import cloudinary.uploader
+    if not _cloudinary_configurado:
+        cloudinary.config(
+            cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME'),
+            api_key = os.environ.get('CLOUDINARY_API_KEY'),
+            api_secret = os.environ.get('CLOUDINARY_API_SECRET'),
+            secure = True
+        )
+        _cloudinary_configurado = True
+    return cloudinary.uploader
+
+def render_streaming(template_name, **context):
+    """
+    Como render_template, mas envia a página enquanto ela é renderizada
+    (stream_template): o <head> sai logo e as linhas vindas de geradores
+    (db.iterar_linhas) saem à medida que são buscadas. Com
+    TEMPLATES_STREAMING desligado, renderiza tudo em memória.
+    """
+    if not current_app.config['TEMPLATES_STREAMING']:
+        return render_template(template_name, **context)
+    # O cookie de sessão vai nos cabeçalhos, antes do corpo: o token CSRF e
+    # as mensagens flash (que mudam a sessão) precisam ser lidos agora
+    generate_csrf()
+    get_flashed_messages()
+    response = Response(stream_template(template_name, **context), mimetype='text/html')
+    # Sem isso o nginx acumula a resposta inteira antes de repassar
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def is_admin_request():
+    """Verifica se a requisição traz as credenciais de admin (HTTP Basic)."""
+    auth = request.authorization
+    return bool(auth and auth.username == current_app.config['ADMIN_USERNAME'] and auth.password == current_app.config['ADMIN_PASSWORD'])
 
 def auth_required(f):
     """Decorador para proteger rotas que exigem autenticação de admin."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        auth = request.authorization
-        if auth and auth.username == current_app.config['ADMIN_USERNAME'] and auth.password == current_app.config['ADMIN_PASSWORD']:
+        if is_admin_request():
             return f(*args, **kwargs)
         return Response(
             'Acesso negado. Autenticação necessária.', 401,
@@ -25,12 +66,16 @@ def auth_required(f):
 
 def get_request_metadata():
     """Obtém IP, cidade e User-Agent do cliente que fez a requisição."""
+    import requests
+    from .budgets import prazo_vencido, prazo_restante
     ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
     user_agent = request.headers.get('User-Agent')
     city = "Desconhecida"
     try:
-        if not (ip_address.startswith('127.0.0.1') or ip_address.startswith('192.168.')):
-            geo_response = requests.get(f"http://ip-api.com/json/{ip_address}")
+        # Prazo da rota já vencido: grava sem a cidade em vez de atrasar mais
+        if not (ip_address.startswith('127.0.0.1') or ip_address.startswith('192.168.')) and not prazo_vencido():
+            # Dentro do orçamento da rota: no máximo o que resta do prazo
+            geo_response = requests.get(f"http://ip-api.com/json/{ip_address}", timeout=prazo_restante(3))
             if geo_response.status_code == 200 and geo_response.json().get('status') == 'success':
                 geo_data = geo_response.json()
                 city = f"{geo_data.get('city', '')}, {geo_data.get('regionName', '')}"
@@ -38,6 +83,43 @@ def get_request_metadata():
         current_app.logger.warning(f"Falha ao contatar API de geolocalização para IP {ip_address}: {e}")
     return ip_address, city, user_agent
 
+def load_oidc_metadata(app, metadata_url, ttl=24 * 3600):
+    """
+    Retorna os metadados OpenID do provedor (Google) com cache em disco, no
+    formato de kwargs aceito por 'oauth.register'. Evita a ida à rede a cada
+    boot do container; se o cache expirou e a busca falhar, usa o cache antigo.
+    """
+    import json
+    import time
+    import requests
+
+    cache_path = os.path.join(app.instance_path, 'oidc_metadata.json')
+    cached = None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if time.time() - cached.get('_loaded_at', 0) < ttl:
+            return cached
+    except (OSError, ValueError):
+        pass
+
+    try:
+        resp = requests.get(metadata_url, timeout=5)
+        resp.raise_for_status()
+        metadata = resp.json()
+        metadata['_loaded_at'] = time.time()
+        os.makedirs(app.instance_path, exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+        return metadata
+    except (requests.exceptions.RequestException, ValueError, OSError) as e:
+        app.logger.warning(f"Falha ao buscar metadados OIDC em {metadata_url}: {e}")
+
+    if cached:
+        return cached
+    # Sem cache: deixa o Authlib buscar os metadados por conta própria
+    return {'server_metadata_url': metadata_url}
+
 def is_safe_url(target):
     """Verifica se uma URL de redirecionamento é segura."""
     ref_url = urlparse(request.host_url)
@@ -68,6 +150,7 @@ def get_city_from_ip(ip_address):
     Recebe um endereço de IP e retorna a cidade.
     Esta é a função lenta que faz a chamada de rede para a API externa.
     """
+    import requests
     if not ip_address or ip_address.startswith('127.0.0.1') or ip_address.startswith('192.168.'):
         return "Desconhecida"
     
@@ -81,32 +164,27 @@ def get_city_from_ip(ip_address):
         
     return "Desconhecida"
 
-def upload_image_task(imagem_file, results):
-    """Esta função faz o upload da imagem e armazena a URL no dicionário de resultados."""
+def upload_image_task(storage, imagem_file, results, timeout=None):
+    """Esta função envia a imagem ao backend de armazenamento e guarda chave e URL no dicionário de resultados."""
+    from .storage import PASTA_IMAGENS, StorageError
     try:
-        upload_result = cloudinary.uploader.upload(
-            imagem_file,
-            folder="observatorio_uem_imagens",
-            transformation=[{'width': 1920, 'height': 1080, 'crop': 'limit'}, {'quality': 'auto', 'fetch_format': 'auto'}]
-        )
-        results['imagem_url'] = upload_result.get('secure_url')
-    except Exception as e:
-        current_app.logger.error(f"Erro na thread de upload de imagem: {e}")
+        objeto = storage.salvar(imagem_file, PASTA_IMAGENS, tipo='imagem', timeout=timeout)
+        results['imagem_url'] = objeto.url
+        results['imagem_key'] = objeto.chave
+    except StorageError as e:
+        print(f"Erro na thread de upload de imagem: {e}")
         results['imagem_url'] = None
         results['image_error'] = 'Houve um erro ao fazer o upload da imagem.'
 
-def upload_audio_task(audio_file, results):
-    """Esta função faz o upload do áudio e armazena a URL no dicionário de resultados."""
+def upload_audio_task(storage, audio_file, results, timeout=None):
+    """Esta função envia o áudio ao backend de armazenamento e guarda chave e URL no dicionário de resultados."""
+    from .storage import PASTA_AUDIOS, StorageError
     try:
-        upload_result = cloudinary.uploader.upload(
-            audio_file,
-            folder="observatorio_uem_audios",
-            resource_type="video",
-            transformation=[{'audio_codec': 'mp3', 'bit_rate': '64k'}]
-        )
-        results['audio_url'] = upload_result.get('secure_url')
-    except Exception as e:
-        current_app.logger.error(f"Erro na thread de upload de áudio: {e}")
+        objeto = storage.salvar(audio_file, PASTA_AUDIOS, tipo='audio', timeout=timeout)
+        results['audio_url'] = objeto.url
+        results['audio_key'] = objeto.chave
+    except StorageError as e:
+        print(f"Erro na thread de upload de áudio: {e}")
         results['audio_url'] = None
         results['audio_error'] = 'Houve um erro ao fazer o upload do áudio.'
 
@@ -122,6 +200,10 @@ def send_new_relato_notification(app, relato_data):
     Envia um e-mail de notificação para o admin sobre um novo relato.
     Projetado para ser executado em uma thread separada para não bloquear a requisição.
     """
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     with app.app_context():
         
         # Pega as configurações de e-mail do app
@@ -159,7 +241,7 @@ def send_new_relato_notification(app, relato_data):
         try:
             # Conecta ao servidor SMTP e envia o e-mail
             context = smtplib.ssl.create_default_context()
-            with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
+            with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=app.config['MAIL_TIMEOUT']) as server:
                 server.starttls(context=context)
                 server.login(sender_email, password)
                 server.sendmail(sender_email, receiver_email, message.as_string())
@@ -172,6 +254,10 @@ def send_approval_notification(app, user_email, relato_data):
     Envia um e-mail para o usuário informando que seu relato foi aprovado.
     Executado em uma thread para não bloquear a ação do admin.
     """
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     with app.app_context():
         sender_email = app.config['MAIL_USERNAME']
         password = app.config['MAIL_PASSWORD']
@@ -226,7 +312,7 @@ def send_approval_notification(app, user_email, relato_data):
         try:
             # Conecta ao servidor SMTP e envia o e-mail
             context = smtplib.ssl.create_default_context()
-            with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
+            with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=app.config['MAIL_TIMEOUT']) as server:
                 server.starttls(context=context)
                 server.login(sender_email, password)
                 server.sendmail(sender_email, user_email, message.as_string())
@@ -28,6 +28,70 @@ CREATE TABLE IF NOT EXISTS relatos (
 -- Adiciona colunas à tabela de relatos, somente se elas não existirem
 ALTER TABLE relatos ADD COLUMN IF NOT EXISTS audio_url TEXT;
 ALTER TABLE relatos ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id) ON DELETE SET NULL;
+-- Chave do objeto no backend de armazenamento (Cloudinary public_id, caminho local ou chave S3)
+ALTER TABLE relatos ADD COLUMN IF NOT EXISTS imagem_key TEXT;
+ALTER TABLE relatos ADD COLUMN IF NOT EXISTS audio_key TEXT;
+
+-- Metadados de origem das interações codificados em dicionário: cada cidade
+-- e cada User-Agent distinto é guardado uma vez e referenciado por um id.
+CREATE TABLE IF NOT EXISTS cities (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(100) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS user_agents (
+    id SERIAL PRIMARY KEY,
+    texto VARCHAR(255) NOT NULL UNIQUE
+);
+
+-- Id da cidade/User-Agent, criando a entrada na primeira vez. Usadas direto
+-- nos INSERTs: ... VALUES (ip_ou_nulo(%s), city_id_de(%s), user_agent_id_de(%s))
+CREATE OR REPLACE FUNCTION city_id_de(p_nome TEXT) RETURNS INTEGER AS $$
+DECLARE
+    v_id INTEGER;
+BEGIN
+    IF p_nome IS NULL THEN
+        RETURN NULL;
+    END IF;
+    p_nome := LEFT(p_nome, 100);
+    SELECT id INTO v_id FROM cities WHERE nome = p_nome;
+    IF v_id IS NULL THEN
+        INSERT INTO cities (nome) VALUES (p_nome) ON CONFLICT (nome) DO NOTHING RETURNING id INTO v_id;
+        IF v_id IS NULL THEN
+            SELECT id INTO v_id FROM cities WHERE nome = p_nome;
+        END IF;
+    END IF;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_agent_id_de(p_texto TEXT) RETURNS INTEGER AS $$
+DECLARE
+    v_id INTEGER;
+BEGIN
+    IF p_texto IS NULL THEN
+        RETURN NULL;
+    END IF;
+    p_texto := LEFT(p_texto, 255);
+    SELECT id INTO v_id FROM user_agents WHERE texto = p_texto;
+    IF v_id IS NULL THEN
+        INSERT INTO user_agents (texto) VALUES (p_texto) ON CONFLICT (texto) DO NOTHING RETURNING id INTO v_id;
+        IF v_id IS NULL THEN
+            SELECT id INTO v_id FROM user_agents WHERE texto = p_texto;
+        END IF;
+    END IF;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- IP do cliente como inet: primeiro endereço do X-Forwarded-For; NULL se inválido
+CREATE OR REPLACE FUNCTION ip_ou_nulo(p_ip TEXT) RETURNS INET AS $$
+BEGIN
+    RETURN NULLIF(btrim(split_part(p_ip, ',', 1)), '')::inet;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
 
 -- Cria a tabela de comentários, somente se ela não existir
 CREATE TABLE IF NOT EXISTS comentarios (
@@ -36,9 +100,9 @@ CREATE TABLE IF NOT EXISTS comentarios (
     texto VARCHAR(500) NOT NULL,
     denunciado BOOLEAN NOT NULL DEFAULT FALSE,
     criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    ip_address VARCHAR(45),
-    city VARCHAR(100),
-    user_agent VARCHAR(255)
+    ip_address INET,
+    city_id INTEGER REFERENCES cities(id),
+    user_agent_id INTEGER REFERENCES user_agents(id)
 );
 
 -- Adiciona colunas à tabela de comentários, somente se elas não existirem
@@ -47,28 +111,38 @@ ALTER TABLE comentarios ADD COLUMN IF NOT EXISTS autor VARCHAR(50);
 ALTER TABLE comentarios ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0;
 
 
--- Cria a tabela de votos, somente se ela não existir
+-- Tabelas de interação (votos, testemunhas, curtidas): registros append-only
+-- particionados por mês de criado_em. As partições (<tabela>_AAAA_MM) e a
+-- partição padrão são criadas por criar_particoes_mensais(), chamada no fim
+-- deste arquivo e por 'flask criar-particoes'; as antigas saem com
+-- 'flask arquivar-particoes'. Bancos criados antes do particionamento são
+-- convertidos uma vez com 'flask migrar-particoes'.
+-- Sem restrição UNIQUE global (ela teria de incluir criado_em): a checagem
+-- por sessão é feita na aplicação, usando os índices (…, session_id).
 CREATE TABLE IF NOT EXISTS votos (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     relato_id INTEGER NOT NULL REFERENCES relatos(id) ON DELETE CASCADE,
     session_id VARCHAR(36) NOT NULL,
     tipo_voto VARCHAR(10) NOT NULL,
     criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    ip_address VARCHAR(45),
-    city VARCHAR(100),
-    user_agent VARCHAR(255)
-);
+    ip_address INET,
+    city_id INTEGER REFERENCES cities(id),
+    user_agent_id INTEGER REFERENCES user_agents(id),
+    PRIMARY KEY (id, criado_em)
+) PARTITION BY RANGE (criado_em);
+CREATE INDEX IF NOT EXISTS idx_votos_relato_sessao ON votos (relato_id, session_id);
 
--- Cria a tabela de testemunhas, somente se ela não existir
 CREATE TABLE IF NOT EXISTS testemunhas (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     relato_id INTEGER NOT NULL REFERENCES relatos(id) ON DELETE CASCADE,
     session_id VARCHAR(36) NOT NULL,
     criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    ip_address VARCHAR(45),
-    city VARCHAR(100),
-    user_agent VARCHAR(255)
-);
+    ip_address INET,
+    city_id INTEGER REFERENCES cities(id),
+    user_agent_id INTEGER REFERENCES user_agents(id),
+    PRIMARY KEY (id, criado_em)
+) PARTITION BY RANGE (criado_em);
+CREATE INDEX IF NOT EXISTS idx_testemunhas_relato_sessao ON testemunhas (relato_id, session_id);
 
 -- Cria a tabela de lendas, somente se ela não existir
 CREATE TABLE IF NOT EXISTS lendas (
@@ -78,14 +152,317 @@ CREATE TABLE IF NOT EXISTS lendas (
     local VARCHAR(255) NOT NULL,
     imagem_url VARCHAR(255)
 );
+ALTER TABLE lendas ADD COLUMN IF NOT EXISTS imagem_key TEXT;
 
 CREATE TABLE IF NOT EXISTS comentarios_likes (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     comentario_id INTEGER NOT NULL REFERENCES comentarios(id) ON DELETE CASCADE,
     session_id VARCHAR(36) NOT NULL,
     criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    ip_address VARCHAR(45),
-    city VARCHAR(100),
-    user_agent VARCHAR(255),
-    UNIQUE (comentario_id, session_id)
-);
\ No newline at end of file
+    ip_address INET,
+    city_id INTEGER REFERENCES cities(id),
+    user_agent_id INTEGER REFERENCES user_agents(id),
+    PRIMARY KEY (id, criado_em)
+) PARTITION BY RANGE (criado_em);
+CREATE INDEX IF NOT EXISTS idx_comentarios_likes_comentario_sessao ON comentarios_likes (comentario_id, session_id);
+CREATE INDEX IF NOT EXISTS idx_comentarios_likes_sessao ON comentarios_likes (session_id);
+
+-- Sessões de upload retomável (observatorio/uploads.py). Os blocos ficam em
+-- disco até a montagem; depois a linha guarda a chave/URL no backend de mídia.
+CREATE TABLE IF NOT EXISTS uploads (
+    id UUID PRIMARY KEY,
+    dono VARCHAR(36) NOT NULL,
+    tipo VARCHAR(10) NOT NULL,
+    tamanho INTEGER NOT NULL,
+    nome_arquivo VARCHAR(255),
+    content_type VARCHAR(100),
+    status VARCHAR(10) NOT NULL DEFAULT 'pendente',
+    chave TEXT,
+    url TEXT,
+    criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_abandonados ON uploads (criado_em) WHERE status <> 'usado';
+ALTER TABLE uploads ADD COLUMN IF NOT EXISTS sha256 CHAR(64);
+-- Início da montagem: 'montando' antigo demais é de um processo que morreu (uploads.py)
+ALTER TABLE uploads ADD COLUMN IF NOT EXISTS montando_desde TIMESTAMP WITH TIME ZONE;
+
+-- Mídias armazenadas, endereçadas pelo conteúdo (SHA-256). Cada arquivo
+-- distinto é enviado ao backend uma vez; relatos e lendas com o mesmo
+-- conteúdo compartilham o objeto, removido quando ref_count chega a zero.
+CREATE TABLE IF NOT EXISTS media (
+    sha256 CHAR(64) NOT NULL,
+    tipo VARCHAR(10) NOT NULL,
+    chave TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    atualizado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sha256, tipo)
+);
+CREATE INDEX IF NOT EXISTS idx_media_sem_referencia ON media (atualizado_em) WHERE ref_count = 0;
+CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256);
+
+-- Listagem paginada de relatos aprovados (/api/relatos): um índice parcial
+-- por ordenação, na mesma ordem do ORDER BY e da chave do cursor, mais os
+-- filtros de igualdade mais comuns à frente da chave.
+CREATE INDEX IF NOT EXISTS idx_relatos_aprovados_recentes ON relatos (criado_em DESC, id DESC) WHERE aprovado;
+CREATE INDEX IF NOT EXISTS idx_relatos_aprovados_acredito ON relatos (votos_acredito DESC, id DESC) WHERE aprovado;
+CREATE INDEX IF NOT EXISTS idx_relatos_aprovados_categoria ON relatos (categoria, criado_em DESC, id DESC) WHERE aprovado;
+CREATE INDEX IF NOT EXISTS idx_relatos_aprovados_local ON relatos (local, criado_em DESC, id DESC) WHERE aprovado;
+
+-- Listas paginadas do perfil (relatos e comentários de um investigador)
+CREATE INDEX IF NOT EXISTS idx_relatos_user ON relatos (user_id, criado_em DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comentarios_user ON comentarios (user_id, criado_em DESC, id DESC);
+
+-- Cabeçalho do perfil: contadores por investigador, mantidos pelos triggers
+-- abaixo a cada relato/comentário criado, removido ou reatribuído e a cada
+-- voto recebido (acredito + cético), sem varrer as tabelas na leitura.
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    relatos_count INTEGER NOT NULL DEFAULT 0,
+    comentarios_count INTEGER NOT NULL DEFAULT 0,
+    votos_recebidos INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION ajustar_user_stats(p_user_id INTEGER, d_relatos INTEGER, d_comentarios INTEGER, d_votos INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    IF p_user_id IS NULL OR (d_relatos = 0 AND d_comentarios = 0 AND d_votos = 0) THEN
+        RETURN;
+    END IF;
+    UPDATE user_stats
+    SET relatos_count = relatos_count + d_relatos,
+        comentarios_count = comentarios_count + d_comentarios,
+        votos_recebidos = votos_recebidos + d_votos
+    WHERE user_id = p_user_id;
+    IF NOT FOUND THEN
+        -- O EXISTS evita recriar a linha quando o próprio usuário está sendo excluído
+        INSERT INTO user_stats (user_id, relatos_count, comentarios_count, votos_recebidos)
+        SELECT p_user_id, d_relatos, d_comentarios, d_votos
+        WHERE EXISTS (SELECT 1 FROM users WHERE id = p_user_id)
+        ON CONFLICT (user_id) DO UPDATE SET
+            relatos_count = user_stats.relatos_count + EXCLUDED.relatos_count,
+            comentarios_count = user_stats.comentarios_count + EXCLUDED.comentarios_count,
+            votos_recebidos = user_stats.votos_recebidos + EXCLUDED.votos_recebidos;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION relatos_user_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM ajustar_user_stats(NEW.user_id, 1, 0, NEW.votos_acredito + NEW.votos_cetico);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM ajustar_user_stats(OLD.user_id, -1, 0, -(OLD.votos_acredito + OLD.votos_cetico));
+    ELSIF NEW.user_id IS DISTINCT FROM OLD.user_id THEN
+        PERFORM ajustar_user_stats(OLD.user_id, -1, 0, -(OLD.votos_acredito + OLD.votos_cetico));
+        PERFORM ajustar_user_stats(NEW.user_id, 1, 0, NEW.votos_acredito + NEW.votos_cetico);
+    ELSE
+        PERFORM ajustar_user_stats(NEW.user_id, 0, 0,
+            (NEW.votos_acredito + NEW.votos_cetico) - (OLD.votos_acredito + OLD.votos_cetico));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_relatos_user_stats ON relatos;
+CREATE TRIGGER trg_relatos_user_stats
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, votos_acredito, votos_cetico ON relatos
+    FOR EACH ROW EXECUTE FUNCTION relatos_user_stats();
+
+CREATE OR REPLACE FUNCTION comentarios_user_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM ajustar_user_stats(NEW.user_id, 0, 1, 0);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM ajustar_user_stats(OLD.user_id, 0, -1, 0);
+    ELSIF NEW.user_id IS DISTINCT FROM OLD.user_id THEN
+        PERFORM ajustar_user_stats(OLD.user_id, 0, -1, 0);
+        PERFORM ajustar_user_stats(NEW.user_id, 0, 1, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_comentarios_user_stats ON comentarios;
+CREATE TRIGGER trg_comentarios_user_stats
+    AFTER INSERT OR DELETE OR UPDATE OF user_id ON comentarios
+    FOR EACH ROW EXECUTE FUNCTION comentarios_user_stats();
+
+-- Recalcula tudo a partir das tabelas (carga inicial e correção de desvios
+-- a cada 'flask init-db')
+INSERT INTO user_stats (user_id, relatos_count, comentarios_count, votos_recebidos)
+SELECT u.id,
+       (SELECT COUNT(*) FROM relatos r WHERE r.user_id = u.id),
+       (SELECT COUNT(*) FROM comentarios c WHERE c.user_id = u.id),
+       (SELECT COALESCE(SUM(r.votos_acredito + r.votos_cetico), 0) FROM relatos r WHERE r.user_id = u.id)
+FROM users u
+ON CONFLICT (user_id) DO UPDATE SET
+    relatos_count = EXCLUDED.relatos_count,
+    comentarios_count = EXCLUDED.comentarios_count,
+    votos_recebidos = EXCLUDED.votos_recebidos;
+
+-- Última alteração de cada relato e lenda, usada como marca d'água pelo
+-- 'flask freeze' (estatico.py) para refazer só as páginas que mudaram.
+-- Atualizada por trigger em qualquer UPDATE (aprovação, votos, edição) e,
+-- no relato, também quando um comentário é criado, editado ou removido.
+ALTER TABLE relatos ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE lendas ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_relatos_aprovados_atualizados ON relatos (atualizado_em) WHERE aprovado;
+
+CREATE OR REPLACE FUNCTION tocar_atualizado_em() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.atualizado_em := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_relatos_atualizado_em ON relatos;
+CREATE TRIGGER trg_relatos_atualizado_em
+    BEFORE UPDATE ON relatos
+    FOR EACH ROW EXECUTE FUNCTION tocar_atualizado_em();
+
+DROP TRIGGER IF EXISTS trg_lendas_atualizado_em ON lendas;
+CREATE TRIGGER trg_lendas_atualizado_em
+    BEFORE UPDATE ON lendas
+    FOR EACH ROW EXECUTE FUNCTION tocar_atualizado_em();
+
+-- Curtidas (like_count) ficam de fora: tocariam o relato a cada clique
+CREATE OR REPLACE FUNCTION comentarios_tocar_relato() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE relatos SET atualizado_em = NOW() WHERE id = OLD.relato_id;
+    ELSE
+        UPDATE relatos SET atualizado_em = NOW() WHERE id = NEW.relato_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_comentarios_tocar_relato ON comentarios;
+CREATE TRIGGER trg_comentarios_tocar_relato
+    AFTER INSERT OR DELETE OR UPDATE OF texto ON comentarios
+    FOR EACH ROW EXECUTE FUNCTION comentarios_tocar_relato();
+
+-- Quase-duplicatas (similaridade.py): assinatura MinHash da descrição do
+-- relato e do texto do comentário, as chaves LSH (uma por faixa da
+-- assinatura) e a raiz do grupo de cópias em que o texto caiu (o texto mais
+-- antigo do grupo). O índice GIN sobre as chaves responde "quem coincide com
+-- este texto em alguma faixa" sem varrer a tabela.
+ALTER TABLE relatos ADD COLUMN IF NOT EXISTS minhash INTEGER[];
+ALTER TABLE relatos ADD COLUMN IF NOT EXISTS minhash_bandas BIGINT[];
+ALTER TABLE relatos ADD COLUMN IF NOT EXISTS duplicata_de INTEGER REFERENCES relatos(id) ON DELETE SET NULL;
+ALTER TABLE comentarios ADD COLUMN IF NOT EXISTS minhash INTEGER[];
+ALTER TABLE comentarios ADD COLUMN IF NOT EXISTS minhash_bandas BIGINT[];
+ALTER TABLE comentarios ADD COLUMN IF NOT EXISTS duplicata_de INTEGER REFERENCES comentarios(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_relatos_minhash_bandas ON relatos USING GIN (minhash_bandas);
+CREATE INDEX IF NOT EXISTS idx_relatos_duplicata_de ON relatos (duplicata_de) WHERE duplicata_de IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_comentarios_minhash_bandas ON comentarios USING GIN (minhash_bandas);
+CREATE INDEX IF NOT EXISTS idx_comentarios_duplicata_de ON comentarios (duplicata_de) WHERE duplicata_de IS NOT NULL;
+
+-- Registro de locais (locais.py). 'flask importar-locais' carrega o
+-- locais_uem.json; qualquer alteração incrementa locais_versao, que os
+-- workers consultam para recarregar o registro sem reinício.
+CREATE TABLE IF NOT EXISTS locais (
+    nome VARCHAR(255) PRIMARY KEY,
+    lat DOUBLE PRECISION NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    atualizado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS locais_versao (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    versao BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO locais_versao (id, versao) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION locais_nova_versao() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE locais_versao SET versao = versao + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_locais_versao ON locais;
+CREATE TRIGGER trg_locais_versao
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON locais
+    FOR EACH STATEMENT EXECUTE FUNCTION locais_nova_versao();
+
+DROP TRIGGER IF EXISTS trg_locais_atualizado_em ON locais;
+CREATE TRIGGER trg_locais_atualizado_em
+    BEFORE UPDATE ON locais
+    FOR EACH ROW EXECUTE FUNCTION tocar_atualizado_em();
+
+-- Agregados diários por (local, categoria), lidos por /api/stats, rankings e
+-- o painel admin no lugar de GROUP BY sobre relatos e interações. Mantidos
+-- por observatorio/estatisticas.py: o dia vem de criado_em no fuso
+-- ESTATISTICAS_FUSO; votos, testemunhas e comentários contam no local e na
+-- categoria do relato.
+CREATE TABLE IF NOT EXISTS estatisticas_diarias (
+    dia DATE NOT NULL,
+    local VARCHAR(255) NOT NULL,
+    categoria VARCHAR(50) NOT NULL,
+    relatos INTEGER NOT NULL DEFAULT 0,
+    relatos_aprovados INTEGER NOT NULL DEFAULT 0,
+    votos_acredito INTEGER NOT NULL DEFAULT 0,
+    votos_cetico INTEGER NOT NULL DEFAULT 0,
+    testemunhas INTEGER NOT NULL DEFAULT 0,
+    comentarios INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, local, categoria)
+);
+
+-- Marca d'água por tabela de origem: maior id já agregado
+CREATE TABLE IF NOT EXISTS estatisticas_marcas (
+    tabela VARCHAR(50) PRIMARY KEY,
+    ultimo_id BIGINT NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP WITH TIME ZONE
+);
+
+-- Dias antigos a recalcular, marcados pelas rotas de moderação (aprovação e
+-- exclusão mudam dias que a marca d'água não enxerga)
+CREATE TABLE IF NOT EXISTS estatisticas_pendentes (
+    dia DATE PRIMARY KEY
+);
+
+-- Cria a partição padrão e as partições mensais de 'tabela' do mês de
+-- 'desde' até 'meses_a_frente' meses depois do atual. Linhas que caíram na
+-- partição padrão por falta da partição do mês são movidas para ela antes do
+-- ATTACH. Não faz nada se a tabela ainda não é particionada.
+CREATE OR REPLACE FUNCTION criar_particoes_mensais(tabela TEXT, meses_a_frente INTEGER DEFAULT 3, desde DATE DEFAULT CURRENT_DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    mes DATE := date_trunc('month', desde)::date;
+    ultimo DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => meses_a_frente))::date;
+    proximo DATE;
+    nome TEXT;
+    criadas INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass(tabela) AND relkind = 'p') THEN
+        RETURN 0;
+    END IF;
+    IF to_regclass(tabela || '_padrao') IS NULL THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', tabela || '_padrao', tabela);
+    END IF;
+    WHILE mes <= ultimo LOOP
+        proximo := (mes + INTERVAL '1 month')::date;
+        nome := tabela || '_' || to_char(mes, 'YYYY_MM');
+        IF to_regclass(nome) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', nome, tabela);
+            EXECUTE format(
+                'WITH movidas AS (DELETE FROM %I WHERE criado_em >= %L AND criado_em < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM movidas',
+                tabela || '_padrao', mes, proximo, nome);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           tabela, nome, mes, proximo);
+            criadas := criadas + 1;
+        END IF;
+        mes := proximo;
+    END LOOP;
+    RETURN criadas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT criar_particoes_mensais('votos');
+SELECT criar_particoes_mensais('testemunhas');
+SELECT criar_particoes_mensais('comentarios_likes');
@@ -0,0 +1,77 @@
+// Gráfico de barras do painel de admin, lido de /api/stats (agregados diários).
+// SVG puro, sem biblioteca de gráficos.
+
+const SVG_NS = 'http://www.w3.org/2000/svg';
+const DIAS_POR_INTERVALO = { dia: 90, semana: 365, mes: 3 * 365 };
+
+function elementoSvg(nome, atributos) {
+    const elemento = document.createElementNS(SVG_NS, nome);
+    Object.entries(atributos).forEach(([chave, valor]) => elemento.setAttribute(chave, valor));
+    return elemento;
+}
+
+function isoDiasAtras(dias) {
+    const data = new Date();
+    data.setDate(data.getDate() - dias);
+    return data.toISOString().slice(0, 10);
+}
+
+function desenharSerie(container, serie) {
+    const largura = 800, altura = 200, margem = 20;
+    const maximo = Math.max(1, ...serie.map(ponto => ponto.valor));
+    const passo = (largura - 2 * margem) / Math.max(1, serie.length);
+    const svg = elementoSvg('svg', { viewBox: `0 0 ${largura} ${altura}`, preserveAspectRatio: 'none' });
+
+    serie.forEach((ponto, i) => {
+        const h = (altura - 2 * margem) * ponto.valor / maximo;
+        const barra = elementoSvg('rect', {
+            x: margem + i * passo, y: altura - margem - h,
+            width: Math.max(1, passo - 1), height: h,
+        });
+        const titulo = elementoSvg('title', {});
+        titulo.textContent = `${ponto.periodo}: ${ponto.valor}`;
+        barra.appendChild(titulo);
+        svg.appendChild(barra);
+    });
+
+    const rotuloMaximo = elementoSvg('text', { x: 2, y: margem - 5 });
+    rotuloMaximo.textContent = maximo;
+    svg.appendChild(rotuloMaximo);
+    if (serie.length) {
+        const inicio = elementoSvg('text', { x: margem, y: altura - 5 });
+        inicio.textContent = serie[0].periodo;
+        const fim = elementoSvg('text', { x: largura - margem, y: altura - 5, 'text-anchor': 'end' });
+        fim.textContent = serie[serie.length - 1].periodo;
+        svg.append(inicio, fim);
+    }
+    container.replaceChildren(svg);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.getElementById('stats-grafico');
+    const metrica = document.getElementById('stats-metrica');
+    const intervalo = document.getElementById('stats-intervalo');
+    if (!container) return;
+
+    async function atualizar() {
+        const params = new URLSearchParams({
+            tipo: 'serie',
+            metrica: metrica.value,
+            intervalo: intervalo.value,
+            desde: isoDiasAtras(DIAS_POR_INTERVALO[intervalo.value] - 1),
+        });
+        try {
+            const response = await fetch(`/api/stats?${params}`, { headers: { 'Accept': 'application/json' } });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const data = await response.json();
+            desenharSerie(container, data.serie);
+        } catch (error) {
+            console.error('Erro ao carregar estatísticas:', error);
+            container.textContent = 'Não foi possível carregar as estatísticas.';
+        }
+    }
+
+    metrica.addEventListener('change', atualizar);
+    intervalo.addEventListener('change', atualizar);
+    atualizar();
+});
@@ -57,7 +57,7 @@ function createPopupContent(local, marker) {
         }
 
         // Adiciona a miniatura da imagem se ela existir
-        let imageHtml = relato.imagem_url ? `<div class="popup-image-container"><img src="${relato.imagem_url}" alt="Miniatura do relato"></div>` : '';
+        let imageHtml = relato.imagem_thumb ? `<div class="popup-image-container"><img src="${relato.imagem_thumb}" alt="Miniatura do relato" loading="lazy" width="320"></div>` : '';
 
         const content = `
             <div class="popup-content">
@@ -116,3 +116,27 @@ if (typeof locais_data !== 'undefined' && locais_data) {
         createPopupContent(local, marker);
     });
 }
+
+// Clique fora dos marcadores: o local conhecido mais próximo (grade espacial
+// do servidor), com atalho para relatar algo ali
+map.on('click', (evento) => {
+    const { lat, lng } = evento.latlng;
+    fetch(`/api/locais/proximos?lat=${lat}&lon=${lng}&raio=300`)
+        .then(resposta => resposta.ok ? resposta.json() : null)
+        .then(dados => {
+            if (!dados || !dados.locais.length) return;
+            const local = dados.locais[0];
+            const conteudo = document.createElement('div');
+            conteudo.className = 'popup-content';
+            const titulo = document.createElement('h4');
+            titulo.textContent = local.local;
+            const distancia = document.createElement('p');
+            distancia.textContent = `A cerca de ${local.distancia_m} m do ponto clicado.`;
+            const link = document.createElement('a');
+            link.href = `/submit?local=${encodeURIComponent(local.local)}`;
+            link.textContent = 'Relatar algo aqui...';
+            conteudo.append(titulo, distancia, link);
+            L.popup().setLatLng([local.lat, local.lon]).setContent(conteudo).openOn(map);
+        })
+        .catch(() => {});
+});
@@ -0,0 +1,166 @@
+// Worker de compressão de mídia usado pelo submit.js antes do upload.
+// - imagem: redimensiona para caber em 1920x1080 (o mesmo 'crop: limit' que
+//   o Cloudinary aplicava) e recodifica em WebP/JPEG num OffscreenCanvas;
+// - audio: recebe amostras mono a 48 kHz já decodificadas pela página e as
+//   codifica em Opus (WebCodecs), empacotando num arquivo Ogg.
+// Responde { id, ok, resultado } ou { id, ok: false, erro }.
+
+const OPUS_PRE_SKIP = 312;
+const OPUS_GRANULE_HZ = 48000;
+const BYTES_POR_PAGINA = 4096;
+
+self.onmessage = async (e) => {
+    const { id, acao } = e.data;
+    try {
+        let resultado;
+        if (acao === 'imagem') {
+            resultado = await reduzirImagem(e.data.arquivo, e.data.maxLargura, e.data.maxAltura, e.data.qualidade);
+        } else if (acao === 'audio') {
+            resultado = await codificarOpus(e.data.amostras, e.data.taxa, e.data.bitrate);
+        } else {
+            throw new Error(`Ação desconhecida: ${acao}`);
+        }
+        self.postMessage({ id, ok: true, resultado });
+    } catch (err) {
+        self.postMessage({ id, ok: false, erro: String((err && err.message) || err) });
+    }
+};
+
+async function reduzirImagem(arquivo, maxLargura, maxAltura, qualidade) {
+    if (typeof OffscreenCanvas === 'undefined') throw new Error('sem-suporte');
+    const bitmap = await createImageBitmap(arquivo, { imageOrientation: 'from-image' });
+    const escala = Math.min(1, maxLargura / bitmap.width, maxAltura / bitmap.height);
+    const largura = Math.max(1, Math.round(bitmap.width * escala));
+    const altura = Math.max(1, Math.round(bitmap.height * escala));
+
+    const canvas = new OffscreenCanvas(largura, altura);
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, largura, altura);
+    bitmap.close();
+
+    let blob = await canvas.convertToBlob({ type: 'image/webp', quality: qualidade });
+    // Navegadores sem codificador WebP devolvem PNG: usa JPEG nesse caso
+    if (blob.type !== 'image/webp') blob = await canvas.convertToBlob({ type: 'image/jpeg', quality: qualidade });
+    return blob;
+}
+
+async function codificarOpus(amostras, taxa, bitrate) {
+    if (typeof AudioEncoder === 'undefined') throw new Error('sem-suporte');
+    const config = { codec: 'opus', sampleRate: taxa, numberOfChannels: 1, bitrate };
+    const { supported } = await AudioEncoder.isConfigSupported(config);
+    if (!supported) throw new Error('sem-suporte');
+
+    const pacotes = [];
+    let falha = null;
+    const encoder = new AudioEncoder({
+        output: (chunk) => {
+            const dados = new Uint8Array(chunk.byteLength);
+            chunk.copyTo(dados);
+            pacotes.push({ dados, amostras: Math.round((chunk.duration || 20000) * OPUS_GRANULE_HZ / 1e6) });
+        },
+        error: (err) => { falha = err; },
+    });
+    encoder.configure(config);
+
+    // Alimenta o encoder em blocos de 1 segundo
+    for (let inicio = 0; inicio < amostras.length; inicio += taxa) {
+        const parte = amostras.subarray(inicio, Math.min(inicio + taxa, amostras.length));
+        const dados = new AudioData({
+            format: 'f32-planar',
+            sampleRate: taxa,
+            numberOfFrames: parte.length,
+            numberOfChannels: 1,
+            timestamp: Math.round(inicio * 1e6 / taxa),
+            data: parte,
+        });
+        encoder.encode(dados);
+        dados.close();
+    }
+    await encoder.flush();
+    encoder.close();
+    if (falha) throw falha;
+
+    const totalGranulos = Math.round(amostras.length * OPUS_GRANULE_HZ / taxa);
+    return new Blob(montarOgg(pacotes, taxa, totalGranulos), { type: 'audio/ogg' });
+}
+
+// --- Ogg Opus (RFC 7845) ---
+
+const TABELA_CRC = (() => {
+    const tabela = new Uint32Array(256);
+    for (let i = 0; i < 256; i++) {
+        let r = i << 24;
+        for (let j = 0; j < 8; j++) r = (r & 0x80000000) ? ((r << 1) ^ 0x04c11db7) : (r << 1);
+        tabela[i] = r >>> 0;
+    }
+    return tabela;
+})();
+
+function crcOgg(bytes) {
+    let crc = 0;
+    for (let i = 0; i < bytes.length; i++) crc = ((crc << 8) ^ TABELA_CRC[((crc >>> 24) ^ bytes[i]) & 0xff]) >>> 0;
+    return crc;
+}
+
+function paginaOgg(pacotes, granulo, serial, sequencia, flags) {
+    const lacing = [];
+    for (const p of pacotes) {
+        let restante = p.length;
+        while (restante >= 255) { lacing.push(255); restante -= 255; }
+        lacing.push(restante);
+    }
+    const corpo = pacotes.reduce((total, p) => total + p.length, 0);
+    const pagina = new Uint8Array(27 + lacing.length + corpo);
+    const view = new DataView(pagina.buffer);
+    pagina.set([0x4f, 0x67, 0x67, 0x53]); // 'OggS'
+    view.setUint8(5, flags);
+    view.setBigInt64(6, BigInt(granulo), true);
+    view.setUint32(14, serial, true);
+    view.setUint32(18, sequencia, true);
+    view.setUint8(26, lacing.length);
+    pagina.set(lacing, 27);
+    let pos = 27 + lacing.length;
+    for (const p of pacotes) { pagina.set(p, pos); pos += p.length; }
+    view.setUint32(22, crcOgg(pagina), true);
+    return pagina;
+}
+
+function montarOgg(pacotes, taxaOriginal, totalGranulos) {
+    const serial = (Math.random() * 0xffffffff) >>> 0;
+    const texto = new TextEncoder();
+    const paginas = [];
+    let sequencia = 0;
+
+    const cabecalho = new Uint8Array(19);
+    const vc = new DataView(cabecalho.buffer);
+    cabecalho.set(texto.encode('OpusHead'));
+    vc.setUint8(8, 1);   // versão
+    vc.setUint8(9, 1);   // canais
+    vc.setUint16(10, OPUS_PRE_SKIP, true);
+    vc.setUint32(12, taxaOriginal, true);
+    paginas.push(paginaOgg([cabecalho], 0, serial, sequencia++, 0x02));
+
+    const fornecedor = texto.encode('observatorio');
+    const tags = new Uint8Array(8 + 4 + fornecedor.length + 4);
+    tags.set(texto.encode('OpusTags'));
+    new DataView(tags.buffer).setUint32(8, fornecedor.length, true);
+    tags.set(fornecedor, 12);
+    paginas.push(paginaOgg([tags], 0, serial, sequencia++, 0));
+
+    let granulo = OPUS_PRE_SKIP;
+    let pagina = [];
+    let bytes = 0;
+    pacotes.forEach((p, i) => {
+        pagina.push(p.dados);
+        bytes += p.dados.length;
+        granulo += p.amostras;
+        const ultimo = i === pacotes.length - 1;
+        if (ultimo || bytes >= BYTES_POR_PAGINA || pagina.length >= 200) {
+            // Na última página o granulo marca o fim real do áudio (descarta o preenchimento)
+            const final = ultimo ? Math.min(granulo, OPUS_PRE_SKIP + totalGranulos) : granulo;
+            paginas.push(paginaOgg(pagina, final, serial, sequencia++, ultimo ? 0x04 : 0));
+            pagina = [];
+            bytes = 0;
+        }
+    });
+    return paginas;
+}
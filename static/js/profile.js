@@ -0,0 +1,67 @@
+// "Carregar mais" nas listas do perfil: as páginas seguintes vêm da API
+// (/api/users/<id>/relatos e /api/users/<id>/comentarios), por cursor.
+
+function formatarData(iso) {
+    const [ano, mes, dia] = iso.slice(0, 10).split('-');
+    return `${dia}/${mes}/${ano}`;
+}
+
+function criarSpan(classe, texto) {
+    const span = document.createElement('span');
+    span.className = classe;
+    span.textContent = texto;
+    return span;
+}
+
+function itemRelato(relato) {
+    const link = document.createElement('a');
+    link.href = `/relato/${relato.id}`;
+    link.appendChild(criarSpan('profile-list-title', relato.titulo));
+    link.appendChild(relato.aprovado
+        ? criarSpan('profile-list-meta status-aprovado', 'Aprovado')
+        : criarSpan('profile-list-meta status-pendente', 'Pendente'));
+    link.appendChild(criarSpan('profile-list-meta', formatarData(relato.criado_em)));
+    return link;
+}
+
+function itemComentario(comentario) {
+    const link = document.createElement('a');
+    link.href = `/relato/${comentario.relato_id}#comment-${comentario.id}`;
+    link.appendChild(criarSpan('profile-list-title', `"${comentario.trecho}${comentario.truncado ? '...' : ''}"`));
+    link.appendChild(criarSpan('profile-list-meta', `Em: ${comentario.relato_titulo}`));
+    return link;
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('.btn-load-more').forEach(button => {
+        const lista = document.getElementById(button.dataset.lista);
+        const tipo = button.dataset.tipo;
+        const montarItem = tipo === 'relatos' ? itemRelato : itemComentario;
+
+        button.addEventListener('click', async () => {
+            button.disabled = true;
+            try {
+                const url = `${button.dataset.url}?cursor=${encodeURIComponent(button.dataset.proximo)}`;
+                const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const data = await response.json();
+
+                data[tipo].forEach(item => {
+                    const li = document.createElement('li');
+                    li.appendChild(montarItem(item));
+                    lista.appendChild(li);
+                });
+                if (data.proximo) {
+                    button.dataset.proximo = data.proximo;
+                    button.disabled = false;
+                } else {
+                    button.remove();
+                }
+            } catch (error) {
+                console.error('Erro ao carregar mais itens do perfil:', error);
+                button.textContent = 'Erro ao carregar. Tentar novamente';
+                button.disabled = false;
+            }
+        });
+    });
+});
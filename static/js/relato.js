@@ -13,10 +13,37 @@ document.addEventListener('DOMContentLoaded', () => {
         updateCounter('texto', 1000);
     }
 
-    const csrfToken = document.querySelector('meta[name="csrf-token"]')?.getAttribute('content');
-    if (!csrfToken) {
+    const csrfMeta = document.querySelector('meta[name="csrf-token"]');
+    if (!csrfMeta) {
         console.error("ERRO CRÍTICO: Meta tag CSRF 'csrf-token' não encontrada no <head>.");
     }
+    let csrfToken = csrfMeta?.getAttribute('content');
+
+    // Páginas estáticas (flask freeze) vêm com a meta tag vazia: o token da
+    // sessão é pedido ao servidor só na primeira ação.
+    async function obterCsrfToken() {
+        if (!csrfToken) {
+            const response = await fetch('/csrf-token', { headers: { 'Accept': 'application/json' } });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            csrfToken = (await response.json()).csrf_token;
+        }
+        return csrfToken;
+    }
+
+    document.querySelectorAll('.report-form').forEach(form => {
+        form.addEventListener('submit', async (e) => {
+            const campo = form.querySelector('input[name="csrf_token"]');
+            if (!campo || campo.value) return;
+            e.preventDefault();
+            try {
+                campo.value = await obterCsrfToken();
+                form.submit();
+            } catch (error) {
+                console.error("Erro ao obter o token CSRF:", error);
+                alert('Falha na comunicação com o servidor.');
+            }
+        });
+    });
 
     const voteSection = document.querySelector('.vote-section');
     if (voteSection) {
@@ -44,7 +71,7 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 const response = await fetch(endpoint, { 
                     method: 'POST',
-                    headers: { 'X-CSRFToken': csrfToken }
+                    headers: { 'X-CSRFToken': await obterCsrfToken() }
                 });
                 const data = await response.json();
 
@@ -72,14 +99,16 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     
     // --- LÓGICA DE LIKE/UNLIKE ATUALIZADA ---
+    // URLs dos ícones vêm do template (os nomes têm hash após o build de assets)
+    const listaComentarios = document.querySelector('.comments-list');
     document.querySelectorAll('.like-icon').forEach(icon => {
         icon.addEventListener('click', async function likeToggleHandler(e) {
             const likeIcon = e.target;
             const commentContainer = likeIcon.closest('.like-container');
             const commentId = commentContainer.dataset.commentId;
 
-            if (!commentId || !csrfToken) {
-                console.error("Faltando ID do comentário ou token CSRF.");
+            if (!commentId) {
+                console.error("Faltando ID do comentário.");
                 return;
             }
 
@@ -90,7 +119,7 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 const response = await fetch(`/like_comment/${commentId}`, {
                     method: 'POST',
-                    headers: { 'X-CSRFToken': csrfToken }
+                    headers: { 'X-CSRFToken': await obterCsrfToken() }
                 });
                 const data = await response.json();
 
@@ -102,11 +131,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
                     // Alterna o estado do ícone com base na resposta do servidor
                     if (data.action === 'liked') {
-                        likeIcon.src = likeIcon.src.replace('ghost_sem_like.png', 'ghost.png');
+                        likeIcon.src = listaComentarios.dataset.iconeCurtido;
                         likeIcon.classList.remove('not-liked');
                         likeIcon.classList.add('liked');
                     } else if (data.action === 'unliked') {
-                        likeIcon.src = likeIcon.src.replace('ghost.png', 'ghost_sem_like.png');
+                        likeIcon.src = listaComentarios.dataset.iconeNaoCurtido;
                         likeIcon.classList.remove('liked');
                         likeIcon.classList.add('not-liked');
                     }
@@ -122,4 +151,78 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
     });
-});
\ No newline at end of file
+
+    // --- ATUALIZAÇÕES EM TEMPO REAL (Server-Sent Events) ---
+    // O servidor publica os novos contadores sempre que alguém vota,
+    // testemunha, curte ou comenta neste relato.
+    if (voteSection && window.EventSource) {
+        const relatoId = voteSection.dataset.relatoId;
+        const eventos = new EventSource(`/relato/${relatoId}/eventos`);
+
+        const aplicarEvento = (evento) => {
+            if (evento.tipo === 'votos') {
+                document.getElementById('votos-acredito').textContent = evento.votos_acredito;
+                document.getElementById('votos-cetico').textContent = evento.votos_cetico;
+            } else if (evento.tipo === 'testemunhas') {
+                document.getElementById('votos-testemunha').textContent = evento.votos_testemunha;
+            } else if (evento.tipo === 'like') {
+                const likeCountSpan = document.querySelector(`.like-container[data-comment-id="${evento.comentario_id}"] .like-count`);
+                if (likeCountSpan) likeCountSpan.textContent = evento.like_count;
+            } else if (evento.tipo === 'comentario') {
+                if (document.getElementById(`comment-${evento.comentario_id}`)) return;
+                let aviso = document.getElementById('novos-comentarios-aviso');
+                if (!aviso) {
+                    aviso = document.createElement('p');
+                    aviso.id = 'novos-comentarios-aviso';
+                    aviso.className = 'vote-info-message';
+                    aviso.innerHTML = 'Há novos comentários. <a href="">Recarregue a página</a> para vê-los.';
+                    document.querySelector('.comments-list')?.before(aviso);
+                }
+            }
+        };
+
+        eventos.onmessage = (e) => {
+            let evento;
+            try {
+                evento = JSON.parse(e.data);
+            } catch (err) {
+                return;
+            }
+            aplicarEvento(evento);
+        };
+
+        // Fallback sem SSE: consulta os contadores a cada 30 s (pula enquanto
+        // a aba estiver oculta) e os aplica como se fossem eventos do stream
+        let consulta = null;
+        const consultarContadores = async () => {
+            if (document.hidden) return;
+            try {
+                const response = await fetch(`/relato/${relatoId}/contadores`, { cache: 'no-store' });
+                if (!response.ok) return;
+                const dados = await response.json();
+                aplicarEvento({ tipo: 'votos', ...dados });
+                aplicarEvento({ tipo: 'testemunhas', ...dados });
+                for (const [comentarioId, likeCount] of Object.entries(dados.comentarios)) {
+                    aplicarEvento({ tipo: 'like', comentario_id: comentarioId, like_count: likeCount });
+                    aplicarEvento({ tipo: 'comentario', comentario_id: comentarioId });
+                }
+            } catch (error) {
+                console.error("Erro ao consultar os contadores do relato:", error);
+            }
+        };
+
+        // Servidor sem vaga (503) ou fora do ar: o EventSource desiste sozinho
+        // (readyState CLOSED) e a página passa a consultar os contadores
+        eventos.onerror = () => {
+            if (eventos.readyState !== EventSource.CLOSED || consulta) return;
+            eventos.close();
+            consulta = setInterval(consultarContadores, 30000);
+        };
+
+        // Fecha a conexão ao sair da página para liberar o servidor
+        window.addEventListener('pagehide', () => {
+            eventos.close();
+            if (consulta) clearInterval(consulta);
+        });
+    }
+});
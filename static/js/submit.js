@@ -1,7 +1,27 @@
+// Upload retomável (ver observatorio/uploads.py): o arquivo é dividido em
+// blocos enviados em paralelo antes do formulário; se a conexão cair, só os
+// blocos que faltam são reenviados. O relato é postado apenas com o ID.
+const TAMANHO_BLOCO = 1024 * 1024;
+const BLOCOS_EM_PARALELO = 3;
+const MAX_TENTATIVAS = 5;
+
+// Compressão antes do envio, nos mesmos limites que o Cloudinary aplicava
+// (imagem em até 1920x1080; áudio mono em Opus a 64 kbps)
+const IMAGEM_MAX_LARGURA = 1920;
+const IMAGEM_MAX_ALTURA = 1080;
+const IMAGEM_QUALIDADE = 0.82;
+const AUDIO_TAXA = 48000;
+const AUDIO_BITRATE = 64000;
+const AUDIO_TAXA_WAV = 16000;
+// O template passa a URL do worker (com hash, após 'flask build-assets') em data-worker
+const WORKER_URL = document.currentScript && document.currentScript.dataset.worker
+    ? new URL(document.currentScript.dataset.worker, location.href)
+    : new URL('media-worker.js', document.currentScript ? document.currentScript.src : location.href);
+
 document.addEventListener('DOMContentLoaded', () => {
-    const localSelect = document.getElementById('{{ form.local.id }}');
+    const localSelect = document.getElementById('local');
     const outroLocalContainer = document.getElementById('outro-local-container');
-    const outroLocalInput = document.getElementById('{{ form.outro_local_texto.id }}');
+    const outroLocalInput = document.getElementById('outro_local_texto');
 
     function toggleOutroLocal() {
         if (localSelect.value === 'Outro Local / Não Listado') {
@@ -14,27 +34,320 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     localSelect.addEventListener('change', toggleOutroLocal);
-    
+
     toggleOutroLocal();
-    updateCounter('{{ form.titulo.id }}', 100);
-    updateCounter('{{ form.descricao.id }}', 2000);
+    updateCounter('titulo', 100);
+    updateCounter('descricao', 2000);
 
     // === INÍCIO: JAVASCRIPT PARA ATIVAR O CARREGAMENTO ===
     const form = document.getElementById('relato-form');
     const submitButton = form.querySelector('.btn-submit');
     const loadingOverlay = document.getElementById('loading-overlay');
+    const loadingText = loadingOverlay.querySelector('.loading-text');
+    const csrfToken = form.querySelector('input[name="csrf_token"]').value;
+
+    const midias = [
+        { tipo: 'imagem', input: document.getElementById('imagem'), hidden: document.getElementById('imagem_upload_id') },
+        { tipo: 'audio', input: document.getElementById('audio'), hidden: document.getElementById('audio_upload_id') },
+    ];
 
-    form.addEventListener('submit', function() {
-        // Desabilita o botão e muda o texto
+    // Trocar o arquivo invalida o upload já feito
+    midias.forEach(m => m.input.addEventListener('change', () => { m.hidden.value = ''; }));
+
+    function mostrarCarregando(texto) {
         submitButton.disabled = true;
         submitButton.value = 'Enviando...';
-
-        // Mostra o overlay de carregamento
+        loadingText.textContent = texto;
         loadingOverlay.classList.add('visible');
+    }
+
+    function esconderCarregando() {
+        submitButton.disabled = false;
+        submitButton.value = 'Enviar Relato';
+        loadingOverlay.classList.remove('visible');
+    }
+
+    form.addEventListener('submit', async (e) => {
+        const pendentes = midias.filter(m => m.input.files.length && !m.hidden.value);
+        if (!pendentes.length || !window.fetch) {
+            mostrarCarregando('Enviando seu relato, por favor aguarde...');
+            return;
+        }
+
+        e.preventDefault();
+        try {
+            for (const m of pendentes) {
+                const nome = m.tipo === 'imagem' ? 'a imagem' : 'o áudio';
+                const original = m.input.files[0];
+                mostrarCarregando(`Otimizando ${nome}...`);
+                const arquivo = await reduzirMidia(original, m.tipo);
+                loadingText.textContent = `Enviando ${nome}... 0%`;
+                m.hidden.value = await enviarArquivo(arquivo, original, m.tipo, csrfToken, (pct) => {
+                    loadingText.textContent = `Enviando ${nome}... ${pct}%`;
+                });
+            }
+        } catch (err) {
+            esconderCarregando();
+            alert(err.message || 'Falha no envio do arquivo. Tente novamente.');
+            return;
+        }
+
+        // Os arquivos já estão no servidor: não reenvia no POST do relato
+        midias.forEach(m => { if (m.hidden.value) m.input.disabled = true; });
+        loadingText.textContent = 'Enviando seu relato, por favor aguarde...';
+        // 'form.submit' é o botão (campo chamado 'submit'), por isso o protótipo
+        HTMLFormElement.prototype.submit.call(form);
     });
     // === FIM: JAVASCRIPT PARA ATIVAR O CARREGAMENTO ===
 });
 
+// --- Compressão no navegador ---
+
+let workerMidia = null;
+let proximoPedido = 0;
+const pedidosWorker = new Map();
+
+function chamarWorker(mensagem, transferir = []) {
+    if (!window.Worker) return Promise.reject(new Error('sem-suporte'));
+    if (!workerMidia) {
+        workerMidia = new Worker(WORKER_URL);
+        workerMidia.onmessage = (e) => {
+            const { id, ok, resultado, erro } = e.data;
+            const pedido = pedidosWorker.get(id);
+            pedidosWorker.delete(id);
+            if (pedido) ok ? pedido.resolve(resultado) : pedido.reject(new Error(erro));
+        };
+    }
+    const id = ++proximoPedido;
+    return new Promise((resolve, reject) => {
+        pedidosWorker.set(id, { resolve, reject });
+        workerMidia.postMessage({ id, ...mensagem }, transferir);
+    });
+}
+
+function renomear(nome, extensao) {
+    return nome.replace(/\.[^.]*$/, '') + extensao;
+}
+
+async function reduzirImagemNaPagina(arquivo) {
+    // Sem OffscreenCanvas no worker: mesmo processo num <canvas> da página
+    const bitmap = await createImageBitmap(arquivo, { imageOrientation: 'from-image' });
+    const escala = Math.min(1, IMAGEM_MAX_LARGURA / bitmap.width, IMAGEM_MAX_ALTURA / bitmap.height);
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(bitmap.width * escala));
+    canvas.height = Math.max(1, Math.round(bitmap.height * escala));
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+    const paraBlob = (tipo) => new Promise(r => canvas.toBlob(r, tipo, IMAGEM_QUALIDADE));
+    let blob = await paraBlob('image/webp');
+    if (!blob || blob.type !== 'image/webp') blob = await paraBlob('image/jpeg');
+    return blob;
+}
+
+async function reduzirImagem(arquivo) {
+    // GIFs podem ser animados: o canvas guardaria só o primeiro quadro
+    if (arquivo.type === 'image/gif' || !window.createImageBitmap) return arquivo;
+    let blob;
+    try {
+        blob = await chamarWorker({
+            acao: 'imagem', arquivo,
+            maxLargura: IMAGEM_MAX_LARGURA, maxAltura: IMAGEM_MAX_ALTURA, qualidade: IMAGEM_QUALIDADE,
+        });
+    } catch (err) {
+        blob = await reduzirImagemNaPagina(arquivo);
+    }
+    if (!blob || blob.size >= arquivo.size) return arquivo;
+    const extensao = blob.type === 'image/webp' ? '.webp' : '.jpg';
+    return new File([blob], renomear(arquivo.name, extensao), { type: blob.type, lastModified: arquivo.lastModified });
+}
+
+async function decodificarAudio(arquivo, taxa) {
+    // decodeAudioData não existe em workers: decodifica e reamostra (mono) aqui
+    const Contexto = window.AudioContext || window.webkitAudioContext;
+    const contexto = new Contexto();
+    let buffer;
+    try {
+        buffer = await contexto.decodeAudioData(await arquivo.arrayBuffer());
+    } finally {
+        contexto.close();
+    }
+    const offline = new OfflineAudioContext(1, Math.ceil(buffer.duration * taxa), taxa);
+    const fonte = offline.createBufferSource();
+    fonte.buffer = buffer;
+    fonte.connect(offline.destination);
+    fonte.start();
+    return (await offline.startRendering()).getChannelData(0);
+}
+
+function codificarWav(amostras, taxa) {
+    // Sem WebCodecs: PCM 16 bits mono a 16 kHz, suficiente para voz
+    const wav = new DataView(new ArrayBuffer(44 + amostras.length * 2));
+    const escrever = (pos, texto) => [...texto].forEach((c, i) => wav.setUint8(pos + i, c.charCodeAt(0)));
+    escrever(0, 'RIFF');
+    wav.setUint32(4, 36 + amostras.length * 2, true);
+    escrever(8, 'WAVE');
+    escrever(12, 'fmt ');
+    wav.setUint32(16, 16, true);
+    wav.setUint16(20, 1, true);
+    wav.setUint16(22, 1, true);
+    wav.setUint32(24, taxa, true);
+    wav.setUint32(28, taxa * 2, true);
+    wav.setUint16(32, 2, true);
+    wav.setUint16(34, 16, true);
+    escrever(36, 'data');
+    wav.setUint32(40, amostras.length * 2, true);
+    for (let i = 0; i < amostras.length; i++) {
+        const s = Math.max(-1, Math.min(1, amostras[i]));
+        wav.setInt16(44 + i * 2, s < 0 ? s * 0x8000 : s * 0x7fff, true);
+    }
+    return new Blob([wav], { type: 'audio/wav' });
+}
+
+async function reduzirAudio(arquivo) {
+    if (!window.OfflineAudioContext) return arquivo;
+    let blob;
+    try {
+        const amostras = await decodificarAudio(arquivo, AUDIO_TAXA);
+        blob = await chamarWorker({ acao: 'audio', amostras, taxa: AUDIO_TAXA, bitrate: AUDIO_BITRATE }, [amostras.buffer]);
+    } catch (err) {
+        try {
+            blob = codificarWav(await decodificarAudio(arquivo, AUDIO_TAXA_WAV), AUDIO_TAXA_WAV);
+        } catch (_) {
+            return arquivo; // formato que o navegador não decodifica: envia como está
+        }
+    }
+    // Gravações já comprimidas (m4a, mp3) podem ficar maiores: fica o menor
+    if (!blob || blob.size >= arquivo.size) return arquivo;
+    const extensao = blob.type === 'audio/ogg' ? '.ogg' : '.wav';
+    return new File([blob], renomear(arquivo.name, extensao), { type: blob.type, lastModified: arquivo.lastModified });
+}
+
+async function reduzirMidia(arquivo, tipo) {
+    try {
+        return tipo === 'imagem' ? await reduzirImagem(arquivo) : await reduzirAudio(arquivo);
+    } catch (err) {
+        console.warn('Compressão no navegador falhou; enviando o arquivo original.', err);
+        return arquivo;
+    }
+}
+
+// --- Upload retomável ---
+
+function chaveRetomada(arquivo, tipo) {
+    return `upload:${tipo}:${arquivo.name}:${arquivo.size}:${arquivo.lastModified}`;
+}
+
+function codificarMetadados(metadados) {
+    return Object.entries(metadados)
+        .map(([k, v]) => `${k} ${btoa(unescape(encodeURIComponent(v)))}`)
+        .join(',');
+}
+
+function faixasRecebidas(cabecalho) {
+    return (cabecalho || '').split(',').filter(Boolean).map(f => f.split('-').map(Number));
+}
+
+function blocoRecebido(faixas, inicio, fim) {
+    return faixas.some(([a, b]) => a <= inicio && fim <= b);
+}
+
+async function comTentativas(fn) {
+    for (let tentativa = 1; ; tentativa++) {
+        try {
+            return await fn();
+        } catch (err) {
+            if (err.definitivo || tentativa >= MAX_TENTATIVAS) throw err;
+            await new Promise(r => setTimeout(r, 500 * 2 ** tentativa));
+        }
+    }
+}
+
+async function falha(response, padrao) {
+    let mensagem = padrao;
+    try {
+        mensagem = (await response.json()).message || padrao;
+    } catch (_) { /* corpo vazio */ }
+    const err = new Error(mensagem);
+    // Erros 4xx não melhoram com nova tentativa
+    err.definitivo = response.status >= 400 && response.status < 500 && response.status !== 409;
+    return err;
+}
+
+async function criarUpload(arquivo, tipo, csrfToken) {
+    const response = await fetch('/uploads', {
+        method: 'POST',
+        headers: {
+            'X-CSRFToken': csrfToken,
+            'Upload-Length': String(arquivo.size),
+            'Upload-Metadata': codificarMetadados({ tipo, filename: arquivo.name, filetype: arquivo.type }),
+        },
+    });
+    if (response.status !== 201) throw await falha(response, 'Não foi possível iniciar o envio.');
+    return response.headers.get('Upload-Id');
+}
+
+async function consultarUpload(uploadId) {
+    const response = await fetch(`/uploads/${uploadId}`, { method: 'HEAD', cache: 'no-store' });
+    if (!response.ok) return null;
+    return {
+        offset: Number(response.headers.get('Upload-Offset')),
+        tamanho: Number(response.headers.get('Upload-Length')),
+        faixas: faixasRecebidas(response.headers.get('Upload-Received')),
+    };
+}
+
+async function enviarArquivo(arquivo, original, tipo, csrfToken, progresso) {
+    // Retoma um upload iniciado antes (queda de conexão ou recarga da página).
+    // A chave usa o arquivo escolhido: a versão comprimida é refeita a cada vez.
+    const chave = chaveRetomada(original, tipo);
+    let uploadId = localStorage.getItem(chave);
+    let estado = uploadId ? await consultarUpload(uploadId) : null;
+    if (!estado || estado.tamanho !== arquivo.size) {
+        uploadId = await comTentativas(() => criarUpload(arquivo, tipo, csrfToken));
+        localStorage.setItem(chave, uploadId);
+        estado = { offset: 0, tamanho: arquivo.size, faixas: [] };
+    }
+
+    const blocos = [];
+    for (let inicio = 0; inicio < arquivo.size; inicio += TAMANHO_BLOCO) {
+        const fim = Math.min(inicio + TAMANHO_BLOCO, arquivo.size);
+        if (!blocoRecebido(estado.faixas, inicio, fim) && fim > estado.offset) blocos.push([inicio, fim]);
+    }
+    let enviados = arquivo.size - blocos.reduce((total, [a, b]) => total + (b - a), 0);
+    progresso(Math.floor(100 * enviados / arquivo.size));
+
+    const fila = blocos.slice();
+    async function trabalhador() {
+        while (fila.length) {
+            const [inicio, fim] = fila.shift();
+            await comTentativas(async () => {
+                const response = await fetch(`/uploads/${uploadId}`, {
+                    method: 'PATCH',
+                    headers: {
+                        'X-CSRFToken': csrfToken,
+                        'Upload-Offset': String(inicio),
+                        'Content-Type': 'application/offset+octet-stream',
+                    },
+                    body: arquivo.slice(inicio, fim),
+                });
+                if (response.status !== 204) throw await falha(response, 'Falha no envio de um bloco.');
+            });
+            enviados += fim - inicio;
+            progresso(Math.floor(100 * enviados / arquivo.size));
+        }
+    }
+    await Promise.all(Array.from({ length: BLOCOS_EM_PARALELO }, trabalhador));
+
+    // A montagem pode ter sido feita por outro PATCH paralelo: confirma pelo HEAD
+    const final = await comTentativas(async () => {
+        const e = await consultarUpload(uploadId);
+        if (!e || e.offset < arquivo.size) throw new Error('O servidor ainda não recebeu o arquivo inteiro.');
+        return e;
+    });
+    localStorage.removeItem(chave);
+    return final && uploadId;
+}
+
 function updateCounter(fieldId, maxLength) {
     const field = document.getElementById(fieldId);
     const counter = document.getElementById(fieldId + '-counter');
@@ -43,4 +356,4 @@ function updateCounter(fieldId, maxLength) {
         counter.textContent = remaining;
         counter.style.color = remaining < 20 ? (remaining < 0 ? '#ff0000' : '#ffc107') : '#aaa';
     }
-}
\ No newline at end of file
+}
@@ -0,0 +1,36 @@
+# tests/conftest.py
+"""
+Configuração comum dos testes: o app é criado sem banco (a primeira conexão
+só é aberta sob demanda) e com os contadores do rate limiter em memória.
+"""
+
+import os
+
+import pytest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/nao_usado')
+os.environ.setdefault('SECRET_KEY', 'teste')
+
+
+@pytest.fixture
+def criar_app(tmp_path):
+    """Fábrica de apps de teste; 'config' sobrepõe os padrões abaixo."""
+    from observatorio import create_app, limiter
+
+    def criar(**config):
+        padrao = {
+            'TESTING': True,
+            'ADMISSAO_ATIVA': False,
+            # O Limiter é um só para todos os apps do processo: o init_app de
+            # cada um redefine se ele está ligado
+            'RATELIMIT_ENABLED': True,
+            'RATELIMIT_STORAGE_URI': 'memory://',
+            'MEDIA_ROOT': str(tmp_path / 'media'),
+        }
+        padrao.update(config)
+        # Os limites de cada rota (@limiter.limit) são guardados pelo nome da
+        # view: sem isso, cada app criado no processo somaria mais uma cópia
+        limiter.limit_manager._decorated_limits.clear()
+        return create_app(padrao)
+
+    return criar
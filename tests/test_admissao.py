@@ -0,0 +1,148 @@
+# tests/test_admissao.py
+"""
+Controle de admissão (admissao.py): fila limitada por prioridade na frente
+do pool, descarte de quem é menos prioritário, espera máxima e a resposta
+rápida (503 ou a cópia guardada da página) para quem não entra.
+"""
+
+import time
+from threading import Thread
+
+import psycopg2.pool
+
+from observatorio import admissao, routes_public
+from observatorio.admissao import FilaAdmissao, CachePaginas, MODERACAO, ESCRITA, LEITURA, ANONIMA
+
+
+class Pedido(Thread):
+    """Chama fila.entrar numa thread e guarda o resultado."""
+
+    def __init__(self, fila, classe, espera_max=5):
+        super().__init__(daemon=True)
+        self.fila, self.classe, self.espera_max = fila, classe, espera_max
+        self.resultado = None
+        self.start()
+
+    def run(self):
+        self.resultado = self.fila.entrar(self.classe, self.espera_max)
+
+
+def _esperar_fila(fila, tamanho):
+    limite = time.monotonic() + 5
+    while fila.na_fila != tamanho:
+        assert time.monotonic() < limite, 'a fila não chegou ao tamanho esperado'
+        time.sleep(0.005)
+
+
+def test_vaga_passa_direto_para_quem_espera():
+    fila = FilaAdmissao(vagas=1, max_fila=4)
+    assert fila.entrar(ANONIMA, 1)
+    pedido = Pedido(fila, ANONIMA)
+    _esperar_fila(fila, 1)
+    fila.sair()
+    pedido.join(5)
+    assert pedido.resultado is True
+    # A vaga mudou de dono sem ficar livre no meio
+    assert fila.em_uso == 1 and fila.na_fila == 0
+    fila.sair()
+    assert fila.em_uso == 0
+
+
+def test_mais_prioritario_sai_da_fila_primeiro():
+    fila = FilaAdmissao(vagas=1, max_fila=4)
+    assert fila.entrar(ANONIMA, 1)
+    anonima = Pedido(fila, ANONIMA)
+    _esperar_fila(fila, 1)
+    escrita = Pedido(fila, ESCRITA)
+    _esperar_fila(fila, 2)
+    fila.sair()
+    escrita.join(5)
+    assert escrita.resultado is True and anonima.is_alive()
+    fila.sair()
+    anonima.join(5)
+    assert anonima.resultado is True
+
+
+def test_fila_cheia_descarta_o_menos_prioritario():
+    fila = FilaAdmissao(vagas=1, max_fila=1)
+    assert fila.entrar(LEITURA, 1)
+    leitura = Pedido(fila, LEITURA)
+    _esperar_fila(fila, 1)
+    # Mesma classe ou menos prioritária: recusada na hora
+    assert fila.entrar(LEITURA, 5) is False
+    assert fila.entrar(ANONIMA, 5) is False
+    # Moderação toma o lugar da leitura, que é descartada
+    moderacao = Pedido(fila, MODERACAO)
+    leitura.join(5)
+    assert leitura.resultado is False
+    _esperar_fila(fila, 1)
+    fila.sair()
+    moderacao.join(5)
+    assert moderacao.resultado is True
+
+
+def test_espera_esgotada_sai_da_fila():
+    fila = FilaAdmissao(vagas=1, max_fila=4)
+    assert fila.entrar(ESCRITA, 1)
+    assert fila.entrar(ESCRITA, 0.05) is False
+    assert fila.na_fila == 0
+    fila.sair()
+    assert fila.em_uso == 0
+
+
+def test_cache_de_paginas(monkeypatch):
+    cache = CachePaginas(max_itens=2, idade_max=60)
+    cache.guardar('/a', b'a', 'text/html')
+    cache.guardar('/b', b'b', 'text/html')
+    cache.guardar('/a', b'a2', 'text/html')
+    cache.guardar('/c', b'c', 'text/html')
+    assert cache.buscar('/b') is None
+    assert cache.buscar('/a')[1] == b'a2'
+    agora = time.time()
+    monkeypatch.setattr(admissao.time, 'time', lambda: agora + 61)
+    assert cache.buscar('/a') is None
+
+
+def _app_lotado(criar_app, **config):
+    """App com a única vaga ocupada e sem fila: toda requisição com banco é descartada."""
+    app = criar_app(ADMISSAO_ATIVA=True, ADMISSAO_VAGAS=1, ADMISSAO_FILA=0, **config)
+    app.extensions['admissao'].em_uso = 1
+    return app
+
+
+def test_sobrecarga_responde_503_rapido(criar_app):
+    cliente = _app_lotado(criar_app, ADMISSAO_RETRY_AFTER=7).test_client()
+    resposta = cliente.get('/rankings')
+    assert resposta.status_code == 503
+    assert resposta.headers['Retry-After'] == '7'
+    assert resposta.get_json()['success'] is False
+    resposta = cliente.get('/rankings', headers={'Accept': 'text/html'})
+    assert resposta.status_code == 503 and resposta.mimetype == 'text/plain'
+    # Views sem banco não passam pela fila
+    assert cliente.get('/healthz/live').status_code == 200
+
+
+def test_leitura_anonima_recebe_a_pagina_guardada(criar_app):
+    app = _app_lotado(criar_app)
+    app.extensions['admissao_cache'].guardar(
+        '/rankings?', b'<form><input value="' + admissao.MARCADOR_CSRF + b'"></form>', 'text/html; charset=utf-8')
+    cliente = app.test_client()
+    resposta = cliente.get('/rankings')
+    assert resposta.status_code == 200
+    assert resposta.headers['X-Cache'] == 'STALE'
+    corpo = resposta.get_data()
+    assert admissao.MARCADOR_CSRF not in corpo and b'value="' in corpo
+
+    # Logado não recebe cópia de página anônima
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = 1
+    assert cliente.get('/rankings').status_code == 503
+
+
+def test_pool_esgotado_vira_503(criar_app, monkeypatch):
+    def esgotado():
+        raise psycopg2.pool.PoolError('connection pool exhausted')
+
+    monkeypatch.setattr(routes_public, 'get_db', esgotado)
+    resposta = criar_app().test_client().get('/rankings')
+    assert resposta.status_code == 503 and resposta.headers['Retry-After']
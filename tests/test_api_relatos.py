@@ -0,0 +1,148 @@
+# tests/test_api_relatos.py
+"""
+/api/relatos (routes_api.py): cursor opaco da paginação por chave (keyset)
+e a recusa de cursores adulterados, filtros compostos e a resposta com
+'proximo', header Link e ETag.
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from observatorio import routes_api
+from observatorio.routes_api import ApiError, codificar_cursor, decodificar_cursor, build_relatos_query
+
+CATEGORIAS = ["Aparição", "Som Estranho"]
+
+
+def _cursor_cru(dados):
+    """Cursor montado à mão, como faria alguém adulterando o da resposta."""
+    texto = dados if isinstance(dados, bytes) else json.dumps(dados).encode()
+    return base64.urlsafe_b64encode(texto).decode().rstrip('=')
+
+
+def test_cursor_ida_e_volta():
+    linha = {'id': 42, 'criado_em': datetime(2024, 5, 1, 12, 30), 'votos_acredito': 7}
+    cursor = codificar_cursor('recentes', linha)
+    assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+    assert decodificar_cursor(cursor, 'recentes') == ['2024-05-01T12:30:00', 42]
+    assert decodificar_cursor(codificar_cursor('acredito', linha), 'acredito') == [7, 42]
+
+
+@pytest.mark.parametrize('cursor', [
+    'não-é-base64!',
+    _cursor_cru(b'{"nao": "lista"'),
+    _cursor_cru(b'\xff\xfe'),
+    _cursor_cru({'ordem': 'recentes'}),
+    _cursor_cru(['recentes', '2024-05-01T12:30:00']),
+    _cursor_cru(['recentes', '2024-05-01T12:30:00', 1, 2]),
+    # Cursor de outra listagem
+    _cursor_cru(['acredito', 7, 42]),
+    _cursor_cru(['relatos_usuario', '2024-05-01T12:30:00', 42]),
+    # Tipos trocados que chegariam ao banco como erro 500
+    _cursor_cru(['recentes', 'ontem', 42]),
+    _cursor_cru(['recentes', None, 42]),
+    _cursor_cru(['recentes', ['2024-05-01'], 42]),
+    _cursor_cru(['recentes', '2024-05-01T12:30:00', '42; DROP TABLE relatos']),
+])
+def test_cursor_adulterado_e_recusado(cursor):
+    with pytest.raises(ApiError):
+        decodificar_cursor(cursor, 'recentes')
+
+
+class _Args(dict):
+    """Imita o request.args (MultiDict) com listas para os filtros repetidos."""
+
+    def getlist(self, nome):
+        valor = self.get(nome, [])
+        return valor if isinstance(valor, list) else [valor]
+
+
+def test_consulta_com_filtros_compostos_e_cursor():
+    cursor = codificar_cursor('acredito', {'votos_acredito': 7, 'id': 42})
+    args = {'ordem': 'acredito', 'categoria': ['Aparição,Som Estranho', 'Aparição'], 'local': ['Bloco C'],
+            'desde': '2024-01-01', 'ate': '2024-01-31', 'limite': '500', 'cursor': cursor}
+    query, params, ordem, limite = build_relatos_query(_Args(args), CATEGORIAS)
+    assert (ordem, limite) == ('acredito', routes_api.LIMITE_MAXIMO)
+    assert 'categoria = ANY(%s)' in query and 'local = ANY(%s)' in query
+    assert '(votos_acredito, id) < (%s, %s)' in query
+    assert 'ORDER BY votos_acredito DESC, id DESC' in query
+    assert params[:2] == [["Aparição", "Som Estranho"], ['Bloco C']]
+    assert params[-3:] == [7, 42, limite + 1]
+
+
+@pytest.mark.parametrize('args', [
+    {'ordem': 'antigos'},
+    {'categoria': ['Fantasma']},
+    {'desde': '2024-02-01', 'ate': '2024-01-01'},
+    {'limite': 'dez'},
+    {'local': [','.join(f'L{i}' for i in range(routes_api.MAX_VALORES_FILTRO + 1))]},
+])
+def test_parametros_invalidos(args):
+    with pytest.raises(ApiError):
+        build_relatos_query(_Args(args), CATEGORIAS)
+
+
+class ConexaoRelatos:
+    """Devolve relatos aprovados em ordem decrescente de criado_em, respeitando o LIMIT."""
+
+    closed = 0
+
+    def __init__(self, total):
+        inicio = datetime(2024, 5, 1)
+        self.relatos = [{'id': i, 'titulo': f'Relato {i}', 'local': 'Bloco C', 'categoria': 'Aparição',
+                         'criado_em': inicio + timedelta(hours=i), 'imagem_url': None,
+                         'votos_acredito': 0, 'votos_cetico': 0, 'votos_testemunha': 0}
+                        for i in range(total, 0, -1)]
+        self.linhas = []
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, query, params):
+        linhas = self.relatos
+        if '(criado_em, id) <' in query:
+            criado_em, relato_id = datetime.fromisoformat(params[-3]), params[-2]
+            linhas = [r for r in linhas if (r['criado_em'], r['id']) < (criado_em, relato_id)]
+        self.linhas = linhas[:params[-1]]
+
+    def fetchall(self):
+        return self.linhas
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_paginas_seguidas_pelo_link(criar_app, monkeypatch):
+    conexao = ConexaoRelatos(5)
+    monkeypatch.setattr(routes_api, 'get_db', lambda: conexao)
+    cliente = criar_app().test_client()
+
+    ids, url = [], '/api/relatos?limite=2&categoria=Aparição'
+    while url:
+        resposta = cliente.get(url)
+        assert resposta.status_code == 200
+        ids += [relato['id'] for relato in resposta.get_json()['relatos']]
+        link = resposta.headers.get('Link')
+        assert bool(link) == bool(resposta.get_json()['proximo'])
+        url = link and link[1:link.index('>')]
+        if url:
+            assert 'categoria=' in url and 'limite=2' in url
+    assert ids == [5, 4, 3, 2, 1]
+
+
+def test_etag_e_erros(criar_app, monkeypatch):
+    monkeypatch.setattr(routes_api, 'get_db', lambda: ConexaoRelatos(3))
+    cliente = criar_app().test_client()
+    resposta = cliente.get('/api/relatos')
+    assert resposta.headers['Cache-Control'] == 'no-cache'
+    etag = resposta.headers['ETag']
+    assert cliente.get('/api/relatos', headers={'If-None-Match': etag}).status_code == 304
+
+    resposta = cliente.get('/api/relatos?cursor=xyz')
+    assert resposta.status_code == 400 and resposta.get_json()['success'] is False
@@ -0,0 +1,109 @@
+# tests/test_asgi.py
+"""
+Modo ASGI (asgi.py) sem banco: o pool do asyncpg é trocado por um falso.
+- /api/mapa com uma imagem fora do Cloudinary (mídia local): variant_url lê
+  MEDIA_URL de current_app, então o handler async precisa do contexto do
+  app Flask;
+- o cache de prepared statements do asyncpg fica desligado atrás de um
+  pooler em modo transação.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/nao_usado')
+os.environ.setdefault('SECRET_KEY', 'teste')
+
+pytest.importorskip('starlette')
+pytest.importorskip('a2wsgi')
+
+
+class PoolFalso:
+    def __init__(self, linhas):
+        self.linhas = linhas
+
+    async def fetch(self, query, *params):
+        return self.linhas
+
+    async def close(self):
+        pass
+
+
+async def _chamar(app, caminho):
+    """Roda o lifespan e uma requisição GET direto na interface ASGI."""
+    entrada_lifespan = asyncio.Queue()
+    saida_lifespan = asyncio.Queue()
+    await entrada_lifespan.put({'type': 'lifespan.startup'})
+    tarefa = asyncio.create_task(app({'type': 'lifespan', 'asgi': {'version': '3.0'}},
+                                     entrada_lifespan.get, saida_lifespan.put))
+    assert (await saida_lifespan.get())['type'] == 'lifespan.startup.complete'
+
+    enviados = []
+
+    async def receber():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def enviar(mensagem):
+        enviados.append(mensagem)
+
+    escopo = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': caminho, 'raw_path': caminho.encode(), 'query_string': b'',
+        'root_path': '', 'headers': [(b'host', b'teste')], 'client': ('127.0.0.1', 1234),
+        'server': ('teste', 80),
+    }
+    await app(escopo, receber, enviar)
+    await entrada_lifespan.put({'type': 'lifespan.shutdown'})
+    await tarefa
+    status = next(m['status'] for m in enviados if m['type'] == 'http.response.start')
+    corpo = b''.join(m.get('body', b'') for m in enviados if m['type'] == 'http.response.body')
+    return status, corpo
+
+
+def test_api_mapa_com_midia_local(monkeypatch):
+    from observatorio import create_app
+    from observatorio import asgi
+
+    linhas = [{'local': 'Biblioteca Central', 'relatos_json': json.dumps([{
+        'id': 1, 'titulo': 'Vulto', 'local': 'Biblioteca Central', 'categoria': 'Aparição',
+        'criado_em': '01/01/2025', 'imagem_url': '/media/img/a.jpg',
+    }])}]
+
+    async def criar_pool(*args, **kwargs):
+        return PoolFalso(linhas)
+
+    monkeypatch.setattr(asgi.asyncpg, 'create_pool', criar_pool)
+    flask_app = create_app({'TESTING': True, 'ADMISSAO_ATIVA': False, 'RATELIMIT_ENABLED': False,
+                            'MEDIA_URL': '/media/'})
+    status, corpo = asyncio.run(_chamar(asgi.create_asgi_app(flask_app), '/api/mapa'))
+
+    assert status == 200
+    marcadores = json.loads(corpo)
+    assert marcadores[0]['relatos'][0]['imagem_thumb'] == '/media/_variantes/thumb/img/a.jpg'
+
+
+@pytest.mark.parametrize('url, modo, cache_desligado', [
+    ('postgresql://u@ep-frio-123-pooler.us-east-2.aws.neon.tech/neondb', 'auto', True),
+    ('postgresql://u@localhost:6432/observatorio', 'auto', True),
+    ('postgresql://u@ep-frio-123.us-east-2.aws.neon.tech/neondb', 'auto', False),
+    ('postgresql://u@localhost:6432/observatorio', 'true', False),
+    ('postgresql://u@localhost/observatorio', 'false', True),
+])
+def test_cache_de_statements_atras_de_pooler(criar_app, monkeypatch, url, modo, cache_desligado):
+    from observatorio import asgi
+
+    opcoes = {}
+
+    async def criar_pool(*args, **kwargs):
+        opcoes.update(kwargs)
+        return PoolFalso([])
+
+    monkeypatch.setattr(asgi.asyncpg, 'create_pool', criar_pool)
+    flask_app = criar_app(DATABASE_URL=url, DB_PREPARED_STATEMENTS=modo)
+    status, _ = asyncio.run(_chamar(asgi.create_asgi_app(flask_app), '/api/mapa'))
+
+    assert status == 200
+    assert (opcoes.get('statement_cache_size') == 0) is cache_desligado
@@ -0,0 +1,87 @@
+# tests/test_budgets.py
+"""
+Orçamentos de latência (budgets.py): prazo da requisição, statement_timeout
+por transação (db.py) e a resposta degradada quando o Postgres cancela a
+consulta, inclusive nas rotas que tratam os próprios erros (vote, like).
+"""
+
+import time
+
+import psycopg2.errors
+import pytest
+from flask import g
+
+from observatorio import budgets, db, routes_public
+
+
+def test_prazo_restante_e_vencido(criar_app):
+    app = criar_app()
+    with app.test_request_context('/'):
+        assert budgets.prazo_restante(10) == 10
+        assert not budgets.prazo_vencido()
+        g.prazo = time.monotonic() + 1
+        assert 0.9 < budgets.prazo_restante(10) <= 1
+        assert budgets.prazo_restante(0.5) == 0.5
+        g.prazo = time.monotonic() - 1
+        assert budgets.prazo_restante(10) == 0.05
+        with pytest.raises(budgets.OrcamentoEsgotado):
+            budgets.verificar_prazo()
+    # Fora de uma requisição vale o padrão
+    assert budgets.prazo_restante(7) == 7
+
+
+def test_statement_timeout_so_nas_transacoes_da_requisicao(criar_app):
+    app = criar_app()
+    conn = db.ConexaoComPrazo.__new__(db.ConexaoComPrazo)
+    aplicados = []
+    conn.aplicar_prazo = lambda: aplicados.append(conn.prazo_ms)
+    devolvidas = []
+
+    class Pool:
+        def putconn(self, conexao, close=False):
+            devolvidas.append((conexao.prazo_ms, close))
+
+    with app.test_request_context('/'):
+        g.budget_ms = 300
+        db._ajustar_statement_timeout(conn)
+        assert aplicados == [300]
+        g.db, g.db_pool = conn, Pool()
+        db.close_db()
+    # Volta ao pool sem prazo: o rollback do pool não abre outra transação
+    assert devolvidas == [(0, False)]
+
+    with app.test_request_context('/'):
+        db._ajustar_statement_timeout(conn)
+    assert conn.prazo_ms == 0 and aplicados == [300]
+
+
+class ConexaoCancelada:
+    """Conexão cuja primeira consulta é cancelada pelo statement_timeout."""
+
+    closed = 0
+
+    @property
+    def connection(self):
+        return self
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, *args, **kwargs):
+        raise psycopg2.errors.QueryCanceled('canceling statement due to statement timeout')
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.mark.parametrize('caminho', ['/vote/1/acredito', '/like_comment/1'])
+def test_cancelamento_vira_resposta_degradada(criar_app, monkeypatch, caminho):
+    conn = ConexaoCancelada()
+    monkeypatch.setattr(routes_public, 'get_db', lambda: conn)
+    app = criar_app(WTF_CSRF_ENABLED=False, DB_PREPARED_STATEMENTS='false')
+    resposta = app.test_client().post(caminho)
+    assert resposta.status_code == 503
+    assert resposta.headers['Retry-After']
@@ -0,0 +1,106 @@
+# tests/test_estatisticas.py
+"""
+Agregados diários (estatisticas.py), /api/stats (routes_api.py) e o ranking
+de locais, que soma aos agregados os dias ainda não recalculados.
+"""
+
+from datetime import date, datetime
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from observatorio import estatisticas
+from observatorio.routes_api import ApiError, _periodos, build_stats_query
+from observatorio.routes_public import consultar_rankings
+
+CATEGORIAS = ['Aparição', 'Som Estranho']
+
+
+def test_intervalos_agrupa_dias_contiguos():
+    dias = [date(2025, 1, 3), date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 10)]
+    assert estatisticas._intervalos(dias) == [
+        [date(2025, 1, 1), date(2025, 1, 4)],
+        [date(2025, 1, 10), date(2025, 1, 11)],
+    ]
+    assert estatisticas._intervalos([]) == []
+
+
+def test_parametros_no_fuso_dos_agregados():
+    parametros = estatisticas._parametros(date(2025, 3, 1), date(2025, 3, 2), 'America/Sao_Paulo')
+    assert parametros['desde'] == datetime.fromisoformat('2025-03-01T00:00:00-03:00')
+    assert parametros['ate'] == datetime.fromisoformat('2025-03-02T00:00:00-03:00')
+
+
+@pytest.mark.parametrize('intervalo, esperado', [
+    ('dia', [date(2025, 1, 30), date(2025, 1, 31), date(2025, 2, 1)]),
+    # Semanas começam na segunda-feira (date_trunc('week'))
+    ('semana', [date(2025, 1, 27)]),
+    ('mes', [date(2025, 1, 1), date(2025, 2, 1)]),
+])
+def test_periodos_preenchem_a_serie(intervalo, esperado):
+    assert _periodos(date(2025, 1, 30), date(2025, 2, 1), intervalo) == esperado
+
+
+def test_periodos_de_mes_atravessam_o_ano():
+    assert _periodos(date(2024, 11, 15), date(2025, 2, 1), 'mes') == [
+        date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1), date(2025, 2, 1)]
+
+
+def test_consulta_de_serie():
+    args = MultiDict({'metrica': 'votos', 'intervalo': 'mes', 'desde': '2025-01-01', 'ate': '2025-03-31',
+                      'categoria': 'Aparição'})
+    query, params, resolvidos = build_stats_query(args, CATEGORIAS)
+    assert 'votos_acredito + votos_cetico' in query
+    assert params == ['month', date(2025, 1, 1), date(2025, 3, 31), ['Aparição']]
+    assert resolvidos['intervalo'] == 'mes'
+
+
+@pytest.mark.parametrize('args', [
+    {'metrica': 'senhas'},
+    {'intervalo': 'hora'},
+    {'tipo': 'pizza'},
+    {'categoria': 'Inexistente'},
+    # Série longa demais
+    {'desde': '2000-01-01', 'ate': '2025-01-01', 'intervalo': 'dia'},
+])
+def test_consulta_de_stats_invalida(args):
+    with pytest.raises(ApiError):
+        build_stats_query(MultiDict(args), CATEGORIAS)
+
+
+class CursorRankings:
+    def __init__(self, com_marca):
+        self.com_marca = com_marca
+        self.consultas = []
+        self.resultado = []
+
+    def execute(self, sql, params=None):
+        self.consultas.append((sql, params))
+        if 'FROM estatisticas_marcas' in sql:
+            self.resultado = [(1,)] if self.com_marca else []
+        else:
+            self.resultado = [('Biblioteca Central', 3)]
+
+    def fetchone(self):
+        return self.resultado[0] if self.resultado else None
+
+    def fetchall(self):
+        return self.resultado
+
+
+def test_ranking_de_locais_soma_os_dias_pendentes(criar_app):
+    cur = CursorRankings(com_marca=True)
+    with criar_app().app_context():
+        _, top_locais = consultar_rankings(cur)
+    assert top_locais == [('Biblioteca Central', 3)]
+    sql, params = cur.consultas[-1]
+    assert 'FROM estatisticas_diarias' in sql and 'FROM estatisticas_pendentes p' in sql
+    assert params == {'fuso': 'America/Sao_Paulo'}
+
+
+def test_ranking_de_locais_sem_agregados_vem_de_relatos(criar_app):
+    cur = CursorRankings(com_marca=False)
+    with criar_app().app_context():
+        consultar_rankings(cur)
+    sql, _ = cur.consultas[-1]
+    assert 'estatisticas_diarias' not in sql and 'FROM relatos' in sql
@@ -0,0 +1,168 @@
+# tests/test_export.py
+"""
+Exportações em streaming (export.py): consulta com filtros da whitelist,
+NDJSON por cursor nomeado, CSV via COPY numa thread auxiliar (inclusive o
+cancelamento quando o cliente desiste) e a compressão gzip incremental.
+"""
+
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+
+from observatorio import export
+from observatorio.export import ExportError, montar_consulta, iter_ndjson, iter_copy_csv, comprimir_gzip
+
+
+def test_consulta_com_filtros():
+    consulta, params, nomes = montar_consulta('relatos', de='2024-01-01', ate='2024-01-31',
+                                              status='aprovados', local='Ouro Preto')
+    assert 'r.criado_em >= %s' in consulta and 'r.criado_em < %s' in consulta
+    assert 'r.aprovado' in consulta and 'r.local = %s' in consulta
+    # 'ate' inclui o dia inteiro
+    assert params == [date(2024, 1, 1), date(2024, 2, 1), 'Ouro Preto']
+    assert nomes[:2] == ['id', 'titulo']
+
+
+def test_consulta_decodifica_metadados():
+    consulta, params, nomes = montar_consulta('votos', status='cetico')
+    assert "v.tipo_voto = 'cetico'" in consulta and params == []
+    assert nomes[-3:] == ['ip_address', 'city', 'user_agent']
+
+
+@pytest.mark.parametrize('tabela, filtros', [
+    ('users', {}),
+    ('relatos', {'status': 'denunciados'}),
+    ('testemunhas', {'status': 'aprovados'}),
+    ('relatos', {'de': '01/02/2024'}),
+])
+def test_consulta_recusa_filtros_fora_da_whitelist(tabela, filtros):
+    with pytest.raises(ExportError):
+        montar_consulta(tabela, **filtros)
+
+
+class CursorNomeado:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.fechado = False
+
+    def execute(self, consulta, params):
+        pass
+
+    def __iter__(self):
+        return iter(self.linhas)
+
+    def close(self):
+        self.fechado = True
+
+
+class BancoNdjson:
+    def __init__(self, linhas):
+        self.cur = CursorNomeado(linhas)
+
+    def cursor(self, name=None):
+        assert name, 'o NDJSON precisa de um cursor nomeado (server-side)'
+        return self.cur
+
+
+def test_ndjson_em_pedacos(monkeypatch):
+    monkeypatch.setattr(export, 'TAMANHO_CHUNK', 40)
+    db = BancoNdjson([(i, f'relato {i}', datetime(2024, 1, i + 1)) for i in range(5)])
+    pedacos = list(iter_ndjson(db, 'SELECT ...', [], ['id', 'titulo', 'criado_em']))
+    assert len(pedacos) > 1
+    linhas = b''.join(pedacos).decode('utf-8').splitlines()
+    assert [json.loads(linha)['id'] for linha in linhas] == list(range(5))
+    assert json.loads(linhas[0])['criado_em'] == '2024-01-01 00:00:00'
+    assert db.cur.fechado
+
+
+class CursorCopy:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.escritas = 0
+        self.fechado = False
+
+    def mogrify(self, consulta, params):
+        return consulta.encode('utf-8')
+
+    def copy_expert(self, sql, arquivo):
+        assert sql.startswith('COPY (') and 'TO STDOUT' in sql
+        arquivo.write('id,titulo\n')
+        for i in range(self.linhas):
+            arquivo.write(f'{i},relato {i}\n')
+            self.escritas += 1
+
+    def close(self):
+        self.fechado = True
+
+
+class BancoCopy:
+    encoding = 'UTF8'
+
+    def __init__(self, linhas):
+        self.cur = CursorCopy(linhas)
+        self.cancelado = False
+        self.fechado = False
+
+    def cursor(self):
+        return self.cur
+
+    def cancel(self):
+        self.cancelado = True
+
+    def close(self):
+        self.fechado = True
+
+
+def test_csv_completo_devolve_a_conexao(monkeypatch):
+    monkeypatch.setattr(export, 'TAMANHO_CHUNK', 64)
+    db = BancoCopy(50)
+    csv = b''.join(iter_copy_csv(db, 'SELECT 1', []))
+    linhas = csv.decode('utf-8').splitlines()
+    assert linhas[0] == 'id,titulo' and len(linhas) == 51
+    assert db.cur.fechado
+    assert not db.cancelado and not db.fechado
+
+
+def test_csv_abandonado_cancela_o_copy_e_descarta_a_conexao(monkeypatch):
+    monkeypatch.setattr(export, 'TAMANHO_CHUNK', 16)
+    db = BancoCopy(100000)
+    chunks = iter_copy_csv(db, 'SELECT 1', [])
+    next(chunks)
+    chunks.close()
+    assert db.cancelado and db.fechado and db.cur.fechado
+    # A thread do COPY parou na escrita seguinte ao cancelamento
+    assert db.cur.escritas < 100000
+
+
+def test_gzip_incremental():
+    fechado = []
+
+    def origem():
+        try:
+            for i in range(100):
+                yield f'linha {i}\n'.encode('utf-8') * 50
+        finally:
+            fechado.append(True)
+
+    dados = b''.join(comprimir_gzip(origem()))
+    assert gzip.decompress(dados) == b''.join(f'linha {i}\n'.encode('utf-8') * 50 for i in range(100))
+    assert fechado
+
+
+def test_gzip_repassa_o_fechamento_ao_gerador_de_origem():
+    fechado = []
+
+    def sem_fim():
+        try:
+            while True:
+                yield os.urandom(4096)
+        finally:
+            fechado.append(True)
+
+    comprimido = comprimir_gzip(sem_fim())
+    next(comprimido)
+    comprimido.close()
+    assert fechado
@@ -0,0 +1,74 @@
+# tests/test_imagens.py
+"""Variantes de imagem (imagens.py): URLs, geração sob demanda e a rota das derivadas locais."""
+
+import io
+import os
+import threading
+
+import pytest
+
+from observatorio import imagens
+
+
+def test_variant_url(criar_app):
+    app = criar_app(MEDIA_URL='/media/')
+    with app.app_context():
+        assert imagens.variant_url('/media/img/a.jpg', 'medium') == '/media/_variantes/medium/img/a.jpg'
+        assert imagens.variant_url('/media/img/a.jpg', 'full') == '/media/img/a.jpg'
+        assert imagens.variant_url('https://res.cloudinary.com/x/image/upload/v1/a.jpg') == \
+            'https://res.cloudinary.com/x/image/upload/c_limit,w_320,h_320,q_auto,f_auto/v1/a.jpg'
+        assert imagens.variant_url('https://exemplo.org/a.jpg') == 'https://exemplo.org/a.jpg'
+        assert imagens.srcset('https://exemplo.org/a.jpg') == ''
+
+
+def _em_thread(destino, dentro, soltar=None):
+    """Segura a trava de 'destino' numa thread; 'dentro' é sinalizado ao entrar."""
+    def gerar():
+        with imagens._travar_destino(destino):
+            dentro.set()
+            if soltar is not None:
+                soltar.wait(5)
+    tarefa = threading.Thread(target=gerar)
+    tarefa.start()
+    return tarefa
+
+
+def test_destinos_diferentes_nao_se_bloqueiam(tmp_path):
+    a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+    soltar = threading.Event()
+    primeira, outra, mesma = threading.Event(), threading.Event(), threading.Event()
+    tarefas = [_em_thread(a, primeira, soltar)]
+    try:
+        assert primeira.wait(5)
+        tarefas.append(_em_thread(b, outra))
+        tarefas.append(_em_thread(a, mesma))
+        # Outra variante não espera a primeira; a mesma espera
+        assert outra.wait(2)
+        assert not mesma.wait(0.2)
+    finally:
+        soltar.set()
+        for tarefa in tarefas:
+            tarefa.join()
+    assert mesma.is_set()
+    assert imagens._travas == {}
+
+
+def test_rota_de_variantes(criar_app):
+    Image = pytest.importorskip('PIL.Image')
+    app = criar_app()
+    raiz = app.config['MEDIA_ROOT']
+    os.makedirs(os.path.join(raiz, 'img'))
+    Image.new('RGB', (1200, 800), 'red').save(os.path.join(raiz, 'img', 'a.jpg'), format='JPEG')
+
+    assert getattr(app.view_functions['media_variante'], 'sem_admissao', False)
+    cliente = app.test_client()
+    # Mais que os 50 por hora do limite padrão por IP
+    for _ in range(60):
+        resposta = cliente.get('/media/_variantes/thumb/img/a.jpg')
+        assert resposta.status_code == 200
+        dados = resposta.get_data()
+        resposta.close()
+    with Image.open(io.BytesIO(dados)) as img:
+        assert max(img.size) == 320
+    assert cliente.get('/media/_variantes/full/img/a.jpg').status_code == 404
+    assert cliente.get('/media/_variantes/thumb/../../etc/passwd').status_code == 404
@@ -0,0 +1,157 @@
+# tests/test_limiter_storage.py
+"""
+Contadores do rate limiter num mmap compartilhado (limiter_storage.py):
+janela fixa e deslizante, expiração, descarte quando a faixa enche e a
+mesma tabela vista por vários processos.
+"""
+
+import asyncio
+import multiprocessing
+
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+from observatorio import limiter_storage
+from observatorio.limiter_storage import ArmazenamentoCompartilhado, caminho_do_uri
+
+pytestmark = pytest.mark.skipif(not limiter_storage.DISPONIVEL, reason='sem fcntl.lockf')
+
+
+class Relogio:
+    def __init__(self, agora=1_000_000.0):
+        self.agora = agora
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(limiter_storage.time, 'time', relogio)
+    return relogio
+
+
+@pytest.fixture
+def uri(tmp_path):
+    return f"mmap://{tmp_path}/ratelimit.bin"
+
+
+def test_uri():
+    assert caminho_do_uri('mmap:///var/run/rl.bin?faixas=8&slots=16') == ('/var/run/rl.bin', {'faixas': '8', 'slots': '16'})
+    assert caminho_do_uri('mmap://instance/rl.bin')[0] == 'instance/rl.bin'
+    with pytest.raises(ValueError):
+        caminho_do_uri('mmap://')
+
+
+def test_esquema_registrado_no_limits(uri):
+    armazenamento = storage_from_string(f"{uri}?faixas=4&slots=8")
+    assert isinstance(armazenamento, ArmazenamentoCompartilhado)
+    assert (armazenamento.faixas, armazenamento.slots) == (4, 8)
+    assert armazenamento.check()
+
+
+def test_contador_expira(uri, relogio):
+    armazenamento = ArmazenamentoCompartilhado(uri)
+    assert [armazenamento.incr('voto:1.2.3.4', 60) for _ in range(3)] == [1, 2, 3]
+    assert armazenamento.get('voto:1.2.3.4') == 3
+    assert armazenamento.get_expiry('voto:1.2.3.4') == relogio.agora + 60
+    assert armazenamento.get('outra') == 0
+
+    relogio.agora += 61
+    assert armazenamento.get('voto:1.2.3.4') == 0
+    # Renasce com um prazo novo
+    assert armazenamento.incr('voto:1.2.3.4', 60) == 1
+    assert armazenamento.get_expiry('voto:1.2.3.4') == relogio.agora + 60
+
+    armazenamento.clear('voto:1.2.3.4')
+    assert armazenamento.get('voto:1.2.3.4') == 0
+
+
+def test_tabela_existente_vale_sobre_o_pedido(uri):
+    ArmazenamentoCompartilhado(uri, faixas=4, slots=8).incr('chave', 60)
+    reaberto = ArmazenamentoCompartilhado(uri, faixas=64, slots=64)
+    assert (reaberto.faixas, reaberto.slots) == (4, 8)
+    assert reaberto.get('chave') == 1
+
+
+def test_faixa_cheia_descarta_a_que_expira_primeiro(uri, relogio):
+    armazenamento = ArmazenamentoCompartilhado(uri, faixas=1, slots=4)
+    for i in range(4):
+        armazenamento.incr(f"chave{i}", 60 + i)
+    armazenamento.incr('nova', 600)
+    assert armazenamento.get('nova') == 1
+    assert armazenamento.get('chave0') == 0
+    assert [armazenamento.get(f"chave{i}") for i in range(1, 4)] == [1, 1, 1]
+
+    # Posição expirada é reaproveitada antes de descartar alguém
+    relogio.agora += 61.5
+    armazenamento.incr('depois', 60)
+    assert armazenamento.get('chave2') == 1 and armazenamento.get('depois') == 1
+
+
+def test_reset(uri, relogio):
+    armazenamento = ArmazenamentoCompartilhado(uri, faixas=2, slots=8)
+    armazenamento.incr('a', 10)
+    armazenamento.incr('b', 100)
+    relogio.agora += 20
+    assert armazenamento.reset() == 1
+    assert armazenamento.get('b') == 0
+
+
+def test_limites_do_flask_limiter(uri, relogio):
+    armazenamento = ArmazenamentoCompartilhado(uri)
+    limite = parse('3/minute')
+    for estrategia in (FixedWindowRateLimiter(armazenamento), SlidingWindowCounterRateLimiter(armazenamento)):
+        assert [estrategia.hit(limite, '1.2.3.4') for _ in range(4)] == [True, True, True, False]
+        assert estrategia.hit(limite, '5.6.7.8')
+
+
+def test_janela_deslizante_pondera_a_anterior(uri, relogio):
+    armazenamento = ArmazenamentoCompartilhado(uri)
+    relogio.agora = 60 * 100_000
+    assert all(armazenamento.acquire_sliding_window_entry('k', 4, 60) for _ in range(4))
+    assert not armazenamento.acquire_sliding_window_entry('k', 4, 60)
+    # Metade da janela seguinte: a anterior ainda pesa metade (2 de 4)
+    relogio.agora += 90
+    anterior, _, atual, _ = armazenamento.get_sliding_window('k', 60)
+    assert (anterior, atual) == (4, 0)
+    assert armazenamento.acquire_sliding_window_entry('k', 4, 60)
+    assert armazenamento.acquire_sliding_window_entry('k', 4, 60)
+    assert not armazenamento.acquire_sliding_window_entry('k', 4, 60)
+    # Duas janelas depois, nada sobra
+    relogio.agora += 120
+    assert armazenamento.get_sliding_window('k', 60)[::2] == (0, 0)
+
+
+def _incrementar(uri, vezes):
+    armazenamento = ArmazenamentoCompartilhado(uri)
+    for _ in range(vezes):
+        armazenamento.incr('compartilhada', 3600)
+
+
+def test_processos_somam_no_mesmo_contador(uri):
+    contexto = multiprocessing.get_context('fork')
+    processos = [contexto.Process(target=_incrementar, args=(uri, 200)) for _ in range(4)]
+    for processo in processos:
+        processo.start()
+    _incrementar(uri, 200)
+    for processo in processos:
+        processo.join(30)
+        assert processo.exitcode == 0
+    assert ArmazenamentoCompartilhado(uri).get('compartilhada') == 1000
+
+
+def test_versao_async(uri):
+    armazenamento = storage_from_string(f"async+{uri}")
+
+    async def usar():
+        assert await armazenamento.incr('k', 60) == 1
+        assert await armazenamento.get('k') == 1
+        assert await armazenamento.acquire_sliding_window_entry('j', 1, 60)
+        assert not await armazenamento.acquire_sliding_window_entry('j', 1, 60)
+        return await armazenamento.check()
+
+    assert asyncio.run(usar())
@@ -0,0 +1,216 @@
+# tests/test_locais.py
+"""
+Registro de locais (locais.py): normalização e trigramas, o casamento do
+texto livre com o local conhecido que ele cita, a grade espacial conferida
+contra a busca exaustiva e a troca do registro quando locais_versao muda.
+"""
+
+import math
+import random
+
+import pytest
+
+from observatorio import locais
+from observatorio.locais import (
+    OUTRO, COORDS_PADRAO, METROS_GRAU, GradeEspacial, RegistroLocais, _normalizar, trigramas, registro_atual,
+)
+
+COORDENADAS = {
+    'Restaurante Universitário (RU)': (-23.406913, -51.938269),
+    'Biblioteca Central (BCE)': (-23.405180, -51.937650),
+    'Reitoria': (-23.404930, -51.939230),
+    'Bloco C34': (-23.407800, -51.936900),
+    OUTRO: (-23.4060, -51.9390),
+}
+
+
+@pytest.fixture
+def registro():
+    return RegistroLocais(COORDENADAS, versao=1)
+
+
+@pytest.mark.parametrize('texto, normalizado', [
+    ('Bloco C-34', 'bloco c34'),
+    ('bloco c 34', 'bloco c34'),
+    ('Bloco 01', 'bloco 1'),
+    ('Prefeitura do Campus (PCU)', 'prefeitura do campus pcu'),
+    ('Ágora   Música!', 'agora musica'),
+])
+def test_normalizar(texto, normalizado):
+    assert _normalizar(texto) == normalizado
+
+
+def test_trigramas_como_os_do_pg_trgm():
+    assert trigramas('RU') == {'  r', ' ru', 'ru '}
+    assert trigramas('Bloco C-34') == trigramas('bloco c34')
+    assert trigramas('!!!') == frozenset()
+
+
+@pytest.mark.parametrize('texto, nome', [
+    ('RU', 'Restaurante Universitário (RU)'),
+    ('perto do RU', 'Restaurante Universitário (RU)'),
+    ('restaurante universitario', 'Restaurante Universitário (RU)'),
+    ('atrás da biblioteca central', 'Biblioteca Central (BCE)'),
+    ('bloco c-34, segundo andar', 'Bloco C34'),
+    ('lago do campus', None),
+    ('', None),
+])
+def test_casar(registro, texto, nome):
+    assert registro.casar(texto) == nome
+
+
+def test_resolver(registro):
+    assert registro.resolver('Reitoria') == 'Reitoria'
+    assert registro.resolver('Outro: atrás da BCE') == 'Biblioteca Central (BCE)'
+    # OUTRO não é um local: o texto livre vem em outro campo
+    assert registro.resolver(OUTRO) is None
+    assert registro.resolver('lago do campus') is None
+    assert registro._resolvidos == {'Outro: atrás da BCE': 'Biblioteca Central (BCE)',
+                                    OUTRO: None, 'lago do campus': None}
+
+
+def test_cache_de_resolvidos_limitado(registro, monkeypatch):
+    monkeypatch.setattr(locais, 'MAX_RESOLVIDOS', 1)
+    assert registro.resolver('perto do RU') == 'Restaurante Universitário (RU)'
+    assert registro.resolver('Outro: atrás da BCE') == 'Biblioteca Central (BCE)'
+    assert list(registro._resolvidos) == ['perto do RU']
+
+
+def test_coordenadas_de(registro):
+    assert registro.coordenadas_de('perto do RU') == COORDENADAS['Restaurante Universitário (RU)']
+    assert registro.coordenadas_de('lago do campus') == COORDENADAS[OUTRO]
+    sem_outro = RegistroLocais({'Reitoria': (-23.40493, -51.93923)})
+    assert sem_outro.coordenadas_de('lago do campus') == COORDS_PADRAO
+
+
+def test_choices(registro):
+    assert registro.choices[0] == ('Biblioteca Central (BCE)', 'Biblioteca Central (BCE)')
+    assert [nome for nome, _ in registro.choices] == sorted(COORDENADAS)
+    assert registro.choices_submit[0] == ('', 'Selecione um local...')
+    assert registro.choices_submit[1:] == registro.choices
+    with pytest.raises(TypeError):
+        registro.coordenadas['Novo'] = (0, 0)
+
+
+def _exaustiva(pontos, lat, lon, k, raio):
+    """Mesma projeção da grade, sem índice nenhum."""
+    lat_media = sum(p[1] for p in pontos) / len(pontos)
+    escala_lon = METROS_GRAU * math.cos(math.radians(lat_media))
+    distancias = sorted((math.hypot((plon - lon) * escala_lon, (plat - lat) * METROS_GRAU), nome)
+                        for nome, plat, plon in pontos)
+    return [nome for d, nome in distancias[:k] if raio is None or d <= raio]
+
+
+@pytest.mark.parametrize('celula', [25, 100, 400])
+def test_grade_confere_com_a_busca_exaustiva(celula):
+    aleatorio = random.Random(celula)
+    pontos = [(f'P{i}', -23.41 + aleatorio.uniform(0, 0.01), -51.94 + aleatorio.uniform(0, 0.01))
+              for i in range(200)]
+    grade = GradeEspacial(pontos, celula)
+    for _ in range(50):
+        lat, lon = -23.412 + aleatorio.uniform(0, 0.014), -51.942 + aleatorio.uniform(0, 0.014)
+        for k, raio in ((1, None), (5, None), (10, 150), (3, 40)):
+            achados = grade.proximos(lat, lon, k, raio)
+            assert [nome for nome, *_ in achados] == _exaustiva(pontos, lat, lon, k, raio)
+            assert all(d <= raio for *_, d in achados) if raio else len(achados) == k
+
+
+def test_grade_ponto_longe_do_campus(registro):
+    # Curitiba: centenas de células de distância, cai na busca exaustiva
+    pontos = [(nome, *coords) for nome, coords in COORDENADAS.items() if nome != OUTRO]
+    achados = registro.proximos(-25.43, -49.27, k=2)
+    assert [nome for nome, *_ in achados] == _exaustiva(pontos, -25.43, -49.27, 2, None)
+    assert achados[0][3] > 300_000
+    assert registro.proximos(-25.43, -49.27, raio=1000) == []
+    assert GradeEspacial([], 100).proximos(-23.4, -51.9) == []
+
+
+def test_registro_com_o_locais_uem_json(criar_app):
+    app = criar_app()
+    with app.app_context():
+        atual = registro_atual()
+    assert atual is app.extensions['locais']['registro']
+    assert not any(nome.startswith('_') for nome in atual.nomes)
+    assert atual.resolver('na frente do DCE à noite') == 'Diretório Central dos Estudantes (DCE)'
+    assert atual.resolver('Outro: fila do RU') == 'Restaurante Universitário (RU)'
+    # Cada local está a zero metros do mais próximo das suas coordenadas
+    for nome in atual.nomes:
+        if nome != OUTRO:
+            assert atual.proximos(*atual.coordenadas[nome])[0][3] == pytest.approx(0)
+
+
+class PoolLocais:
+    """Pool de mentira com uma conexão que responde locais_versao e a tabela locais."""
+
+    def __init__(self, versao, linhas):
+        self.versao, self.linhas = versao, linhas
+        self.consultas = []
+        self.devolvida = False
+
+    def getconn(self):
+        return self
+
+    def putconn(self, conn):
+        self.devolvida = True
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.consultas.append(sql)
+
+    def fetchone(self):
+        return (self.versao,) if self.versao is not None else None
+
+    def fetchall(self):
+        return self.linhas
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def estado_locais(criar_app):
+    app = criar_app()
+    estado = app.extensions['locais']
+    estado['verificando'] = True
+    return app, estado
+
+
+def test_recarregar_troca_o_registro(estado_locais, monkeypatch):
+    app, estado = estado_locais
+    pool = PoolLocais(3, [('Reitoria', -23.40493, -51.93923)])
+    monkeypatch.setattr(locais, 'get_pool', lambda url: pool)
+    locais._recarregar(app, estado)
+    assert estado['registro'].versao == 3 and estado['registro'].nomes == ('Reitoria',)
+    assert estado['verificando'] is False and pool.devolvida
+
+    # Mesma versão: a tabela nem é lida e o registro é o mesmo objeto
+    anterior = estado['registro']
+    pool.consultas.clear()
+    locais._recarregar(app, estado)
+    assert estado['registro'] is anterior
+    assert pool.consultas == ['SELECT versao FROM locais_versao']
+
+
+def test_recarregar_com_a_tabela_vazia_fica_o_json(estado_locais, monkeypatch):
+    app, estado = estado_locais
+    monkeypatch.setattr(locais, 'get_pool', lambda url: PoolLocais(1, []))
+    locais._recarregar(app, estado)
+    assert estado['registro'].versao == 1
+    assert len(estado['registro'].nomes) == len(app.config['LOCAIS_UEM'])
+
+
+def test_recarregar_com_o_banco_fora_mantem_o_registro(estado_locais, monkeypatch):
+    app, estado = estado_locais
+    anterior = estado['registro']
+
+    def fora(url):
+        raise locais.psycopg2.OperationalError('could not connect to server')
+
+    monkeypatch.setattr(locais, 'get_pool', fora)
+    locais._recarregar(app, estado)
+    assert estado['registro'] is anterior and estado['verificando'] is False
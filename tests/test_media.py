@@ -0,0 +1,144 @@
+# tests/test_media.py
+"""
+Deduplicação e contagem de referências das mídias (storage.py), com o
+backend local numa pasta temporária e uma tabela 'media' falsa em memória.
+"""
+
+import copy
+import io
+import os
+
+import pytest
+
+from observatorio import storage
+from observatorio.storage import (
+    ArmazenamentoLocal, buscar_media, liberar_media, referenciar_media, registrar_media,
+    remover_midias, sha256_arquivo,
+)
+
+
+class CursorMedia:
+    """Cursor que executa as consultas de storage.py sobre um dict chave -> linha, com commit/rollback."""
+
+    def __init__(self):
+        self.linhas = {}
+        self._confirmado = {}
+        self.resultado = None
+        self.rowcount = 0
+
+    def commit(self):
+        self._confirmado = copy.deepcopy(self.linhas)
+
+    def rollback(self):
+        self.linhas = copy.deepcopy(self._confirmado)
+
+    def _por_conteudo(self, sha256, tipo):
+        return next((l for l in self.linhas.values() if l['sha256'] == sha256 and l['tipo'] == tipo), None)
+
+    def execute(self, sql, params):
+        self.resultado, self.rowcount = None, 0
+        if sql.startswith('INSERT INTO media'):
+            sha256, tipo, chave, url = params
+            if self._por_conteudo(sha256, tipo) is None:
+                self.linhas[chave] = {'sha256': sha256, 'tipo': tipo, 'chave': chave, 'url': url, 'ref_count': 0}
+                self.resultado = (chave,)
+        elif 'SET atualizado_em' in sql:
+            linha = self._por_conteudo(*params)
+            self.resultado = (linha['chave'], linha['url']) if linha else None
+        elif 'ref_count + 1' in sql:
+            linha = self.linhas.get(params[0])
+            if linha:
+                linha['ref_count'] += 1
+                self.rowcount = 1
+        elif 'ref_count - 1' in sql:
+            linha = self.linhas.get(params[0])
+            if linha:
+                linha['ref_count'] = max(linha['ref_count'] - 1, 0)
+                self.resultado = (linha['ref_count'],)
+        elif sql.startswith('DELETE FROM media'):
+            if self.linhas.get(params[0], {}).get('ref_count') == 0:
+                del self.linhas[params[0]]
+        else:
+            raise AssertionError(f'consulta inesperada: {sql}')
+
+    def fetchone(self):
+        return self.resultado
+
+
+@pytest.fixture
+def local(tmp_path):
+    return ArmazenamentoLocal(str(tmp_path), '/media/')
+
+
+def _enviar(cur, backend, conteudo):
+    """Fluxo do submit: reaproveita o conteúdo já armazenado ou envia e registra."""
+    arquivo = io.BytesIO(conteudo)
+    sha256 = sha256_arquivo(arquivo)
+    objeto = buscar_media(cur, sha256, 'imagem') or \
+        registrar_media(cur, backend, sha256, 'imagem', backend.salvar(arquivo, 'imagens'))
+    assert referenciar_media(cur, objeto.chave)
+    return objeto
+
+
+def test_conteudo_repetido_compartilha_o_objeto(local):
+    cur = CursorMedia()
+    primeiro = _enviar(cur, local, b'foto')
+    segundo = _enviar(cur, local, b'foto')
+    assert primeiro.chave == segundo.chave
+    assert cur.linhas[primeiro.chave]['ref_count'] == 2
+    assert _enviar(cur, local, b'outra').chave != primeiro.chave
+    assert len(os.listdir(os.path.join(local.raiz, 'imagens'))) == 2
+
+
+def test_registro_concorrente_remove_a_copia_redundante(local):
+    cur = CursorMedia()
+    primeiro = _enviar(cur, local, b'foto')
+    # Outro envio do mesmo conteúdo que não achou a linha antes de enviar
+    redundante = local.salvar(io.BytesIO(b'foto'), 'imagens')
+    objeto = registrar_media(cur, local, sha256_arquivo(io.BytesIO(b'foto')), 'imagem', redundante)
+    assert objeto.chave == primeiro.chave
+    assert not os.path.exists(os.path.join(local.raiz, redundante.chave))
+
+
+def test_objeto_so_sai_na_ultima_referencia_e_depois_do_commit(local):
+    cur = CursorMedia()
+    objeto = _enviar(cur, local, b'foto')
+    _enviar(cur, local, b'foto')
+    cur.commit()
+    caminho = os.path.join(local.raiz, objeto.chave)
+
+    assert liberar_media(cur, objeto.chave, objeto.url) is None
+    pendente = liberar_media(cur, objeto.chave, objeto.url)
+    assert pendente == (objeto.chave, objeto.url, 'imagem')
+    assert objeto.chave not in cur.linhas
+    # A transação foi desfeita: a linha volta e o objeto continua no backend
+    cur.rollback()
+    assert cur.linhas[objeto.chave]['ref_count'] == 2
+    assert os.path.exists(caminho)
+
+    liberar_media(cur, objeto.chave, objeto.url)
+    pendentes = [liberar_media(cur, objeto.chave, objeto.url)]
+    cur.commit()
+    remover_midias(local, pendentes)
+    assert not os.path.exists(caminho)
+
+
+def test_midia_anterior_a_deduplicacao_sai_sempre(local):
+    cur = CursorMedia()
+    objeto = local.salvar(io.BytesIO(b'antiga'), 'imagens')
+    assert liberar_media(cur, objeto.chave, objeto.url) == (objeto.chave, objeto.url, 'imagem')
+    assert liberar_media(cur, None, None) is None
+
+
+def test_remocao_tambem_apaga_variantes(local):
+    objeto = local.salvar(io.BytesIO(b'foto'), 'imagens')
+    variante = os.path.join(local.raiz, '_variantes', 'thumb', objeto.chave)
+    os.makedirs(os.path.dirname(variante))
+    open(variante, 'wb').close()
+    remover_midias(local, [(objeto.chave, objeto.url, 'imagem'), None])
+    assert not os.path.exists(variante)
+
+
+def test_chave_fora_da_raiz(local):
+    with pytest.raises(storage.StorageError):
+        local.remover('../fora.txt')
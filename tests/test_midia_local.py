@@ -0,0 +1,17 @@
+# tests/test_midia_local.py
+"""Mídia do backend local (storage.py): servida fora dos limites padrão por IP."""
+
+import os
+
+
+def test_media_local_sem_limite_por_ip(criar_app):
+    app = criar_app()
+    os.makedirs(app.config['MEDIA_ROOT'])
+    with open(os.path.join(app.config['MEDIA_ROOT'], 'a.txt'), 'w') as f:
+        f.write('x')
+    cliente = app.test_client()
+    # Mais que os 50 por hora do limite padrão
+    for _ in range(60):
+        resposta = cliente.get('/media/a.txt')
+        assert resposta.status_code == 200
+        resposta.close()
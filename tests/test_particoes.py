@@ -0,0 +1,133 @@
+# tests/test_particoes.py
+"""
+Conversão e manutenção das tabelas de interação particionadas
+(particoes.py) e o bloqueio do /healthz/ready com o schema desatualizado.
+Sem banco: um cursor falso responde às consultas de catálogo.
+"""
+
+from datetime import date
+
+import pytest
+
+from observatorio import db, particoes
+
+
+class CursorFalso:
+    """Responde às consultas de catálogo de particoes.py a partir de 'relkind' e 'colunas_comentarios'."""
+
+    def __init__(self, relkind, colunas_comentarios=('id', 'texto', 'city_id'), particoes_de=()):
+        self.relkind = relkind
+        self.colunas_comentarios = colunas_comentarios
+        self.particoes_de = list(particoes_de)
+        self.executados = []
+        self.resultado = []
+        self.rowcount = 0
+
+    def execute(self, consulta, params=()):
+        texto = consulta if isinstance(consulta, str) else repr(consulta)
+        self.executados.append(texto)
+        self.resultado = []
+        if 'SELECT relkind FROM pg_class' in texto:
+            tipo = self.relkind.get(params[0])
+            self.resultado = [(tipo,)] if tipo else []
+        elif 'information_schema.columns' in texto:
+            self.resultado = [(1,)] if 'city' in self.colunas_comentarios else []
+        elif 'FROM pg_inherits' in texto:
+            self.resultado = [(nome,) for nome in self.particoes_de]
+        elif 'pg_get_serial_sequence' in texto and 'setval' not in texto:
+            self.resultado = [(f'public.{params[0]}_id_seq',)]
+        elif 'SELECT MIN(criado_em)' in texto:
+            self.resultado = [(None,)]
+
+    def fetchone(self):
+        return self.resultado[0] if self.resultado else None
+
+    def fetchall(self):
+        return self.resultado
+
+    def close(self):
+        pass
+
+
+def test_migracoes_pendentes():
+    cur = CursorFalso({'votos': 'r', 'testemunhas': 'p', 'comentarios_likes': 'p'},
+                      colunas_comentarios=('id', 'city'))
+    assert particoes.migracoes_pendentes(cur) == ['votos', 'comentarios']
+    novo = CursorFalso({'votos': 'p', 'testemunhas': 'p', 'comentarios_likes': 'p'})
+    assert particoes.migracoes_pendentes(novo) == []
+
+
+def test_migrar_banco_novo_so_aplica_o_schema(monkeypatch):
+    aplicados = []
+    monkeypatch.setattr(particoes, 'executar_schema', lambda cur: aplicados.append(cur))
+    cur = CursorFalso({})
+    assert particoes.migrar(cur) == ({}, False)
+    assert len(aplicados) == 1
+    assert not any('RENAME' in sql or 'DROP' in sql for sql in cur.executados)
+
+
+def test_migrar_converte_tabelas_antigas(monkeypatch):
+    ordem = []
+    monkeypatch.setattr(particoes, 'executar_schema', lambda cur: ordem.append('schema'))
+    monkeypatch.setattr(particoes, '_copiar_antiga', lambda cur, tabela: ordem.append(f'copiar {tabela}') or 7)
+    cur = CursorFalso({'votos': 'r', 'testemunhas': 'p', 'comentarios_likes': 'p'})
+    copiadas, comentarios = particoes.migrar(cur)
+    assert copiadas == {'votos': 7}
+    assert comentarios is False
+    # A antiga sai do caminho antes do schema.sql recriar a tabela, e só é apagada depois da cópia
+    assert ordem == ['schema', 'copiar votos']
+    renomeia = [i for i, sql in enumerate(cur.executados) if 'RENAME' in sql]
+    apaga = [i for i, sql in enumerate(cur.executados) if 'DROP TABLE' in sql]
+    assert renomeia and apaga and max(renomeia) < min(apaga)
+
+
+def test_particoes_antigas(monkeypatch):
+    class Hoje(date):
+        @classmethod
+        def today(cls):
+            return cls(2026, 3, 15)
+
+    monkeypatch.setattr(particoes, 'date', Hoje)
+    cur = CursorFalso({}, particoes_de=['votos_2024_12', 'votos_2025_01', 'votos_2025_02', 'votos_2025_03',
+                                        'votos_padrao', 'votos_2026_03'])
+    # 12 meses completos além do atual: de março/2025 em diante ficam
+    assert particoes.particoes_antigas(cur, 'votos', 12) == ['votos_2024_12', 'votos_2025_01', 'votos_2025_02']
+
+
+class PoolFalso:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def getconn(self):
+        pool = self
+
+        class Conexao:
+            def cursor(self):
+                return pool.cur
+
+            def rollback(self):
+                pass
+
+        return Conexao()
+
+    def putconn(self, conn):
+        pass
+
+
+@pytest.fixture
+def estado_limpo(monkeypatch):
+    monkeypatch.setitem(db._estado, 'aquecido', True)
+    monkeypatch.setitem(db._estado, 'erro', None)
+    monkeypatch.setitem(db._estado, 'schema', None)
+
+
+def test_schema_desatualizado_tira_o_worker_do_balanceador(estado_limpo):
+    antigo = CursorFalso({'votos': 'r', 'testemunhas': 'r', 'comentarios_likes': 'r'})
+    assert db.verificar_schema(PoolFalso(antigo)) == ['votos', 'testemunhas', 'comentarios_likes']
+    estado = db.estado_pool()
+    assert not estado['pronto']
+    assert 'flask init-db' in estado['schema']
+
+    convertido = CursorFalso({'votos': 'p', 'testemunhas': 'p', 'comentarios_likes': 'p'})
+    assert db.verificar_schema(PoolFalso(convertido)) == []
+    assert db.estado_pool()['pronto']
@@ -0,0 +1,128 @@
+# tests/test_perfil.py
+"""
+Listas do perfil de um investigador (routes_api.py): páginas por cursor
+de relatos e comentários, empates de criado_em resolvidos pelo id, cursor
+de uma lista recusado na outra e a primeira página renderizada no perfil.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from observatorio import routes_api, routes_public
+from observatorio.routes_api import (
+    ApiError, TRECHO_COMENTARIO, listar_relatos_usuario, listar_comentarios_usuario,
+)
+
+INICIO = datetime(2024, 5, 1)
+
+
+class CursorPerfil:
+    """
+    RealDictCursor de mentira com os relatos e comentários do usuário 1.
+    Metade das linhas compartilha o mesmo criado_em, para exercitar o desempate pelo id.
+    """
+
+    def __init__(self, total=7):
+        self.relatos = [{'id': i, 'titulo': f'Relato {i}', 'aprovado': i % 2 == 0,
+                         'criado_em': INICIO + timedelta(hours=i // 2)} for i in range(1, total + 1)]
+        self.comentarios = [{'id': i, 'relato_id': 1, 'criado_em': INICIO + timedelta(hours=i // 2),
+                             'texto': 'x' * (TRECHO_COMENTARIO + i - 3)} for i in range(1, total + 1)]
+        self.consultas = []
+        self.linhas = []
+
+    def execute(self, query, params):
+        self.consultas.append((query, params))
+        if 'SELECT u.id' in query:
+            self.linhas = [{'id': params[0], 'nome': 'Investigadora', 'profile_pic_url': None, 'criado_em': INICIO,
+                            'relatos_count': len(self.relatos), 'comentarios_count': len(self.comentarios),
+                            'votos_recebidos': 3}] if params[0] == 1 else []
+            return
+        if 'FROM comentarios' in query:
+            trecho, _, user_id, *resto = params
+            fonte = [dict(c, relato_titulo='Relato 1', trecho=c['texto'][:trecho],
+                          truncado=len(c['texto']) > trecho) for c in self.comentarios]
+            for linha in fonte:
+                del linha['texto']
+        else:
+            user_id, *resto = params
+            fonte = self.relatos
+        linhas = sorted(fonte if user_id == 1 else [], key=lambda l: (l['criado_em'], l['id']), reverse=True)
+        *chave, limite = resto
+        if chave:
+            linhas = [l for l in linhas if (l['criado_em'], l['id']) < (datetime.fromisoformat(chave[0]), chave[1])]
+        self.linhas = linhas[:limite]
+
+    def fetchone(self):
+        return self.linhas[0] if self.linhas else None
+
+    def fetchall(self):
+        return self.linhas
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('listar', [listar_relatos_usuario, listar_comentarios_usuario])
+def test_paginas_sem_repetir_nem_pular(listar):
+    cur = CursorPerfil()
+    ids, cursor = [], None
+    while True:
+        itens, cursor = listar(cur, 1, cursor, limite=2)
+        ids += [item['id'] for item in itens]
+        if cursor is None:
+            break
+    assert ids == [7, 6, 5, 4, 3, 2, 1]
+    assert all('LIMIT %s' in query for query, _ in cur.consultas)
+
+
+def test_trecho_dos_comentarios():
+    itens, _ = listar_comentarios_usuario(CursorPerfil(), 1, limite=10)
+    assert all(len(item['trecho']) <= TRECHO_COMENTARIO for item in itens)
+    assert {item['id']: item['truncado'] for item in itens}[3] is False
+    assert {item['id']: item['truncado'] for item in itens}[4] is True
+
+
+def test_cursor_de_uma_lista_nao_vale_na_outra():
+    cur = CursorPerfil()
+    _, cursor = listar_relatos_usuario(cur, 1, limite=2)
+    with pytest.raises(ApiError):
+        listar_comentarios_usuario(cur, 1, cursor, limite=2)
+
+
+class ConexaoPerfil:
+    closed = 0
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def cursor(self, *args, **kwargs):
+        return self.cur
+
+    def rollback(self):
+        pass
+
+
+def test_api_de_comentarios(criar_app, monkeypatch):
+    monkeypatch.setattr(routes_api, 'get_db', lambda: ConexaoPerfil(CursorPerfil()))
+    cliente = criar_app().test_client()
+    dados = cliente.get('/api/users/1/comentarios?limite=3').get_json()
+    assert [c['id'] for c in dados['comentarios']] == [7, 6, 5]
+    assert dados['comentarios'][0]['criado_em'] == '2024-05-01T03:00:00'
+    seguinte = cliente.get(f"/api/users/1/comentarios?limite=3&cursor={dados['proximo']}").get_json()
+    assert [c['id'] for c in seguinte['comentarios']] == [4, 3, 2]
+    assert cliente.get('/api/users/1/relatos?cursor=abc').status_code == 400
+
+
+def test_perfil_renderiza_a_primeira_pagina(criar_app, monkeypatch):
+    cur = CursorPerfil(total=routes_api.LIMITE_PADRAO + 1)
+    monkeypatch.setattr(routes_public, 'get_db', lambda: ConexaoPerfil(cur))
+    cliente = criar_app().test_client()
+    resposta = cliente.get('/profile/1')
+    assert resposta.status_code == 200
+    html = resposta.get_data(as_text=True)
+    assert 'Investigadora' in html
+    assert html.count('Carregar mais') == 2
+    assert '/api/users/1/relatos' in html and '/api/users/1/comentarios' in html
+
+    assert cliente.get('/profile/2').status_code == 302
@@ -0,0 +1,149 @@
+# tests/test_preparadas.py
+"""
+Prepared statements por conexão do pool (db.py): PREPARE uma vez por
+conexão e depois só EXECUTE, nomes distintos para SQLs distintos e a
+desativação atrás de um pooler em modo transação.
+"""
+
+import psycopg2
+import pytest
+
+from observatorio import db
+from observatorio.db import executar, dsn_usa_pooler, preparadas_ativas
+
+
+class Conexao:
+    """Conexão de mentira que registra os comandos; 'falhar' faz o próximo PREPARE dar erro."""
+
+    def __init__(self, host='db.interno', port=5432):
+        self.parametros = {'host': host, 'port': str(port)}
+        self.consultas_parametros = 0
+        self.comandos = []
+        self.falhar = False
+
+    def get_dsn_parameters(self):
+        self.consultas_parametros += 1
+        return self.parametros
+
+    def cursor(self):
+        return Cursor(self)
+
+
+class Cursor:
+    def __init__(self, conexao):
+        self.connection = conexao
+
+    def execute(self, sql, params=None):
+        if sql.startswith('PREPARE') and self.connection.falhar:
+            self.connection.falhar = False
+            raise psycopg2.errors.SyntaxError('syntax error')
+        self.connection.comandos.append((sql, params))
+
+
+SQL = 'SELECT tipo_voto FROM votos WHERE relato_id = %s AND session_id = %s'
+
+
+@pytest.fixture
+def app_preparadas(criar_app):
+    def criar(modo):
+        app = criar_app(DB_PREPARED_STATEMENTS=modo)
+        contexto = app.app_context()
+        contexto.push()
+        return contexto
+
+    contextos = []
+    yield lambda modo: contextos.append(criar(modo))
+    for contexto in contextos:
+        contexto.pop()
+
+
+def test_prepara_uma_vez_por_conexao(app_preparadas):
+    app_preparadas('true')
+    conexao = Conexao()
+    executar(conexao.cursor(), 'voto_da_sessao', SQL, (1, 'abc'))
+    executar(conexao.cursor(), 'voto_da_sessao', SQL, (2, 'def'))
+    (prepare, _), (execute1, params1), (execute2, params2) = conexao.comandos
+    assert prepare.startswith('PREPARE voto_da_sessao_') and prepare.endswith(
+        'AS SELECT tipo_voto FROM votos WHERE relato_id = $1 AND session_id = $2')
+    nome = prepare.split()[1]
+    assert execute1 == execute2 == f'EXECUTE {nome} (%s, %s)'
+    assert (params1, params2) == ((1, 'abc'), (2, 'def'))
+
+    # Outra conexão do pool prepara de novo
+    outra = Conexao()
+    executar(outra.cursor(), 'voto_da_sessao', SQL, (1, 'abc'))
+    assert outra.comandos[0][0] == prepare
+
+
+def test_sql_diferente_ganha_outro_nome(app_preparadas):
+    app_preparadas('true')
+    conexao = Conexao()
+    executar(conexao.cursor(), 'mapa', 'SELECT local FROM relatos WHERE aprovado = %s', (True,))
+    executar(conexao.cursor(), 'mapa', 'SELECT local FROM relatos WHERE aprovado = %s AND categoria = %s',
+             (True, 'Aparição'))
+    preparos = [sql.split()[1] for sql, _ in conexao.comandos if sql.startswith('PREPARE')]
+    assert len(preparos) == 2 and preparos[0] != preparos[1]
+    assert all(nome.startswith('mapa_') for nome in preparos)
+
+
+def test_sem_parametros(app_preparadas):
+    app_preparadas('true')
+    conexao = Conexao()
+    executar(conexao.cursor(), 'top', 'SELECT id FROM relatos LIMIT 10')
+    assert conexao.comandos[1] == (f"EXECUTE {conexao.comandos[0][0].split()[1]}", None)
+
+
+def test_prepare_que_falhou_e_refeito(app_preparadas):
+    app_preparadas('true')
+    conexao = Conexao()
+    conexao.falhar = True
+    with pytest.raises(psycopg2.Error):
+        executar(conexao.cursor(), 'voto_da_sessao', SQL, (1, 'abc'))
+    executar(conexao.cursor(), 'voto_da_sessao', SQL, (1, 'abc'))
+    assert conexao.comandos[0][0].startswith('PREPARE')
+
+
+@pytest.mark.parametrize('modo, conexao, prepara', [
+    ('false', Conexao(), False),
+    ('auto', Conexao(), True),
+    ('auto', Conexao(host='ep-frio-123-pooler.sa-east-1.aws.neon.tech'), False),
+    ('auto', Conexao(port=6432), False),
+    ('true', Conexao(port=6432), True),
+])
+def test_modos(app_preparadas, modo, conexao, prepara):
+    app_preparadas(modo)
+    executar(conexao.cursor(), 'voto_da_sessao', SQL, (1, 'abc'))
+    executar(conexao.cursor(), 'voto_da_sessao', SQL, (2, 'def'))
+    if prepara:
+        assert conexao.comandos[0][0].startswith('PREPARE')
+    else:
+        assert conexao.comandos == [(SQL, (1, 'abc')), (SQL, (2, 'def'))]
+    # A heurística do pooler roda no máximo uma vez por conexão, e só em 'auto'
+    assert conexao.consultas_parametros == (1 if modo == 'auto' else 0)
+
+
+def test_pooler_pela_url():
+    assert dsn_usa_pooler('postgresql://u:s@ep-frio-123-pooler.sa-east-1.aws.neon.tech/obs?sslmode=require')
+    assert dsn_usa_pooler('postgresql://u:s@pgbouncer:6432/obs')
+    assert not dsn_usa_pooler('postgresql://u:s@ep-frio-123.sa-east-1.aws.neon.tech/obs')
+    assert not dsn_usa_pooler('host=localhost dbname=obs')
+
+
+def test_preparadas_ativas_so_consulta_o_pooler_no_auto():
+    def nao_chamar():
+        raise AssertionError('usa_pooler não deveria ser chamada')
+
+    assert preparadas_ativas('true', nao_chamar)
+    assert not preparadas_ativas('false', nao_chamar)
+    assert preparadas_ativas('auto', lambda: False)
+    assert not preparadas_ativas('auto', lambda: True)
+
+
+def test_registro_some_com_a_conexao(app_preparadas):
+    app_preparadas('true')
+    conexao = Conexao()
+    executar(conexao.cursor(), 'voto_da_sessao', SQL, (1, 'abc'))
+    assert conexao in db._preparadas
+    quantas = len(db._preparadas)
+    del conexao
+    assert len(db._preparadas) == quantas - 1
@@ -0,0 +1,178 @@
+# tests/test_replicas.py
+"""
+Réplicas de leitura (db.py): checagem de atraso com ejeção, rodízio entre
+as réplicas saudáveis, escolha do destino por requisição (read-your-writes)
+e volta ao primário quando a réplica recusa a conexão.
+"""
+
+import psycopg2
+import pytest
+from flask import g, session
+
+from observatorio import db
+
+REPLICAS = ['postgresql://replica-a/obs', 'postgresql://replica-b/obs']
+
+
+@pytest.fixture(autouse=True)
+def estado_limpo(monkeypatch):
+    monkeypatch.setattr(db, '_replicas_estado', {})
+    monkeypatch.setattr(db, 'replica_pools', {})
+
+
+class ThreadAdiada:
+    """
+    Guarda as checagens disparadas para o teste rodá-las quando quiser (o
+    start acontece com o _replicas_lock seguro, como numa thread de verdade).
+    """
+
+    pendentes = []
+
+    def __init__(self, target, args, daemon):
+        self.target, self.args = target, args
+
+    def start(self):
+        self.pendentes.append(self)
+
+    @classmethod
+    def rodar(cls):
+        while cls.pendentes:
+            thread = cls.pendentes.pop(0)
+            thread.target(*thread.args)
+
+
+class Cursor:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def execute(self, sql):
+        if isinstance(self.lag, Exception):
+            raise self.lag
+
+    def fetchone(self):
+        return (self.lag,)
+
+    def close(self):
+        pass
+
+
+class Conexao:
+    closed = 0
+    prazo_ms = 0
+
+    def __init__(self, lag=0):
+        self.lag = lag
+
+    def cursor(self):
+        return Cursor(self.lag)
+
+    def rollback(self):
+        pass
+
+
+class Pool:
+    def __init__(self, lag=0, erro=None):
+        self.lag, self.erro = lag, erro
+        self.devolvidas = 0
+
+    def getconn(self):
+        if self.erro:
+            raise self.erro
+        return Conexao(self.lag)
+
+    def putconn(self, conexao, close=False):
+        self.devolvidas += 1
+
+
+def _replicas(monkeypatch, pools):
+    monkeypatch.setattr(db, '_get_replica_pool', lambda dsn: pools[dsn])
+    for dsn in pools:
+        db._replicas_estado[dsn] = {'lag': None, 'checado_em': 0, 'ativa': False, 'checando': True}
+
+
+@pytest.mark.parametrize('pool, ativa, lag', [
+    (Pool(lag=1.5), True, 1.5),
+    (Pool(lag=12), False, 12.0),
+    (Pool(lag=psycopg2.OperationalError('recovery conflict')), False, None),
+    (Pool(erro=psycopg2.OperationalError('connection refused')), False, None),
+])
+def test_checagem_ejeta_replica_atrasada_ou_inacessivel(monkeypatch, pool, ativa, lag):
+    _replicas(monkeypatch, {REPLICAS[0]: pool})
+    db._checar_replica(REPLICAS[0], max_lag=5)
+    estado = db._replicas_estado[REPLICAS[0]]
+    assert (estado['ativa'], estado['lag'], estado['checando']) == (ativa, lag, False)
+    if not pool.erro:
+        assert pool.devolvidas == 1
+
+
+def test_rodizio_so_entre_replicas_saudaveis(criar_app, monkeypatch):
+    pools = {REPLICAS[0]: Pool(lag=0), REPLICAS[1]: Pool(lag=30)}
+    monkeypatch.setattr(db, 'Thread', ThreadAdiada)
+    monkeypatch.setattr(db, '_get_replica_pool', lambda dsn: pools[dsn])
+    app = criar_app(DATABASE_REPLICA_URLS=REPLICAS, DB_REPLICA_MAX_LAG=5, DB_REPLICA_CHECK_INTERVAL=3600)
+
+    def checar_de_novo():
+        for estado in db._replicas_estado.values():
+            estado['checado_em'] = 0
+        db._replica_disponivel()
+        ThreadAdiada.rodar()
+
+    with app.app_context():
+        # Até a primeira checagem terminar, nenhuma réplica recebe tráfego
+        assert db._replica_disponivel() is None
+        assert len(ThreadAdiada.pendentes) == 2
+        ThreadAdiada.rodar()
+        assert {db._replica_disponivel() for _ in range(4)} == {REPLICAS[0]}
+
+        # A réplica atrasada se recupera, mas só volta na próxima checagem
+        pools[REPLICAS[1]].lag = 0
+        assert {db._replica_disponivel() for _ in range(4)} == {REPLICAS[0]}
+        assert ThreadAdiada.pendentes == []
+        checar_de_novo()
+        assert {db._replica_disponivel() for _ in range(4)} == set(REPLICAS)
+
+        pools[REPLICAS[0]].lag = pools[REPLICAS[1]].lag = 30
+        checar_de_novo()
+        assert db._replica_disponivel() is None
+
+
+def _destino(app, metodo='GET', caminho='/rankings', fixado=False):
+    with app.test_request_context(caminho, method=metodo):
+        if fixado:
+            db.pin_primary()
+        db._escolher_destino()
+        return g.db_destino
+
+
+def test_destino_da_requisicao(criar_app):
+    app = criar_app(DATABASE_REPLICA_URLS=REPLICAS)
+    assert _destino(app) == 'replica'
+    assert _destino(app, metodo='POST', caminho='/vote/1/acredito') == 'primario'
+    # View sem @read_only
+    assert _destino(app, caminho='/csrf-token') == 'primario'
+    # Logo depois de uma escrita a sessão lê do primário
+    assert _destino(app, fixado=True) == 'primario'
+    assert _destino(criar_app(DATABASE_REPLICA_URLS=[])) == 'primario'
+
+
+def test_escrita_fixa_a_sessao_no_primario(criar_app):
+    app = criar_app(DATABASE_REPLICA_URLS=REPLICAS, DB_PRIMARY_PIN_SECONDS=10)
+    with app.test_request_context('/vote/1/acredito', method='POST'):
+        g.db_usou_primario = True
+        db._fixar_apos_escrita(app.response_class())
+        assert session[db.PIN_SESSION_KEY] > 0
+
+
+def test_replica_que_recusa_conexao_cai_para_o_primario(criar_app, monkeypatch):
+    primario = Pool()
+    pools = {REPLICAS[0]: Pool(erro=psycopg2.OperationalError('too many connections'))}
+    monkeypatch.setattr(db, '_get_replica_pool', lambda dsn: pools[dsn])
+    monkeypatch.setattr(db, '_replica_disponivel', lambda: REPLICAS[0])
+    monkeypatch.setattr(db, 'get_pool', lambda: primario)
+    db._replicas_estado[REPLICAS[0]] = {'lag': 0, 'checado_em': 0, 'ativa': True, 'checando': False}
+    app = criar_app(DATABASE_REPLICA_URLS=REPLICAS)
+    with app.test_request_context('/rankings'):
+        g.db_destino = 'replica'
+        db.get_db()
+        assert g.db_pool is primario and g.db_usou_primario
+    assert db._replicas_estado[REPLICAS[0]]['ativa'] is False
@@ -0,0 +1,171 @@
+# tests/test_similaridade.py
+"""
+Quase-duplicatas (similaridade.py): assinaturas MinHash e chaves LSH, o
+Jaccard estimado, a classificação de um texto novo no grupo do mais
+antigo parecido e a separação de um falso positivo do seu grupo.
+"""
+
+import re
+
+import pytest
+
+from observatorio.similaridade import HASHES, BANDAS, minhash, bandas, jaccard, buscar_parecidos, classificar, separar
+
+TEXTO = ('Ontem à noite, no bloco C34, ouvi passos no corredor vazio e as luzes do segundo andar '
+         'piscaram três vezes antes de apagar de vez')
+# Mesmo texto com uma palavra trocada no fim: Jaccard real de ~0,9
+QUASE = TEXTO.replace('de vez', 'de novo')
+OUTRO = 'Vi uma mulher de branco atravessando o estacionamento do RU às três da manhã sem fazer barulho nenhum'
+
+
+def _jaccard_real(a, b):
+    def atributos(texto):
+        palavras = re.findall(r'\w+', texto.lower())
+        return set(palavras) | {f'{x} {y}' for x, y in zip(palavras, palavras[1:])}
+    a, b = atributos(a), atributos(b)
+    return len(a & b) / len(a | b)
+
+
+def test_assinatura_normalizada_e_estavel():
+    assinatura = minhash(TEXTO)
+    assert len(assinatura) == HASHES
+    assert all(-2 ** 31 <= valor < 2 ** 31 for valor in assinatura)
+    # Acentos, maiúsculas e pontuação não mudam a assinatura
+    assert minhash('ONTEM A NOITE... no Bloco  C34!') == minhash('ontem à noite no bloco c34')
+    assert minhash(TEXTO) == assinatura
+
+
+def test_textos_curtos_nao_sao_assinados():
+    assert minhash('que medo!', min_palavras=8) is None
+    assert minhash('', min_palavras=1) is None
+    assert minhash(None) is None
+    assert minhash('!!!') is None
+    assert minhash('um dois três quatro cinco seis sete oito', min_palavras=8) is not None
+
+
+def test_jaccard_estimado():
+    assinatura = minhash(TEXTO)
+    assert jaccard(assinatura, assinatura) == 1
+    # 64 funções de hash: o erro padrão fica perto de 0,06
+    assert jaccard(assinatura, minhash(QUASE)) == pytest.approx(_jaccard_real(TEXTO, QUASE), abs=0.2)
+    assert jaccard(assinatura, minhash(OUTRO)) < 0.2
+
+
+def test_bandas():
+    chaves = bandas(minhash(TEXTO))
+    assert len(chaves) == BANDAS
+    assert all(-2 ** 63 <= chave < 2 ** 63 for chave in chaves)
+    assert len(set(chaves)) == BANDAS
+    # Quase-duplicatas coincidem em alguma faixa; textos diferentes, não
+    assert set(chaves) & set(bandas(minhash(QUASE)))
+    assert not set(chaves) & set(bandas(minhash(OUTRO)))
+    # A faixa entra na chave: valores iguais em faixas diferentes não colidem
+    constante = [7] * HASHES
+    assert len(set(bandas(constante))) == BANDAS
+
+
+class CursorParecidos:
+    """Devolve (id, minhash, raiz) dos candidatos, como a consulta pelas faixas LSH."""
+
+    def __init__(self, linhas):
+        self.connection = self  # o executar guarda as preparadas por conexão
+        self.linhas = linhas
+        self.consultas = []
+
+    def execute(self, sql, params=None):
+        self.consultas.append((sql, params))
+
+    def fetchall(self):
+        return self.linhas
+
+
+@pytest.fixture
+def contexto(criar_app):
+    def criar(**config):
+        app = criar_app(DB_PREPARED_STATEMENTS='false', SIMILARIDADE_MIN_PALAVRAS=8, **config)
+        return app.app_context()
+    return criar
+
+
+def test_buscar_parecidos(contexto):
+    assinatura = minhash(TEXTO)
+    cur = CursorParecidos([(3, minhash(OUTRO), 3), (5, minhash(QUASE), 2), (8, assinatura, 2), (9, assinatura, 2)])
+    with contexto():
+        parecidos = buscar_parecidos(cur, 'relato', assinatura, bandas(assinatura), 0.7, 30, antes_de=9)
+    assert [(linha_id, raiz) for linha_id, raiz, _ in parecidos] == [(8, 2), (5, 2)]
+    assert parecidos[0][2] == 1
+    sql, params = cur.consultas[0]
+    assert 'FROM relatos' in sql and 'minhash_bandas && %s::bigint[]' in sql
+    assert params == (bandas(assinatura), 30)
+
+
+def test_classificar(contexto):
+    cur = CursorParecidos([(4, minhash(QUASE), 2), (6, minhash(OUTRO), 6)])
+    with contexto():
+        assinatura, chaves, raiz = classificar(cur, 'comentario', TEXTO)
+        assert (assinatura, chaves, raiz) == (minhash(TEXTO), bandas(minhash(TEXTO)), 2)
+        assert 'FROM comentarios' in cur.consultas[0][0]
+        # Curto demais: nem consulta o banco
+        assert classificar(cur, 'comentario', 'que medo!') == (None, None, None)
+        assert len(cur.consultas) == 1
+        # Inédito
+        assert classificar(CursorParecidos([(6, minhash(OUTRO), 6)]), 'relato', TEXTO)[2] is None
+
+
+def test_classificar_com_a_deteccao_desligada(contexto):
+    cur = CursorParecidos([(4, minhash(TEXTO), 2)])
+    with contexto(SIMILARIDADE_JACCARD_MIN=0):
+        assinatura, chaves, raiz = classificar(cur, 'relato', TEXTO)
+    assert assinatura == minhash(TEXTO) and chaves == bandas(assinatura) and raiz is None
+    assert cur.consultas == []
+
+
+class TabelaGrupos:
+    """
+    Cursor sobre {id: duplicata_de} que executa as duas instruções do
+    separar com a semântica do Postgres (a CTE enxerga a tabela de antes).
+    """
+
+    def __init__(self, duplicata_de):
+        self.duplicata_de = dict(duplicata_de)
+        self.comandos = []
+
+    def execute(self, sql, params):
+        self.comandos.append(sql)
+        if 'WITH novas_raizes' in sql:
+            ids = params[0]
+            assert params == (ids, ids, ids)
+            novas = {}
+            for linha_id, raiz in self.duplicata_de.items():
+                if raiz in ids and linha_id not in ids:
+                    novas[raiz] = min(novas.get(raiz, linha_id), linha_id)
+            for linha_id, raiz in list(self.duplicata_de.items()):
+                if raiz in novas and linha_id not in ids:
+                    self.duplicata_de[linha_id] = None if novas[raiz] == linha_id else novas[raiz]
+        else:
+            assert sql.startswith('UPDATE relatos SET duplicata_de = NULL')
+            for linha_id in params[0]:
+                self.duplicata_de[linha_id] = None
+
+
+# Grupo 1 <- 2, 3, 4 e grupo 10 <- 11
+GRUPOS = {1: None, 2: 1, 3: 1, 4: 1, 10: None, 11: 10}
+
+
+@pytest.mark.parametrize('ids, depois', [
+    # Cópia separada: sai do grupo, o resto fica como estava
+    ([3], {1: None, 2: 1, 3: None, 4: 1, 10: None, 11: 10}),
+    # Raiz separada: a cópia mais antiga vira a raiz
+    ([1], {1: None, 2: None, 3: 2, 4: 2, 10: None, 11: 10}),
+    # Raiz e a próxima cópia juntas
+    ([1, 2], {1: None, 2: None, 3: None, 4: 3, 10: None, 11: 10}),
+    # Raiz com uma só cópia: o grupo acaba
+    ([10], {1: None, 2: 1, 3: 1, 4: 1, 10: None, 11: None}),
+    # Grupo inteiro
+    ([1, 2, 3, 4], {1: None, 2: None, 3: None, 4: None, 10: None, 11: 10}),
+])
+def test_separar(ids, depois):
+    cur = TabelaGrupos(GRUPOS)
+    separar(cur, 'relato', ids)
+    assert cur.duplicata_de == depois
+    assert all('relatos' in sql for sql in cur.comandos)
@@ -0,0 +1,100 @@
+# tests/test_startup.py
+"""
+Inicialização enxuta do create_app(): sem imports pesados nem conexão com o
+banco no boot, fases medidas para o 'flask startup-profile' e o cache em
+disco dos metadados OpenID.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+from observatorio.utils import load_oidc_metadata
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_create_app_nao_importa_modulos_pesados():
+    codigo = (
+        "import sys\n"
+        "from observatorio import create_app, db\n"
+        "create_app()\n"
+        "pesados = ('requests', 'cloudinary', 'authlib', 'smtplib')\n"
+        "print(sorted(m for m in pesados if m in sys.modules))\n"
+        "print(db.pool is None)\n"
+    )
+    # Banco inexistente: o create_app() não pode tentar conectar
+    env = dict(os.environ, DATABASE_URL='postgresql://nao_existe.invalid/x', DB_WARMUP='false')
+    resultado = subprocess.run([sys.executable, '-c', codigo], cwd=RAIZ, env=env,
+                               capture_output=True, text=True, timeout=60)
+    assert resultado.returncode == 0, resultado.stderr
+    assert resultado.stdout.split('\n')[:2] == ['[]', 'True']
+
+
+def test_fases_do_create_app(criar_app):
+    app = criar_app()
+    fases = app.extensions['startup_phases']
+    assert [nome for nome, _ in fases] == ['config', 'locais', 'extensoes', 'db', 'rotas']
+    assert all(segundos >= 0 for _, segundos in fases)
+
+
+class AppFalso:
+    def __init__(self, instance_path):
+        self.instance_path = str(instance_path)
+        self.avisos = []
+        self.logger = self
+
+    def warning(self, mensagem):
+        self.avisos.append(mensagem)
+
+
+URL = 'https://accounts.example.com/.well-known/openid-configuration'
+
+
+def _gravar_cache(app, carregado_em):
+    with open(os.path.join(app.instance_path, 'oidc_metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump({'issuer': 'antigo', '_loaded_at': carregado_em}, f)
+
+
+def _rede_fora(*args, **kwargs):
+    raise requests.exceptions.ConnectionError('sem rede')
+
+
+def test_oidc_cache_valido_nao_vai_a_rede(tmp_path, monkeypatch):
+    app = AppFalso(tmp_path)
+    _gravar_cache(app, time.time())
+    monkeypatch.setattr(requests, 'get', _rede_fora)
+    assert load_oidc_metadata(app, URL)['issuer'] == 'antigo'
+    assert app.avisos == []
+
+
+def test_oidc_renova_o_cache_vencido(tmp_path, monkeypatch):
+    app = AppFalso(tmp_path)
+    _gravar_cache(app, 0)
+
+    class Resposta:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'issuer': 'novo'}
+
+    monkeypatch.setattr(requests, 'get', lambda url, timeout: Resposta())
+    assert load_oidc_metadata(app, URL)['issuer'] == 'novo'
+    with open(os.path.join(app.instance_path, 'oidc_metadata.json'), encoding='utf-8') as f:
+        assert json.load(f)['issuer'] == 'novo'
+
+
+def test_oidc_falha_na_rede(tmp_path, monkeypatch):
+    app = AppFalso(tmp_path)
+    monkeypatch.setattr(requests, 'get', _rede_fora)
+    # Sem cache: o Authlib busca os metadados por conta própria
+    assert load_oidc_metadata(app, URL) == {'server_metadata_url': URL}
+    # Cache vencido: melhor que nada
+    _gravar_cache(app, 0)
+    assert load_oidc_metadata(app, URL)['issuer'] == 'antigo'
+    assert len(app.avisos) == 2
@@ -0,0 +1,94 @@
+# tests/test_tempo_real.py
+"""
+Tempo real do relato no modo WSGI: vagas dos streams SSE e os contadores
+em JSON que o relato.js consulta quando o stream é recusado.
+"""
+
+import queue
+
+from observatorio import routes_public
+
+
+class DifusorFalso:
+    """Difusor sem LISTEN: entrega filas vazias e registra os cancelamentos."""
+
+    def __init__(self):
+        self.canceladas = []
+
+    def assinar_fila(self, relato_id):
+        fila = queue.Queue()
+        fila.callback = object()
+        return fila
+
+    def cancelar(self, relato_id, callback):
+        self.canceladas.append(relato_id)
+
+
+def test_stream_sem_vaga_responde_503(criar_app, monkeypatch):
+    difusor = DifusorFalso()
+    monkeypatch.setattr(routes_public, 'get_difusor', lambda: difusor)
+    cliente = criar_app(SSE_MAX_CONEXOES=1).test_client()
+
+    primeiro = cliente.get('/relato/1/eventos')
+    assert primeiro.status_code == 200
+    assert primeiro.mimetype == 'text/event-stream'
+
+    recusado = cliente.get('/relato/1/eventos')
+    assert recusado.status_code == 503
+    assert recusado.headers['Retry-After']
+
+    # Fechar o stream devolve a vaga e cancela a assinatura
+    primeiro.close()
+    assert difusor.canceladas == [1]
+    segundo = cliente.get('/relato/1/eventos')
+    assert segundo.status_code == 200
+    segundo.close()
+
+
+class ConexaoContadores:
+    """Conexão com um relato aprovado (id 1) e dois comentários."""
+
+    closed = 0
+
+    def __init__(self):
+        self.linhas = []
+
+    @property
+    def connection(self):
+        return self
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=()):
+        if 'FROM relatos' in sql:
+            self.linhas = [{'votos_acredito': 3, 'votos_cetico': 1, 'votos_testemunha': 2}] if params == (1,) else []
+        else:
+            self.linhas = [{'id': 10, 'like_count': 4}, {'id': 11, 'like_count': 0}]
+
+    def fetchone(self):
+        return self.linhas[0] if self.linhas else None
+
+    def fetchall(self):
+        return self.linhas
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_contadores_para_o_fallback_de_consulta(criar_app, monkeypatch):
+    monkeypatch.setattr(routes_public, 'get_db', ConexaoContadores)
+    cliente = criar_app(DB_PREPARED_STATEMENTS='false').test_client()
+
+    resposta = cliente.get('/relato/1/contadores')
+    assert resposta.status_code == 200
+    assert resposta.headers['Cache-Control'] == 'no-store'
+    assert resposta.get_json() == {
+        'votos_acredito': 3, 'votos_cetico': 1, 'votos_testemunha': 2,
+        'comentarios': {'10': 4, '11': 0},
+    }
+
+    assert cliente.get('/relato/2/contadores').status_code == 404
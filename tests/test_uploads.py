@@ -0,0 +1,224 @@
+# tests/test_uploads.py
+"""
+Uploads retomáveis (uploads.py): metadados do tus, detecção de formato,
+blocos fora de ordem com o offset contíguo, recusa de sobreposição e a
+retomada de uploads e montagens interrompidos.
+"""
+
+import base64
+import io
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from observatorio import uploads
+from observatorio.uploads import (
+    UploadError, parse_metadata, detectar_formato, validar_midia, offset_contiguo, _faixas,
+    partes_recebidas, gravar_bloco, _montagem_vencida,
+)
+
+WEBP = b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 20
+
+
+def _b64(texto):
+    return base64.b64encode(texto.encode('utf-8')).decode('ascii')
+
+
+def test_metadata_do_tus():
+    cabecalho = f"tipo {_b64('imagem')},filename {_b64('foto ç.webp')}, vazio"
+    assert parse_metadata(cabecalho) == {'tipo': 'imagem', 'filename': 'foto ç.webp', 'vazio': ''}
+    assert parse_metadata(None) == {}
+    with pytest.raises(UploadError):
+        parse_metadata('tipo não-é-base64!')
+
+
+@pytest.mark.parametrize('cabecalho, tipo, esperado', [
+    (WEBP, 'imagem', 'image/webp'),
+    (b'\xff\xd8\xff\xe0' + b'\x00' * 12, 'imagem', 'image/jpeg'),
+    (b'RIFF\x00\x00\x00\x00WAVEfmt ', 'audio', 'audio/wav'),
+    (b'RIFF\x00\x00\x00\x00WAVEfmt ', 'imagem', None),
+    (b'\x00\x00\x00\x18ftypM4A ', 'audio', 'audio/mp4'),
+    # Quadro MP3 sem tag ID3
+    (b'\xff\xfb\x90\x00' + b'\x00' * 12, 'audio', 'audio/mpeg'),
+    (b'<svg xmlns="http', 'imagem', None),
+])
+def test_formato_pelos_magic_bytes(cabecalho, tipo, esperado):
+    assert detectar_formato(cabecalho, tipo) == esperado
+
+
+def test_validar_midia(criar_app):
+    with criar_app(MAX_IMAGE_BYTES=1024).app_context():
+        stream = io.BytesIO(WEBP)
+        assert validar_midia(stream, 'imagem', len(WEBP)) == 'image/webp'
+        assert stream.tell() == 0
+        with pytest.raises(UploadError) as grande:
+            validar_midia(io.BytesIO(WEBP), 'imagem', 2048)
+        assert grande.value.status == 413
+        with pytest.raises(UploadError) as formato:
+            validar_midia(io.BytesIO(b'GIF00a' + b'\x00' * 10), 'imagem', 16)
+        assert formato.value.status == 415
+
+
+def test_offset_contiguo_e_faixas():
+    assert offset_contiguo([]) == 0
+    assert offset_contiguo([(0, 10), (20, 10)]) == 10
+    assert offset_contiguo([(0, 10), (10, 5), (20, 10)]) == 15
+    assert offset_contiguo([(5, 10)]) == 0
+    assert _faixas([(0, 10), (10, 5), (20, 10)]) == '0-15,20-30'
+
+
+@pytest.fixture
+def app_uploads(criar_app, tmp_path):
+    app = criar_app(UPLOADS_TMP_DIR=str(tmp_path / 'uploads'), WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        yield app
+
+
+def _upload(tamanho=30, status='pendente', **extras):
+    upload = {'id': str(uuid.uuid4()), 'dono': 'sessao', 'tipo': 'imagem', 'tamanho': tamanho,
+              'status': status, 'montando_desde': None, 'nome_arquivo': 'foto.webp'}
+    upload.update(extras)
+    os.makedirs(uploads._pasta_upload(upload['id']), exist_ok=True)
+    return upload
+
+
+def _gravar(upload, offset, dados, declarado=None):
+    gravar_bloco(upload, offset, io.BytesIO(dados), len(dados) if declarado is None else declarado)
+
+
+def test_blocos_fora_de_ordem(app_uploads):
+    upload = _upload()
+    _gravar(upload, 20, b'c' * 10)
+    _gravar(upload, 0, b'a' * 10)
+    assert offset_contiguo(partes_recebidas(upload['id'])) == 10
+    _gravar(upload, 10, b'b' * 10)
+    assert partes_recebidas(upload['id']) == [(0, 10), (10, 10), (20, 10)]
+    assert offset_contiguo(partes_recebidas(upload['id'])) == 30
+
+
+def test_reenvio_identico_substitui_e_sobreposicao_e_recusada(app_uploads):
+    upload = _upload()
+    _gravar(upload, 0, b'a' * 10)
+    _gravar(upload, 0, b'A' * 10)
+    with open(os.path.join(uploads._pasta_upload(upload['id']), '0.part'), 'rb') as parte:
+        assert parte.read() == b'A' * 10
+    for offset, tamanho in ((5, 10), (0, 5), (0, 20)):
+        with pytest.raises(UploadError) as erro:
+            _gravar(upload, offset, b'x' * tamanho)
+        assert erro.value.status == 409
+    assert partes_recebidas(upload['id']) == [(0, 10)]
+
+
+@pytest.mark.parametrize('offset, dados, declarado, status', [
+    (25, b'x' * 10, None, 409),     # passa do Upload-Length
+    (-1, b'x', None, 409),
+    (0, b'x' * 5, 10, 400),         # conexão caiu no meio do bloco
+    (0, b'x' * 10, 5, 400),         # corpo maior que o Content-Length
+])
+def test_bloco_invalido_nao_deixa_lixo(app_uploads, offset, dados, declarado, status):
+    upload = _upload()
+    with pytest.raises(UploadError) as erro:
+        _gravar(upload, offset, dados, declarado)
+    assert erro.value.status == status
+    assert os.listdir(uploads._pasta_upload(upload['id'])) == []
+
+
+def test_bloco_depois_da_montagem(app_uploads):
+    with pytest.raises(UploadError) as erro:
+        _gravar(_upload(status='concluido'), 0, b'x')
+    assert erro.value.status == 409
+
+
+def test_montagem_vencida():
+    agora = datetime.now(timezone.utc)
+    assert not _montagem_vencida({'status': 'montando', 'montando_desde': agora})
+    assert _montagem_vencida({'status': 'montando', 'montando_desde': agora - timedelta(hours=1)})
+    assert not _montagem_vencida({'status': 'pendente', 'montando_desde': None})
+
+
+class ConexaoUploads:
+    """Conexão que só responde ao SELECT do upload pedido."""
+
+    closed = 0
+
+    def __init__(self, upload):
+        self.upload = upload
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=()):
+        assert sql.startswith('SELECT * FROM uploads')
+
+    def fetchone(self):
+        return self.upload
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def cliente_upload(criar_app, tmp_path, monkeypatch):
+    """Cliente com um upload de 30 bytes desta sessão; 'montados' registra as montagens."""
+    app = criar_app(UPLOADS_TMP_DIR=str(tmp_path / 'uploads'), WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        upload = _upload()
+        montados = []
+        monkeypatch.setattr(uploads, 'get_db', lambda: ConexaoUploads(upload))
+        monkeypatch.setattr(uploads, 'montar_upload', lambda u: montados.append(u['id']) or True)
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao['sid'] = 'sessao'
+        yield cliente, upload, montados
+
+
+def _patch(cliente, upload, offset, dados):
+    return cliente.patch(f"/uploads/{upload['id']}", data=dados, headers={
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': str(offset),
+    })
+
+
+def test_retomada_pelo_head(cliente_upload):
+    cliente, upload, montados = cliente_upload
+    resposta = _patch(cliente, upload, 10, b'b' * 10)
+    assert resposta.status_code == 204
+    assert resposta.headers['Upload-Offset'] == '0'
+    assert resposta.headers['Upload-Received'] == '10-20'
+
+    # Cliente reconecta: o HEAD diz o que falta
+    resposta = cliente.head(f"/uploads/{upload['id']}")
+    assert resposta.status_code == 200
+    assert (resposta.headers['Upload-Offset'], resposta.headers['Upload-Length']) == ('0', '30')
+
+    _patch(cliente, upload, 0, b'a' * 10)
+    resposta = _patch(cliente, upload, 20, b'c' * 10)
+    assert resposta.status_code == 204
+    assert resposta.headers['Upload-Offset'] == '30'
+    assert montados == [upload['id']]
+
+
+def test_upload_de_outra_sessao_ou_id_invalido(cliente_upload):
+    cliente, upload, _ = cliente_upload
+    with cliente.session_transaction() as sessao:
+        sessao['sid'] = 'outra'
+    assert cliente.head(f"/uploads/{upload['id']}").status_code == 404
+    assert cliente.head('/uploads/nao-e-uuid').status_code == 404
+
+
+def test_head_retoma_montagem_vencida(cliente_upload):
+    cliente, upload, montados = cliente_upload
+    for offset, dados in ((0, b'a' * 10), (10, b'b' * 10), (20, b'c' * 10)):
+        _gravar(upload, offset, dados)
+    upload.update(status='montando', montando_desde=datetime.now(timezone.utc))
+    resposta = cliente.head(f"/uploads/{upload['id']}")
+    assert resposta.headers['Upload-Offset'] == '30' and montados == []
+
+    upload['montando_desde'] -= timedelta(seconds=uploads.MONTAGEM_MAX_SEGUNDOS + 1)
+    cliente.head(f"/uploads/{upload['id']}")
+    assert montados == [upload['id']]